@@ -1,61 +1,161 @@
 # Description: This file contains the main application code for the CLUSCO dashboard
 
 import pandas as pd
-import holoviews as hv # noqa
-import holoviews.operation.datashader as hd # noqa
-import datashader as ds # noqa
-import hvplot.pandas # noqa
 import panel as pn
-import time
+import asyncio
 import gc
-import threading
-import sys
 import os
+import threading
+import time
+import argparse
+import multiprocessing
+from functools import partial
 
+from bokeh.document import without_document_lock
 
-# Application modules
-import dashboard_utils
-from config import WEBSOCKET_ORIGIN
+
+# Application modules. The plotting modules (HoloViews, datashader, hvPlot and the modules of the dashboard using them)
+# are imported in the background when the server starts (See `import_plotting_modules`)
+import data_api
+import database
+import export
+import memory_manager
+import metrics
+import payloads
+import prewarm
+import profiling
+import registry
+import shared_cache
+import telescopes
+from config import DB_CREATE_INDEXES, WEBSOCKET_ORIGIN, SHARED_CACHE_DIR, SHARED_CACHE_MAX_MB, SNAPSHOTS_DIR, PAYLOAD_CACHE_MAX_MB
 
 gc.enable()
 
-# Holoviz and Pandas Settings
-hv.extension('bokeh', logo=False) 
+# Panel Settings
 pn.extension(loading_spinner='dots', loading_color='#00204e', sizing_mode="stretch_width")
-pd.options.plotting.backend = 'holoviews'
 pn.config.throttled = True
+pn.config.admin_plugins = [('Memory', memory_manager.memory_report)]
 # pn.config.sizing_mode = 'stretch_width'
 
+plotting_modules_ready = threading.Event()
+"""
+Event set when the plotting modules are imported and the HoloViews settings are applied
+"""
+
+
+def import_plotting_modules():
+    """
+    Imports HoloViews, datashader, hvPlot and the modules of the dashboard using them, and applies the HoloViews and Pandas
+    settings. They take most of the startup time of the process, so the server imports them in the background while it
+    already serves the loading template (See `serve`). The sessions wait for them before creating their dashboard.
+    """
+    tic = time.perf_counter()
+
+    import holoviews as hv
+    import holoviews.operation.datashader as hd # noqa
+    import datashader as ds # noqa
+    import hvplot.pandas # noqa
+    import dashboard_utils # noqa
+
+    # Holoviz and Pandas Settings
+    hv.extension('bokeh', logo=False)
+    pd.options.plotting.backend = 'holoviews'
+
+    toc = time.perf_counter()
+    metrics.STAGE_SECONDS.labels('startup', 'plotting_modules').observe(toc - tic)
+    plotting_modules_ready.set()
+    print(f"Plotting modules imported in {toc - tic:0.4f} seconds")
+
+
+def startup_task(prewarm_data=True):
+    """
+    Imports the plotting modules and, once they are imported, starts the prewarm of the latest night of each telescope.
+
+    Parameters
+    ----------
+    - `prewarm_data` (bool) Whether to load the latest night into the shared caches.
+    """
+    import_plotting_modules()
+
+    if prewarm_data:
+        for telescope in telescopes.get_all():
+            prewarm.start_prewarm(telescope)
 
-def restart_server_if_empty_task(interval_sec=60):
-    # This function will restart the server if it is empty
-    while True:
-        time.sleep(interval_sec)
-        
-        #print('Checking if server is empty to perform restart...')
-        if pn.state.session_info['live'] == 0:
-            print("Restarting server to clean up resources, as there are 0 active sessions. ")
-            #os.execv(sys.executable, ['python -u'] + sys.argv + ['>> output.log'])
-            os.execv(sys.executable, ['python'] + sys.argv)
-        
-# Global variable to store the thread that will restart the server if it is empty
-restart_server_thread_task = threading.Thread(target=restart_server_if_empty_task)
-restart_server_thread_task.daemon = True
+
+def check_databases(create_indexes=DB_CREATE_INDEXES):
+    """
+    Checks the database of each telescope (See `check_database`).
+
+    Parameters
+    ----------
+    - `create_indexes` (bool) Whether to create the missing indexes.
+    """
+    for telescope in telescopes.get_all():
+        check_database(telescope, create_indexes)
+
+
+def check_database(telescope, create_indexes=DB_CREATE_INDEXES):
+    """
+    Checks the index of each collection of the registry (See `database.check_index`) and explains the query of the
+    latest night of its first property (See `database.sample_query_plan`), so a missing or unused index is reported
+    when the server starts instead of as slower dashboards.
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope whose database is checked.
+    - `create_indexes` (bool) Whether to create the missing indexes.
+    """
+    db = telescope.connect()
+
+    if db is None:
+        return
+
+    try:
+        for collection_name in dict.fromkeys(prop['collection'] for prop in registry.PROPERTIES):
+            collection = db[collection_name]
+            database.check_index(collection, telescope.name, create_indexes)
+
+            prop = next(prop for prop in registry.PROPERTIES if prop['collection'] == collection_name)
+            night = database.get_latest_night(collection, prop['name'], database.get_current_night())
+
+            if night is not None:
+                stats = database.sample_query_plan(collection, database.get_night_query(prop['name'], night), {'date': 1, prop['value_field']: 1, '_id': 0},
+                                                   telescope.name)
+
+                if stats is not None:
+                    print(f"Query plan of {collection_name} ({telescope.name}): {stats['keys_examined']} keys and {stats['docs_examined']} documents examined for "
+                          f"{stats['returned']} returned in {stats['execution_ms']} ms using the indexes {', '.join(stats['indexes']) or 'none'}")
+    except Exception as e:
+        print(f"Error checking the database indexes of {telescope.name}:", e)
+    finally:
+        db.client.close()
 
 
 def destroyed(session_context):
     print("Session destroyed", session_context)
-    gc.collect()
-    
-    if  not restart_server_thread_task.is_alive():
-        print("Starting application restart checker in another thread")
-        restart_server_thread_task.start()
+    memory_manager.release_session(session_context)
+    profiling.dump_session_report(session_context.id)
 
 
-def get_user_dashboard():
+def create_loading_template(telescope=None):
+    """
+    Creates the dashboard template showing the loading messages, which are replaced by the plots in `dashboard_utils.update_dashboard`.
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope displayed, shown in the title when several telescopes are served. Defaults to the default telescope.
+
+    Returns
+    ----------
+    - `template` (pn.template.MaterialTemplate) The dashboard template.
+    """
+    if telescope is None:
+        telescope = telescopes.default
+
+    title = 'Clusco Reports' if len(telescopes.get_all()) == 1 else f'Clusco Reports - {telescope.name}'
 
     material_dashboard = pn.template.MaterialTemplate(
-        title='Clusco Reports', header_background='#00204e', favicon='/images/favicon.ico')
+        title=title, header_background='#00204e', favicon='/images/favicon.ico')
 
     # MAIN
     loading = pn.indicators.LoadingSpinner(
@@ -75,38 +175,126 @@ def get_user_dashboard():
 
     material_dashboard.sidebar.append(pn.Column(pn.Column(pn.layout.VSpacer(), logo_sidebar, pn.layout.VSpacer(), loading_sidebar, loading_text_sidebar, pn.layout.VSpacer(), sizing_mode='stretch_both')))
 
+    return material_dashboard
+
+
+def get_user_dashboard():
+
+    # The telescope is selected with the telescope URL parameter (See `telescopes`)
+    telescope_name = pn.state.session_args.get('telescope', [b''])[0].decode() or None
+    telescope = telescopes.get(telescope_name)
+
+    if telescope_name is not None and telescope.name != telescope_name.upper():
+        print(f"Unknown telescope {telescope_name}, showing {telescope.name}")
+
+    material_dashboard = create_loading_template(telescope)
+
     # Config callback when session is destroyed
     pn.state.on_session_destroyed(destroyed)
 
-    create_dashboard_thread_task = threading.Thread(target=dashboard_utils.create_dashboard, args=(material_dashboard, ))
-    create_dashboard_thread_task.daemon = True
-    create_dashboard_thread_task.start()
+    # Track the resources of the session and check the memory used by the application
+    memory_manager.register_session(pn.state.curdoc, material_dashboard)
+    memory_manager.start_memory_monitor()
+
+    # The dashboard is created by a coroutine run on the event loop of the server, without the lock of the document
+    # (See `dashboard_utils.update_dashboard`)
+    doc = pn.state.curdoc
+    doc.add_next_tick_callback(without_document_lock(partial(create_dashboard_when_ready, material_dashboard, doc, telescope)))
     
     return material_dashboard
 
 
+async def create_dashboard_when_ready(template, doc, telescope):
+    """
+    Creates the dashboard of a session once the plotting modules are imported. Until then the session shows the loading template.
+
+    Parameters
+    ----------
+    - `template` (pn.template.MaterialTemplate) The template of the session (See `create_loading_template`).
+    - `doc` (bokeh.document.Document) The document of the session.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+    """
+    while not plotting_modules_ready.is_set():
+        await asyncio.sleep(0.1)
+
+    import dashboard_utils
+    await dashboard_utils.update_dashboard(template, doc=doc, telescope=telescope)
+
+
+def serve(port, prewarm_data=True, n_threads=None):
+    """
+    Serves the dashboard in a port. Used to run each worker process when the application is served with several processes.
+
+    Parameters
+    ----------
+    - `port` (int) The port where the application listens for connections.
+    - `prewarm_data` (bool) Whether to load the latest night into the shared caches once the plotting modules are imported.
+    - `n_threads` (int) The number of threads used by the server to process the events of the sessions. None by default,
+    to process them in the thread of the server.
+    """
+    if n_threads:
+        pn.config.nthreads = n_threads
+
+    # The arrays of the cached aggregates are encoded once for the plots of every session (See `payloads`)
+    payloads.store.enable(PAYLOAD_CACHE_MAX_MB)
+
+    # The server accepts connections and serves the loading template while the plotting modules are imported
+    startup_thread = threading.Thread(target=startup_task, args=(prewarm_data, ))
+    startup_thread.daemon = True
+    startup_thread.start()
+
+    # The date picker and the queries use the nights with data of the availability index of each telescope (See `availability`)
+    for telescope in telescopes.get_all():
+        telescope.availability.start()
+
+    check_thread = threading.Thread(target=check_databases)
+    check_thread.daemon = True
+    check_thread.start()
+
+    # The static snapshots of the archived nights are served in /snapshots (See `snapshots`)
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+
+    server = pn.serve(get_user_dashboard, address='127.0.0.1', port=port, websocket_origin=WEBSOCKET_ORIGIN, show=False,
+                      static_dirs={'images': './images', 'snapshots': SNAPSHOTS_DIR}, admin=True, title='Clusco Reports',
+                      threaded=True, extra_patterns=[('/metrics', metrics.MetricsHandler), (r'/api/data/([^/]+)', data_api.DataHandler),
+                                                     ('/api/export', export.ExportHandler)])
+
+    # The main thread waits for the server thread, since the thread pools (e.g. the one retrieving the data of a night)
+    # do not accept new tasks once the main thread has finished
+    try:
+        server.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
 if __name__ == '__main__':
     # The app can be executed with -p argument to indicates the port from the command line: example: python3 app.py -p 5007
+    # and with --num-procs to serve it with several worker processes, each one listening in a consecutive port: python3 app.py -p 5007 --num-procs 4
 
-    default_port = 5006
+    parser = argparse.ArgumentParser(description='Clusco Reports dashboard')
+    parser.add_argument('-p', '--port', type=int, default=5006, help='Port where the application listens for connections (5006 by default)')
+    parser.add_argument('--num-procs', type=int, default=1,
+                        help='Number of worker processes. Each worker listens in a consecutive port starting from the given port (1 by default)')
+    parser.add_argument('--num-threads', type=int, default=None,
+                        help='Number of threads of each process used to process the events of the sessions (By default they are processed in the thread of the server)')
+    args = parser.parse_args()
 
-    args = sys.argv[1:]
+    if args.num_procs > 1:
+        # Workers share the data retrieved from the database and its aggregates. Only the first worker prewarms the latest night.
+        shared_cache.store.enable(SHARED_CACHE_DIR, SHARED_CACHE_MAX_MB, clear=True)
 
-    if len(args) > 1:
-        port_cmd_arg = args[0]
+        workers = [multiprocessing.Process(target=serve, args=(args.port + i, i == 0, args.num_threads)) for i in range(args.num_procs)]
 
-        # Check if port is a number
-        if port_cmd_arg == '-p':
-            port = args[1]
-            if port.isdigit():
-                port = int(port)
-        
-        else:  # Error in command line arguments
-            print("Error indicating arguments or port. Using default port 5006")
-            port = default_port
-    else:
-        port = default_port
-    
+        for worker in workers:
+            worker.start()
+
+        print(f"Serving with {args.num_procs} worker processes in ports {args.port}-{args.port + args.num_procs - 1}")
 
-    pn.serve(get_user_dashboard, address='127.0.0.1', port=port, websocket_origin=WEBSOCKET_ORIGIN, show=False, static_dirs={'images': './images'}, admin=True, title='Clusco Reports',
-             threaded=True, n_threads=4)
\ No newline at end of file
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+    else:
+        serve(args.port, n_threads=args.num_threads)
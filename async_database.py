@@ -0,0 +1,140 @@
+"""
+Asynchronous access to the database for the dashboards of the sessions, which are created by coroutines run on the
+event loop of the server (See `dashboard_utils.update_dashboard`). The night queries use motor, the asyncio driver of
+MongoDB, when it is installed, so the queries of many sessions are in flight at the same time without a thread for
+each one. Without motor, and for the rest of the blocking work of the sessions (the other pymongo queries and the
+building of the dataframes and the plots), a pool of `ASYNC_DB_THREADS` threads is shared by all the sessions (See `run_blocking`).
+"""
+
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import metrics
+import profiling
+from config import DB_TIMEOUT_MS, ASYNC_DB_DRIVER, ASYNC_DB_THREADS
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+executor = ThreadPoolExecutor(max_workers=max(ASYNC_DB_THREADS, 1), thread_name_prefix='clusco-async')
+"""
+Pool of threads shared by all the sessions to run their blocking work
+"""
+
+queries_in_flight = 0
+"""
+Number of night queries started and not finished yet
+"""
+
+_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def uses_motor():
+    """
+    Whether the night queries are run with motor (See `ASYNC_DB_DRIVER`).
+
+    Returns
+    ----------
+    - `motor` (bool) True when motor is installed and selected, False when the queries run in the shared pool of threads.
+    """
+    return AsyncIOMotorClient is not None and ASYNC_DB_DRIVER == 'motor'
+
+
+def get_motor_database(telescope):
+    """
+    Get the motor database of a telescope in the running event loop. The motor clients are bound to the event loop where
+    they are created, so a client is created for each loop and telescope the first time it queries the database, and reused afterwards.
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope.
+
+    Returns
+    ----------
+    - `db` (motor.motor_asyncio.AsyncIOMotorDatabase) The database object from motor.
+    """
+    loop = asyncio.get_running_loop()
+
+    with _lock:
+        clients = _clients.setdefault(loop, {})
+        client = clients.get(telescope.name)
+
+        if client is None:
+            client = AsyncIOMotorClient(host=telescope.db_host, port=int(telescope.db_port), serverSelectionTimeoutMS=DB_TIMEOUT_MS, io_loop=loop)
+            clients[telescope.name] = client
+
+    return client[telescope.db_name]
+
+
+async def run_blocking(function, *args, session_id=None):
+    """
+    Runs a blocking function in the pool of threads shared by the sessions, without blocking the event loop.
+
+    Parameters
+    ----------
+    - `function` (callable) The function to run.
+    - `args` The arguments of the function.
+    - `session_id` (str) The session the memory profiled stages are attributed to (See `profiling.bind_session`).
+
+    Returns
+    ----------
+    - `result` The value returned by the function.
+    """
+    def run():
+        profiling.bind_session(session_id)
+        return function(*args)
+
+    return await asyncio.get_running_loop().run_in_executor(executor, run)
+
+
+async def get_night_documents(db, collection_name, property_names, date_time, value_fields, telescope):
+    """
+    Get the values and dates of the documents of several properties of a collection for a given night with a single
+    query (See `database.get_night_documents`), with motor or in the shared pool of threads.
+
+    Parameters
+    ----------
+    - `db` (telescopes.TelescopeDatabase) The database of the telescope. Used when motor is not available and to check the query plans.
+    - `collection_name` (str) The name of the collection in the registry.
+    - `property_names` (list) The names of the properties to search in the collection
+    - `date_time` (dt.date) The day in which the night starts.
+    - `value_fields` (list) The name of the field to retrieve for each property
+    - `telescope` (telescopes.Telescope) The telescope, whose database and collection names are used by motor.
+
+    Returns
+    ----------
+    - `documents` (dict) A tuple with the values and the dates retrieved for each property, by property name. Properties without data have empty lists.
+    """
+    global queries_in_flight
+
+    with _lock:
+        queries_in_flight += 1
+
+    try:
+        if not uses_motor():
+            return await run_blocking(database.get_night_documents, db[collection_name], property_names, date_time, value_fields, telescope.name)
+
+        documents = {property_name: ([], []) for property_name in property_names}
+        fields = dict(zip(property_names, value_fields))
+        query, projection = database.get_batch_query(property_names, date_time, value_fields)
+
+        print('Retrieving ' + ', '.join(property_names) + ' data from date: ' + str(date_time))
+
+        with metrics.timer('batch_query', collection_name):
+            async for document in get_motor_database(telescope)[telescope.get_collection_name(collection_name)].find(query, projection):
+                data_values, datetime_values = documents[document['name']]
+                data_values.append(document[fields[document['name']]])
+                datetime_values.append(document['date'])
+
+        database.schedule_query_plan(db[collection_name], query, projection, telescope.name)
+
+        return documents
+    finally:
+        with _lock:
+            queries_in_flight -= 1
@@ -0,0 +1,273 @@
+"""
+Night availability index. The number of documents of each property of the registry in each night is counted with a
+single aggregation per collection, stored in the `AVAILABILITY_FILE` file and refreshed in a background thread every
+`AVAILABILITY_REFRESH_INTERVAL` seconds, counting again only the nights from the last refresh on. The date picker of
+the dashboard only enables the nights with data and shows their coverage, and the nights known to be empty are not
+queried (See `AvailabilityIndex.is_empty`). Each telescope has its own index (See `telescopes`).
+"""
+
+import datetime as dt
+import json
+import os
+import threading
+import time
+
+import database
+import metrics
+import registry
+from config import AVAILABILITY_REFRESH_INTERVAL
+
+FILE_VERSION = 1
+"""
+Version of the layout of the index file. Files of other versions are built again
+"""
+
+
+class AvailabilityIndex:
+    """
+    Number of documents of each property in each night. The index is complete up to the time of its last refresh
+    (`covered_until`): the nights that finished before it are known to be empty when they have no documents.
+    """
+
+    def __init__(self, path=None, connect=None):
+        """
+        Parameters
+        ----------
+        - `path` (str) The file where the index is stored. None to keep it only in memory.
+        - `connect` (callable) The function called without arguments to connect to the database of the telescope (See `telescopes.Telescope.connect`).
+        """
+        self.path = path
+        self.connect = connect
+        self.covered_until = None
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def load(self):
+        """
+        Loads the index stored in the index file, if any.
+
+        Returns
+        ----------
+        - `loaded` (bool) Whether the index was loaded.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path) as index_file:
+                stored = json.load(index_file)
+        except (OSError, ValueError) as e:
+            print("Availability index: error reading the index file:", e)
+            return False
+
+        if stored.get('version') != FILE_VERSION:
+            return False
+
+        counts = {name: {dt.date.fromisoformat(night): count for night, count in nights.items()} for name, nights in stored['counts'].items()}
+
+        with self._lock:
+            self._counts = counts
+            self.covered_until = dt.datetime.fromisoformat(stored['covered_until'])
+
+        return True
+
+    def save(self):
+        """
+        Stores the index in the index file through a temporary file, so the other processes never read a partially written index.
+        """
+        if self.path is None:
+            return
+
+        with self._lock:
+            stored = {'version': FILE_VERSION, 'covered_until': self.covered_until.isoformat(),
+                      'counts': {name: {str(night): count for night, count in nights.items()} for name, nights in self._counts.items()}}
+
+        temporary_path = f'{self.path}.{os.getpid()}.tmp'
+
+        with open(temporary_path, 'w') as index_file:
+            json.dump(stored, index_file)
+
+        os.replace(temporary_path, self.path)
+
+    def refresh(self, db):
+        """
+        Counts the documents of each property in each night with an aggregation per collection. The first time all
+        the nights are counted. Afterwards only the night of the last refresh and the following ones are counted again,
+        since the nights before had finished.
+
+        Parameters
+        ----------
+        - `db` (pymongo.database.Database) The database object from pymongo.
+        """
+        tic = time.perf_counter()
+        now = dt.datetime.now()
+        since = database.get_night_range(database.get_night_of(self.covered_until))[0] if self.covered_until is not None else None
+        counts = {}
+
+        for collection_name in dict.fromkeys(prop['collection'] for prop in registry.PROPERTIES):
+            property_names = [prop['name'] for prop in registry.PROPERTIES if prop['collection'] == collection_name]
+
+            with metrics.timer('availability', collection_name):
+                counts.update(count_documents(db[collection_name], property_names, since))
+
+        with self._lock:
+            if since is not None:
+                first_night = database.get_night_of(since)
+
+                for nights in self._counts.values():
+                    for night in [night for night in nights if night >= first_night]:
+                        del nights[night]
+
+            for name, nights in counts.items():
+                self._counts.setdefault(name, {}).update(nights)
+
+            self.covered_until = now
+
+        print(f"Availability index {'refreshed' if since is not None else 'built'} in {time.perf_counter() - tic:0.4f} seconds")
+
+    def get_count(self, property_name, night):
+        """
+        Get the number of documents of a property in a night.
+
+        Parameters
+        ----------
+        - `property_name` (str) The name of the property.
+        - `night` (dt.date) The day in which the night starts.
+
+        Returns
+        ----------
+        - `count` (int) The number of documents, 0 if the night has none or the index is not built.
+        """
+        with self._lock:
+            return self._counts.get(property_name, {}).get(night, 0)
+
+    def is_empty(self, property_name, night):
+        """
+        Whether a night is known to have no documents of a property, so it does not need to be queried. Only the
+        nights that finished before the last refresh of the index can be known to be empty.
+
+        Parameters
+        ----------
+        - `property_name` (str) The name of the property.
+        - `night` (dt.date) The day in which the night starts.
+
+        Returns
+        ----------
+        - `empty` (bool) Whether the night is known to be empty.
+        """
+        with self._lock:
+            if self.covered_until is None or database.get_night_range(night)[1] > self.covered_until:
+                return False
+
+            return self._counts.get(property_name, {}).get(night, 0) == 0
+
+    def get_latest_night(self, property_name, date_time):
+        """
+        Get the latest night with data of a property up to a night.
+
+        Parameters
+        ----------
+        - `property_name` (str) The name of the property.
+        - `date_time` (dt.date) The day in which the latest night to check starts.
+
+        Returns
+        ----------
+        - `night` (dt.date) The latest night with data, or None if there is none in the index.
+        """
+        with self._lock:
+            nights = [night for night, count in self._counts.get(property_name, {}).items() if night <= date_time and count > 0]
+
+        return max(nights, default=None)
+
+    def get_nights(self):
+        """
+        Get the nights with data of any property.
+
+        Returns
+        ----------
+        - `nights` (list) The sorted days in which each night starts.
+        """
+        with self._lock:
+            return sorted({night for nights in self._counts.values() for night, count in nights.items() if count > 0})
+
+    def get_coverage(self, night):
+        """
+        Get the properties with data in a night and their number of documents.
+
+        Parameters
+        ----------
+        - `night` (dt.date) The day in which the night starts.
+
+        Returns
+        ----------
+        - `coverage` (dict) The number of documents of each property with data, by property name.
+        """
+        with self._lock:
+            return {name: nights[night] for name, nights in self._counts.items() if nights.get(night, 0) > 0}
+
+    def start(self, interval_sec=AVAILABILITY_REFRESH_INTERVAL):
+        """
+        Loads the stored index and starts refreshing it in another thread, if it is not running yet.
+
+        Parameters
+        ----------
+        - `interval_sec` (int) Seconds between each refresh.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._thread = threading.Thread(target=self._run, args=(interval_sec, ))
+            self._thread.daemon = True
+
+        print("Starting availability index refresh in another thread")
+        self._thread.start()
+
+    def _run(self, interval_sec):
+        self.load()
+
+        while True:
+            db = self.connect()
+
+            if db is not None:
+                try:
+                    self.refresh(db)
+                    self.save()
+                except Exception as e:
+                    print("Availability index: error refreshing the index:", e)
+                finally:
+                    db.client.close()
+
+            time.sleep(interval_sec)
+
+
+def count_documents(collection, property_names, since=None):
+    """
+    Counts the documents of several properties of a collection in each night with a single aggregation.
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `property_names` (list) The names of the properties.
+    - `since` (dt.datetime) The date from which the documents are counted. All of them when None.
+
+    Returns
+    ----------
+    - `counts` (dict) The number of documents in each night with data (dict by dt.date), by property name.
+    """
+    match = {'name': {'$in': list(property_names)}}
+
+    if since is not None:
+        match['date'] = {'$gte': since}
+
+    # The night of a document is the day 12 hours before its date (See `database.get_night_of`)
+    night = {'$dateToString': {'format': '%Y-%m-%d', 'date': {'$subtract': ['$date', 12 * 3600 * 1000]}}}
+    pipeline = [{'$match': match}, {'$group': {'_id': {'name': '$name', 'night': night}, 'count': {'$sum': 1}}}]
+
+    counts = {}
+
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        counts.setdefault(group['_id']['name'], {})[dt.date.fromisoformat(group['_id']['night'])] = group['count']
+
+    return counts
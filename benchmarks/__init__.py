@@ -0,0 +1,12 @@
+"""
+Offline benchmark suite and load test. Synthetic nights with the structure of the `CLUSCO_min` and `TIB_min` collections are generated
+(See `benchmarks.synthetic`) and loaded in a local stand-in of the observatory database (mongomock, or a local mongod),
+and the data retrieval, the aggregations, the plot builders and the whole dashboard creation are benchmarked against
+them (See `benchmarks.run`), as well as several concurrent sessions (See `benchmarks.load_test`) and the cold start of the server (See `benchmarks.startup`). The results are written as JSON, so different runs can be compared over time.
+
+Usage (from the root of the repository):
+
+    python -m benchmarks.run --nights 2 --minutes 720 --repeat 5 --output results.json
+    python -m benchmarks.load_test --sessions 8 --output load_test.json
+    python -m benchmarks.startup --repeat 5 --output startup_results.json
+"""
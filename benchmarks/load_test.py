@@ -0,0 +1,469 @@
+"""
+Concurrent-session load test. Serves the dashboard locally with synthetic nights (See `benchmarks.synthetic`), or uses
+an already running server, and opens several headless Bokeh sessions against it. Each session waits for its first plot,
+then moves the channel/module sliders and changes the date picker, as an operator would do. The time to the first plot,
+the latency of each update, the websocket bytes of each session and the RSS of the server over time are written as JSON.
+The latencies include the decoding of the messages by the Python client, so they are an upper bound of the ones of a browser.
+
+Usage (from the root of the repository):
+
+    python -m benchmarks.load_test --sessions 8 --actions 6 --output load_test.json
+    python -m benchmarks.load_test --sessions 16 --num-threads 8 --minutes 720 --output load_test_8_threads.json
+    python -m benchmarks.load_test --url http://localhost:5006/ --dates 2023-06-01 2023-06-02 --sessions 4
+"""
+
+import argparse
+import asyncio
+import base64
+import datetime as dt
+import json
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+import urllib.request
+from unittest import mock
+
+import numpy as np
+import panel.models  # noqa: F401 Registers the Bokeh models of Panel, needed to load the documents of the sessions
+import panel.models.tabulator  # noqa: F401 Loaded on demand by Panel, needed by the table of the thresholds tab
+from bokeh.client import pull_session
+from bokeh.client.session import ClientSession
+from bokeh.client.websocket import WebSocketClientConnectionWrapper
+from bokeh.models import DatePicker, Plot, Slider, Title
+from pymongo import MongoClient
+from tornado.ioloop import IOLoop
+
+# Application modules
+import app
+import database
+from benchmarks import synthetic
+from benchmarks.run import get_environment
+
+TITLE_DATE = re.compile(r'\((\d{4}-\d{2}-\d{2})\)')
+"""
+Regular expression matching the date shown in the title of the plots
+"""
+
+
+def count_websocket_bytes():
+    """
+    Wraps the websocket of the Bokeh client to count the bytes received and sent by each connection,
+    in the `bytes_received` and `bytes_sent` attributes of the connection.
+    """
+    read_message = WebSocketClientConnectionWrapper.read_message
+    write_message = WebSocketClientConnectionWrapper.write_message
+
+    def message_size(message):
+        return len(message.encode()) if isinstance(message, str) else len(message)
+
+    def counted_read_message(self, callback=None):
+        future = read_message(self, callback)
+
+        def count(future):
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                self.bytes_received = getattr(self, 'bytes_received', 0) + message_size(future.result())
+
+        future.add_done_callback(count)
+
+        return future
+
+    async def counted_write_message(self, message, binary=False, locked=True):
+        self.bytes_sent = getattr(self, 'bytes_sent', 0) + message_size(message)
+        await write_message(self, message, binary, locked)
+
+    WebSocketClientConnectionWrapper.read_message = counted_read_message
+    WebSocketClientConnectionWrapper.write_message = counted_write_message
+
+
+def decode_binary_buffers():
+    """
+    Wraps the Bokeh client to apply the patches of the server containing binary buffers (e.g. the columns of the plots),
+    which it can not decode, converting the buffers to base64 encoded arrays.
+    """
+    handle_patch = ClientSession._handle_patch
+
+    def resolve(value, buffers):
+        if isinstance(value, dict):
+            if '__buffer__' in value:
+                return {'__ndarray__': base64.b64encode(buffers[value['__buffer__']]).decode(), 'dtype': value['dtype'], 'shape': value['shape']}
+
+            return {key: resolve(item, buffers) for key, item in value.items()}
+
+        if isinstance(value, list):
+            return [resolve(item, buffers) for item in value]
+
+        return value
+
+    def decoded_handle_patch(self, message):
+        if message.buffers:
+            # The headers of the buffers are received as JSON strings
+            buffers = {json.loads(header)['id'] if isinstance(header, str) else header['id']: payload for header, payload in message.buffers}
+            message.content = resolve(message.content, buffers)
+
+        handle_patch(self, message)
+
+    ClientSession._handle_patch = decoded_handle_patch
+
+
+async def wait_for(predicate, timeout, interval=0.05):
+    """
+    Waits until a condition is met.
+
+    Parameters
+    ----------
+    - `predicate` (callable) The function called without arguments to check the condition.
+    - `timeout` (float) The maximum seconds to wait.
+    - `interval` (float) The seconds between each check.
+
+    Returns
+    ----------
+    - `met` (bool) Whether the condition was met before the timeout.
+    """
+    deadline = time.perf_counter() + timeout
+
+    while not predicate():
+        if time.perf_counter() > deadline:
+            return False
+
+        await asyncio.sleep(interval)
+
+    return True
+
+
+def run_session(index, url, actions, dates, think_time, timeout, settle, seed):
+    """
+    Opens a headless session and runs the scenario of an operator: waits for the dashboard, then moves a random slider and
+    changes the date alternately. It runs in its own thread with its own event loop.
+
+    Parameters
+    ----------
+    - `index` (int) The index of the session.
+    - `url` (str) The URL of the dashboard.
+    - `actions` (int) The number of slider moves and date changes.
+    - `dates` (list) The dates (ISO format) selected in the date picker.
+    - `think_time` (float) The seconds between actions.
+    - `timeout` (float) The maximum seconds to wait for the dashboard and for each update.
+    - `settle` (float) The seconds without new messages from the server after which a slider update is considered finished.
+    - `seed` (int) The seed of the random choices.
+
+    Returns
+    ----------
+    - `stats` (dict) The results of the session: connection time, time to the first plot and to the whole dashboard,
+    latency of each update (None when timed out), websocket bytes and error, if any.
+    """
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    loop = IOLoop.current()
+    rng = random.Random(seed + index)
+    stats = {'session': index, 'connect': None, 'first_plot': None, 'dashboard': None, 'slider': [], 'date': [],
+             'bytes_received': 0, 'bytes_sent': 0, 'error': None}
+
+    tic = time.perf_counter()
+
+    try:
+        session = pull_session(url=url, io_loop=loop)
+    except Exception as e:
+        stats['error'] = repr(e)
+        return stats
+
+    stats['connect'] = time.perf_counter() - tic
+    doc = session.document
+    received = []
+
+    def on_change(event):
+        # Changes applied from the messages of the server have the session as setter
+        if getattr(event, 'setter', None) is session:
+            received.append(time.perf_counter())
+
+    doc.on_change(on_change)
+
+    def displayed_dates():
+        return {match.group(1) for title in doc.select({'type': Title}) for match in [TITLE_DATE.search(title.text or '')] if match}
+
+    async def move_slider():
+        sliders = [slider for slider in doc.select({'type': Slider}) if slider.end > slider.start]
+
+        if not sliders:
+            return
+
+        slider = rng.choice(sliders)
+        value = rng.choice([value for value in range(int(slider.start), int(slider.end) + 1) if value != slider.value])
+
+        before = len(received)
+        action_tic = time.perf_counter()
+        slider.value = value
+        # Panel listens to the throttled value (pn.config.throttled), which is read only for the Python models
+        slider.set_from_json('value_throttled', value)
+
+        # The update is finished when no more messages are received during the settle time
+        await wait_for(lambda: len(received) > before and time.perf_counter() - received[-1] > settle, timeout)
+        stats['slider'].append(received[-1] - action_tic if len(received) > before else None)
+
+    async def change_date():
+        date_pickers = list(doc.select({'type': DatePicker}))
+        current = displayed_dates()
+        candidates = [date for date in dates if date not in current]
+
+        if not date_pickers or not candidates:
+            return
+
+        date = rng.choice(candidates)
+        action_tic = time.perf_counter()
+        date_pickers[0].value = date
+
+        # The update is finished when all the plots show the new date in their titles
+        updated = await wait_for(lambda: displayed_dates() == {date}, timeout)
+        stats['date'].append(time.perf_counter() - action_tic if updated else None)
+
+    async def scenario():
+        try:
+            if await wait_for(lambda: any(True for _ in doc.select({'type': Plot})), timeout):
+                stats['first_plot'] = time.perf_counter() - tic
+
+            if await wait_for(lambda: any(True for _ in doc.select({'type': DatePicker})) and len(displayed_dates()) > 0, timeout):
+                stats['dashboard'] = time.perf_counter() - tic
+
+            for i in range(actions):
+                await asyncio.sleep(think_time)
+
+                if i % 2 == 0:
+                    await move_slider()
+                else:
+                    await change_date()
+
+        except Exception as e:
+            stats['error'] = repr(e)
+
+        finally:
+            socket = session._connection._socket
+            stats['bytes_received'] = getattr(socket, 'bytes_received', 0)
+            stats['bytes_sent'] = getattr(socket, 'bytes_sent', 0)
+            session.close()
+
+    loop.add_callback(scenario)
+    session._loop_until_closed()  # Processes the messages of the server until the scenario closes the session
+
+    return stats
+
+
+def sample_server(metrics_url, interval, samples, stop):
+    """
+    Samples the RSS and the number of live sessions of the server from its /metrics endpoint until stopped.
+
+    Parameters
+    ----------
+    - `metrics_url` (str) The URL of the /metrics endpoint.
+    - `interval` (float) The seconds between samples.
+    - `samples` (list) The list where the samples are appended, as dicts with the time, the RSS in MB and the live sessions.
+    - `stop` (threading.Event) The event set to stop sampling.
+    """
+    tic = time.perf_counter()
+
+    while not stop.is_set():
+        try:
+            values = read_metrics(metrics_url)
+            samples.append({'time': time.perf_counter() - tic, 'rss_mb': values.get('clusco_process_rss_bytes', 0) / 2**20,
+                            'live_sessions': values.get('clusco_live_sessions')})
+        except OSError:
+            pass
+
+        stop.wait(interval)
+
+
+def read_metrics(metrics_url):
+    """
+    Reads the metrics without labels of the /metrics endpoint.
+
+    Parameters
+    ----------
+    - `metrics_url` (str) The URL of the /metrics endpoint.
+
+    Returns
+    ----------
+    - `values` (dict) The value of each metric by name.
+    """
+    with urllib.request.urlopen(metrics_url, timeout=5) as response:
+        text = response.read().decode()
+
+    values = {}
+
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value)
+
+    return values
+
+
+def serve_synthetic(port, nights, minutes, mongo_uri, n_threads):
+    """
+    Serves the dashboard with synthetic nights instead of the observatory database. It runs in a child process.
+
+    Parameters
+    ----------
+    - `port` (int) The port of the server.
+    - `nights` (list) The days in which each synthetic night starts.
+    - `minutes` (int) The minutes with data of each night.
+    - `mongo_uri` (str) The URI of a local MongoDB server, or None to use mongomock.
+    - `n_threads` (int) The number of threads of the server.
+    """
+    db = synthetic.create_database(mongo_uri)
+    synthetic.load_nights(db, nights, minutes)
+
+    if mongo_uri is None:
+        connect = lambda *args: db  # noqa: E731
+    else:
+        connect = lambda *args: MongoClient(mongo_uri)[db.name]  # noqa: E731
+
+    # The server runs in its own thread, so the patch is kept for the whole life of the process
+    mock.patch.object(database, 'connect', side_effect=connect).start()
+    app.serve(port, prewarm_data=True, n_threads=n_threads)
+
+
+def wait_for_server(metrics_url, timeout):
+    """
+    Waits until the server answers, the plotting modules are imported and the startup prewarm is finished.
+
+    Parameters
+    ----------
+    - `metrics_url` (str) The URL of the /metrics endpoint.
+    - `timeout` (float) The maximum seconds to wait.
+    """
+    deadline = time.perf_counter() + timeout
+
+    while time.perf_counter() < deadline:
+        try:
+            values = read_metrics(metrics_url)
+
+            # The prewarm starts once the plotting modules are imported
+            if (values.get('clusco_stage_seconds_count{name="plotting_modules",stage="startup"}', 0) >= 1
+                    and values.get('clusco_prewarm_state{state="running"}', 1) == 0):
+                return
+        except OSError:
+            pass
+
+        time.sleep(1)
+
+    raise TimeoutError(f"The server did not start in {timeout} seconds")
+
+
+def percentiles(values):
+    """
+    Get the percentiles of a list of measurements, ignoring the ones that timed out.
+
+    Parameters
+    ----------
+    - `values` (list) The measurements in seconds (None for the ones that timed out).
+
+    Returns
+    ----------
+    - `summary` (dict) The count, timeouts, p50, p90, p99 and max of the measurements.
+    """
+    measured = [value for value in values if value is not None]
+    summary = {'count': len(measured), 'timeouts': len(values) - len(measured)}
+
+    if measured:
+        summary.update({f'p{q}': float(np.percentile(measured, q)) for q in (50, 90, 99)})
+        summary['max'] = max(measured)
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the dashboard with concurrent headless sessions')
+    parser.add_argument('--sessions', type=int, default=4, help='Number of concurrent sessions (4 by default)')
+    parser.add_argument('--ramp', type=float, default=5, help='Seconds to open all the sessions (5 by default)')
+    parser.add_argument('--actions', type=int, default=6, help='Slider moves and date changes of each session, alternately (6 by default)')
+    parser.add_argument('--think-time', type=float, default=1, help='Seconds between the actions of a session (1 by default)')
+    parser.add_argument('--timeout', type=float, default=120, help='Maximum seconds to wait for the dashboard and for each update (120 by default)')
+    parser.add_argument('--settle', type=float, default=0.5, help='Seconds without messages after which a slider update is finished (0.5 by default)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random choices (0 by default)')
+    parser.add_argument('--url', default=None, help='URL of a running dashboard. A local server with synthetic nights is started if it is not given')
+    parser.add_argument('--dates', nargs='+', default=None, help='Dates to select with the date picker when using --url')
+    parser.add_argument('--port', type=int, default=5099, help='Port of the local server (5099 by default)')
+    parser.add_argument('--num-threads', type=int, default=None, help='Number of threads of the local server (See --num-threads of app.py)')
+    parser.add_argument('--nights', type=int, default=2, help='Number of synthetic nights of the local server (2 by default)')
+    parser.add_argument('--minutes', type=int, default=240, help='Minutes with data of each synthetic night (240 by default)')
+    parser.add_argument('--mongo-uri', default=None, help='URI of a local MongoDB server for the synthetic nights. mongomock is used if it is not given')
+    parser.add_argument('--sample-interval', type=float, default=1, help='Seconds between samples of the server RSS (1 by default)')
+    parser.add_argument('--output', default='load_test_results.json', help='Path of the JSON file with the results')
+    args = parser.parse_args()
+
+    server = None
+
+    if args.url is None:
+        last_night = database.get_current_night() - dt.timedelta(days=1)
+        nights = [last_night - dt.timedelta(days=i) for i in range(args.nights)]
+        dates = [night.isoformat() for night in nights]
+        url = f'http://127.0.0.1:{args.port}/'
+
+        server = multiprocessing.Process(target=serve_synthetic, args=(args.port, nights, args.minutes, args.mongo_uri, args.num_threads), daemon=True)
+        server.start()
+    else:
+        dates = args.dates or []
+        url = args.url
+
+    metrics_url = url.rstrip('/') + '/metrics'
+
+    try:
+        wait_for_server(metrics_url, args.timeout * 5)
+
+        samples = []
+        stop = threading.Event()
+        sampler = threading.Thread(target=sample_server, args=(metrics_url, args.sample_interval, samples, stop), daemon=True)
+        sampler.start()
+
+        count_websocket_bytes()
+        decode_binary_buffers()
+
+        results = [None] * args.sessions
+
+        def start_session(index):
+            time.sleep(args.ramp * index / args.sessions)
+            results[index] = run_session(index, url, args.actions, dates, args.think_time, args.timeout, args.settle, args.seed)
+
+        tic = time.perf_counter()
+        threads = [threading.Thread(target=start_session, args=(index, ), daemon=True) for index in range(args.sessions)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        duration = time.perf_counter() - tic
+
+        # Keep sampling for a while to see the memory released by the closed sessions
+        time.sleep(5 * args.sample_interval)
+        stop.set()
+        sampler.join()
+
+    finally:
+        if server is not None:
+            server.terminate()
+
+    summary = {'duration': duration,
+               'errors': [result['error'] for result in results if result['error'] is not None],
+               'first_plot': percentiles([result['first_plot'] for result in results]),
+               'dashboard': percentiles([result['dashboard'] for result in results]),
+               'slider': percentiles([latency for result in results for latency in result['slider']]),
+               'date': percentiles([latency for result in results for latency in result['date']]),
+               'bytes_received_per_session': float(np.mean([result['bytes_received'] for result in results])),
+               'bytes_sent_per_session': float(np.mean([result['bytes_sent'] for result in results])),
+               'peak_rss_mb': max((sample['rss_mb'] for sample in samples), default=None)}
+
+    report = {'date': dt.datetime.now().isoformat(), 'environment': get_environment(),
+              'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+              'summary': summary, 'sessions': results, 'server': samples}
+
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    print(f"\nResults written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
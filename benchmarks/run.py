@@ -0,0 +1,323 @@
+"""
+Benchmark runner. Loads synthetic nights into a local database (See `benchmarks.synthetic`) and measures the data
+retrieval, the aggregations, the plot builders and the creation of the whole dashboard. The results are written as
+JSON and can be compared with the results of a previous run.
+
+Usage (from the root of the repository):
+
+    python -m benchmarks.run --nights 2 --minutes 720 --repeat 5 --output results.json
+    python -m benchmarks.run --mongo-uri mongodb://localhost:27017 --compare results.json
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from unittest import mock
+
+import holoviews as hv
+import numpy as np
+import pandas as pd
+import panel as pn
+import psutil
+from pymongo import MongoClient
+
+# Application modules. Importing app applies the same Panel settings used by the dashboard, and the HoloViews settings
+# are applied when the plotting modules are imported.
+import app
+app.import_plotting_modules()
+import cache
+import dashboard_utils
+import database
+import plot_helper
+import registry
+from benchmarks import synthetic
+
+ARRAY_PROPERTIES = {
+    # property name: (var_name, value_name)
+    'scb_pixel_temperature': ('channel', 'temperature'),
+    'scb_temperature': ('module', 'temperature'),
+    'scb_humidity': ('module', 'humidity'),
+    'scb_pixel_an_current': ('channel', 'anode'),
+    'scb_pixel_hv_monitored': ('channel', 'hv'),
+    'backplane_temperature': ('module', 'temperature'),
+    'l1_rate': ('module', 'l1_rate'),
+    'l0_pixel_ipr': ('channel', 'l0_pixel_ipr'),
+    'dragon_busy': ('module', 'busy_status'),
+}
+"""
+Array properties with the names of the variable and value columns used by the dashboard
+"""
+
+SCALAR_PROPERTIES = {
+    # property name: (collection, value_name, remove_zero_values)
+    'clusco_l1_rate_control': ('CLUSCO_min', 'l1_rate_control', True),
+    'clusco_l0_rate_control': ('CLUSCO_min', 'l0_rate_control', True),
+    'clusco_l1_rate_max': ('CLUSCO_min', 'l1_rate_max', False),
+    'clusco_l1_rate_target': ('CLUSCO_min', 'l1_rate_target', False),
+    'clusco_l0_rate_max': ('CLUSCO_min', 'l0_rate_max', False),
+    'TIB_Rates_BUSYRate': ('TIB_min', 'tib_busy_rate', False),
+    'TIB_Rates_CalibrationRate': ('TIB_min', 'calibration_rate', False),
+    'TIB_Rates_CameraRate': ('TIB_min', 'camera_rate', False),
+    'TIB_Rates_LocalRate': ('TIB_min', 'local_rate', False),
+    'TIB_Rates_PedestalRate': ('TIB_min', 'pedestal_rate', False),
+}
+"""
+Scalar properties with their collection, the name of the value column and whether zero values are removed
+"""
+
+GROUPED_PLOTS = {
+    # property name: (ylabel, colormap, color limits)
+    'scb_pixel_temperature': ('Temperature (ºC)', 'cmap_temps', (0, 30)),
+    'scb_temperature': ('Temperature (ºC)', 'cmap_temps', (0, 30)),
+    'scb_humidity': ('Humidity (%)', 'cmap_humidty', (0, 80)),
+    'scb_pixel_an_current': ('Anode Current (µA)', 'cmap_anode', (0, 100)),
+    'scb_pixel_hv_monitored': ('HV (V)', 'cmap_hv', (10, 1400)),
+    'backplane_temperature': ('Temperature (ºC)', 'cmap_backplane_temp', (0, 37)),
+}
+"""
+Properties plotted with `plot_helper.multiplot_grouped_data` and the options used by the dashboard
+"""
+
+
+def measure(name, function, repeat, setup=None, **info):
+    """
+    Measures the time spent by a function.
+
+    Parameters
+    ----------
+    - `name` (str) The name of the benchmark.
+    - `function` (callable) The function to measure. It is called with the arguments returned by `setup`.
+    - `repeat` (int) The number of times the function is called.
+    - `setup` (callable) Function called without arguments before each call, not included in the measured time. It should
+    return a tuple with the arguments of the measured function. None to call it without arguments.
+    - `info` Other values stored in the result (e.g. the number of rows processed).
+
+    Returns
+    ----------
+    - `result` (dict) The name of the benchmark, the measured times, their statistics in seconds and the RSS of the process after the calls.
+    """
+    times = []
+
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+
+        tic = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - tic)
+
+    result = {'name': name, 'repeat': repeat, 'times': times, 'min': min(times), 'median': statistics.median(times),
+              'mean': statistics.mean(times), 'max': max(times), 'rss_mb': psutil.Process().memory_info().rss / 2**20}
+    result.update(info)
+
+    print(f"{name:<70} median {result['median'] * 1000:10.2f} ms   min {result['min'] * 1000:10.2f} ms", file=sys.stderr)
+
+    return result
+
+
+def run_benchmarks(db, connect, night, empty_night, repeat):
+    """
+    Runs all the benchmarks against a database loaded with synthetic nights.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database or mongomock.Database) The database with the synthetic nights.
+    - `connect` (callable) Function returning a database object, used instead of `database.connect` by the dashboard.
+    - `night` (dt.date) The latest night with data.
+    - `empty_night` (dt.date) A night without data after `night`, or None if all the nights have data.
+    - `repeat` (int) The number of times each benchmark is repeated.
+
+    Returns
+    ----------
+    - `results` (list) The result of each benchmark (See `measure`).
+    """
+    results = []
+    clusco_min_collection = db['CLUSCO_min']
+    array_data = {}
+
+    # Data retrieval
+    for property_name, (var_name, value_name) in ARRAY_PROPERTIES.items():
+        value_field = 'max' if property_name == 'dragon_busy' else 'avg'
+
+        def get_data(property_name=property_name, var_name=var_name, value_name=value_name, value_field=value_field):
+            return database.get_data_by_date(clusco_min_collection, property_name, night, value_field, 'date', var_name, value_name, search_previous=False)
+
+        array_data[property_name] = get_data()
+        results.append(measure(f'database.get_data_by_date[{property_name}]', get_data, repeat, rows=len(array_data[property_name])))
+
+    if empty_night is not None:
+        results.append(measure('database.get_data_by_date[scb_pixel_temperature, search_previous]',
+                               lambda: database.get_data_by_date(clusco_min_collection, 'scb_pixel_temperature', empty_night, 'avg', 'date', 'channel',
+                                                                 'temperature', search_previous=True), repeat))
+
+    scalar_data = {}
+
+    for property_name, (collection_name, value_name, remove_zero_values) in SCALAR_PROPERTIES.items():
+        def get_scalar_data(property_name=property_name, collection_name=collection_name, value_name=value_name, remove_zero_values=remove_zero_values):
+            return database.get_scalar_data_by_date(db[collection_name], property_name, night, 'avg', value_name, search_previous=False,
+                                                    remove_zero_values=remove_zero_values)
+
+        scalar_data[property_name] = get_scalar_data()
+        results.append(measure(f'database.get_scalar_data_by_date[{property_name}]', get_scalar_data, repeat, rows=len(scalar_data[property_name])))
+
+    # All the properties of the night, retrieved with a query for each batch of properties and several concurrent queries
+    def setup_load_night_data():
+        cache.night_data.clear()
+        return (connect(), night)
+
+    results.append(measure('dashboard_utils.load_night_data[cold]', dashboard_utils.load_night_data, repeat, setup=setup_load_night_data))
+
+    # Aggregations
+    for property_name, (var_name, value_name) in ARRAY_PROPERTIES.items():
+        if property_name == 'dragon_busy':
+            continue
+
+        df = array_data[property_name]
+        results.append(measure(f'plot_helper.build_min_max_avg[{property_name}]', lambda df=df, var_name=var_name, value_name=value_name:
+                               plot_helper.build_min_max_avg(df, 'date', value_name, var_name), repeat, rows=len(df)))
+
+    # Composite plot builders. A copy of the data is used in each call, so the aggregates are not taken from the cache.
+    # The plots are rendered to Bokeh models as well, which is the work done when they are added to a session.
+    for property_name, (ylabel, cmap_name, clim) in GROUPED_PLOTS.items():
+        var_name, value_name = ARRAY_PROPERTIES[property_name]
+        df = array_data[property_name]
+        cmap = getattr(registry, cmap_name)
+
+        def build_grouped_plot(df, title=property_name, var_name=var_name, value_name=value_name, ylabel=ylabel, cmap=cmap, clim=clim):
+            return plot_helper.multiplot_grouped_data(df, 'date', value_name, title, 'Time (UTC)', ylabel, var_name, cmap, clim)
+
+        results.append(measure(f'plot_helper.multiplot_grouped_data[{property_name}]', build_grouped_plot, repeat, setup=lambda df=df: (df.copy(), ), rows=len(df)))
+        results.append(measure(f'render[{property_name}]', hv.render, repeat, setup=lambda df=df, build=build_grouped_plot: (build(df), )))
+
+    l1_rate_data_dict = {'l1_rate': array_data['l1_rate'],
+                         'l1_rate_control': scalar_data['clusco_l1_rate_control'],
+                         'l1_rate_max': scalar_data['clusco_l1_rate_max'],
+                         'l1_rate_target': scalar_data['clusco_l1_rate_target'],
+                         'l0_rate_control': scalar_data['clusco_l0_rate_control']}
+
+    results.append(measure('plot_helper.plot_l1_rate_data', lambda data_dict: plot_helper.plot_l1_rate_data(
+        data_dict, 'date', 'l1_rate', 'L1 Rate', 'Time (UTC)', 'L1 Rate (Hz)', 'module', registry.cmap_temps, (0, 1000)), repeat,
+        setup=lambda: (dict(l1_rate_data_dict, l1_rate=l1_rate_data_dict['l1_rate'].copy()), )))
+
+    l0_pixel_ipr_data_dict = {'l0_pixel_ipr': array_data['l0_pixel_ipr'],
+                              'l0_rate_max': scalar_data['clusco_l0_rate_max']}
+
+    results.append(measure('plot_helper.plot_l0_ipr_data', lambda data_dict: plot_helper.plot_l0_ipr_data(
+        data_dict, 'date', 'l0_pixel_ipr', 'L0 Pixel IPR', 'Time (UTC)', 'L0 Pixel IPR (Hz)', 'channel', registry.cmap_temps, (0, 1000)), repeat,
+        setup=lambda: (dict(l0_pixel_ipr_data_dict, l0_pixel_ipr=l0_pixel_ipr_data_dict['l0_pixel_ipr'].copy()), )))
+
+    tib_rates_data_dict = {'tib_busy_rate': scalar_data['TIB_Rates_BUSYRate'],
+                           'tib_calibration_rate': scalar_data['TIB_Rates_CalibrationRate'],
+                           'tib_camera_rate': scalar_data['TIB_Rates_CameraRate'],
+                           'tib_local_rate': scalar_data['TIB_Rates_LocalRate'],
+                           'tib_pedestal_rate': scalar_data['TIB_Rates_PedestalRate']}
+
+    results.append(measure('plot_helper.plot_tib_rate_data', lambda: plot_helper.plot_tib_rate_data(tib_rates_data_dict, 'TIB Rates', 'Time (UTC)', 'TIB Rates (Hz)'), repeat))
+    results.append(measure('plot_helper.plot_dragon_busy_data', lambda: plot_helper.plot_dragon_busy_data(array_data['dragon_busy'], 'Dragon Busy', 'Time (UTC)', 'Module ID'), repeat))
+
+    # Whole dashboard, with the night data cache empty (as the first session of a night) and with the data already cached
+    def setup_cold_dashboard():
+        cache.night_data.clear()
+        return (app.create_loading_template(), )
+
+    with mock.patch.object(database, 'connect', side_effect=lambda *args: connect()):
+        results.append(measure('dashboard_utils.create_dashboard[cold]', dashboard_utils.create_dashboard, repeat, setup=setup_cold_dashboard))
+        results.append(measure('dashboard_utils.create_dashboard[cached]', dashboard_utils.create_dashboard, repeat,
+                               setup=lambda: (app.create_loading_template(), )))
+
+    return results
+
+
+def get_environment():
+    """
+    Get the versions of the main packages and the machine where the benchmarks are run.
+
+    Returns
+    ----------
+    - `environment` (dict) The environment information.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'holoviews': hv.__version__, 'panel': pn.__version__}
+
+
+def compare(results, baseline_path):
+    """
+    Prints the ratio between the median time of each benchmark and the one of a previous run.
+
+    Parameters
+    ----------
+    - `results` (list) The results of this run.
+    - `baseline_path` (str) The path of the JSON file with the results of the previous run.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = {result['name']: result for result in json.load(baseline_file)['results']}
+
+    print(f"\nComparison with {baseline_path} (median time, < 1 is faster):", file=sys.stderr)
+
+    for result in results:
+        previous = baseline.get(result['name'])
+
+        if previous is not None and previous['median'] > 0:
+            print(f"{result['name']:<70} {result['median'] / previous['median']:6.2f}x", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the dashboard with synthetic nights')
+    parser.add_argument('--nights', type=int, default=1, help='Number of consecutive nights with data (1 by default)')
+    parser.add_argument('--empty-nights', type=int, default=1, help='Number of nights without data after the last night with data (1 by default)')
+    parser.add_argument('--minutes', type=int, default=720, help='Minutes with data of each night (720 by default)')
+    parser.add_argument('--gap', action='append', default=[], metavar='START:END',
+                        help='Interval of minutes of each night without data. It can be repeated')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated values (0 by default)')
+    parser.add_argument('--mongo-uri', default=None, help='URI of a local MongoDB server. mongomock is used if it is not given')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times each benchmark is repeated (3 by default)')
+    parser.add_argument('--output', default='benchmark_results.json', help='Path of the JSON file with the results')
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help='JSON file with the results of a previous run to compare with')
+    args = parser.parse_args()
+
+    gaps = [tuple(int(minute) for minute in gap.split(':')) for gap in args.gap]
+
+    # The nights end before the current night, so the live feed is not started by the dashboard
+    last_night = database.get_current_night() - dt.timedelta(days=1 + args.empty_nights)
+    nights = [last_night - dt.timedelta(days=i) for i in range(args.nights)]
+    empty_night = last_night + dt.timedelta(days=args.empty_nights) if args.empty_nights > 0 else None
+
+    db = synthetic.create_database(args.mongo_uri)
+
+    tic = time.perf_counter()
+    count = synthetic.load_nights(db, nights, args.minutes, gaps=gaps, seed=args.seed)
+    print(f"Loaded {count} documents of {len(nights)} nights in {time.perf_counter() - tic:0.2f} seconds", file=sys.stderr)
+
+    if args.mongo_uri is None:
+        connect = lambda: db  # noqa: E731
+    else:
+        connect = lambda: MongoClient(args.mongo_uri)[db.name]  # noqa: E731
+
+    results = run_benchmarks(db, connect, last_night, empty_night, args.repeat)
+
+    report = {'date': dt.datetime.now().isoformat(), 'environment': get_environment(),
+              'parameters': {'nights': args.nights, 'empty_nights': args.empty_nights, 'minutes': args.minutes, 'gaps': gaps,
+                             'seed': args.seed, 'database': 'mongod' if args.mongo_uri else 'mongomock', 'repeat': args.repeat},
+              'results': results}
+
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print(f"\nResults written to {args.output}", file=sys.stderr)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
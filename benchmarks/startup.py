@@ -0,0 +1,171 @@
+"""
+Cold start benchmark. Starts the application in a new process several times and measures the seconds from the start
+of the process until the server accepts connections, until the first byte of the loading template is received, until
+the whole page is received and until the plotting modules are imported (read from /metrics), when the sessions can
+create their dashboards. The database is not needed, the sessions opened by the benchmark just fail to connect to it.
+
+Usage (from the root of the repository):
+
+    python -m benchmarks.startup --repeat 5 --output startup_results.json
+    python -m benchmarks.startup --app ../previous_checkout/app.py --modules-timeout 0 --output previous_startup_results.json
+    python -m benchmarks.startup --compare previous_startup_results.json
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.run import compare, get_environment
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+"""
+Path of the application started by default
+"""
+
+MODULES_METRIC = 'clusco_stage_seconds_count{name="plotting_modules",stage="startup"}'
+"""
+Metric counting the imports of the plotting modules (See `app.import_plotting_modules`)
+"""
+
+
+def wait_for_connection(port, process, deadline):
+    """
+    Waits until the server accepts connections.
+
+    Parameters
+    ----------
+    - `port` (int) The port of the server.
+    - `process` (subprocess.Popen) The process of the server.
+    - `deadline` (float) The `time.perf_counter` value after which it stops waiting.
+    """
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The application exited with code {process.returncode}")
+
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.01)
+
+    raise TimeoutError("The server did not accept connections in time")
+
+
+def wait_for_modules(port, deadline):
+    """
+    Waits until the plotting modules are imported, reading the /metrics endpoint.
+
+    Parameters
+    ----------
+    - `port` (int) The port of the server.
+    - `deadline` (float) The `time.perf_counter` value after which it stops waiting.
+
+    Returns
+    ----------
+    - `imported` (bool) Whether the modules were imported before the deadline.
+    """
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as response:
+                if any(line.startswith(MODULES_METRIC) and float(line.rpartition(' ')[2]) >= 1 for line in response.read().decode().splitlines()):
+                    return True
+        except OSError:
+            pass
+
+        time.sleep(0.05)
+
+    return False
+
+
+def start_once(app_path, port, timeout, modules_timeout):
+    """
+    Starts the application in a new process, measures its startup and stops it.
+
+    Parameters
+    ----------
+    - `app_path` (str) The path of the app.py file to start.
+    - `port` (int) The port of the server.
+    - `timeout` (float) The maximum seconds to wait for the first response.
+    - `modules_timeout` (float) The maximum seconds to wait for the plotting modules after the first response.
+
+    Returns
+    ----------
+    - `times` (dict) The seconds from the start of the process to each step. The `modules` step is None if it was not reached.
+    """
+    times = {}
+    tic = time.perf_counter()
+    process = subprocess.Popen([sys.executable, app_path, '-p', str(port)], cwd=os.path.dirname(os.path.abspath(app_path)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        deadline = tic + timeout
+        wait_for_connection(port, process, deadline)
+        times['connection'] = time.perf_counter() - tic
+
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=max(deadline - time.perf_counter(), 1)) as response:
+            response.read(1)
+            times['first_byte'] = time.perf_counter() - tic
+            response.read()
+            times['page'] = time.perf_counter() - tic
+
+        imported = modules_timeout > 0 and wait_for_modules(port, time.perf_counter() + modules_timeout)
+        times['modules'] = time.perf_counter() - tic if imported else None
+
+    finally:
+        process.terminate()
+
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    print('   '.join(f"{step} {seconds:0.3f} s" if seconds is not None else f"{step} -" for step, seconds in times.items()), file=sys.stderr)
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark of the dashboard')
+    parser.add_argument('--app', default=APP_PATH, help='Path of the app.py file to start (the one of this repository by default)')
+    parser.add_argument('--port', type=int, default=5098, help='Port of the server (5098 by default)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times the application is started (3 by default)')
+    parser.add_argument('--timeout', type=float, default=120, help='Maximum seconds to wait for the first response (120 by default)')
+    parser.add_argument('--modules-timeout', type=float, default=120,
+                        help='Maximum seconds to wait for the plotting modules after the first response, 0 to skip it (120 by default)')
+    parser.add_argument('--output', default='startup_results.json', help='Path of the JSON file with the results')
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help='JSON file with the results of a previous run to compare with')
+    args = parser.parse_args()
+
+    runs = [start_once(args.app, args.port, args.timeout, args.modules_timeout) for _ in range(args.repeat)]
+
+    results = []
+
+    for step in ('connection', 'first_byte', 'page', 'modules'):
+        times = [run[step] for run in runs if run[step] is not None]
+
+        if times:
+            results.append({'name': f'startup[{step}]', 'repeat': len(times), 'times': times, 'min': min(times), 'median': statistics.median(times),
+                            'mean': statistics.mean(times), 'max': max(times)})
+
+    report = {'date': dt.datetime.now().isoformat(), 'environment': get_environment(),
+              'parameters': {'app': os.path.abspath(args.app), 'repeat': args.repeat}, 'results': results}
+
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print(f"\nResults written to {args.output}", file=sys.stderr)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
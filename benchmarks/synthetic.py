@@ -0,0 +1,197 @@
+"""
+Synthetic night generator. Creates documents with the same structure as the ones stored in the `CLUSCO_min` and
+`TIB_min` collections (one document per property and minute, with arrays of 1855 pixels or 265 modules, or scalar
+values) with realistic values, and loads them into a MongoDB database or a mongomock stand-in.
+"""
+
+import datetime as dt
+
+import numpy as np
+from pymongo import ASCENDING, MongoClient
+
+N_CHANNELS = 1855
+"""
+Number of pixels (channels) of the camera
+"""
+
+N_MODULES = 265
+"""
+Number of modules of the camera
+"""
+
+
+def normal(mean, std, low=None, high=None, decimals=2):
+    """
+    Creates a generator of normally distributed values.
+
+    Parameters
+    ----------
+    - `mean` (float) The mean of the values.
+    - `std` (float) The standard deviation of the values.
+    - `low` (float) The minimum value. None to not clip the values.
+    - `high` (float) The maximum value. None to not clip the values.
+    - `decimals` (int) The number of decimals of the values. 2 by default.
+
+    Returns
+    ----------
+    - `generate` (callable) A function receiving a numpy random generator and the number of values, returning the values.
+    """
+    def generate(rng, size):
+        values = rng.normal(mean, std, size)
+
+        if low is not None or high is not None:
+            values = np.clip(values, low, high)
+
+        return values.round(decimals)
+
+    return generate
+
+
+def choice(values, probabilities):
+    """
+    Creates a generator of values chosen from a list.
+
+    Parameters
+    ----------
+    - `values` (list) The possible values.
+    - `probabilities` (list) The probability of each value.
+
+    Returns
+    ----------
+    - `generate` (callable) A function receiving a numpy random generator and the number of values, returning the values.
+    """
+    def generate(rng, size):
+        return rng.choice(values, size, p=probabilities)
+
+    return generate
+
+
+PROPERTIES = [
+    # Pixel arrays
+    {'collection': 'CLUSCO_min', 'name': 'scb_pixel_temperature', 'size': N_CHANNELS, 'value_field': 'avg', 'generate': normal(22, 3, 0, 40)},
+    {'collection': 'CLUSCO_min', 'name': 'scb_pixel_an_current', 'size': N_CHANNELS, 'value_field': 'avg', 'generate': normal(8, 4, 0, 100)},
+    {'collection': 'CLUSCO_min', 'name': 'scb_pixel_hv_monitored', 'size': N_CHANNELS, 'value_field': 'avg', 'generate': normal(1100, 60, 0, 1400)},
+    {'collection': 'CLUSCO_min', 'name': 'l0_pixel_ipr', 'size': N_CHANNELS, 'value_field': 'avg', 'generate': normal(500, 150, 0)},
+    # Module arrays
+    {'collection': 'CLUSCO_min', 'name': 'scb_temperature', 'size': N_MODULES, 'value_field': 'avg', 'generate': normal(24, 2, 0, 40)},
+    {'collection': 'CLUSCO_min', 'name': 'scb_humidity', 'size': N_MODULES, 'value_field': 'avg', 'generate': normal(30, 5, 0, 80)},
+    {'collection': 'CLUSCO_min', 'name': 'backplane_temperature', 'size': N_MODULES, 'value_field': 'avg', 'generate': normal(27, 2, 0, 40)},
+    {'collection': 'CLUSCO_min', 'name': 'l1_rate', 'size': N_MODULES, 'value_field': 'avg', 'generate': normal(400, 100, 0)},
+    {'collection': 'CLUSCO_min', 'name': 'dragon_busy', 'size': N_MODULES, 'value_field': 'max', 'generate': choice([0, 1, 2, 3], [0.97, 0.02, 0.007, 0.003])},
+    # Scalars
+    {'collection': 'CLUSCO_min', 'name': 'clusco_l1_rate_control', 'size': None, 'value_field': 'avg', 'generate': choice([0, 1], [0.9, 0.1])},
+    {'collection': 'CLUSCO_min', 'name': 'clusco_l0_rate_control', 'size': None, 'value_field': 'avg', 'generate': choice([0, 1], [0.9, 0.1])},
+    {'collection': 'CLUSCO_min', 'name': 'clusco_l1_rate_max', 'size': None, 'value_field': 'avg', 'generate': normal(1000, 0)},
+    {'collection': 'CLUSCO_min', 'name': 'clusco_l1_rate_target', 'size': None, 'value_field': 'avg', 'generate': normal(600, 0)},
+    {'collection': 'CLUSCO_min', 'name': 'clusco_l0_rate_max', 'size': None, 'value_field': 'avg', 'generate': normal(800, 0)},
+    {'collection': 'TIB_min', 'name': 'TIB_Rates_BUSYRate', 'size': None, 'value_field': 'avg', 'generate': normal(50, 10, 0)},
+    {'collection': 'TIB_min', 'name': 'TIB_Rates_CalibrationRate', 'size': None, 'value_field': 'avg', 'generate': normal(100, 2, 0)},
+    {'collection': 'TIB_min', 'name': 'TIB_Rates_CameraRate', 'size': None, 'value_field': 'avg', 'generate': normal(7000, 500, 0)},
+    {'collection': 'TIB_min', 'name': 'TIB_Rates_LocalRate', 'size': None, 'value_field': 'avg', 'generate': normal(7500, 500, 0)},
+    {'collection': 'TIB_min', 'name': 'TIB_Rates_PedestalRate', 'size': None, 'value_field': 'avg', 'generate': normal(100, 2, 0)},
+]
+"""
+Properties plotted in the dashboard, with the collection where they are stored, the size of their arrays (None for scalars),
+the field where the value is stored and the generator of their values
+"""
+
+
+def generate_night(night, minutes=720, start_hour=20, gaps=(), seed=0):
+    """
+    Generates the documents of all the properties for a night, one document per property and minute.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The day in which the night starts.
+    - `minutes` (int) The number of minutes with data. 720 by default (12 hours).
+    - `start_hour` (int) The hour of the first document. 20 by default.
+    - `gaps` (list) Tuples with the first and last minute (exclusive) of the intervals without data (e.g. the DAQ was stopped).
+    - `seed` (int) The seed of the random generator, so the same night is always generated with the same values.
+
+    Returns
+    ----------
+    - `documents` (generator) Tuples with the name of the collection and the document for each minute and property.
+    """
+    rng = np.random.default_rng([seed, night.toordinal()])
+    start = dt.datetime(night.year, night.month, night.day, start_hour)
+
+    for minute in range(minutes):
+        if any(gap_start <= minute < gap_end for gap_start, gap_end in gaps):
+            continue
+
+        date = start + dt.timedelta(minutes=minute)
+
+        for prop in PROPERTIES:
+            if prop['size'] is None:
+                value = prop['generate'](rng, 1)[0].item()
+            else:
+                value = prop['generate'](rng, prop['size']).tolist()
+
+            yield prop['collection'], {'name': prop['name'], 'date': date, prop['value_field']: value}
+
+
+def load_nights(db, nights, minutes=720, start_hour=20, gaps=(), seed=0, batch_size=5000):
+    """
+    Loads the documents of several synthetic nights into a database, creating the index on name and date used by the queries.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database or mongomock.Database) The database.
+    - `nights` (list) The days in which each night starts.
+    - `minutes`, `start_hour`, `gaps`, `seed`: See `generate_night`.
+    - `batch_size` (int) The number of documents inserted at once.
+
+    Returns
+    ----------
+    - `count` (int) The number of documents inserted.
+    """
+    count = 0
+    batches = {}
+
+    for collection_name in {prop['collection'] for prop in PROPERTIES}:
+        db[collection_name].create_index([('name', ASCENDING), ('date', ASCENDING)])
+        batches[collection_name] = []
+
+    for night in nights:
+        for collection_name, document in generate_night(night, minutes, start_hour, gaps, seed):
+            batch = batches[collection_name]
+            batch.append(document)
+
+            if len(batch) >= batch_size:
+                db[collection_name].insert_many(batch)
+                count += len(batch)
+                batch.clear()
+
+    for collection_name, batch in batches.items():
+        if batch:
+            db[collection_name].insert_many(batch)
+            count += len(batch)
+
+    return count
+
+
+def create_database(mongo_uri=None, db_name='clusco_benchmark'):
+    """
+    Creates an empty database for the synthetic nights. A mongomock database is created when no URI is given, so the
+    benchmarks can run without a MongoDB server. Note that the query times of mongomock are not representative of a
+    real server; use a local mongod to benchmark the database access.
+
+    Parameters
+    ----------
+    - `mongo_uri` (str) The URI of a MongoDB server (e.g. mongodb://localhost:27017). None to use mongomock.
+    - `db_name` (str) The name of the database. Any previous database with this name is dropped.
+
+    Returns
+    ----------
+    - `db` (pymongo.database.Database or mongomock.Database) The empty database.
+    """
+    if mongo_uri is None:
+        import mongomock  # Only needed to run the benchmarks without a MongoDB server
+
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+
+    client.drop_database(db_name)
+
+    return client[db_name]
@@ -0,0 +1,425 @@
+"""
+Night data cache module. The data retrieved from the database is shared by all the sessions of the process, so
+several operators looking at the same night do not query the database again. The aggregates computed from this
+data to build the plots (envelopes, rasters) are shared in the same way.
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+import pandas as pd
+
+import payloads
+import shared_cache
+
+
+class NightDataCache:
+    """
+    Thread-safe cache with the dataframes retrieved for each night.
+
+    Each entry is stored as a list of dataframe chunks, so new data of the current night can be appended
+    with a cost proportional to the new rows. Chunks are concatenated when the entry is read.
+
+    The memory used by each entry is accounted, and entries are kept in least recently used order, so the
+    cache can be evicted when the process memory goes over the high-water mark (See `memory_manager`). The keys
+    start with the telescope of the data (See `telescopes`), and the data of a telescope with a budget is evicted
+    when it goes over it, without evicting the data of the other telescopes.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._budgets = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(telescope_name, collection_name, property_name, value_field, night):
+        """
+        Build the key used to store a property of a night in the cache.
+
+        Parameters
+        ----------
+        - `telescope_name` (str) The name of the telescope (LST1, LST2...)
+        - `collection_name` (str) The name of the collection where the property is stored (CLUSCO_min, TIB_min...)
+        - `property_name` (str) The name of the property
+        - `value_field` (str) The name of the field retrieved from the collection (avg, max...)
+        - `night` (dt.date) The day in which the night starts.
+
+        Returns
+        ----------
+        - `key` (tuple) The cache key.
+        """
+        return (telescope_name, collection_name, property_name, value_field, night)
+
+    def set_budget(self, telescope_name, nbytes):
+        """
+        Set the maximum memory used by the cached data of a telescope.
+
+        Parameters
+        ----------
+        - `telescope_name` (str) The name of the telescope.
+        - `nbytes` (int) The memory in bytes, or None for no limit.
+        """
+        with self._lock:
+            self._budgets[telescope_name] = nbytes
+
+    def get(self, key):
+        """
+        Get the dataframe stored for a key.
+
+        Parameters
+        ----------
+        - `key` (tuple) The cache key.
+
+        Returns
+        ----------
+        - `df` (pandas.DataFrame) The cached dataframe or None if the key is not in the cache.
+        """
+        with self._lock:
+            chunks = self._entries.get(key)
+
+            if chunks is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+            # Consolidate the appended chunks, so the next read does not need to concatenate them again
+            if len(chunks) > 1:
+                chunks[:] = [pd.concat(chunks)]
+
+            return chunks[0]
+
+    def put(self, key, df):
+        """
+        Store a dataframe for a key, replacing any previous value.
+
+        Parameters
+        ----------
+        - `key` (tuple) The cache key.
+        - `df` (pandas.DataFrame) The dataframe to store.
+        """
+        with self._lock:
+            self._entries[key] = [df]
+            self._entries.move_to_end(key)
+            self._sizes[key] = get_dataframe_size(df)
+            self._enforce_budget(key)
+
+    def append(self, key, df):
+        """
+        Append new rows to a cached dataframe. Nothing is done if the key is not in the cache.
+
+        Parameters
+        ----------
+        - `key` (tuple) The cache key.
+        - `df` (pandas.DataFrame) The new rows to append.
+
+        Returns
+        ----------
+        - `appended` (bool) Whether the rows were appended or not.
+        """
+        with self._lock:
+            chunks = self._entries.get(key)
+
+            if chunks is None:
+                return False
+
+            if chunks[0].empty:
+                chunks[:] = [df]
+            else:
+                chunks.append(df)
+
+            self._sizes[key] += get_dataframe_size(df)
+            self._enforce_budget(key)
+
+            return True
+
+    def _enforce_budget(self, key):
+        # Evicts the least recently used data of the telescope of a new entry while it is over its budget, keeping the
+        # night of the new entry
+        budget = self._budgets.get(key[0])
+
+        if budget is not None:
+            excess = self.nbytes(key[0]) - budget
+
+            if excess > 0:
+                self.evict(excess, protected_nights=(key[4], ), telescope_name=key[0])
+
+    def last_timestamp(self, key):
+        """
+        Get the date of the newest row stored for a key.
+
+        Parameters
+        ----------
+        - `key` (tuple) The cache key.
+
+        Returns
+        ----------
+        - `timestamp` (pandas.Timestamp) The newest date in the cached data, or None if there is no data for the key.
+        """
+        with self._lock:
+            chunks = self._entries.get(key)
+
+            if not chunks or chunks[-1].empty:
+                return None
+
+            return chunks[-1].index.max()
+
+    def remove(self, key):
+        """
+        Remove an entry from the cache.
+
+        Parameters
+        ----------
+        - `key` (tuple) The cache key.
+
+        Returns
+        ----------
+        - `size` (int) The memory in bytes used by the removed entry (0 if the key was not in the cache).
+        """
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return 0
+
+            return self._sizes.pop(key)
+
+    def evict(self, nbytes, protected_nights=(), telescope_name=None):
+        """
+        Remove the least recently used entries until the given amount of memory is freed or there is nothing more to evict.
+
+        Parameters
+        ----------
+        - `nbytes` (int) The memory in bytes to free.
+        - `protected_nights` (iterable) Nights that should not be evicted (e.g. the current night, which is being updated by the live feed).
+        - `telescope_name` (str) The telescope whose entries are evicted. The entries of all the telescopes by default.
+
+        Returns
+        ----------
+        - `freed` (int) The memory in bytes used by the evicted entries.
+        """
+        freed = 0
+
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if freed >= nbytes:
+                    break
+
+                if key[4] in protected_nights or (telescope_name is not None and key[0] != telescope_name):
+                    continue
+
+                freed += self.remove(key)
+                self.evictions += 1
+
+        return freed
+
+    def clear(self):
+        """
+        Remove all the entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+    def nbytes(self, telescope_name=None):
+        """
+        Get the memory used by the cached dataframes.
+
+        Parameters
+        ----------
+        - `telescope_name` (str) The telescope whose dataframes are accounted. All of them by default.
+
+        Returns
+        ----------
+        - `nbytes` (int) The memory in bytes.
+        """
+        with self._lock:
+            return sum(size for key, size in self._sizes.items() if telescope_name is None or key[0] == telescope_name)
+
+    def is_cached(self, df):
+        """
+        Check if a dataframe is stored in the cache (the same object, not an equal one).
+
+        Parameters
+        ----------
+        - `df` (pandas.DataFrame) The dataframe to check.
+
+        Returns
+        ----------
+        - `cached` (bool) Whether the dataframe is stored in the cache.
+        """
+        with self._lock:
+            return any(chunk is df for chunks in self._entries.values() for chunk in chunks)
+
+    def key_of(self, df):
+        """
+        Get the key of a dataframe stored in the cache (the same object, not an equal one).
+
+        Parameters
+        ----------
+        - `df` (pandas.DataFrame) The dataframe to check.
+
+        Returns
+        ----------
+        - `key` (tuple) The cache key, or None if the dataframe is not stored in the cache.
+        """
+        with self._lock:
+            for key, chunks in self._entries.items():
+                if len(chunks) == 1 and chunks[0] is df:
+                    return key
+
+            return None
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def keys(self):
+        """
+        Get the keys stored in the cache.
+
+        Returns
+        ----------
+        - `keys` (list) The list of cache keys.
+        """
+        with self._lock:
+            return list(self._entries.keys())
+
+
+class AggregateCache:
+    """
+    Thread-safe cache with the aggregates (envelopes, rasters...) computed from the dataframes of the night data cache.
+
+    The entries are keyed by the identity of the source dataframe, so when new data is appended to a night a new
+    dataframe is returned by the night data cache and the aggregates are computed again. Entries are removed when
+    the source dataframe is garbage collected. If an aggregate is being computed by another thread (e.g. by the
+    startup prewarm), the caller waits for it instead of computing it twice.
+
+    Aggregates of the dataframes stored in the night data cache are also shared with the other worker processes
+    (See `shared_cache`), keyed by the night data key and the number of rows of the source dataframe, and their
+    arrays are encoded once for the plots of all the sessions (See `payloads`).
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._pending = {}
+        self._sources = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, kind, df, params, compute, dump=None, load=None):
+        """
+        Get an aggregate of a dataframe, computing it if it is not cached.
+
+        Parameters
+        ----------
+        - `kind` (str) The kind of aggregate (envelope, raster...)
+        - `df` (pandas.DataFrame) The source dataframe.
+        - `params` (tuple) The parameters used to compute the aggregate.
+        - `compute` (callable) The function called without arguments to compute the aggregate.
+        - `dump` (callable) The function converting the aggregate to the value stored in the shared cache. None to store it as it is.
+        - `load` (callable) The function converting the value stored in the shared cache to the aggregate. None to use it as it is.
+
+        Returns
+        ----------
+        - `aggregate` The cached or computed aggregate.
+        """
+        key = (kind, id(df), params)
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+
+                if entry is not None and entry[0]() is df:
+                    self.hits += 1
+                    return entry[1]
+
+                pending = self._pending.get(key)
+
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+
+            pending.wait()
+
+        try:
+            aggregate = None
+            shared_key = None
+            data_key = night_data.key_of(df) if shared_cache.store.enabled or payloads.store.enabled else None
+
+            if data_key is not None and shared_cache.store.enabled:
+                shared_key = (kind, ) + data_key + (len(df), ) + params
+                aggregate = shared_cache.store.load(shared_key)
+
+                if aggregate is not None and load is not None:
+                    aggregate = load(aggregate)
+
+            if aggregate is None:
+                aggregate = compute()
+
+                if shared_key is not None:
+                    shared_cache.store.store(shared_key, dump(aggregate) if dump is not None else aggregate)
+
+            # The encoded arrays of the aggregate are reused by the plots of every session
+            if data_key is not None:
+                payloads.store.share(aggregate, (kind, ) + data_key + (len(df), ) + params)
+
+            with self._lock:
+                self._entries[key] = (weakref.ref(df), aggregate)
+
+                # Remove the aggregates of the dataframe when it is garbage collected
+                if id(df) not in self._sources:
+                    self._sources[id(df)] = weakref.finalize(df, self._remove_source, id(df))
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+            pending.set()
+
+        return aggregate
+
+    def _remove_source(self, source_id):
+        with self._lock:
+            self._sources.pop(source_id, None)
+
+            for key in [key for key in list(self._entries) if key[1] == source_id]:
+                del self._entries[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def get_dataframe_size(df):
+    """
+    Get the memory used by a dataframe, including its index.
+
+    Parameters
+    ----------
+    - `df` (pandas.DataFrame) The dataframe.
+
+    Returns
+    ----------
+    - `size` (int) The memory in bytes.
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+night_data = NightDataCache()
+"""
+Process-wide cache with the data of each night and property
+"""
+
+aggregates = AggregateCache()
+"""
+Process-wide cache with the aggregates computed from the night data
+"""
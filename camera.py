@@ -0,0 +1,241 @@
+"""
+Pixel to module mapping of the camera. The pixel properties (PACTA temperature, anode current, HV and L0 IPR) are
+stored for each of the 1855 pixels (channels) and the module properties (SCB temperature, humidity, L1 rate...) for
+each of the 265 modules, so the mapping puts both in the same id space: the values of the 7 pixels of each module are
+reduced to a single value per module (mean, max, min or spread) at once with `numpy.ufunc.reduceat` over the columns
+of the 2D array of the night (See `thresholds.load_night_array`), and the pixels of a module are found to drill into it.
+
+By default the pixels are numbered module after module (channels 1-7 are the pixels of module 1, 8-14 of module 2...).
+Another mapping can be given in a CSV file with the columns `channel` and `module` (See `PIXEL_MODULE_FILE`).
+"""
+
+import numpy as np
+import pandas as pd
+
+import cache
+import correlation
+import thresholds
+from config import PIXEL_MODULE_FILE
+
+N_PIXELS = 1855
+"""
+Number of pixels (channels) of the camera
+"""
+PIXELS_PER_MODULE = 7
+"""
+Number of pixels of each module in the default mapping
+"""
+STATISTICS = ('mean', 'max', 'min', 'spread')
+"""
+Statistics reducing the pixels of each module to a single value. The spread is the difference between the max and the min
+"""
+
+
+class PixelModuleMap:
+    """
+    Module of each pixel of the camera.
+    """
+
+    def __init__(self, modules):
+        """
+        Parameters
+        ----------
+        - `modules` (numpy.ndarray) The module of each channel, starting from channel 1.
+        """
+        self.modules = np.asarray(modules, dtype='uint16')
+
+    @property
+    def n_modules(self):
+        return len(np.unique(self.modules))
+
+    def get_modules(self, channels):
+        """
+        Get the module of some channels.
+
+        Parameters
+        ----------
+        - `channels` (numpy.ndarray) The channels, starting from 1. They must be mapped (See `is_mapped`).
+
+        Returns
+        ----------
+        - `modules` (numpy.ndarray) The module of each channel.
+        """
+        return self.modules[np.asarray(channels, dtype='int64') - 1]
+
+    def get_pixels(self, module):
+        """
+        Get the pixels of a module.
+
+        Parameters
+        ----------
+        - `module` (int) The module.
+
+        Returns
+        ----------
+        - `channels` (numpy.ndarray) The channels of the module, sorted. Empty if it is not mapped.
+        """
+        return np.flatnonzero(self.modules == module) + 1
+
+    def is_mapped(self, channels):
+        """
+        Check which channels have a module.
+
+        Parameters
+        ----------
+        - `channels` (numpy.ndarray) The channels.
+
+        Returns
+        ----------
+        - `mapped` (numpy.ndarray) Boolean array, True for the channels with a module.
+        """
+        channels = np.asarray(channels)
+
+        return (channels >= 1) & (channels <= len(self.modules))
+
+    def aggregate(self, channels, values, statistic='mean'):
+        """
+        Reduce the values of the pixels of each module to a single value, for every row of a 2D array at once. The
+        missing values (NaN) are ignored, and a module is NaN in the rows where all its pixels are missing.
+
+        Parameters
+        ----------
+        - `channels` (numpy.ndarray) The channel of each column of the array.
+        - `values` (numpy.ndarray) Array with a row per date and a column per channel (See `thresholds.get_night_array`).
+        - `statistic` (str) The statistic of the pixels of each module (See `STATISTICS`).
+
+        Returns
+        ----------
+        - `modules` (numpy.ndarray) The modules with any pixel in the channels, sorted.
+        - `module_values` (numpy.ndarray) Array of float32 with a row per date and a column per module.
+        """
+        if statistic not in STATISTICS:
+            raise ValueError(f'Unknown statistic {statistic}, expected one of {", ".join(STATISTICS)}')
+
+        mapped = self.is_mapped(channels)
+        channels, values = np.asarray(channels)[mapped], values[:, mapped]
+
+        # The columns are sorted by module, so the pixels of each module are contiguous and reduced from the first one
+        channel_modules = self.get_modules(channels)
+        order = np.argsort(channel_modules, kind='stable')
+        channel_modules, values = channel_modules[order], values[:, order]
+
+        if len(channel_modules) == 0:
+            return channel_modules, np.empty((len(values), 0), dtype='float32')
+
+        starts = np.flatnonzero(np.concatenate(([True], channel_modules[1:] != channel_modules[:-1])))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if statistic == 'mean':
+                valid = ~np.isnan(values)
+                sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=1, dtype='float64')
+                module_values = sums / np.add.reduceat(valid, starts, axis=1, dtype='int32')
+            elif statistic == 'max':
+                module_values = np.fmax.reduceat(values, starts, axis=1)
+            elif statistic == 'min':
+                module_values = np.fmin.reduceat(values, starts, axis=1)
+            else:
+                module_values = np.fmax.reduceat(values, starts, axis=1) - np.fmin.reduceat(values, starts, axis=1)
+
+        return channel_modules[starts], module_values.astype('float32', copy=False)
+
+
+def load_pixel_modules(path=PIXEL_MODULE_FILE):
+    """
+    Load the pixel to module mapping of the camera.
+
+    Parameters
+    ----------
+    - `path` (str) CSV file with the columns `channel` and `module`, with a row for each channel. Empty for the default mapping.
+
+    Returns
+    ----------
+    - `pixel_modules` (PixelModuleMap) The mapping.
+    """
+    if not path:
+        return PixelModuleMap(np.arange(N_PIXELS) // PIXELS_PER_MODULE + 1)
+
+    mapping = pd.read_csv(path, usecols=['channel', 'module']).sort_values('channel')
+
+    if not np.array_equal(mapping['channel'].to_numpy(), np.arange(1, len(mapping) + 1)):
+        raise ValueError(f'The pixel to module mapping in {path} must have a row for each channel from 1 to {len(mapping)}')
+
+    return PixelModuleMap(mapping['module'].to_numpy())
+
+
+def get_module_array(pandas_df, value_name, statistic):
+    """
+    Get the values of a pixel property of a night reduced to its modules.
+
+    Parameters
+    ----------
+    - `pandas_df` (pandas.DataFrame) The dataframe of the night, indexed by date, with a `channel` column (See `database.build_array_dataframe`).
+    - `value_name` (str) The name of the column with the values.
+    - `statistic` (str) The statistic of the pixels of each module (See `STATISTICS`).
+
+    Returns
+    ----------
+    - `dates` (numpy.ndarray) The dates of the rows, as datetime64[ns].
+    - `modules` (numpy.ndarray) The module of each column.
+    - `values` (numpy.ndarray) Array of float32 with a row per date and a column per module. NaN when there is no value.
+    """
+    dates, channels, values = thresholds.load_night_array(pandas_df, 'channel', value_name)
+    modules, module_values = pixel_modules.aggregate(channels, values, statistic)
+
+    return dates, modules, module_values
+
+
+def get_module_image(dates, modules, values):
+    """
+    Arrange the values of the modules of a night as an image, with a column per minute of the time grid (See
+    `correlation.GRID_SECONDS`) and a row per module, since the images need evenly spaced coordinates.
+
+    Parameters
+    ----------
+    - `dates` (numpy.ndarray) The dates of the rows of the values (See `get_module_array`).
+    - `modules` (numpy.ndarray) The module of each column of the values.
+    - `values` (numpy.ndarray) The values, with a row per date and a column per module.
+
+    Returns
+    ----------
+    - `image` (tuple) The dates of the columns, the modules of the rows and the values, with a row per module from the
+    first to the last one and a column per minute. NaN when there is no value.
+    """
+    grid = dates.astype('datetime64[s]').astype('int64') // correlation.GRID_SECONDS
+    columns = grid - grid[0]
+    rows = modules.astype('int64') - int(modules[0])
+
+    image = np.full((int(rows[-1]) + 1, int(columns[-1]) + 1), np.nan, dtype='float32')
+    image[np.ix_(rows, columns)] = values.T
+    grid_dates = ((grid[0] + np.arange(image.shape[1])) * correlation.GRID_SECONDS).astype('datetime64[s]').astype('datetime64[ns]')
+
+    return grid_dates, np.arange(int(modules[0]), int(modules[0]) + image.shape[0]), image
+
+
+def load_module_data(pandas_df, value_name, statistic):
+    """
+    Get the values of a pixel property of a night reduced to its modules (See `get_module_array`) and their image (See
+    `get_module_image`) from the aggregates cache, computing them if they are not cached.
+
+    Parameters
+    ----------
+    - `pandas_df` (pandas.DataFrame) The dataframe of the night, indexed by date, with a `channel` column.
+    - `value_name` (str) The name of the column with the values.
+    - `statistic` (str) The statistic of the pixels of each module (See `STATISTICS`).
+
+    Returns
+    ----------
+    - `module_array` (tuple) The dates, modules and values of the night (See `get_module_array`).
+    - `image` (tuple) The dates, modules and values of the image (See `get_module_image`).
+    """
+    def compute():
+        module_array = get_module_array(pandas_df, value_name, statistic)
+
+        return module_array, get_module_image(*module_array)
+
+    return cache.aggregates.get_or_compute('module_data', pandas_df, (value_name, statistic), compute)
+
+
+pixel_modules = load_pixel_modules()
+"""
+Pixel to module mapping of the camera
+"""
@@ -20,7 +20,148 @@ DB_NAME = os.environ.get('DB_NAME', 'db_name')
 """
 The name of the database
 """
+TELESCOPES = os.environ.get('TELESCOPES', 'LST1')
+"""
+Comma-separated names of the telescopes served by the application, the first one by default. The database and the
+collections of each telescope are set with the variables prefixed with its name (e.g. LST2_DB_NAME, See `telescopes`),
+which default to the ones above
+"""
+TELESCOPE_CACHE_MAX_MB = int(os.environ.get('TELESCOPE_CACHE_MAX_MB', 2048))
+"""
+Maximum memory in MB used by the cached night data of each telescope, so one telescope does not evict the data of the
+others. It can be set for a single telescope prefixing its name (e.g. LST2_CACHE_MAX_MB)
+"""
+DB_TIMEOUT_MS = int(os.environ.get('DB_TIMEOUT_MS', 5000))
+"""
+Milliseconds waited for the database when connecting before the connection fails
+"""
+DB_BREAKER_FAILURES = int(os.environ.get('DB_BREAKER_FAILURES', 3))
+"""
+Consecutive failed connections to the database that open the circuit breaker, so the next connections fail immediately
+"""
+DB_BREAKER_RESET = int(os.environ.get('DB_BREAKER_RESET', 30))
+"""
+Seconds the circuit breaker stays open before a connection is attempted again
+"""
+DB_RETRY_ATTEMPTS = int(os.environ.get('DB_RETRY_ATTEMPTS', 6))
+"""
+Connections attempted by the background refresh of the dashboards served from the cached data while the database is unavailable
+"""
+DB_RETRY_BACKOFF = float(os.environ.get('DB_RETRY_BACKOFF', 2))
+"""
+Seconds waited after the first failed attempt of the background refresh, doubled after each failure
+"""
+DB_CREATE_INDEXES = os.environ.get('DB_CREATE_INDEXES', 'false').lower() in ('1', 'true', 'yes')
+"""
+Whether to create the index on name and date of the collections when the server starts and finds it missing
+"""
+QUERY_EXPLAIN_RATE = float(os.environ.get('QUERY_EXPLAIN_RATE', 0.01))
+"""
+Fraction of the night queries whose plan is checked in the background with explain (0 to disable it)
+"""
+ASYNC_DB_DRIVER = os.environ.get('ASYNC_DB_DRIVER', 'motor')
+"""
+Driver of the queries of the dashboards, run on the event loop of the server: motor (used when it is installed) or threads (the blocking pymongo queries run in a shared pool of threads)
+"""
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 16))
+"""
+Number of threads of the pool shared by all the sessions to run the blocking database queries and to build the plots
+"""
 WEBSOCKET_ORIGIN = os.environ.get('WEBSOCKET_ORIGIN', 'localhost')
 """
 The origin of the websocket
-"""
\ No newline at end of file
+"""
+LIVE_FEED_INTERVAL = int(os.environ.get('LIVE_FEED_INTERVAL', 60))
+"""
+Seconds between each poll of the database for new data of the current night
+"""
+
+MEMORY_HIGH_WATER_MB = int(os.environ.get('MEMORY_HIGH_WATER_MB', 4096))
+"""
+Memory (RSS in MB) used by the application process that triggers the eviction of the cached data
+"""
+MEMORY_CHECK_INTERVAL = int(os.environ.get('MEMORY_CHECK_INTERVAL', 60))
+"""
+Seconds between each check of the memory used by the application process
+"""
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR', '/dev/shm/clusco-dashboard')
+"""
+Directory of the cache shared by the worker processes when serving with --num-procs. In /dev/shm it is kept in memory
+"""
+SHARED_CACHE_MAX_MB = int(os.environ.get('SHARED_CACHE_MAX_MB', 4096))
+"""
+Maximum size in MB of the cache shared by the worker processes
+"""
+PAYLOAD_CACHE_MAX_MB = int(os.environ.get('PAYLOAD_CACHE_MAX_MB', 512))
+"""
+Maximum size in MB of the encoded arrays of the plots reused by all the sessions (See `payloads`). 0 to encode them for each session
+"""
+MEMORY_PROFILING = os.environ.get('MEMORY_PROFILING', 'false').lower() in ('1', 'true', 'yes')
+"""
+Whether to profile the memory allocated by each database fetch and plot build with tracemalloc. It slows down the application, so it is disabled by default
+"""
+MEMORY_PROFILING_DIR = os.environ.get('MEMORY_PROFILING_DIR', './memory_reports')
+"""
+Directory where the memory profiling report of each session is written when the session is destroyed
+"""
+MEMORY_PROFILING_TOP = int(os.environ.get('MEMORY_PROFILING_TOP', 10))
+"""
+Number of allocation sites reported for each profiled stage
+"""
+MEMORY_PROFILING_FRAMES = int(os.environ.get('MEMORY_PROFILING_FRAMES', 10))
+"""
+Number of frames stored by tracemalloc for each allocation, used to find the line of the application responsible of it. More frames make the profiling slower
+"""
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 4))
+"""
+Number of database queries run concurrently when loading the data of a night
+"""
+FETCH_BATCH_SIZE = int(os.environ.get('FETCH_BATCH_SIZE', 4))
+"""
+Maximum number of array properties retrieved with a single database query. The scalars of a collection are always retrieved together
+"""
+SNAPSHOTS_DIR = os.environ.get('SNAPSHOTS_DIR', './snapshots')
+"""
+Directory with the static snapshots of the archived nights (See `snapshots`), served in the /snapshots address
+"""
+DATA_API_MAX_NIGHTS = int(os.environ.get('DATA_API_MAX_NIGHTS', 31))
+"""
+Maximum number of nights served by a request to the binary data API (See `data_api`)
+"""
+DATA_API_CHUNK_ROWS = int(os.environ.get('DATA_API_CHUNK_ROWS', 500000))
+"""
+Number of rows encoded and sent at once by the binary data API
+"""
+EXPORT_BATCH_DOCS = int(os.environ.get('EXPORT_BATCH_DOCS', 200))
+"""
+Number of documents read from the database cursor and sent at once by the exports of the nights not cached (See `export`)
+"""
+PIXEL_MODULE_FILE = os.environ.get('PIXEL_MODULE_FILE', '')
+"""
+CSV file with the module of each pixel of the camera (columns `channel` and `module`). Empty to number the pixels module after module, 7 per module (See `camera`)
+"""
+RANGE_MAX_NIGHTS = int(os.environ.get('RANGE_MAX_NIGHTS', 92))
+"""
+Maximum number of nights plotted at once in the multi-night view. The wide ranges are read from the time pyramid of the rollups when available
+"""
+RANGE_TIME_BINS = int(os.environ.get('RANGE_TIME_BINS', 1200))
+"""
+Number of time bins of the plots of the multi-night view, whatever the number of nights. It bounds the memory used by their aggregates
+and sets the level of the time pyramid read, which must have at least one bucket per time bin
+"""
+RANGE_VALUE_BINS = int(os.environ.get('RANGE_VALUE_BINS', 300))
+"""
+Number of value bins of the raster of the multi-night view
+"""
+ROLLUPS_DIR = os.environ.get('ROLLUPS_DIR', './rollups')
+"""
+Directory with the nightly statistics of each channel and module (See `rollups`), used by the trends view
+"""
+AVAILABILITY_FILE = os.environ.get('AVAILABILITY_FILE', './availability.json')
+"""
+File where the night availability index is stored, so it is only built once and then refreshed
+"""
+AVAILABILITY_REFRESH_INTERVAL = int(os.environ.get('AVAILABILITY_REFRESH_INTERVAL', 300))
+"""
+Seconds between each refresh of the night availability index
+"""
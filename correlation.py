@@ -0,0 +1,131 @@
+"""
+Correlation of two pixel or module properties of a night. The values of both properties are arranged as 2D arrays
+(See `thresholds.load_night_array`) and aligned onto a common grid of minutes and channels, so the correlation
+coefficient of every channel or module is computed at once over the columns of the arrays, and the pairs of values of
+all the channels are binned in a 2D histogram shown as a rasterized scatter.
+"""
+
+import numpy as np
+import pandas as pd
+
+import metrics
+import thresholds
+
+GRID_SECONDS = 60
+"""
+Seconds of the time grid where the values of both properties are aligned. The documents of the `_min` collections are
+stored every minute, but the dates of different properties do not need to match exactly
+"""
+
+
+def align_night_arrays(x_df, y_df, var_name, x_value_name, y_value_name):
+    """
+    Aligns the values of two properties of a night onto the dates of the time grid and the channels or modules they have in common.
+
+    Parameters
+    ----------
+    - `x_df` (pandas.DataFrame) The dataframe of the first property, indexed by date (See `database.build_array_dataframe`).
+    - `y_df` (pandas.DataFrame) The dataframe of the second property.
+    - `var_name` (str) The name of the column with the channel or module, the same in both dataframes.
+    - `x_value_name` (str) The name of the column with the values of the first property.
+    - `y_value_name` (str) The name of the column with the values of the second property.
+
+    Returns
+    ----------
+    - `channels` (numpy.ndarray) The channels or modules in common.
+    - `x_values` (numpy.ndarray) The values of the first property, with a row per date in common and a column per channel or module.
+    - `y_values` (numpy.ndarray) The values of the second property, with the same rows and columns.
+    """
+    x_dates, x_channels, x_values = thresholds.load_night_array(x_df, var_name, x_value_name)
+    y_dates, y_channels, y_values = thresholds.load_night_array(y_df, var_name, y_value_name)
+
+    # Index of the interval of the time grid of each date, as seconds since the epoch
+    x_grid = x_dates.astype('datetime64[s]').astype('int64') // GRID_SECONDS
+    y_grid = y_dates.astype('datetime64[s]').astype('int64') // GRID_SECONDS
+    _, x_rows, y_rows = np.intersect1d(x_grid, y_grid, return_indices=True)
+    channels, x_columns, y_columns = np.intersect1d(x_channels, y_channels, assume_unique=True, return_indices=True)
+
+    return channels, x_values[np.ix_(x_rows, x_columns)], y_values[np.ix_(y_rows, y_columns)]
+
+
+@metrics.timed('correlation')
+def correlate_channels(x_values, y_values):
+    """
+    Computes the Pearson correlation coefficient of each channel or module (column) of two aligned arrays, using the
+    dates where both properties have a value.
+
+    Parameters
+    ----------
+    - `x_values` (numpy.ndarray) The values of the first property (See `align_night_arrays`).
+    - `y_values` (numpy.ndarray) The values of the second property.
+
+    Returns
+    ----------
+    - `coefficients` (numpy.ndarray) The coefficient of each column, NaN when it has less than 3 pairs or a constant property.
+    - `samples` (numpy.ndarray) The number of pairs of values of each column.
+    """
+    valid = ~(np.isnan(x_values) | np.isnan(y_values))
+    samples = np.count_nonzero(valid, axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.where(valid, x_values, 0).astype('float64')
+        y = np.where(valid, y_values, 0).astype('float64')
+        x -= np.where(valid, x.sum(axis=0) / samples, 0)
+        y -= np.where(valid, y.sum(axis=0) / samples, 0)
+
+        coefficients = (x * y).sum(axis=0) / np.sqrt((x * x).sum(axis=0) * (y * y).sum(axis=0))
+
+    coefficients[samples < 3] = np.nan
+
+    return coefficients, samples
+
+
+def rank_channels(channels, coefficients, samples, var_name):
+    """
+    Ranks the channels or modules from the most to the least correlated.
+
+    Parameters
+    ----------
+    - `channels` (numpy.ndarray) The channels or modules.
+    - `coefficients` (numpy.ndarray) The correlation coefficient of each one (See `correlate_channels`).
+    - `samples` (numpy.ndarray) The number of pairs of values of each one.
+    - `var_name` (str) The name of the column with the channel or module.
+
+    Returns
+    ----------
+    - `ranking` (pandas.DataFrame) A row for each channel or module, sorted by coefficient. The ones without coefficient go last.
+    """
+    ranking = pd.DataFrame({var_name: channels, 'correlation': coefficients, 'samples': samples})
+
+    return ranking.sort_values('correlation', ascending=False, na_position='last', ignore_index=True)
+
+
+def bin_pairs(x_values, y_values, x_range, y_range, bins=300):
+    """
+    Counts the pairs of values of all the channels or modules in the bins of a 2D histogram, shown as a rasterized
+    scatter of both properties. The values out of the ranges are counted in the first or last bin.
+
+    Parameters
+    ----------
+    - `x_values` (numpy.ndarray) The values of the first property (See `align_night_arrays`).
+    - `y_values` (numpy.ndarray) The values of the second property.
+    - `x_range` (tuple) The min and max values of the first property.
+    - `y_range` (tuple) The min and max values of the second property.
+    - `bins` (int) The number of bins of each axis.
+
+    Returns
+    ----------
+    - `image` (tuple) The centers of the bins of each axis and the counts, with a row per bin of the second property
+    (NaN when there are no pairs), as accepted by `holoviews.Image`.
+    """
+    valid = ~(np.isnan(x_values) | np.isnan(y_values))
+    x_index = ((x_values[valid] - x_range[0]) / (x_range[1] - x_range[0]) * bins).clip(0, bins - 1).astype('int64')
+    y_index = ((y_values[valid] - y_range[0]) / (y_range[1] - y_range[0]) * bins).clip(0, bins - 1).astype('int64')
+
+    counts = np.bincount(y_index * bins + x_index, minlength=bins * bins).reshape(bins, bins).astype('float64')
+    counts[counts == 0] = np.nan
+
+    x_edges = np.linspace(x_range[0], x_range[1], bins + 1)
+    y_edges = np.linspace(y_range[0], y_range[1], bins + 1)
+
+    return (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2, counts
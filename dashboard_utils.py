@@ -1,290 +1,260 @@
 import panel as pn
+import numpy as np
+import asyncio
 import datetime as dt
 import time
 import threading
-from matplotlib.colors import LinearSegmentedColormap
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import partial
 
+from bokeh.document import without_document_lock
+from tornado.web import HTTPError
+
+import async_database
+import cache
+import camera
+import correlation
+import data_api
 import database
+import export
+import memory_manager
+import metrics
 import panel_helper
-from config import DB_HOST, DB_PORT, DB_NAME
+import plot_helper
+import profiling
+import registry
+import rollups
+import shared_cache
+import snapshots
+import telescopes
+import thresholds
+from config import LIVE_FEED_INTERVAL, ASYNC_DB_THREADS, FETCH_WORKERS, FETCH_BATCH_SIZE, RANGE_MAX_NIGHTS, RANGE_TIME_BINS, RANGE_VALUE_BINS
 
 """
 Module with utility functions for the dashboard.
 """
 
-# Custom color maps recreated from this bars: https://camera.lst1.iac.es/mon0
-cmap_temps = LinearSegmentedColormap.from_list('cmap_temps', [
-    (0, (0, 0, 1)),
-    (18/30, (0, 1, 0)),
-    (25/30, (1, 0.65, 0)),
-    (26/30, (1, 0, 0)),
-    (1, (1, 0, 0))])
-
-cmap_humidty = LinearSegmentedColormap.from_list('cmap_humidity', [
-    (0, (1, 0.64, 0)),
-    (10/80, (1, 0.92, 0)),
-    (40/80, (0, 1, 0)),
-    (70/80, (1, 0.92, 0)),
-    (74/80, (1, 0.64, 0)),
-    (80/80, (1, 0, 0))])
-
-cmap_anode = LinearSegmentedColormap.from_list('cmap_anode', [
-    (0, (0, 0, 1)),
-    (5/100, (0, 1, 0)),
-    (60/100, (1, 0.92, 0)),
-    (80/100, (1, 0.64, 0)),
-    (100/100, (1, 0, 0))])
-
-cmap_hv = LinearSegmentedColormap.from_list('cmap_hv', [
-    (0, (0, 0, 1)),
-    (10/1400, (0, 0, 1)),
-    (200/1400, (0, 1, 0)),
-    (950/1400, (1, 0.92, 0)),
-    (1200/1400, (1, 0.64, 0)),
-    (1400/1400, (1, 0, 0))])
-
-cmap_backplane_temp = LinearSegmentedColormap.from_list('cmap_bp_temp', [
-    (0, (0, 0, 1)),
-    (20/37, (0, 1, 0)),
-    (30/37, (1, 0.99, 0.22)),
-    (33/37, (1, 0.64, 0)),
-    (35/37, (1, 0, 0)),
-    (37/37, (1, 0, 0))])
-
-
-def create_dashboard(template, date_filter=dt.date.today(), update=False):
+def create_dashboard(template, date_filter=None, update=False, doc=None, telescope=None):
     """
-    Creates the dashboard with all the panel plots with the given template and date filter and shows it in the browser.
+    Creates the dashboard with all the panel plots with the given template and date filter, running `update_dashboard`
+    in a new event loop. Used outside the event loop of the server (e.g. by the benchmarks). The sessions schedule it
+    in the event loop of the server instead (See `schedule_dashboard`).
 
     Parameters
     ----------
     - `template` (pn.template.MaterialTemplate) The template to use for the dashboard.
     - `date_filter` (date) The date filter to use for the dashboard. Defaults to today.
     - `update` (bool) Whether to update the dashboard or is a new creation. Defaults to False.
-
+    - `doc` (bokeh.document.Document) The document of the user session. Used to push the new data of the current night to the plots. Defaults to None.
+    - `telescope` (telescopes.Telescope) The telescope displayed. Defaults to the default telescope.
     """
+    asyncio.run(update_dashboard(template, date_filter, update, doc, telescope))
 
-    if update:
-        print('Updating dashboard')
-    else:
-        print('Creating dashboard')
-        
-    tic = time.perf_counter()
 
-    pn.param.ParamMethod.loading_indicator = True
+def schedule_dashboard(template, date_filter=None, update=False, doc=None, telescope=None):
+    """
+    Schedules the creation or update of the dashboard of a session in the event loop of the server. It runs without
+    the lock of the session document, so the queries and plots of many sessions progress at the same time, and the
+    changes of the layout are applied in next tick callbacks of the document (See `apply_to_document`). Without a
+    session the dashboard is created in another thread.
 
-    if update is False:
-        update_loading_message(template, '''<h1 style="text-align:center">Getting data...</h1>''')
+    Parameters
+    ----------
+    - `template` (pn.template.MaterialTemplate) The template to use for the dashboard.
+    - `date_filter` (date) The date filter to use for the dashboard. Defaults to today.
+    - `update` (bool) Whether to update the dashboard or is a new creation. Defaults to False.
+    - `doc` (bokeh.document.Document) The document of the user session. Defaults to None.
+    - `telescope` (telescopes.Telescope) The telescope displayed. Defaults to the default telescope.
+    """
+    if doc is None or doc.session_context is None:
+        t = threading.Thread(target=create_dashboard, args=(template, date_filter, update, doc, telescope))
+        t.daemon = True
+        t.start()
+        return
 
-    # Setup BD Connection
-    db = database.connect(DB_HOST, DB_PORT, DB_NAME)
+    @without_document_lock
+    async def run():
+        await update_dashboard(template, date_filter, update, doc, telescope)
 
-    if (db == None):
-        display_database_error(template=template)
-        exit()
+    doc.add_next_tick_callback(run)
 
-    clusco_min_collection = db['CLUSCO_min']
-    tib_min_collection = db['TIB_min'] 
 
-    # Data retrieved from database
-    pacta_temperature_data = database.get_data_by_date(collection=clusco_min_collection, property_name='scb_pixel_temperature',
-                                            date_time=date_filter, value_field='avg', id_var='date', var_name='channel', value_name='temperature', search_previous = not update)
+async def apply_to_document(doc, callback, *args):
+    """
+    Applies a change to the layout of a session in a next tick callback of its document, which holds the document lock,
+    and waits for it. Without a session the change is applied directly. The coroutine is cancelled when the session is
+    destroyed before the callback runs, since the callbacks of a destroyed session are discarded.
 
-    # Get the min date (year-month-day) from the PACTA temperature dataframe, where date is the index of the dataframe,
-    # in case the dataframe is not empty. We are going to retrieve the data from the
-    # left plots from the first date with available data in the PACTA temperature data
-    if not pacta_temperature_data.empty:
-        min_filtered_date = pacta_temperature_data.index.min().date()
-    else:
-        min_filtered_date = date_filter
+    Parameters
+    ----------
+    - `doc` (bokeh.document.Document) The document of the user session, or None.
+    - `callback` (callable) The function applying the change.
+    - `args` The arguments of the function.
 
-    scb_temperature_data = database.get_data_by_date(collection=clusco_min_collection, property_name='scb_temperature',
-                                            date_time=min_filtered_date, value_field='avg', id_var='date', var_name='module', value_name='temperature', search_previous = False)
+    Returns
+    ----------
+    - `result` The value returned by the function.
+    """
+    if doc is None or doc.session_context is None:
+        return callback(*args)
 
-    scb_humidity_data = database.get_data_by_date(collection=clusco_min_collection, property_name='scb_humidity',
-                                        date_time=min_filtered_date, value_field='avg', id_var='date', var_name='module', value_name='humidity', search_previous = False)
+    future = Future()
 
-    scb_anode_current_data = database.get_data_by_date(collection=clusco_min_collection, property_name='scb_pixel_an_current',
-                                            date_time=min_filtered_date, value_field='avg', id_var='date', var_name='channel', value_name='anode', search_previous = False)
+    def run():
+        try:
+            future.set_result(callback(*args))
+        except Exception as e:
+            future.set_exception(e)
 
-    hv_data = database.get_data_by_date(collection=clusco_min_collection, property_name='scb_pixel_hv_monitored',
-                            date_time=min_filtered_date, value_field='avg', id_var='date', var_name='channel', value_name='hv', search_previous = False)
-    
-    scb_backplane_temperature_data = database.get_data_by_date(collection=clusco_min_collection, property_name='backplane_temperature',
-                                            date_time=min_filtered_date, value_field='avg', id_var='date', var_name='module', value_name='temperature', search_previous = False)
+    doc.add_next_tick_callback(run)
+    wrapped_future = asyncio.wrap_future(future)
 
+    while True:
+        done, _ = await asyncio.wait({wrapped_future}, timeout=1)
 
-    # L1 Rate plot data
-    l1_rate_data = database.get_data_by_date(collection=clusco_min_collection, property_name='l1_rate',
-                                            date_time=min_filtered_date, value_field='avg', id_var='date', var_name='module', value_name='l1_rate', search_previous = False)
-    
-    l1_rate_control_data = database.get_scalar_data_by_date(collection=clusco_min_collection, property_name='clusco_l1_rate_control',
-                                            date_time=min_filtered_date, value_field='avg', value_name='l1_rate_control', search_previous = False, remove_zero_values=True)
+        if done:
+            return wrapped_future.result()
 
-    l0_rate_control_data = database.get_scalar_data_by_date(collection=clusco_min_collection, property_name='clusco_l0_rate_control',
-                                            date_time=min_filtered_date, value_field='avg', value_name='l0_rate_control', search_previous = False, remove_zero_values=True)
-    
-    l1_rate_max_data = database.get_scalar_data_by_date(collection=clusco_min_collection, property_name='clusco_l1_rate_max',
-                                            date_time=min_filtered_date, value_field='avg', value_name='l1_rate_max', search_previous = False)
-    
-    l1_rate_target_data = database.get_scalar_data_by_date(collection=clusco_min_collection, property_name='clusco_l1_rate_target',
-                                                           date_time=min_filtered_date, value_field='avg', value_name='l1_rate_target', search_previous = False)
-
-    # L0 Pixel Ipr Data
-    l0_pixel_ipr_data = database.get_data_by_date(collection=clusco_min_collection, property_name='l0_pixel_ipr',
-                                                   date_time=min_filtered_date, value_field='avg', id_var='date', var_name='channel', value_name='l0_pixel_ipr', search_previous = False)
-    # L0 Rate max data
-    l0_rate_max_data = database.get_scalar_data_by_date(collection=clusco_min_collection, property_name='clusco_l0_rate_max', 
-                                                        date_time=min_filtered_date, value_field='avg', value_name='l0_rate_max', search_previous = False)
-
-    # TIB rates data
-    tib_busy_rate_data = database.get_scalar_data_by_date(collection=tib_min_collection, property_name='TIB_Rates_BUSYRate', date_time=min_filtered_date, value_field='avg', value_name='tib_busy_rate', search_previous = False)
-    tib_calibration_rate_data = database.get_scalar_data_by_date(collection=tib_min_collection, property_name='TIB_Rates_CalibrationRate', date_time=min_filtered_date, value_field='avg', value_name='calibration_rate', search_previous = False)
-    tib_camera_rate_data = database.get_scalar_data_by_date(collection=tib_min_collection, property_name='TIB_Rates_CameraRate', date_time=min_filtered_date, value_field='avg', value_name='camera_rate', search_previous = False)
-    tib_local_rate_data = database.get_scalar_data_by_date(collection=tib_min_collection, property_name='TIB_Rates_LocalRate', date_time=min_filtered_date, value_field='avg', value_name='local_rate', search_previous = False)
-    tib_pedestal_rate_data = database.get_scalar_data_by_date(collection=tib_min_collection, property_name='TIB_Rates_PedestalRate', date_time=min_filtered_date, value_field='avg', value_name='pedestal_rate', search_previous = False)
-    
-    # Dragon Busy
-    dragon_busy_data = database.get_data_by_date(collection=clusco_min_collection, property_name='dragon_busy', date_time=min_filtered_date, value_field='max', id_var='date', var_name='module', value_name='busy_status', search_previous = False)
+        if doc.session_context.destroyed:
+            wrapped_future.cancel()
+            print("Session destroyed, dashboard not completed")
+            raise asyncio.CancelledError()
 
-    # close mongodb connection
-    db.client.close()
 
-    if update is False:
-        update_loading_message(template, '''<h1 style="text-align:center">Making plots...</h1>''')
+async def update_dashboard(template, date_filter=None, update=False, doc=None, telescope=None):
+    """
+    Creates the dashboard with all the panel plots with the given template and date filter and shows it in the browser.
+    The properties retrieved, the plots built and their place in the layout are described in the `registry` module.
+    The queries are awaited on the event loop (See `async_database`), the plots are built in the pool of threads
+    shared by the sessions and the layout is changed in next tick callbacks of the session document.
 
-    if update is False:
-        # min_date_from_data = min([x for x in data_min_date_dict.values() if x is not None])
+    Parameters
+    ----------
+    - `template` (pn.template.MaterialTemplate) The template to use for the dashboard.
+    - `date_filter` (date) The date filter to use for the dashboard. Defaults to today.
+    - `update` (bool) Whether to update the dashboard or is a new creation. Defaults to False.
+    - `doc` (bokeh.document.Document) The document of the user session. Used to push the new data of the current night to the plots. Defaults to None.
+    - `telescope` (telescopes.Telescope) The telescope displayed (See `telescopes`). Defaults to the default telescope.
 
-        date_picker = pn.widgets.DatePicker(
-            name='Date Selection', value=min_filtered_date, end=dt.date.today())
+    """
 
-    print("\nMaking plots...")
+    if date_filter is None:
+        date_filter = dt.date.today()
 
-    # # # # # # # # # # # # #
-    # First dashboard tab  #
-    # # # # # # # # # # # # #
-    pacta_temp_title = 'PACTA Temperature ' + '(' + str(min_filtered_date) + ')'
-    pacta_temp_plot_panel =  panel_helper.create_plot_panel(pacta_temperature_data, pacta_temp_title, 'date', 'channel', 'temperature', 'Time (UTC)', 'Temperature (ºC)', cmap_temps, (0, 30), template, not update) 
+    if telescope is None:
+        telescope = telescopes.default
 
     if update:
-        template.main[0][0][0][0, 0] = pacta_temp_plot_panel
+        print('Updating dashboard')
+    else:
+        print('Creating dashboard')
+        
+    tic = time.perf_counter()
 
-    scb_temp_title = 'SCB Temperature ' + '(' + str(min_filtered_date) + ')'
-    scb_temp_plot_panel = panel_helper.create_plot_panel(scb_temperature_data, scb_temp_title, 'date', 'module', 'temperature', 'Time (UTC)', 'Temperature (ºC)', cmap_temps, (0, 30), template, not update)
+    # The coroutines of several sessions share the thread of the event loop, so the session of the profiled stages is
+    # bound to the threads running them (See `async_database.run_blocking`)
+    if doc is not None and doc.session_context is not None:
+        session_id = doc.session_context.id
+    else:
+        session_id = profiling.get_session()
 
-    if update:
-        template.main[0][0][0][0, 1] = scb_temp_plot_panel
+    pn.param.ParamMethod.loading_indicator = True
 
-    scb_humidity_title = 'SCB Humidity ' + '(' + str(min_filtered_date) + ')'
-    scb_humidity_plot_panel = panel_helper.create_plot_panel(scb_humidity_data, scb_humidity_title, 'date', 'module', 'humidity', 'Time (UTC)', 'Humidity (%)', cmap_humidty, (0, 80), template, not update)
+    if update is False:
+        await apply_to_document(doc, update_loading_message, template, '''<h1 style="text-align:center">Getting data...</h1>''')
 
-    if update:
-        template.main[0][0][0][0, 2] = scb_humidity_plot_panel
-    
-    scb_anode_title = 'SCB Anode Current ' + '(' + str(min_filtered_date) + ')'
-    scb_anode_current_plot_panel = panel_helper.create_plot_panel(scb_anode_current_data, scb_anode_title, 'date', 'channel', 'anode', 'Time (UTC)', 'Anode Current (µA)', cmap_anode, (0, 100), template, not update)
+    # Setup BD Connection. When the database is unavailable, the cached data is displayed while the connection is
+    # retried in the background (See `revalidate_telescope`)
+    db = await async_database.run_blocking(telescope.connect)
 
-    if update:
-        template.main[0][0][0][1, 0] = scb_anode_current_plot_panel
+    # Get the night from the data of the anchor property (PACTA temperature), in case it is not empty. When creating the
+    # dashboard, the latest night with data is displayed if the selected night has no data
+    db, anchor_data = await async_database.run_blocking(get_anchor_data, db, date_filter, not update, telescope, session_id=session_id)
 
-    hv_title = 'High Voltage ' + '(' + str(min_filtered_date) + ')'
-    hv_plot_panel = panel_helper.create_plot_panel(hv_data, hv_title, 'date', 'channel', 'hv', 'Time (UTC)', 'HV (V)', cmap_hv, (10, 1400), template, not update)
-    
-    if update:
-        template.main[0][0][0][1, 1] = hv_plot_panel
-    
-    
-    scb_backplane_temp_title = 'SCB Backplane Temperature ' + '(' + str(min_filtered_date) + ')'
-    scb_backplane_temp_plot_panel = panel_helper.create_plot_panel(scb_backplane_temperature_data, scb_backplane_temp_title, 'date', 'module', 'temperature', 'Time (UTC)', 'Temperature (ºC)', cmap_backplane_temp, (0, 37), template, not update)
+    if not anchor_data.empty:
+        min_filtered_date = database.get_night_of(anchor_data.index.min())
+    else:
+        min_filtered_date = date_filter
 
-    if update:
-        template.main[0][0][0][1, 2] = scb_backplane_temp_plot_panel
+    print("\nMaking plots...")
 
+    # Streams to send the new data to the plots while the current night is displayed, with the kind of data each one
+    # receives and its column of values by night data cache key (See `push_live_updates`)
+    live_streams = {}
+    is_current_night = min_filtered_date == database.get_current_night()
 
-    # # # # # # # # # # # # #
-    # Second dashboard tab  #
-    # # # # # # # # # # # # #
+    def add_live_stream(panel_streams, name, prop, kind, stream):
+        key = cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], min_filtered_date)
+        live_streams.setdefault(key, []).append((kind, stream, prop['value_name']))
+        panel_streams[name] = stream
 
-    # Creates a dict with all the params to plot with the L1 Rate data
-    l1_rate_data_dict = {'l1_rate': l1_rate_data,
-                         'l1_rate_control': l1_rate_control_data,
-                         'l1_rate_max': l1_rate_max_data,
-                         'l1_rate_target': l1_rate_target_data,
-                         'l0_rate_control': l0_rate_control_data}
+    def create_live_streams(panel):
+        if not is_current_night or panel['kind'] not in registry.LIVE_KINDS:
+            return None
 
-    l1_rate_title = 'L1 Rate ' + '(' + str(min_filtered_date) + ')'
-    l1_rate_plot_panel = panel_helper.create_l1_rate_plot_panel(l1_rate_data_dict,
-                l1_rate_title, 'date', 'module', 'l1_rate', 'Time (UTC)', 'L1 Rate (Hz)', cmap_temps, (0, 1000), template, not update)
+        panel_streams = {}
+        prop = registry.get_property(panel['property'])
 
-    if update:
-        template.main[0][0][1][0, 0] = l1_rate_plot_panel
+        if panel['kind'] in registry.AGGREGATED_KINDS:
+            add_live_stream(panel_streams, 'envelope', prop, 'envelope', plot_helper.create_live_buffer())
+            add_live_stream(panel_streams, 'raster', prop, 'raster', plot_helper.create_live_raster_pipe())
+            inputs = {}
+        else:
+            inputs = {} if 'inputs' in panel else {'rows': panel['property']}
 
-    # Creates a dict with all the params to plot with the L0 Pixel IPR data
-    l0_pixel_ipr_data_dict = {'l0_pixel_ipr': l0_pixel_ipr_data,
-                              'l0_rate_max': l0_rate_max_data}
+        inputs.update({name: panel['inputs'][name] for name in panel.get('live_inputs', ())})
 
-    l0_pixel_ipr_title = 'L0 Pixel IPR ' + '(' + str(min_filtered_date) + ')'
-    l0_pixel_ipr_panel = panel_helper.create_l0_ipr_plot_panel(l0_pixel_ipr_data_dict, l0_pixel_ipr_title, 'date', 'channel', 'l0_pixel_ipr', 'Time (UTC)', 'L0 Pixel IPR (Hz)', cmap_temps, (0, 1000), template, not update)
+        for name, property_name in inputs.items():
+            input_prop = registry.get_property(property_name)
+            add_live_stream(panel_streams, name, input_prop, 'rows', plot_helper.create_live_rows_buffer(get_live_columns(input_prop)))
 
-    if update:
-        template.main[0][0][1][0, 1] = l0_pixel_ipr_panel
-
-    # Creates a dict with all the params to plot with the TIB Rates
-    tib_rates_data_dict = {'tib_busy_rate': tib_busy_rate_data,
-                            'tib_calibration_rate': tib_calibration_rate_data,
-                            'tib_camera_rate': tib_camera_rate_data,
-                            'tib_local_rate': tib_local_rate_data,
-                            'tib_pedestal_rate': tib_pedestal_rate_data}
-    
-    tib_rates_title = 'TIB Rates ' + '(' + str(min_filtered_date) + ')'
-    tib_rates_panel = panel_helper.create_tib_rates_plot_panel(tib_rates_data_dict, tib_rates_title, 'Time (UTC)', 'TIB Rates (Hz)', template, not update)
+        return panel_streams
 
-    if update:
-        template.main[0][0][1][1, :] = tib_rates_panel
+    def replace_panel(panel, plot_panel):
+        template.main[0][0][panel['tab']][panel['cell']] = plot_panel
 
-    # # # # # # # # # # # # #
-    # Third dashboard tab   #
-    # # # # # # # # # # # # #
+    # Each panel is built as soon as the data of the properties it depends on is retrieved, while the other
+    # properties are still being retrieved
+    night_data = {}
+    plot_panels = {}
 
-    dragon_busy_title = 'Dragon Busy ' + '(' + str(min_filtered_date) + ')'
-    dragon_busy_panel = panel_helper.create_dragon_busy_plot_panel(dragon_busy_data, dragon_busy_title, 'Time (UTC)', 'Module ID', template, not update)
+    async for property_name, pandas_df in aiter_night_data(db, min_filtered_date, telescope, session_id=session_id):
+        night_data[property_name] = pandas_df
 
-    if update:
-        template.main[0][0][2][0, :] = dragon_busy_panel
+        for panel in registry.PANELS:
+            if panel['name'] in plot_panels or not all(name in night_data for name in registry.get_dependencies(panel)):
+                continue
 
+            if update is False and not plot_panels:
+                await apply_to_document(doc, update_loading_message, template, '''<h1 style="text-align:center">Making plots...</h1>''')
 
-    if update is False:
+            plot_panels[panel['name']] = await async_database.run_blocking(build_panel, panel, night_data, min_filtered_date, template, not update,
+                                                                           create_live_streams(panel), session_id=session_id)
+
+            if update:
+                await apply_to_document(doc, replace_panel, panel, plot_panels[panel['name']])
+
+    # close mongodb connection
+    if db is not None:
+        db.client.close()
+
+    # The properties neither cached nor retrieved are displayed empty until the database is available again
+    missing_properties = [prop['name'] for prop in registry.PROPERTIES
+                          if cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], min_filtered_date) not in cache.night_data]
+    stale = db is None or len(missing_properties) > 0
+
+    def deploy():
         update_loading_message(template, '''<h1 style="text-align:center">Deploying dashboard...</h1>''')
-    
-        # =========================
-        # FIRST GRID - FIRST TAB
-        # =========================
-        # Creates a grid from GridSpec and adds plots to it
-        grid = pn.GridSpec(sizing_mode='stretch_both',
-                        ncols=3, nrows=2, mode='override')
-
-        grid[0, 0] = pacta_temp_plot_panel
-        grid[0, 1] = scb_temp_plot_panel
-        grid[0, 2] = scb_humidity_plot_panel
-        grid[1, 0] = scb_anode_current_plot_panel
-        grid[1, 1] = hv_plot_panel
-        grid[1, 2] = scb_backplane_temp_plot_panel
-
-        # =========================
-        # SECOND GRID - SECOND TAB
-        # =========================
-        grid_b = pn.GridSpec(sizing_mode='stretch_both', ncols=2, nrows=2, mode='override')
-        grid_b[0, 0] = l1_rate_plot_panel
-        grid_b[0, 1] = l0_pixel_ipr_panel
-        grid_b[1, :] = tib_rates_panel
-        
-        # =========================
-        # THIRD GRID - THIRD TAB
-        # =========================
-        grid_c = pn.GridSpec(sizing_mode='stretch_both', ncols=1, nrows=1, mode='override')
-        grid_c[0, 0] = dragon_busy_panel
-        
+
+        date_picker = pn.widgets.DatePicker(
+            name='Date Selection', value=min_filtered_date, end=dt.date.today(), enabled_dates=get_enabled_nights(min_filtered_date, telescope))
+        coverage_info = pn.pane.Markdown(get_coverage_message(min_filtered_date, telescope))
+
+        # Creates a grid from GridSpec for each tab and adds the plots to it
+        grids = [pn.GridSpec(sizing_mode='stretch_both', ncols=tab['ncols'], nrows=tab['nrows'], mode='override') for tab in registry.TABS]
+
+        for panel in registry.PANELS:
+            grids[panel['tab']][panel['cell']] = plot_panels[panel['name']]
 
         # Sidebar creation
 
@@ -293,64 +263,1566 @@ def create_dashboard(template, date_filter=dt.date.today(), update=False):
               the selected day, you should select the previous day."""
         
         png_pane = pn.pane.PNG('./images/cta-logo.png', width=200, align='center')
+
+        # The static snapshot of an archived night is shown instead of the tabs when it is available (See `snapshots`),
+        # and the button builds the interactive plots of the night
+        snapshot_pane = pn.pane.HTML(sizing_mode='stretch_both', visible=False)
+        interactive_button = pn.widgets.Button(name='Interactive view', button_type='primary', visible=False)
+
+        # Shown while the data displayed is stale because the database is unavailable
+        stale_alert = pn.pane.Alert(alert_type='warning', visible=False)
+
         sidebar_col = pn.Column(pn.layout.HSpacer(), png_pane,
-                                pn.layout.HSpacer(), date_picker,
-                                date_selection_info)
+                                pn.layout.HSpacer(), get_telescope_links(telescope), date_picker, coverage_info, interactive_button, stale_alert,
+                                create_export_view(date_picker, doc, telescope), date_selection_info)
 
         # Append tabs and grids to template main
         template.main[0].sizing_mode = 'stretch_both'
         
-        # Creating tabs and appends grids to it
-        tabs = pn.Tabs(('Pixel Temp, Anode & HV - SCB Temp & Humidity', grid), ('Rates', grid_b), ('Dragon Busy', grid_c))
+        # Creating tabs and appends grids to it. The multi-night, trends, modules, correlation and thresholds views go after the tabs of the registry.
+        # The rollups of the trends are only computed for the default telescope (See `rollups`)
+        tabs = pn.Tabs(*[(tab['title'], grid) for tab, grid in zip(registry.TABS, grids)])
+        tabs.append(('Multi-night', create_range_view(min_filtered_date, doc, telescope)))
 
-        template.main[0][0] = tabs
+        if telescope is telescopes.default:
+            tabs.append(('Trends', create_trend_view(min_filtered_date)))
 
-        # Append content to template sidebar
-        template.sidebar.objects[0].sizing_mode = 'stretch_both'
-        template.sidebar[0][0] = sidebar_col
+        tabs.append(('Modules', create_module_view(date_picker, telescope)))
+        tabs.append(('Correlation', create_correlation_view(date_picker, telescope)))
+        tabs.append(('Thresholds', create_threshold_view(date_picker, tabs, telescope)))
 
-        @pn.depends(date_picker.param.value, watch=True)
-        def thread_update_dashboard_task(date_picker):
+        # The Bokeh models of the session are created when the tabs and the sidebar are added to the template
+        with metrics.timer('panel_models', 'layout'):
+            template.main[0][0] = tabs
+            template.main[0].append(snapshot_pane)
+
+            # Append content to template sidebar
+            template.sidebar.objects[0].sizing_mode = 'stretch_both'
+            template.sidebar[0][0] = sidebar_col
+
+        def show_interactive_view(night):
+            snapshot_pane.visible = False
+            interactive_button.visible = False
+            tabs.visible = True
 
             # Iterates each tab to activates loading indicator for each panel
-            for tabs in template.main[0][0]:
-                for panel in tabs:
-                    #print(panel)
+            for grid in grids:
+                for panel in grid:
                     # set param loading indicator param in panel to True
-                    panel[0].loading = True        
+                    panel[0].loading = True
+
+            # Update the dashboard in the event loop of the server
+            schedule_dashboard(template, night, True, doc, telescope)
+
+        @pn.depends(date_picker.param.value, watch=True)
+        def thread_update_dashboard_task(date_picker):
+            coverage_info.object = get_coverage_message(date_picker, telescope)
+
+            # The snapshots are only written for the default telescope (See `snapshots`)
+            if telescope is not telescopes.default or not snapshots.has_snapshot(date_picker):
+                show_interactive_view(date_picker)
+                return
+
+            print(f'Showing the snapshot of night {date_picker}')
+            tabs.visible = False
+            snapshot_pane.object = f'''<iframe src="{snapshots.get_snapshot_url(date_picker)}" style="width:100%; height:100%; min-height:85vh; border:none"></iframe>'''
+            snapshot_pane.visible = True
+            interactive_button.visible = True
+
+            # The plots of the previous night are hidden, so they do not need its new data
+            if doc is not None and doc.session_context is not None:
+                telescope.live_feed.unsubscribe(doc.session_context.id)
+
+        interactive_button.on_click(lambda event: show_interactive_view(date_picker.value))
 
-            # Create thread to update the dashboard
-            t = threading.Thread(target=create_dashboard, args=(template, date_picker, True))
-            t.daemon = False
-            t.start()
+    def show_stale_alert():
+        stale_alert = template.sidebar[0][0].select(pn.pane.Alert)[0]
+        stale_alert.object = get_stale_message(min_filtered_date, night_data, missing_properties) if stale else ''
+        stale_alert.visible = stale
+
+    if update is False:
+        await apply_to_document(doc, deploy)
     
+    # Mark the data as stale and refresh the dashboard once the database is available again
+    await apply_to_document(doc, show_stale_alert)
+
+    if stale:
+        start_revalidation(template, min_filtered_date, doc, telescope)
+
+    # Track the resources created for the session, so they can be released when the session is destroyed
+    memory_manager.track(doc, 'dataframes', list(night_data.values()))
+    memory_manager.track(doc, 'holoviews', [pane.object for plot_panel in plot_panels.values() for pane in plot_panel.select(pn.pane.HoloViews)])
+
+    # Subscribe the session to the new data of the current night, or cancel the subscription when other night is displayed
+    if doc is not None and doc.session_context is not None:
+        if live_streams:
+            telescope.live_feed.subscribe(doc.session_context.id, partial(push_live_updates, doc, live_streams))
+        else:
+            telescope.live_feed.unsubscribe(doc.session_context.id)
+
     toc = time.perf_counter()
-    print(f"\Dashboard deployed in {toc - tic:0.4f} seconds")
+    metrics.STAGE_SECONDS.labels('dashboard', 'update' if update else 'create').observe(toc - tic)
+    print(f"\Dashboard of {telescope.name} deployed in {toc - tic:0.4f} seconds")
 
 
-def update_loading_message(template:pn.template.MaterialTemplate, message:str):
+def get_anchor_data(db, date_filter, search_previous, telescope):
     """
-    Updates and shows a loading message in the dashboard while deploying it for the first time.
+    Get the data of the anchor property (See `registry.ANCHOR_PROPERTY`), which sets the night displayed. When the
+    query fails the database is considered unavailable and the cached data is used.
 
     Parameters
     ----------
-    - `template` (pn.template.MaterialTemplate) The template object from panel.
-    - `message` (str) The message to display in the loading screen.
+    - `db` (pymongo.database.Database) The database object from pymongo, or None when the database is unavailable.
+    - `date_filter` (date) The selected night.
+    - `search_previous` (bool) Whether to load the latest night with data before the selected night if it has no data.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+
+    Returns
+    ----------
+    - `db` (pymongo.database.Database) The database object, or None when the database is unavailable.
+    - `anchor_data` (pandas.DataFrame) The data of the anchor property.
     """
-    template.main[0][0][2].object = message
-    
+    anchor = registry.get_property(registry.ANCHOR_PROPERTY)
+
+    try:
+        return db, get_property_data(db, anchor, date_filter, search_previous=search_previous, telescope=telescope)
+    except Exception as e:
+        print("Error retrieving the anchor property, using the cached data:", e)
+        telescope.breaker.record_failure()
+
+        if db is not None:
+            db.client.close()
 
-def display_database_error(template: pn.template.MaterialTemplate):
+        return None, get_property_data(None, anchor, date_filter, search_previous=search_previous, telescope=telescope)
+
+
+def build_panel(panel, night_data, night, template, show_loading_msg=True, live_streams=None):
     """
-    Display a message in the dashboard when the connection to the database fails.
+    Builds the plot panel described in the registry with the data of a night.
 
     Parameters
     ----------
+    - `panel` (dict) The description of the panel (See `registry.PANELS`).
+    - `night_data` (dict) The dataframe of each property by property name. It must contain the properties the panel depends on.
+    - `night` (date) The day in which the night starts, shown in the title of the plot.
     - `template` (pn.template.MaterialTemplate) The template object from panel.
+    - `show_loading_msg` (bool) Whether to show the loading messages in the template.
+    - `live_streams` (dict) The streams used to send the new data of the current night to the plot. Defaults to None.
+
+    Returns
+    ----------
+    - `plot_panel` (pn.Column) The plot panel.
+    """
+    prop = registry.get_property(panel['property'])
+    title = panel['title'] + ' (' + str(night) + ')'
+
+    if 'inputs' in panel:
+        data = {key: night_data[property_name] for key, property_name in panel['inputs'].items()}
+    else:
+        data = night_data[panel['property']]
+
+    if panel['kind'] == 'grouped':
+        return panel_helper.create_plot_panel(data, title, 'date', prop['var_name'], prop['value_name'], panel['xlabel'], panel['ylabel'],
+                                              panel['cmap'], panel['clim'], template, show_loading_msg, live_streams)
+
+    if panel['kind'] == 'l1_rate':
+        return panel_helper.create_l1_rate_plot_panel(data, title, 'date', prop['var_name'], prop['value_name'], panel['xlabel'], panel['ylabel'],
+                                                      panel['cmap'], panel['clim'], template, show_loading_msg, live_streams)
+
+    if panel['kind'] == 'l0_ipr':
+        return panel_helper.create_l0_ipr_plot_panel(data, title, 'date', prop['var_name'], prop['value_name'], panel['xlabel'], panel['ylabel'],
+                                                     panel['cmap'], panel['clim'], template, show_loading_msg, live_streams)
+
+    if panel['kind'] == 'tib_rates':
+        return panel_helper.create_tib_rates_plot_panel(data, title, panel['xlabel'], panel['ylabel'], template, show_loading_msg, live_streams)
+
+    if panel['kind'] == 'dragon_busy':
+        return panel_helper.create_dragon_busy_plot_panel(data, title, panel['xlabel'], panel['ylabel'], template, show_loading_msg, live_streams)
+
+    raise ValueError(f"Unknown kind of panel: {panel['kind']}")
+
+
+def load_night_data(db, night, properties=None, telescope=None):
+    """
+    Loads the data of the properties plotted in the dashboard for a night, using the shared night data cache.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo.
+    - `night` (date) The day in which the night starts.
+    - `properties` (list) The descriptions of the properties to load (See `registry.PROPERTIES`). Defaults to all of them.
+    - `telescope` (telescopes.Telescope) The telescope. Defaults to the default telescope.
+
+    Returns
+    ----------
+    - `night_data` (dict) The dataframe of each property by property name.
+    """
+    return dict(iter_night_data(db, night, properties, telescope))
+
+
+def iter_night_data(db, night, properties=None, telescope=None):
+    """
+    Yields the data of the properties of a night as soon as it is available. The cached properties are yielded first.
+    The rest are retrieved from the database in batches of properties of the same collection, each batch with a single
+    query, running `FETCH_WORKERS` queries concurrently. The retrieved data is stored in the night data cache. The
+    properties that cannot be retrieved, because the database is unavailable or the query fails, are yielded empty
+    and not cached.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo, or None when the database is unavailable.
+    - `night` (date) The day in which the night starts.
+    - `properties` (list) The descriptions of the properties to load (See `registry.PROPERTIES`). Defaults to all of them.
+    - `telescope` (telescopes.Telescope) The telescope. Defaults to the default telescope.
+
+    Returns
+    ----------
+    - `night_data` (generator) Tuples with the name of each property and its dataframe.
+    """
+    if telescope is None:
+        telescope = telescopes.default
+
+    missing_properties = []
+
+    yield from iter_cached_night_data(night, properties, missing_properties, telescope)
+
+    if not missing_properties:
+        return
+
+    # Without database the properties not cached are empty, and they are not cached so they are retrieved later
+    if db is None:
+        for prop in missing_properties:
+            yield prop['name'], build_property_dataframe(prop, [], [])
+
+        return
+
+    batches = registry.get_batches(missing_properties, FETCH_BATCH_SIZE)
+
+    with ThreadPoolExecutor(max_workers=max(FETCH_WORKERS, 1)) as executor:
+        futures = {executor.submit(fetch_night_batch, db, batch, night, telescope, profiling.get_session()): batch for batch in batches}
+
+        for future in as_completed(futures):
+            try:
+                yield from future.result().items()
+            except Exception as e:
+                print("Error retrieving " + ', '.join(prop['name'] for prop in futures[future]) + ':', e)
+                telescope.breaker.record_failure()
+
+                for prop in futures[future]:
+                    yield prop['name'], build_property_dataframe(prop, [], [])
+
+
+async def aiter_night_data(db, night, telescope, properties=None, session_id=None):
+    """
+    Asynchronous version of `iter_night_data`, used by the dashboards of the sessions on the event loop of the server.
+    The queries of the batches are awaited at the same time, up to `FETCH_WORKERS` for each session (See `fetch_night_batch_async`).
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo, or None when the database is unavailable.
+    - `night` (date) The day in which the night starts.
+    - `telescope` (telescopes.Telescope) The telescope.
+    - `properties` (list) The descriptions of the properties to load (See `registry.PROPERTIES`). Defaults to all of them.
+    - `session_id` (str) The session the memory profiled stages are attributed to (See `profiling.bind_session`).
+
+    Returns
+    ----------
+    - `night_data` (async generator) Tuples with the name of each property and its dataframe.
+    """
+    missing_properties = []
+
+    for property_name, pandas_df in iter_cached_night_data(night, properties, missing_properties, telescope):
+        yield property_name, pandas_df
+
+    if not missing_properties:
+        return
+
+    # Without database the properties not cached are empty, and they are not cached so they are retrieved later
+    if db is None:
+        for prop in missing_properties:
+            yield prop['name'], build_property_dataframe(prop, [], [])
+
+        return
+
+    semaphore = asyncio.Semaphore(max(FETCH_WORKERS, 1))
+    tasks = {asyncio.ensure_future(fetch_night_batch_async(db, batch, night, semaphore, telescope, session_id)): batch
+             for batch in registry.get_batches(missing_properties, FETCH_BATCH_SIZE)}
+    pending = set(tasks)
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in done:
+            try:
+                night_data = task.result()
+            except Exception as e:
+                print("Error retrieving " + ', '.join(prop['name'] for prop in tasks[task]) + ':', e)
+                telescope.breaker.record_failure()
+                night_data = {prop['name']: build_property_dataframe(prop, [], []) for prop in tasks[task]}
+
+            for property_name, pandas_df in night_data.items():
+                yield property_name, pandas_df
+
+
+def iter_cached_night_data(night, properties, missing_properties, telescope):
+    """
+    Yields the data of the properties of a night found in the night data caches.
+
+    Parameters
+    ----------
+    - `night` (date) The day in which the night starts.
+    - `properties` (list) The descriptions of the properties (See `registry.PROPERTIES`), or None for all of them.
+    - `missing_properties` (list) The list where the descriptions of the properties not cached are appended.
+    - `telescope` (telescopes.Telescope) The telescope.
+
+    Returns
+    ----------
+    - `night_data` (generator) Tuples with the name of each cached property and its dataframe.
+    """
+    if properties is None:
+        properties = registry.PROPERTIES
+
+    for prop in properties:
+        key = cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night)
+        pandas_df = get_cached_night_data(key, get_spec(prop))
+
+        if pandas_df is None:
+            missing_properties.append(prop)
+        else:
+            yield prop['name'], pandas_df
+
+
+def fetch_night_batch(db, batch, night, telescope, session_id=None):
+    """
+    Retrieves the data of a batch of properties of the same collection for a night with a single query, builds
+    their dataframes and stores them in the night data cache. The properties known to be empty in the night are not queried.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo.
+    - `batch` (list) The descriptions of the properties (See `registry.get_batches`).
+    - `night` (date) The day in which the night starts.
+    - `telescope` (telescopes.Telescope) The telescope.
+    - `session_id` (str) The session the memory profiled stages are attributed to (See `profiling.bind_session`).
+
+    Returns
+    ----------
+    - `night_data` (dict) The dataframe of each property by property name.
+    """
+    profiling.bind_session(session_id)
+
+    # The properties known to have no data in the night are not queried (See `availability`)
+    queried = [prop for prop in batch if not telescope.availability.is_empty(prop['name'], night)]
+    documents = {}
+
+    if queried:
+        documents = database.get_night_documents(db[batch[0]['collection']], [prop['name'] for prop in queried], night,
+                                                 [prop['value_field'] for prop in queried], telescope.name)
+
+    return store_night_batch(batch, night, documents, telescope)
+
+
+async def fetch_night_batch_async(db, batch, night, semaphore, telescope, session_id=None):
+    """
+    Asynchronous version of `fetch_night_batch`. The query is awaited on the event loop (See `async_database.get_night_documents`)
+    and the dataframes are built in the pool of threads shared by the sessions.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo.
+    - `batch` (list) The descriptions of the properties (See `registry.get_batches`).
+    - `night` (date) The day in which the night starts.
+    - `semaphore` (asyncio.Semaphore) The semaphore limiting the queries of the session run at the same time.
+    - `telescope` (telescopes.Telescope) The telescope.
+    - `session_id` (str) The session the memory profiled stages are attributed to (See `profiling.bind_session`).
+
+    Returns
+    ----------
+    - `night_data` (dict) The dataframe of each property by property name.
+    """
+    queried = [prop for prop in batch if not telescope.availability.is_empty(prop['name'], night)]
+    documents = {}
+
+    if queried:
+        async with semaphore:
+            documents = await async_database.get_night_documents(db, batch[0]['collection'], [prop['name'] for prop in queried], night,
+                                                                 [prop['value_field'] for prop in queried], telescope)
+
+    return await async_database.run_blocking(store_night_batch, batch, night, documents, telescope, session_id=session_id)
+
+
+def store_night_batch(batch, night, documents, telescope):
+    """
+    Builds the dataframes of a batch of properties from the documents retrieved and stores them in the night data cache.
+
+    Parameters
+    ----------
+    - `batch` (list) The descriptions of the properties (See `registry.get_batches`).
+    - `night` (date) The day in which the night starts.
+    - `documents` (dict) The values and dates retrieved for each property (See `database.get_night_documents`). The properties not included are empty.
+    - `telescope` (telescopes.Telescope) The telescope.
+
+    Returns
+    ----------
+    - `night_data` (dict) The dataframe of each property by property name.
+    """
+    night_data = {}
+
+    for prop in batch:
+        pandas_df = build_property_dataframe(prop, *documents.pop(prop['name'], ([], [])))
+        cache_night_data(cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night), pandas_df, get_spec(prop),
+                         share=True)
+        night_data[prop['name']] = pandas_df
+
+    return night_data
+
+
+def build_property_dataframe(prop, data_values, datetime_values):
+    """
+    Builds the dataframe of a property from the values retrieved from the database.
+
+    Parameters
+    ----------
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `data_values` (list) The values retrieved from the collection, one value or array per document.
+    - `datetime_values` (list) The dates of the retrieved values.
+
+    Returns
+    ----------
+    - `pandas_df` (pandas.DataFrame) The dataframe indexed by date (See `database.build_array_dataframe` and `database.build_scalar_dataframe`).
+    """
+    if prop['shape'] == 'scalar':
+        return database.build_scalar_dataframe(data_values, datetime_values, prop['value_name'], prop.get('remove_zero_values', False))
+
+    return database.build_array_dataframe(data_values, datetime_values, 'date', prop['var_name'], prop['value_name'])
+
+
+def get_night_property_data(db, prop, night, telescope=None):
+    """
+    Get the data of a property for a night from the night data caches or, if it is not cached and not known to be
+    empty (See `availability`), from the database. The data retrieved is not stored in the cache, so going through long ranges of nights does not evict the nights used by the sessions.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo.
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `night` (dt.date) The day in which the night starts.
+    - `telescope` (telescopes.Telescope) The telescope. Defaults to the default telescope.
+
+    Returns
+    ----------
+    - `pandas_df` (pandas.DataFrame) The data of the night (See `build_property_dataframe`).
+    """
+    if telescope is None:
+        telescope = telescopes.default
+
+    key = cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night)
+    pandas_df = get_cached_night_data(key, get_spec(prop))
+
+    if pandas_df is None and telescope.availability.is_empty(prop['name'], night):
+        pandas_df = build_property_dataframe(prop, [], [])
+
+    if pandas_df is None:
+        documents = database.get_night_documents(db[prop['collection']], [prop['name']], night, [prop['value_field']], telescope.name)
+        pandas_df = build_property_dataframe(prop, *documents[prop['name']])
+
+    return pandas_df
+
+
+def get_night_level_data(db, prop, night, telescope, level='1min'):
+    """
+    Get the data of a property for a night at a level of the time pyramid (See `rollups.LEVELS`): the buckets of the
+    level when they are stored for the night, otherwise the minute data (See `get_night_property_data`).
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo.
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `night` (dt.date) The day in which the night starts.
+    - `telescope` (telescopes.Telescope) The telescope. The time pyramid is only stored for the default telescope.
+    - `level` (str) The name of the level. The minute data by default.
+
+    Returns
+    ----------
+    - `night_data` (pandas.DataFrame or tuple) The dataframe of the minute data, or the dates and statistics of the buckets (See `rollups.load_buckets`).
+    """
+    if level != rollups.LEVELS[0][0] and telescope is telescopes.default:
+        buckets = rollups.load_buckets(prop['name'], level, night)
+
+        if buckets is not None:
+            return buckets
+
+    return get_night_property_data(db, prop, night, telescope)
+
+
+def iter_range_data(db, prop, nights, telescope, level='1min'):
+    """
+    Yields the data of a property for several nights, one night after another. The next night is retrieved while the
+    current one is processed, so at most two nights are held in memory however long the range is.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo.
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `nights` (list) The days in which each night starts.
+    - `telescope` (telescopes.Telescope) The telescope.
+    - `level` (str) The level of the time pyramid to retrieve (See `get_night_level_data`). The minute data by default.
+
+    Returns
+    ----------
+    - `range_data` (generator) Tuples with each night and its data (See `get_night_level_data`).
     """
-    template.main[0][0] = pn.Column()
-    template.sidebar[0][0] = pn.Column()
-    db_error_image = pn.pane.PNG('./images/db_error.png', width=100, align='center')
-    db_error_text = pn.pane.Markdown('''<h1 style="text-align:center">Connection to database failed. Check if database is running or contact with a system administrator.</h1>''')
-    main_error_col = pn.Column(pn.layout.VSpacer(), db_error_image,  db_error_text, pn.layout.VSpacer(), sizing_mode='stretch_both')
-    template.main[0][0] = main_error_col
+    if not nights:
+        return
+
+    future = _range_prefetch.submit(get_night_level_data, db, prop, nights[0], telescope, level)
+
+    try:
+        for i, night in enumerate(nights):
+            night_data = future.result()
+
+            if i + 1 < len(nights):
+                future = _range_prefetch.submit(get_night_level_data, db, prop, nights[i + 1], telescope, level)
+
+            yield night, night_data
+            del night_data
+    finally:
+        # The next night is not retrieved when the plot is replaced before it starts
+        future.cancel()
+
+
+def create_range_view(last_night, doc=None, telescope=None):
+    """
+    Creates the view plotting a property over a range of nights. The nights are retrieved one after another and added
+    to the aggregates of the plot (See `plot_helper.RangeAggregate`), so the plot fills in night by night. Zooming
+    into the plot aggregates again the nights of the new x range, from a finer level of the time pyramid if needed.
+
+    Parameters
+    ----------
+    - `last_night` (dt.date) The last night of the range selected by default. The range covers the week before it.
+    - `doc` (bokeh.document.Document) The document of the user session. Used to send the aggregates to the plot. Defaults to None.
+    - `telescope` (telescopes.Telescope) The telescope displayed. Defaults to the default telescope.
+
+    Returns
+    ----------
+    - `range_view` (pn.Column) The widgets to select the range and the property, and the plot.
+    """
+    if telescope is None:
+        telescope = telescopes.default
+
+    range_panels = {panel['title']: panel for panel in registry.PANELS if panel['kind'] in registry.AGGREGATED_KINDS}
+
+    property_select = pn.widgets.Select(name='Property', options=list(range_panels))
+    start_picker = pn.widgets.DatePicker(name='First night', value=last_night - dt.timedelta(days=6), end=dt.date.today())
+    end_picker = pn.widgets.DatePicker(name='Last night', value=last_night, end=dt.date.today())
+    load_button = pn.widgets.Button(name='Plot nights', button_type='primary', align='end')
+    status = pn.pane.Markdown(f'Select up to {RANGE_MAX_NIGHTS} nights and the property to plot.')
+    plot_pane = pn.pane.HoloViews(sizing_mode='stretch_width', linked_axes=False)
+
+    # Each new plot or zoom cancels the nights still being added to the previous aggregates
+    state = {'generation': 0, 'plot': None}
+
+    def aggregate_range(range_start, range_end):
+        """
+        Aggregates the nights of a range of datetimes and sends them to the current plot.
+        """
+        panel, prop, pipe = state['plot']
+        nights = [database.get_night_of(range_start) + dt.timedelta(days=i)
+                  for i in range((database.get_night_of(range_end) - database.get_night_of(range_start)).days + 1)]
+
+        if len(nights) > RANGE_MAX_NIGHTS:
+            status.object = f'At most {RANGE_MAX_NIGHTS} nights can be plotted at once.'
+            return
+
+        aggregate = plot_helper.RangeAggregate(range_start, range_end, panel['clim'], RANGE_TIME_BINS, RANGE_VALUE_BINS)
+        state['range'] = (range_start, range_end)
+        state['generation'] += 1
+        generation = state['generation']
+
+        # The nights are added in the pool of threads shared by the sessions (See `async_database.executor`)
+        future = async_database.executor.submit(stream_range_data, doc, prop, nights, aggregate, pipe, status, lambda: state['generation'] == generation,
+                                                telescope)
+        future.add_done_callback(partial(report_range_error, prop))
+
+    def zoom(x_range):
+        range_start, range_end = x_range
+
+        # The ranges set by the plot itself match the aggregated range up to a time bin
+        tolerance = (state['range'][1] - state['range'][0]) / RANGE_TIME_BINS
+
+        if abs(range_start - state['range'][0]) <= tolerance and abs(range_end - state['range'][1]) <= tolerance:
+            return
+
+        aggregate_range(range_start, range_end)
+
+    def plot_range(event):
+        start, end = start_picker.value, end_picker.value
+
+        if end < start:
+            status.object = 'The last night is before the first night.'
+            return
+
+        if (end - start).days + 1 > RANGE_MAX_NIGHTS:
+            status.object = f'At most {RANGE_MAX_NIGHTS} nights can be plotted at once.'
+            return
+
+        panel = range_panels[property_select.value]
+        prop = registry.get_property(panel['property'])
+        range_start, range_end = database.get_night_range(start)[0], database.get_night_range(end)[1]
+
+        pipe = plot_helper.create_range_pipe(plot_helper.RangeAggregate(range_start, range_end, panel['clim'], RANGE_TIME_BINS, RANGE_VALUE_BINS))
+        plot_pane.object = plot_helper.plot_range_data(pipe, prop['value_name'], f"{panel['title']} ({start} - {end})", panel['xlabel'], panel['ylabel'],
+                                                       panel['cmap'], on_zoom=zoom)
+        state['plot'] = (panel, prop, pipe)
+
+        aggregate_range(range_start, range_end)
+
+    load_button.on_click(plot_range)
+
+    return pn.Column(pn.Row(property_select, start_picker, end_picker, load_button), status, plot_pane, sizing_mode='stretch_width')
+
+
+def create_trend_view(last_night):
+    """
+    Creates the view plotting the nightly statistics of a channel or module over months, read from the rollups (See `rollups`).
+
+    Parameters
+    ----------
+    - `last_night` (dt.date) The last night of the range selected by default. The range covers the 180 nights before it.
+
+    Returns
+    ----------
+    - `trend_view` (pn.Column) The widgets to select the property, the channel and the range, and the plot.
+    """
+    rollup_properties = [prop['name'] for prop in rollups.get_rollup_properties()]
+    trend_panels = {panel['title']: panel for panel in registry.PANELS if panel['property'] in rollup_properties}
+
+    property_select = pn.widgets.Select(name='Property', options=list(trend_panels))
+    channel_input = pn.widgets.IntInput(name='Channel / module', value=1, start=1)
+    start_picker = pn.widgets.DatePicker(name='First night', value=last_night - dt.timedelta(days=179), end=dt.date.today())
+    end_picker = pn.widgets.DatePicker(name='Last night', value=last_night, end=dt.date.today())
+    plot_button = pn.widgets.Button(name='Plot trend', button_type='primary', align='end')
+    status = pn.pane.Markdown('Select the property, the channel or module and the nights to plot.')
+    plot_pane = pn.pane.HoloViews(sizing_mode='stretch_width', linked_axes=False)
+
+    def plot_trend(event):
+        start, end = start_picker.value, end_picker.value
+
+        if end < start:
+            status.object = 'The last night is before the first night.'
+            return
+
+        tic = time.perf_counter()
+        panel = trend_panels[property_select.value]
+        prop = registry.get_property(panel['property'])
+        trend = rollups.load_trend(prop['name'], channel_input.value, start, end)
+
+        if trend.empty:
+            status.object = f'No rollups of {panel["title"]} between {start} and {end}. The nights are rolled up with the rollups.py script.'
+            plot_pane.object = plot_helper.create_empty_plot()
+            return
+
+        title = f"{panel['title']}, {prop['var_name']} {channel_input.value} ({start} - {end})"
+        plot_pane.object = plot_helper.plot_trend_data(trend, title, 'Night', panel['ylabel'])
+
+        toc = time.perf_counter()
+        metrics.STAGE_SECONDS.labels('trend', prop['name']).observe(toc - tic)
+        status.object = f'{len(trend)} nights loaded in {toc - tic:0.2f} seconds.'
+
+    plot_button.on_click(plot_trend)
+
+    return pn.Column(pn.Row(property_select, channel_input, start_picker, end_picker, plot_button), status, plot_pane, sizing_mode='stretch_width')
+
+
+def create_module_view(date_picker, telescope):
+    """
+    Creates the view of a pixel property of the night selected reduced to the modules of the camera (See `camera`): an
+    image with the mean, max, min or spread of the 7 pixels of each module, and the drill-down into the pixels of a
+    module, optionally above a module property of the same module. Clicking a module in the image selects it.
+
+    Parameters
+    ----------
+    - `date_picker` (pn.widgets.DatePicker) The date picker of the dashboard, with the night displayed.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+
+    Returns
+    ----------
+    - `module_view` (pn.Column) The widgets to select the property, the statistic and the module, and the plots.
+    """
+    pixel_panels = {panel['title']: panel for panel in registry.PANELS
+                    if 'clim' in panel and registry.get_property(panel['property'])['var_name'] == 'channel'}
+    module_panels = {panel['title']: panel for panel in registry.PANELS
+                     if 'clim' in panel and registry.get_property(panel['property'])['var_name'] == 'module'}
+    modules = np.unique(camera.pixel_modules.modules)
+
+    property_select = pn.widgets.Select(name='Pixel property', options=list(pixel_panels))
+    statistic_select = pn.widgets.Select(name='Statistic', options=list(camera.STATISTICS))
+    show_button = pn.widgets.Button(name='Show modules', button_type='primary', align='end')
+    module_input = pn.widgets.IntInput(name='Module', value=int(modules[0]), start=int(modules[0]), end=int(modules[-1]))
+    module_property_select = pn.widgets.Select(name='Module property', options=['None'] + list(module_panels))
+    status = pn.pane.Markdown('Select a property of the pixels to show it by module in the night selected.')
+    image_pane = pn.pane.HoloViews(sizing_mode='stretch_width', linked_axes=False)
+    pixels_pane = pn.pane.HoloViews(sizing_mode='stretch_width', linked_axes=False)
+    state = {}
+
+    def get_module_property(module):
+        if module_property_select.value == 'None':
+            return None
+
+        panel = module_panels[module_property_select.value]
+        prop = registry.get_property(panel['property'])
+        pandas_df = get_cached_night_data(cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], state['night']),
+                                          get_spec(prop))
+
+        if pandas_df is None or pandas_df.empty:
+            return None
+
+        dates, property_modules, values = thresholds.load_night_array(pandas_df, 'module', prop['value_name'])
+        column = np.searchsorted(property_modules, module)
+
+        if column == len(property_modules) or property_modules[column] != module:
+            return None
+
+        return dates, values[:, column], f"{panel['title']} of module {module}", panel['ylabel']
+
+    def show_pixels(*events):
+        if not state:
+            return
+
+        panel, prop, module = state['panel'], state['prop'], module_input.value
+        dates, channels, values = thresholds.load_night_array(state['pandas_df'], 'channel', prop['value_name'])
+        module_dates, data_modules, module_values = state['module_array']
+
+        pixels = camera.pixel_modules.get_pixels(module)
+        columns = np.searchsorted(channels, pixels).clip(max=len(channels) - 1)
+        columns = columns[channels[columns] == pixels]
+        module_column = np.searchsorted(data_modules, module)
+
+        if len(columns) == 0 or module_column == len(data_modules) or data_modules[module_column] != module:
+            pixels_pane.object = None
+            status.object = f"No data of the pixels of module {module} in night {state['night']}."
+            return
+
+        title = f"{panel['title']} of the pixels of module {module} ({state['night']})"
+        pixels_pane.object = plot_helper.plot_module_pixels(dates, channels[columns], values[:, columns], module_values[:, module_column], title,
+                                                            panel['xlabel'], panel['ylabel'], state['statistic'], get_module_property(module))
+
+    def select_module(module):
+        module_input.value = min(max(module, module_input.start), module_input.end)
+
+    def show_modules(event):
+        panel = pixel_panels[property_select.value]
+        prop = registry.get_property(panel['property'])
+        night = date_picker.value
+        pandas_df = get_cached_night_data(cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night),
+                                          get_spec(prop))
+
+        if pandas_df is None:
+            status.object = f'The data of night {night} is not loaded yet.'
+            return
+
+        if pandas_df.empty:
+            status.object = f'No data of {panel["title"]} in night {night}.'
+            return
+
+        tic = time.perf_counter()
+        module_array, image = camera.load_module_data(pandas_df, prop['value_name'], statistic_select.value)
+        toc = time.perf_counter()
+
+        state.update(panel=panel, prop=prop, night=night, pandas_df=pandas_df, module_array=module_array, statistic=statistic_select.value)
+        title = f"{panel['title']} by module ({statistic_select.value} of the pixels, {night})"
+        image_pane.object = plot_helper.plot_module_data(image, title, panel['xlabel'], panel['ylabel'], panel['cmap'], panel['clim'], select_module)
+
+        status.object = (f"**{len(module_array[1])} modules** reduced from their pixels over {len(module_array[0])} minutes "
+                         f"in {(toc - tic) * 1000:0.1f} ms. Click a module in the plot or enter it to show its pixels.")
+        show_pixels()
+
+    show_button.on_click(show_modules)
+    module_input.param.watch(show_pixels, 'value')
+    module_property_select.param.watch(show_pixels, 'value')
+
+    return pn.Column(pn.Row(property_select, statistic_select, show_button), status, image_pane, pn.Row(module_input, module_property_select),
+                     pixels_pane, sizing_mode='stretch_width')
+
+
+def create_correlation_view(date_picker, telescope):
+    """
+    Creates the view correlating two pixel or module properties of the night selected (See `correlation`): the
+    rasterized scatter of the values of all the channels or modules and the ranking of the channels or modules by
+    their correlation coefficient. Clicking a row shows the values of its channel or module on top of the scatter.
+
+    Parameters
+    ----------
+    - `date_picker` (pn.widgets.DatePicker) The date picker of the dashboard, with the night displayed.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+
+    Returns
+    ----------
+    - `correlation_view` (pn.Column) The widgets to select the properties, the plot and the table with the ranking.
+    """
+    correlation_panels = {panel['title']: panel for panel in registry.PANELS if panel['kind'] == 'grouped'}
+    titles = list(correlation_panels)
+    var_names = {title: registry.get_property(panel['property'])['var_name'] for title, panel in correlation_panels.items()}
+
+    x_select = pn.widgets.Select(name='Property (x axis)', options=titles, value=titles[0])
+    y_select = pn.widgets.Select(name='Property (y axis)', options=titles, value=next(title for title in titles[1:] if var_names[title] == var_names[titles[0]]))
+    correlate_button = pn.widgets.Button(name='Correlate', button_type='primary', align='end')
+    status = pn.pane.Markdown('Select two properties of the pixels or of the modules to correlate them in the night selected.')
+    plot_pane = pn.pane.HoloViews(sizing_mode='stretch_width', linked_axes=False)
+    table = pn.widgets.Tabulator(disabled=True, show_index=False, pagination='remote', page_size=25, sizing_mode='stretch_width')
+    state = {}
+
+    def plot_correlation(channel=None):
+        x_panel, y_panel = state['panels']
+        highlight = None
+
+        if channel is not None:
+            column = np.searchsorted(state['channels'], channel)
+            highlight = (state['x_values'][:, column], state['y_values'][:, column])
+
+        title = f"{x_panel['title']} vs {y_panel['title']} ({state['night']})"
+        plot_pane.object = plot_helper.plot_correlation_data(state['image'], title, x_panel['ylabel'], y_panel['ylabel'], x_panel['cmap'], highlight,
+                                                             f"{state['var_name']} {channel}")
+
+    def correlate(event):
+        x_panel, y_panel = correlation_panels[x_select.value], correlation_panels[y_select.value]
+        x_prop, y_prop = registry.get_property(x_panel['property']), registry.get_property(y_panel['property'])
+
+        if x_prop['var_name'] != y_prop['var_name']:
+            status.object = 'Both properties must be of the pixels or of the modules.'
+            return
+
+        night = date_picker.value
+        frames = [get_cached_night_data(cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night), get_spec(prop))
+                  for prop in (x_prop, y_prop)]
+
+        if any(pandas_df is None for pandas_df in frames):
+            status.object = f'The data of night {night} is not loaded yet.'
+            return
+
+        if any(pandas_df.empty for pandas_df in frames):
+            status.object = f'No data of {x_panel["title"]} or {y_panel["title"]} in night {night}.'
+            return
+
+        tic = time.perf_counter()
+        channels, x_values, y_values = correlation.align_night_arrays(frames[0], frames[1], x_prop['var_name'], x_prop['value_name'], y_prop['value_name'])
+        coefficients, samples = correlation.correlate_channels(x_values, y_values)
+        image = correlation.bin_pairs(x_values, y_values, x_panel['clim'], y_panel['clim'])
+        toc = time.perf_counter()
+
+        state.update(panels=(x_panel, y_panel), night=night, var_name=x_prop['var_name'], channels=channels, x_values=x_values, y_values=y_values, image=image)
+        table.value = correlation.rank_channels(channels, coefficients, samples, x_prop['var_name']).round({'correlation': 3})
+        plot_correlation()
+
+        status.object = (f"**{np.count_nonzero(~np.isnan(coefficients))} {x_prop['var_name']}s** correlated over {len(x_values)} minutes "
+                         f"in {(toc - tic) * 1000:0.1f} ms. Click a row to show its values on top of the scatter.")
+
+    def show_channel(event):
+        plot_correlation(table.value.iloc[event.row, 0])
+
+    correlate_button.on_click(correlate)
+    table.on_click(show_channel)
+
+    return pn.Column(pn.Row(x_select, y_select, correlate_button), status, plot_pane, table, sizing_mode='stretch_width')
+
+
+def create_threshold_view(date_picker, tabs, telescope):
+    """
+    Creates the view ranking the channels or modules of a property by the time they spent above a threshold in the night
+    selected, and by their peak value (See `thresholds.scan_night`). The night is scanned again when the property, the
+    threshold or the night change, when the view is shown and once the data of a night that was not loaded is plotted.
+    Clicking a row shows its channel or module in the plot of the property.
+
+    Parameters
+    ----------
+    - `date_picker` (pn.widgets.DatePicker) The date picker of the dashboard, with the night displayed.
+    - `tabs` (pn.Tabs) The tabs of the dashboard, with the plots of the properties. The view must be its last tab.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+
+    Returns
+    ----------
+    - `threshold_view` (pn.Column) The widgets to select the property and the threshold, and the table with the ranking.
+    """
+    threshold_panels = {panel['title']: panel for panel in registry.get_threshold_panels()}
+
+    property_select = pn.widgets.Select(name='Property', options=list(threshold_panels))
+    threshold_input = pn.widgets.FloatInput(name='Threshold', value=float(threshold_panels[property_select.value]['threshold']))
+    scan_button = pn.widgets.Button(name='Scan night', button_type='primary', align='end')
+    status = pn.pane.Markdown('Select the property and the threshold to scan.')
+    table = pn.widgets.Tabulator(disabled=True, show_index=False, pagination='remote', page_size=25, sizing_mode='stretch_width')
+    state = {'pending': False}
+
+    def is_shown():
+        return tabs.active == len(tabs) - 1
+
+    def clear_ranking():
+        if table.value is not None:
+            table.value = table.value.iloc[:0]
+
+    def scan(*events):
+        panel = threshold_panels[property_select.value]
+        prop = registry.get_property(panel['property'])
+        night = date_picker.value
+        pandas_df = get_cached_night_data(cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night),
+                                          get_spec(prop))
+
+        # Scanned again once the data of the night is plotted (See `scan_loaded_night`)
+        state['pending'] = pandas_df is None
+
+        if pandas_df is None:
+            clear_ranking()
+            status.object = f"The data of {panel['title']} of night {night} is not loaded yet."
+            return
+
+        tic = time.perf_counter()
+        ranking = thresholds.scan_night(pandas_df, prop['var_name'], prop['value_name'], threshold_input.value)
+        toc = time.perf_counter()
+
+        above = int((ranking['minutes_above'] > 0).sum())
+        table.value = ranking.round({'minutes_above': 1, 'peak': 2})
+        status.object = (f"**{above} of {len(ranking)}** {prop['var_name']}s of {panel['title']} above {threshold_input.value:g} in night {night} "
+                         f"(scanned in {(toc - tic) * 1000:0.1f} ms). Click a row to show it in the plot.")
+
+    def select_property(event):
+        threshold = float(threshold_panels[event.new]['threshold'])
+
+        # Changing the threshold scans the night, otherwise it is scanned here
+        if threshold_input.value != threshold:
+            threshold_input.value = threshold
+        else:
+            scan()
+
+    def show_channel(event):
+        panel = threshold_panels[property_select.value]
+        channel = table.value.iloc[event.row, 0]
+
+        for slider in tabs[panel['tab']][panel['cell']].select(pn.widgets.DiscreteSlider):
+            slider.value = next((value for value in slider.values if value == channel), slider.value)
+
+        tabs.active = panel['tab']
+
+    def show_view(event):
+        if event.new == len(tabs) - 1:
+            scan()
+
+    def change_night(event):
+        # The ranking of the previous night is removed, so its rows do not select the channels of another night
+        if is_shown():
+            scan()
+        else:
+            clear_ranking()
+            status.object = f'Select the property and the threshold to scan night {event.new}.'
+
+    def scan_loaded_night(event):
+        # The plots of a night are placed in the grids of their tabs once its data is loaded
+        if state['pending'] and is_shown():
+            scan()
+
+    property_select.param.watch(select_property, 'value')
+    threshold_input.param.watch(scan, 'value')
+    scan_button.on_click(scan)
+    table.on_click(show_channel)
+    tabs.param.watch(show_view, 'active')
+    date_picker.param.watch(change_night, 'value')
+
+    for tab in {panel['tab'] for panel in threshold_panels.values()}:
+        tabs[tab].param.watch(scan_loaded_night, 'objects')
+
+    return pn.Column(pn.Row(property_select, threshold_input, scan_button), status, table, sizing_mode='stretch_width')
+
+
+def create_export_view(date_picker, doc, telescope):
+    """
+    Creates the card of the sidebar exporting the data of the night selected as Parquet or CSV (See `export`). The size
+    of the file is estimated in another thread when the card is expanded and when the night or the options change, and
+    the download link streams the file from the /api/export address.
+
+    Parameters
+    ----------
+    - `date_picker` (pn.widgets.DatePicker) The date picker of the dashboard, with the night displayed.
+    - `doc` (bokeh.document.Document) The document of the user session, or None to update the card directly.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+
+    Returns
+    ----------
+    - `export_view` (pn.Card) The card with the options of the export, its estimated size and the download link.
+    """
+    properties_choice = pn.widgets.MultiChoice(name='Properties', options=[prop['name'] for prop in registry.PROPERTIES],
+                                               value=[prop['name'] for prop in registry.PROPERTIES])
+    channels_input = pn.widgets.TextInput(name='Channels or modules', placeholder='All (e.g. 1,5,10-20)')
+    format_select = pn.widgets.Select(name='Format', options=list(export.FORMATS))
+    compression_select = pn.widgets.Select(name='Compression', options=export.COMPRESSIONS[format_select.value])
+    estimate_info = pn.pane.Markdown()
+    download_link = pn.pane.HTML()
+    card = pn.Card(properties_choice, channels_input, format_select, compression_select, estimate_info, download_link, title='Export night data',
+                   collapsed=True, sizing_mode='stretch_width')
+    state = {'generation': 0}
+
+    def schedule(callback):
+        if doc is None or doc.session_context is None:
+            callback()
+        else:
+            doc.add_next_tick_callback(callback)
+
+    def estimate(generation, props, night, channels, data_format, compression):
+        db = telescope.connect()
+
+        if db is None:
+            message = 'Size unknown: connection to the database failed.'
+        else:
+            try:
+                nbytes, rows = export.estimate_size(db, props, night, telescope, channels, data_format, compression)
+                message = f"Estimated size: **{nbytes / 2**20:0.1f} MB** ({rows:,} rows)"
+            except ImportError:
+                message = 'pyarrow is needed to export the Parquet format, use CSV.'
+            except Exception as e:
+                print(f"Error estimating the size of the export of night {night}: {e}")
+                message = f'Size unknown: {e}'
+            finally:
+                db.client.close()
+
+        # The estimate of previous options is discarded
+        if state['generation'] == generation:
+            schedule(partial(setattr, estimate_info, 'object', message))
+
+    def update(*events):
+        state['generation'] += 1
+        download_link.object = ''
+
+        if card.collapsed:
+            return
+
+        props = [registry.get_property(name) for name in properties_choice.value]
+
+        if not props:
+            estimate_info.object = 'Select the properties to export.'
+            return
+
+        try:
+            channels = data_api.parse_channels(channels_input.value)
+        except HTTPError as e:
+            estimate_info.object = e.reason
+            return
+
+        night = date_picker.value
+        url = export.get_url(night, properties_choice.value, channels_input.value, format_select.value, compression_select.value, telescope)
+        filename = export.get_filename(telescope, night, format_select.value, compression_select.value)
+        download_link.object = f'<a href="{url}" download="{filename}" target="_blank">Download {filename}</a>'
+        estimate_info.object = 'Estimating size...'
+
+        thread = threading.Thread(target=estimate, args=(state['generation'], props, night, channels, format_select.value, compression_select.value))
+        thread.daemon = True
+        thread.start()
+
+    def select_format(event):
+        compression = compression_select.value
+        compression_select.options = export.COMPRESSIONS[event.new]
+
+        # Changing the compression updates the export, otherwise it is updated here
+        if compression_select.value == compression:
+            update()
+
+    format_select.param.watch(select_format, 'value')
+
+    for widget, parameter in ((properties_choice, 'value'), (channels_input, 'value'), (compression_select, 'value'), (date_picker, 'value'),
+                              (card, 'collapsed')):
+        widget.param.watch(update, parameter)
+
+    return card
+
+
+def report_range_error(prop, future):
+    """
+    Prints the error of a multi-night plot run in the shared pool of threads (See `stream_range_data`), which would be
+    kept in its future otherwise.
+
+    Parameters
+    ----------
+    - `prop` (dict) The description of the property plotted (See `registry.PROPERTIES`).
+    - `future` (concurrent.futures.Future) The future of the plot.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Error plotting the range of nights of {prop['name']}: {future.exception()!r}")
+
+
+def stream_range_data(doc, prop, nights, aggregate, pipe, status, is_current, telescope):
+    """
+    Adds the data of a range of nights to the aggregates of a multi-night plot one night after another, sending the
+    aggregates to the plot after each night.
+
+    Parameters
+    ----------
+    - `doc` (bokeh.document.Document) The document of the user session, or None to update the plot directly.
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `nights` (list) The days in which each night starts.
+    - `aggregate` (plot_helper.RangeAggregate) The aggregates of the plot.
+    - `pipe` (holoviews.streams.Pipe) The pipe of the plot (See `plot_helper.create_range_pipe`).
+    - `status` (pn.pane.Markdown) The pane showing the progress.
+    - `is_current` (callable) Function returning whether the plot is still displayed. The nights are not added once it is replaced.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+    """
+    def send(data, message):
+        pipe.send(data)
+        status.object = message
+
+    def schedule(callback):
+        if doc is None:
+            callback()
+        else:
+            doc.add_next_tick_callback(callback)
+
+    tic = time.perf_counter()
+    db = telescope.connect()
+
+    if db is None:
+        schedule(partial(setattr, status, 'object', 'Connection to the database failed.'))
+        return
+
+    # The coarsest level of the time pyramid with a bucket per time bin, for the properties with a pyramid
+    level = rollups.LEVELS[0][0]
+
+    if prop in rollups.get_rollup_properties() and telescope is telescopes.default:
+        level = rollups.choose_level(aggregate.seconds_per_bin)
+
+    try:
+        for i, (night, night_data) in enumerate(iter_range_data(db, prop, nights, telescope, level)):
+            if not is_current():
+                break
+
+            if isinstance(night_data, tuple):
+                aggregate.add_buckets(*night_data)
+            else:
+                aggregate.add(night_data, prop['value_name'])
+
+            del night_data
+
+            schedule(partial(send, aggregate.snapshot(), f'{i + 1} of {len(nights)} nights plotted ({night}, {level} level).'))
+    finally:
+        db.client.close()
+
+    toc = time.perf_counter()
+    metrics.STAGE_SECONDS.labels('range', prop['name']).observe(toc - tic)
+    print(f"Range of {len(nights)} nights of {prop['name']} plotted at the {level} level in {toc - tic:0.4f} seconds ({aggregate.rows} values)")
+
+
+def get_property_data(db, prop, date_time, search_previous=False, telescope=None):
+    """
+    Get the data of a property for a night using the shared night data cache. In case the data is not cached, it is
+    retrieved from the database using `database.get_data_by_date` or `database.get_scalar_data_by_date` and stored in
+    the cache. Data of the current night is tracked by the live night feed to keep it up to date. When the database is
+    unavailable only the cached data is returned.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo, or None when the database is unavailable.
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `date_time` (dt.date) The selected night.
+    - `search_previous` (bool) Whether to load the latest night with data before the selected night if it has no data. False by default.
+    - `telescope` (telescopes.Telescope) The telescope. Defaults to the default telescope.
+
+    Returns
+    ----------
+    - `pandas_df` A pandas dataframe with the data of the night. In case no data is found, an empty dataframe.
+    """
+    if telescope is None:
+        telescope = telescopes.default
+
+    collection = db[prop['collection']] if db is not None else None
+    spec = get_spec(prop)
+
+    key = cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], date_time)
+    pandas_df = get_cached_night_data(key, spec)
+
+    # When searching in previous days, an empty cached night is not enough, previous days need to be checked
+    if pandas_df is not None and (not pandas_df.empty or not search_previous):
+        return pandas_df
+
+    night, pandas_df = get_latest_cached_night(collection, prop['name'], date_time, prop['value_field'], search_previous, spec, telescope)
+
+    if pandas_df is not None:
+        return pandas_df
+
+    # Without database the night is empty until it is retrieved, so it is not cached
+    if collection is None:
+        return build_property_dataframe(prop, [], [])
+
+    if telescope.availability.is_empty(prop['name'], night):
+        pandas_df = build_property_dataframe(prop, [], [])
+    elif prop['shape'] == 'scalar':
+        pandas_df = database.get_scalar_data_by_date(collection=collection, property_name=prop['name'], date_time=night, value_field=prop['value_field'],
+                                                     value_name=prop['value_name'], search_previous=False, remove_zero_values=prop.get('remove_zero_values', False))
+    else:
+        pandas_df = database.get_data_by_date(collection=collection, property_name=prop['name'], date_time=night, value_field=prop['value_field'],
+                                              id_var='date', var_name=prop['var_name'], value_name=prop['value_name'], search_previous=False)
+
+    cache_night_data(cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night), pandas_df, spec, share=True)
+
+    return pandas_df
+
+
+def get_spec(prop):
+    """
+    Get the parameters needed by the live night feed to update the data of a property (See `live_feed.LiveNightFeed.track`).
+
+    Parameters
+    ----------
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+
+    Returns
+    ----------
+    - `spec` (dict) The parameters of the property.
+    """
+    if prop['shape'] == 'scalar':
+        return {'collection': prop['collection'], 'scalar': True, 'value_field': prop['value_field'], 'value_name': prop['value_name'],
+                'remove_zero_values': prop.get('remove_zero_values', False)}
+
+    return {'collection': prop['collection'], 'scalar': False, 'value_field': prop['value_field'], 'id_var': 'date',
+            'var_name': prop['var_name'], 'value_name': prop['value_name']}
+
+
+def get_cached_night_data(key, spec):
+    """
+    Get the data of a night from the night data cache of the process or, when serving with several worker processes,
+    from the cache shared by the workers. The data of the current night stored in the shared cache is only used if it
+    was stored during the last poll interval of the live night feed.
+
+    Parameters
+    ----------
+    - `key` (tuple) The night data cache key (See `cache.NightDataCache.make_key`)
+    - `spec` (dict) The parameters needed by the live night feed to update the data (See `live_feed.LiveNightFeed.track`)
+
+    Returns
+    ----------
+    - `pandas_df` (pandas.DataFrame) The cached data of the night, or None if it is not cached.
+    """
+    pandas_df = cache.night_data.get(key)
+
+    if pandas_df is None and shared_cache.store.enabled:
+        is_current_night = key[4] == database.get_current_night()
+        pandas_df = shared_cache.store.load(key, max_age=LIVE_FEED_INTERVAL if is_current_night else None)
+
+        if pandas_df is not None:
+            cache_night_data(key, pandas_df, spec)
+
+    return pandas_df
+
+
+def cache_night_data(key, pandas_df, spec, share=False):
+    """
+    Store the data of a night in the night data cache of the process and, optionally, in the cache shared by the worker processes.
+    Data of the current night is tracked by the live night feed of its telescope to keep it up to date.
+
+    Parameters
+    ----------
+    - `key` (tuple) The night data cache key (See `cache.NightDataCache.make_key`)
+    - `pandas_df` (pandas.DataFrame) The data of the night.
+    - `spec` (dict) The parameters needed by the live night feed to update the data (See `live_feed.LiveNightFeed.track`)
+    - `share` (bool) Whether to store the data in the cache shared by the worker processes.
+    """
+    cache.night_data.put(key, pandas_df)
+
+    if share:
+        shared_cache.store.store(key, pandas_df)
+
+    if key[4] == database.get_current_night():
+        telescopes.get(key[0]).live_feed.track(key, spec)
+
+
+def get_latest_cached_night(collection, property_name, date_time, value_field, search_previous, spec, telescope):
+    """
+    Gets the night to load for a property and its data in case it is already cached. When searching in previous days,
+    the latest night with data is found in the availability index when it covers the selected night (See `availability`),
+    or otherwise with a single query (See `database.get_latest_night`).
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo, or None when the database is unavailable.
+    - `property_name` (str) The name of the property
+    - `date_time` (dt.date) The selected night.
+    - `value_field` (str) The name of the field to retrieve from the collection
+    - `search_previous` (bool) Whether to search for the latest night with data before the selected night.
+    - `spec` (dict) The parameters needed by the live night feed to update the data (See `live_feed.LiveNightFeed.track`)
+    - `telescope` (telescopes.Telescope) The telescope.
+
+    Returns
+    ----------
+    - `night` (dt.date) The night to load.
+    - `pandas_df` (pandas.DataFrame) The cached data of the night, or None if it is not cached.
+    """
+    if not search_previous or telescope.availability.get_count(property_name, date_time) > 0:
+        return date_time, None
+
+    # The availability index knows the latest night with data when the selected night is known to be empty
+    if telescope.availability.is_empty(property_name, date_time):
+        night = telescope.availability.get_latest_night(property_name, date_time)
+    elif collection is not None:
+        night = database.get_latest_night(collection, property_name, date_time)
+    else:
+        night = None
+
+    if night is None or night == date_time:
+        return date_time, None
+
+    print('No data found for ' + property_name + ' in ' + str(date_time) + '. Latest night with data: ' + str(night))
+
+    return night, get_cached_night_data(cache.NightDataCache.make_key(telescope.name, spec['collection'], property_name, value_field, night), spec)
+
+
+def get_live_columns(prop):
+    """
+    Get the columns of the new rows of a property streamed to the plots (See `live_feed.LiveNightFeed`).
+
+    Parameters
+    ----------
+    - `prop` (dict) The property (See `registry.PROPERTIES`).
+
+    Returns
+    ----------
+    - `columns` (list) Tuples with the name and the dtype of each column, the date first.
+    """
+    if prop['shape'] == 'scalar':
+        return [('date', 'datetime64[ns]'), (prop['value_name'], 'float64')]
+
+    return [('date', 'datetime64[ns]'), (prop['var_name'], 'int64'), (prop['value_name'], 'float64')]
+
+
+def push_live_updates(doc, live_streams, updates):
+    """
+    Sends the new data of the current night to the streams of the plots of a session: the max, min and avg envelope and the
+    new rows to the buffers, and the raster of the whole night, including the new data, to the pipes. Called from the live
+    night feed thread, so the data is sent in the next tick of the session document.
+
+    Parameters
+    ----------
+    - `doc` (bokeh.document.Document) The document of the user session.
+    - `live_streams` (dict) The kind, the stream and the column of values of each stream of the session plots by night data cache key.
+    - `updates` (dict) The new data for each night data cache key (See `live_feed.LiveNightFeed`)
+    """
+    for key, update in updates.items():
+        for kind, stream, value_name in live_streams.get(key, ()):
+            if kind == 'envelope' and update['envelope'] is not None:
+                data = update['envelope']
+            elif kind == 'rows':
+                data = update['rows'].reset_index()
+            elif kind == 'raster':
+                # The raster is shared by the sessions, since it is cached for the dataframe of the night
+                night_df = cache.night_data.get(key)
+
+                if night_df is None:
+                    continue
+
+                data = plot_helper.rasterize_scatter(night_df, 'date', value_name)
+            else:
+                continue
+
+            doc.add_next_tick_callback(partial(stream.send, data))
+
+
+def get_enabled_nights(night, telescope):
+    """
+    Get the nights enabled in the date picker: the nights with data in the availability index (See `availability`),
+    the current night and the displayed night.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The night displayed.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+
+    Returns
+    ----------
+    - `nights` (list) The days in which each enabled night starts, or None to enable all of them while the index is not built.
+    """
+    if telescope.availability.covered_until is None:
+        return None
+
+    return sorted(set(telescope.availability.get_nights()) | {night, database.get_current_night(), dt.date.today()})
+
+
+def get_coverage_message(night, telescope):
+    """
+    Get the message with the coverage of a night shown below the date picker: the properties with data and their number of documents.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The day in which the night starts.
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+
+    Returns
+    ----------
+    - `message` (str) The message in Markdown.
+    """
+    if telescope.availability.covered_until is None:
+        return ''
+
+    coverage = telescope.availability.get_coverage(night)
+    message = f"**Coverage:** {len(coverage)} of {len(registry.PROPERTIES)} properties with data ({sum(coverage.values()):,} documents)."
+    missing = [prop['name'] for prop in registry.PROPERTIES if prop['name'] not in coverage]
+
+    if coverage and missing:
+        message += ' No data of ' + ', '.join(missing) + '.'
+
+    return message
+
+
+def get_telescope_links(telescope):
+    """
+    Get the pane shown in the sidebar with the telescope displayed and the links to the dashboards of the other
+    telescopes served by the application (See `telescopes`).
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope displayed.
+
+    Returns
+    ----------
+    - `telescope_info` (pn.pane.Markdown) The pane, hidden when a single telescope is served.
+    """
+    others = [other.name for other in telescopes.get_all() if other is not telescope]
+    message = f"**Telescope:** {telescope.name}"
+
+    if others:
+        message += '. Other telescopes: ' + ', '.join(f'[{name}](?telescope={name})' for name in others)
+
+    return pn.pane.Markdown(message, visible=bool(others))
+
+
+def update_loading_message(template:pn.template.MaterialTemplate, message:str):
+    """
+    Updates and shows a loading message in the dashboard while deploying it for the first time.
+
+    Parameters
+    ----------
+    - `template` (pn.template.MaterialTemplate) The template object from panel.
+    - `message` (str) The message to display in the loading screen.
+    """
+    template.main[0][0][2].object = message
+    
+
+def get_stale_message(night, night_data, missing_properties):
+    """
+    Get the message shown while the data displayed is stale because the database is unavailable.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The night displayed.
+    - `night_data` (dict) The dataframe of each property by property name.
+    - `missing_properties` (list) The names of the properties neither cached nor retrieved, displayed empty.
+
+    Returns
+    ----------
+    - `message` (str) The message in Markdown.
+    """
+    message = '**Database unavailable.** Showing the cached data'
+
+    # The data of the current night is as old as its latest document
+    latest_dates = [pandas_df.index.max() for pandas_df in night_data.values() if not pandas_df.empty]
+
+    if night == database.get_current_night() and latest_dates:
+        latest = max(latest_dates)
+        message += f' up to {latest:%H:%M} ({(dt.datetime.now() - latest).total_seconds() / 60:0.0f} minutes old)'
+
+    if missing_properties:
+        message += f'. {len(missing_properties)} of {len(registry.PROPERTIES)} properties are not cached and are shown empty'
+
+    return message + '. Retrying in the background...'
+
+
+_range_prefetch = ThreadPoolExecutor(max_workers=max(ASYNC_DB_THREADS, 1), thread_name_prefix='clusco-range')
+"""
+Pool of threads retrieving the next night of the multi-night plots (See `iter_range_data`). It is not the pool shared
+by the sessions, where the plots wait for the nights, so the nights never wait behind the plots waiting for them
+"""
+
+_revalidating = {}
+"""
+Sessions displaying stale data whose dashboard is refreshed once the database is available again, by telescope name.
+Each session is stored by the id of its template with its template, night and document. A single loop per telescope
+retries the connection for all of them (See `revalidate_telescope`)
+"""
+
+_revalidating_lock = threading.Lock()
+
+
+def start_revalidation(template, night, doc=None, telescope=None):
+    """
+    Adds a session displaying stale data to the sessions refreshed in the background when the database of its telescope is
+    available again, starting the loop retrying the connection of the telescope if it is not running yet.
+
+    Parameters
+    ----------
+    - `template` (pn.template.MaterialTemplate) The template of the session.
+    - `night` (dt.date) The night displayed.
+    - `doc` (bokeh.document.Document) The document of the user session. Defaults to None.
+    - `telescope` (telescopes.Telescope) The telescope displayed. Defaults to the default telescope.
+    """
+    if telescope is None:
+        telescope = telescopes.default
+
+    with _revalidating_lock:
+        running = telescope.name in _revalidating
+        _revalidating.setdefault(telescope.name, {})[id(template)] = (template, night, doc)
+
+    if not running:
+        t = threading.Thread(target=revalidate_telescope, args=(telescope, ))
+        t.daemon = True
+        t.start()
+
+
+def revalidate_telescope(telescope):
+    """
+    Retries the connection to the database of a telescope with backoff (See `database.connect_with_retry`) and, once it
+    is available or every attempt failed, updates the dashboards of all the sessions waiting for it (See `revalidate_dashboard`).
+    The sessions added while the connection is retried are updated too.
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope.
+    """
+    try:
+        db = telescope.connect_with_retry()
+    finally:
+        # The sessions are taken at once with the end of the loop, so a session added later starts a new loop
+        with _revalidating_lock:
+            sessions = _revalidating.pop(telescope.name, {})
+
+    if db is not None:
+        db.client.close()
+
+    for template, night, doc in sessions.values():
+        revalidate_dashboard(template, night, db is not None, doc, telescope)
+
+
+def revalidate_dashboard(template, night, available, doc=None, telescope=None):
+    """
+    Updates the dashboard of a session displaying stale data once the database is available again, in case it still
+    displays the same night, or tells the user that it is still unavailable.
+
+    Parameters
+    ----------
+    - `template` (pn.template.MaterialTemplate) The template of the session.
+    - `night` (dt.date) The night displayed.
+    - `available` (bool) Whether the database is available again.
+    - `doc` (bokeh.document.Document) The document of the user session. Defaults to None.
+    - `telescope` (telescopes.Telescope) The telescope displayed. Defaults to the default telescope.
+    """
+    if telescope is None:
+        telescope = telescopes.default
+
+    # The widgets of the session are read and changed in the event loop, holding the document lock
+    def apply():
+        sidebar_col = template.sidebar[0][0]
+
+        if not available:
+            sidebar_col.select(pn.pane.Alert)[0].object = '**Database unavailable.** Showing the cached data. Select a night to retry.'
+            return
+
+        if sidebar_col.select(pn.widgets.DatePicker)[0].value != night:
+            return
+
+        print(f"Database of {telescope.name} available again, refreshing the dashboard of night {night}")
+        schedule_dashboard(template, night, True, doc, telescope)
+
+    if doc is None or doc.session_context is None:
+        apply()
+    else:
+        doc.add_next_tick_callback(apply)
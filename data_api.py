@@ -0,0 +1,325 @@
+"""
+Binary data API for external analysis tools. The data of any property of the registry is served for a night or a
+range of nights, optionally for a subset of its channels or modules, in the /api/data/<property> address, so the
+analysts do not need to scrape the dashboard or query the database directly. The data is read from the same night
+data caches used by the dashboard, and the nights not cached are retrieved with the same queries and decoders
+(See `database`). The response is encoded and sent in chunks of rows, one night after another, so only one night is
+held in memory however long the range is.
+
+Query arguments:
+
+- `night` (YYYY-MM-DD) The night to retrieve, or `start` and `end` (YYYY-MM-DD) for a range of nights (both included).
+- `channels` (str) The channels or modules to retrieve, numbered from 1 as in the dashboard (e.g. 1,5,10-20). All by default.
+- `format` (str) `arrow` (default) for an Arrow IPC stream, which needs pyarrow, or `npy` for a gzip compressed stream of NPY arrays.
+- `telescope` (str) The telescope whose data is retrieved (See `telescopes`). The default telescope by default.
+
+The rows have the date, the channel or module (array properties only) and the value. The NPY stream has a structured
+array per chunk, which can be read calling `numpy.load` on the decompressed stream until it is consumed. The responses
+of nights that have finished never change, so they are sent with an ETag and cached by the clients as immutable.
+
+Examples:
+
+    curl -o temperature.arrows 'localhost:5006/api/data/scb_pixel_temperature?start=2023-06-01&end=2023-06-07&channels=1-7'
+    curl -o busy.npy.gz 'localhost:5006/api/data/TIB_Rates_BUSYRate?night=2023-06-01&format=npy'
+    curl -o hv.npy.gz 'localhost:5006/api/data/scb_pixel_hv_monitored?night=2023-06-01&format=npy&telescope=LST2'
+"""
+
+import datetime as dt
+import hashlib
+import io
+import time
+import zlib
+
+import numpy as np
+from tornado.iostream import StreamClosedError
+from tornado.web import HTTPError, RequestHandler
+
+import async_database
+import camera
+import database
+import metrics
+import registry
+import telescopes
+from config import DATA_API_MAX_NIGHTS, DATA_API_CHUNK_ROWS
+
+FORMATS = {'arrow': ('application/vnd.apache.arrow.stream', 'arrows'), 'npy': ('application/gzip', 'npy.gz')}
+"""
+Content type and file extension of each format
+"""
+
+FORMAT_VERSION = 1
+"""
+Version of the layout of the responses, part of the ETags so the clients do not reuse responses of a previous layout
+"""
+
+
+def parse_nights(night=None, start=None, end=None):
+    """
+    Get the nights requested with the query arguments.
+
+    Parameters
+    ----------
+    - `night` (str) The night to retrieve (YYYY-MM-DD).
+    - `start` (str) The first night of the range to retrieve (YYYY-MM-DD), when no night is given.
+    - `end` (str) The last night of the range to retrieve (YYYY-MM-DD). The first night by default.
+
+    Returns
+    ----------
+    - `nights` (list) The days in which each night starts.
+    """
+    try:
+        if night is not None:
+            return [dt.date.fromisoformat(night)]
+
+        if start is None:
+            raise HTTPError(400, reason='The night or the start of the range is needed')
+
+        first = dt.date.fromisoformat(start)
+        last = dt.date.fromisoformat(end) if end is not None else first
+    except ValueError:
+        raise HTTPError(400, reason='The nights must have the YYYY-MM-DD format')
+
+    if last < first:
+        raise HTTPError(400, reason='The end of the range is before its start')
+
+    if (last - first).days + 1 > DATA_API_MAX_NIGHTS:
+        raise HTTPError(400, reason=f'At most {DATA_API_MAX_NIGHTS} nights can be requested at once')
+
+    return [first + dt.timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def parse_channels(channels):
+    """
+    Get the channels or modules requested with the query arguments.
+
+    Parameters
+    ----------
+    - `channels` (str) Comma separated channels and ranges of channels (e.g. 1,5,10-20), from 1 to the number of pixels of the camera.
+
+    Returns
+    ----------
+    - `channels` (numpy.ndarray) The sorted channels, or None if all of them are requested.
+    """
+    if not channels:
+        return None
+
+    # The ranges are marked in a mask of the size of the camera, so a wide range does not build a huge set
+    selected = np.zeros(camera.N_PIXELS + 1, dtype=bool)
+
+    try:
+        for part in channels.split(','):
+            first, _, last = part.partition('-')
+            first, last = int(first), int(last or first)
+
+            if not 1 <= first <= last <= camera.N_PIXELS:
+                raise HTTPError(400, reason=f'The channels must be between 1 and {camera.N_PIXELS}, with the ranges in increasing order (e.g. 1,5,10-20)')
+
+            selected[first:last + 1] = True
+    except ValueError:
+        raise HTTPError(400, reason='The channels must be numbers or ranges of numbers separated by commas (e.g. 1,5,10-20)')
+
+    return np.flatnonzero(selected).astype('uint16')
+
+
+def get_columns(prop):
+    """
+    Get the columns of the rows served for a property.
+
+    Parameters
+    ----------
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+
+    Returns
+    ----------
+    - `columns` (list) Tuples with the name and the NumPy dtype of each column.
+    """
+    if prop['shape'] == 'scalar':
+        return [('date', 'datetime64[ns]'), (prop['value_name'], 'float64')]
+
+    return [('date', 'datetime64[ns]'), (prop['var_name'], 'uint16'), (prop['value_name'], 'float64')]
+
+
+def iter_chunks(pandas_df, prop, channels=None):
+    """
+    Yields the rows of the data of a night in chunks of `DATA_API_CHUNK_ROWS` rows.
+
+    Parameters
+    ----------
+    - `pandas_df` (pandas.DataFrame) The data of the night.
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `channels` (numpy.ndarray) The channels or modules to keep. All of them when None.
+
+    Returns
+    ----------
+    - `chunks` (generator) Dicts with the array of each column (See `get_columns`).
+    """
+    if pandas_df.empty:
+        return
+
+    columns = get_columns(prop)
+    arrays = {'date': pandas_df.index.values}
+
+    for name, _ in columns[1:]:
+        arrays[name] = pandas_df[name].values
+
+    if channels is not None and prop['shape'] != 'scalar':
+        mask = np.isin(arrays[prop['var_name']], channels)
+        arrays = {name: values[mask] for name, values in arrays.items()}
+
+    for start in range(0, len(arrays['date']), DATA_API_CHUNK_ROWS):
+        yield {name: np.asarray(arrays[name][start:start + DATA_API_CHUNK_ROWS], dtype=dtype) for name, dtype in columns}
+
+
+class ArrowEncoder:
+    """
+    Encoder of the chunks as the record batches of an Arrow IPC stream.
+    """
+
+    def __init__(self, prop):
+        # pyarrow is only needed to serve the Arrow format
+        import pyarrow as pa
+
+        self._pa = pa
+        self._sink = io.BytesIO()
+        self._schema = pa.schema([(name, pa.from_numpy_dtype(np.dtype(dtype))) for name, dtype in get_columns(prop)])
+        self._writer = pa.ipc.new_stream(self._sink, self._schema)
+
+    def _pop(self):
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+
+        return data
+
+    def encode(self, chunk):
+        batch = self._pa.RecordBatch.from_arrays([self._pa.array(values) for values in chunk.values()], schema=self._schema)
+        self._writer.write_batch(batch)
+
+        return self._pop()
+
+    def close(self):
+        self._writer.close()
+
+        return self._pop()
+
+
+class NpyEncoder:
+    """
+    Encoder of the chunks as the structured arrays of a gzip compressed stream of NPY arrays.
+    """
+
+    def __init__(self, prop):
+        self._dtype = np.dtype(get_columns(prop))
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._empty = True
+
+    def _encode_array(self, array):
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, array, allow_pickle=False)
+        self._empty = False
+
+        return self._compressor.compress(buffer.getvalue())
+
+    def encode(self, chunk):
+        array = np.empty(len(chunk['date']), dtype=self._dtype)
+
+        for name, values in chunk.items():
+            array[name] = values
+
+        return self._encode_array(array)
+
+    def close(self):
+        # An empty array is sent when there is no data, so the clients can always read one array
+        data = self._encode_array(np.empty(0, dtype=self._dtype)) if self._empty else b''
+
+        return data + self._compressor.flush()
+
+
+ENCODERS = {'arrow': ArrowEncoder, 'npy': NpyEncoder}
+"""
+Encoder of each format
+"""
+
+
+class DataHandler(RequestHandler):
+    """
+    Tornado handler serving the data of a property in a binary format. It is added to the server with the `extra_patterns` option of `pn.serve`.
+    """
+
+    async def get(self, property_name):
+        tic = time.perf_counter()
+
+        try:
+            prop = registry.get_property(property_name)
+        except KeyError:
+            raise HTTPError(404, reason=f'Unknown property: {property_name}')
+
+        nights = parse_nights(self.get_argument('night', None), self.get_argument('start', None), self.get_argument('end', None))
+        channels = parse_channels(self.get_argument('channels', None))
+        data_format = self.get_argument('format', 'arrow')
+        telescope_name = self.get_argument('telescope', telescopes.default.name).upper()
+
+        if telescope_name not in telescopes.telescopes:
+            raise HTTPError(404, reason=f'Unknown telescope: {telescope_name}')
+
+        telescope = telescopes.get(telescope_name)
+
+        if data_format not in FORMATS:
+            raise HTTPError(400, reason=f"Unknown format: {data_format}. Available formats: {', '.join(FORMATS)}")
+
+        try:
+            encoder = ENCODERS[data_format](prop)
+        except ImportError:
+            raise HTTPError(501, reason='pyarrow is needed to serve the Arrow format, use format=npy')
+
+        content_type, extension = FORMATS[data_format]
+        self.set_header('Content-Type', content_type)
+        self.set_header('Content-Disposition', f'attachment; filename="{telescope.name}_{property_name}_{nights[0]}_{nights[-1]}.{extension}"')
+
+        # The data of the nights that have finished does not change
+        if nights[-1] < database.get_current_night():
+            channels_key = ','.join(str(channel) for channel in channels) if channels is not None else 'all'
+            key = f'{FORMAT_VERSION}|{telescope.name}|{property_name}|{nights[0]}|{nights[-1]}|{channels_key}|{data_format}|{DATA_API_CHUNK_ROWS}'
+            self.set_header('Etag', '"' + hashlib.sha1(key.encode()).hexdigest() + '"')
+            self.set_header('Cache-Control', 'public, max-age=31536000, immutable')
+
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+        else:
+            self.set_header('Cache-Control', 'no-cache')
+
+        # The dashboard modules are imported in the background when the server starts (See `app.import_plotting_modules`)
+        import dashboard_utils
+
+        # The blocking calls run in the pool of threads shared by the sessions, which bounds the threads used by the requests
+        db = await async_database.run_blocking(telescope.connect)
+
+        if db is None:
+            raise HTTPError(503, reason='Connection to the database failed')
+
+        sent = 0
+
+        try:
+            for night in nights:
+                pandas_df = await async_database.run_blocking(dashboard_utils.get_night_property_data, db, prop, night, telescope)
+
+                for chunk in iter_chunks(pandas_df, prop, channels):
+                    data = encoder.encode(chunk)
+                    self.write(data)
+                    sent += len(data)
+                    await self.flush()
+
+                del pandas_df
+
+            data = encoder.close()
+            self.write(data)
+            sent += len(data)
+        except StreamClosedError:
+            print(f"Data API request of {property_name} of {telescope.name} cancelled by the client")
+        finally:
+            db.client.close()
+            metrics.DATA_API_BYTES.labels(data_format).inc(sent)
+
+        metrics.STAGE_SECONDS.labels('data_api', property_name).observe(time.perf_counter() - tic)
+        print(f"Data API: {property_name} of {telescope.name} from {nights[0]} to {nights[-1]} sent as {data_format} ({sent / 2**20:0.1f} MB) in {time.perf_counter() - tic:0.2f} seconds")
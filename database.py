@@ -5,34 +5,237 @@ Database management module
 from pymongo import MongoClient
 import pandas as pd
 import datetime as dt
+import random
+import threading
+import time
 
-def connect(host, port, db_name):
+import metrics
+import profiling
+from config import DB_TIMEOUT_MS, DB_BREAKER_FAILURES, DB_BREAKER_RESET, DB_RETRY_ATTEMPTS, DB_RETRY_BACKOFF, QUERY_EXPLAIN_RATE
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of the connections to the database. After `failures` consecutive failed connections the circuit
+    opens and the connections fail immediately, instead of blocking every session for the server selection timeout.
+    Once `reset_sec` seconds have passed, a single connection is let through (half open): the circuit closes if it
+    succeeds and opens again if it fails.
+    """
+
+    def __init__(self, failures=3, reset_sec=30):
+        self.failures = failures
+        self.reset_sec = reset_sec
+        self.state = 'closed'
+        self.total_failures = 0
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a connection can be attempted.
+
+        Returns
+        ----------
+        - `allowed` (bool) True when the circuit is closed, or when it is the probe connection of an open circuit.
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return True
+
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_sec:
+                self.state = 'half_open'
+                return True
+
+            return False
+
+    def record_success(self):
+        """
+        Records a successful connection, closing the circuit.
+        """
+        with self._lock:
+            if self.state != 'closed':
+                print("Database circuit breaker closed")
+
+            self.state = 'closed'
+            self._consecutive_failures = 0
+
+    def record_failure(self):
+        """
+        Records a failed connection or query, opening the circuit after too many consecutive failures or a failed probe.
+        """
+        with self._lock:
+            self.total_failures += 1
+            self._consecutive_failures += 1
+
+            if self.state == 'half_open' or (self.state == 'closed' and self._consecutive_failures >= self.failures):
+                print(f"Database circuit breaker open for {self.reset_sec} seconds")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(DB_BREAKER_FAILURES, DB_BREAKER_RESET)
+"""
+Process-wide circuit breaker of the connections to the database
+"""
+
+
+@metrics.timed('connect')
+def connect(host, port, db_name, circuit_breaker=None):
     """
-    Connect to a MongoDB database and return a client object from pymongo.
+    Connect to a MongoDB database and return a client object from pymongo. While the circuit breaker is open the
+    connection is not attempted (See `CircuitBreaker`).
     
     Parameters
     ----------
     - `host`: (str) The host parameter can be a full mongodb URI in addition to a simple hostname or IP.
     - `port` (str) Database port
     - `db_name` (str) The database name
+    - `circuit_breaker` (CircuitBreaker) The circuit breaker of the database. The process-wide `breaker` by default.
 
     Returns
     ----------
     - `client`: A client-side representation of a MongoDB cluster from pymongo. See more at <https://pymongo.readthedocs.io/en/3.12.0/api/pymongo/mongo_client.html>
+    None if the connection failed or was not attempted.
     """
+    if circuit_breaker is None:
+        circuit_breaker = breaker
+
+    if not circuit_breaker.allow():
+        print(f"Connection to database ({host}:{port}) skipped: the circuit breaker is open.")
+        return None
+
     try:
         client = MongoClient(host=host, port=int(port),
-                             serverSelectionTimeoutMS=5000)
+                             serverSelectionTimeoutMS=DB_TIMEOUT_MS)
         client.server_info()
     except:
+        circuit_breaker.record_failure()
         print(
             f"Connection to database ({host}:{port}) failed.\nCheck if the database is running.")
         return None
 
+    circuit_breaker.record_success()
     print("Database connection successful.")
     return client[db_name]
 
 
+def connect_with_retry(host, port, db_name, attempts=DB_RETRY_ATTEMPTS, backoff=DB_RETRY_BACKOFF, circuit_breaker=None):
+    """
+    Connect to a MongoDB database retrying the failed connections with exponential backoff and jitter. Used by the
+    background tasks, since it may take minutes.
+
+    Parameters
+    ----------
+    - `host`: (str) The host parameter can be a full mongodb URI in addition to a simple hostname or IP.
+    - `port` (str) Database port
+    - `db_name` (str) The database name
+    - `attempts` (int) The maximum number of connections attempted.
+    - `backoff` (float) The seconds waited after the first failed connection, doubled after each failure.
+    - `circuit_breaker` (CircuitBreaker) The circuit breaker of the database. The process-wide `breaker` by default.
+
+    Returns
+    ----------
+    - `client`: The database object from pymongo (See `connect`), or None if every attempt failed.
+    """
+    for attempt in range(attempts):
+        db = connect(host, port, db_name, circuit_breaker)
+
+        if db is not None or attempt == attempts - 1:
+            return db
+
+        time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    return None
+
+
+def get_night_range(date):
+    """
+    Get the datetime range covered by a night. A night goes from 12:00 pm on the given day until 12:00 pm the following day (inclusive).
+
+    Parameters
+    ----------
+    - `date` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `night_range` (tuple) A tuple with the start and end datetimes of the night.
+    """
+    return (dt.datetime(date.year, date.month, date.day, 12),
+            dt.datetime(date.year, date.month, date.day) + dt.timedelta(days=1, hours=12))
+
+
+def get_night_query(property_name, date):
+    """
+    Build the query used to retrieve the documents of a property for a given night.
+
+    Parameters
+    ----------
+    - `property_name` (str) The name of the property to search in the collection
+    - `date` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `query` (dict) The MongoDB query filtering by property name and by the night datetime range.
+    """
+    night_start, night_end = get_night_range(date)
+    return {'name': property_name, 'date': {'$gte': night_start, '$lte': night_end}}
+
+
+def get_night_of(date_time):
+    """
+    Get the night to which a datetime belongs. Datetimes before 12:00 pm belong to the night that started the previous day.
+
+    Parameters
+    ----------
+    - `date_time` (dt.datetime) The datetime to check.
+
+    Returns
+    ----------
+    - `night` (dt.date) The day in which the night started.
+    """
+    return (date_time - dt.timedelta(hours=12)).date()
+
+
+def get_current_night():
+    """
+    Get the night that is currently taking place. Before 12:00 pm we are still in the night that started the previous day.
+
+    Returns
+    ----------
+    - `night` (dt.date) The day in which the current night started.
+    """
+    return get_night_of(dt.datetime.now())
+
+
+def get_latest_night(collection, property_name, date_time, max_days=120):
+    """
+    Get the latest night with data of a property, from the night of the specified date until a number of days before.
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `property_name` (str) The name of the property to search in the collection
+    - `date_time` (dt.date) The day in which the latest night to check starts.
+    - `max_days` (int) The number of days before the specified date to search. 120 by default.
+
+    Returns
+    ----------
+    - `night` (dt.date) The day in which the latest night with data starts, or None if there is no data.
+    """
+    night_start, night_end = get_night_range(date_time)
+    query = {'name': property_name, 'date': {'$gte': night_start - dt.timedelta(days=max_days), '$lte': night_end}}
+
+    with metrics.timer('latest_night', property_name):
+        documents = list(collection.find(query, {"date": 1, "_id": 0}).sort('date', -1).limit(1))
+
+    if len(documents) == 0:
+        return None
+
+    return get_night_of(documents[0]['date'])
+
+
+@profiling.profiled('fetch')
 def get_data_by_date(collection, property_name, date_time, value_field, id_var, var_name, value_name, search_previous=True):
     """
     Get array data from Mongodb collection filtering by date. If the search_previous flag is set to True, the function will search
@@ -59,36 +262,220 @@ def get_data_by_date(collection, property_name, date_time, value_field, id_var,
     date = date_time
 
     if search_previous:
-        
-        for i in range(0, 120):
-            # Query date range from the selected day in date_time parameter from 12:00 pm until the next day at 12:00 pm (inclusive)
-            query = {'name': property_name, 'date': {'$gte': dt.datetime(
-                date.year, date.month, date.day, 12), '$lte': dt.datetime(date.year, date.month, date.day) + dt.timedelta(days=1, hours=12)}}
-            
-            print('\nRetrieving ' + property_name +
-                  ' data from date: ' + str(date))
-
-            for document in collection.find(query, {"date": 1, value_field: 1, "_id": 0}):
-                data_values.append(document[value_field])
-                datetime_values.append(document['date'])
-
-            if len(data_values) > 0: # If data is found, break the loop
-                break
-
-            else: # Otherwise, search for data in the previous day
-                date = date_time - dt.timedelta(days=i+1)
-                print('No data found. Retrieving data from previous day...')
-    else:
-        query = {'name': property_name, 'date': {'$gte': dt.datetime(
-                date.year, date.month, date.day, 12), '$lte': dt.datetime(date.year, date.month, date.day) + dt.timedelta(days=1, hours=12)}}
-
-        print('Retrieving ' + property_name +
-              ' data from date: ' + str(date))
+        # Search the latest night with data, from the specified date until 120 days before, with a single query
+        date = get_latest_night(collection, property_name, date_time)
+
+        if date is None:
+            print('No data found for ' + property_name + ' in the previous 120 days.')
+            date = date_time
+
+        elif date != date_time:
+            print('No data found for ' + property_name + ' in ' + str(date_time) + '. Latest night with data: ' + str(date))
+
+    query = get_night_query(property_name, date)
+
+    print('Retrieving ' + property_name +
+          ' data from date: ' + str(date))
+
+    with metrics.timer('query', property_name):
+        for document in collection.find(query, {"date": 1, value_field: 1, "_id": 0}):
+            data_values.append(document[value_field])
+            datetime_values.append(document['date'])
+
+    return build_array_dataframe(data_values, datetime_values, id_var, var_name, value_name)
+
+
+@profiling.profiled('fetch')
+def get_scalar_data_by_date(collection, property_name, date_time, value_field, value_name, search_previous=True, remove_zero_values=False):
+    """
+    Get scalar data from a Mongodb collection filtering by date. If the search_previous flag is set to True, the function will search
+    for data in the previous days (until 120 days) if no data is found for the specified date.
+    
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo. See more at <http://pymongo.readthedocs.io/en/3.12.0/api/pymongo/collection.html?highlight=collection#pymongo.collection.Collection>
+    - `property_name` (str) The name of the property to search in the collection
+    - `date_time` (dt.date) The date to search in the collection. It will search for data from 12:00pm on the selected day until 12:00 the following day.
+    - `value_field` (str) The name of the field to retrieve from the collection
+    - `value_name` (str) The name of the value
+    - `search_previous` (bool) Flag to search for data in the previous days if no data is found for the specified date. True by default.
+    - `remove_zero_values` (bool) Boolean flag to remove zero values from the dataframe. False by default.
+
+    Returns
+    ----------
+    - `pandas_df` A pandas dataframe with the data retrieved from the collection. In case no data is found, the function will return and empty dataframe.
+
+    """
+    data_values = []
+    datetime_values = []
+
+    date = date_time
+
+    if search_previous:
+        # Search the latest night with data, from the specified date until 120 days before, with a single query
+        date = get_latest_night(collection, property_name, date_time)
+
+        if date is None:
+            print('No data found for ' + property_name + ' in the previous 120 days.')
+            date = date_time
+
+        elif date != date_time:
+            print('No data found for ' + property_name + ' in ' + str(date_time) + '. Latest night with data: ' + str(date))
+
+    query = get_night_query(property_name, date)
+
+    print('Retrieving ' + property_name +
+          ' data from date: ' + str(date))
+
+    with metrics.timer('query', property_name):
+        for document in collection.find(query, {"date": 1, value_field: 1, "_id": 0}):
+            data_values.append(document[value_field])
+            datetime_values.append(document['date'])
+
+    return build_scalar_dataframe(data_values, datetime_values, value_name, remove_zero_values)
+
+
+@profiling.profiled('fetch')
+def get_night_documents(collection, property_names, date_time, value_fields, telescope_name):
+    """
+    Get the values and dates of the documents of several properties of a collection for a given night with a single query,
+    instead of querying the night once for each property.
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `property_names` (list) The names of the properties to search in the collection
+    - `date_time` (dt.date) The day in which the night starts.
+    - `value_fields` (list) The name of the field to retrieve for each property
+    - `telescope_name` (str) The name of the telescope of the database, whose query plans are sampled (See `schedule_query_plan`).
+
+    Returns
+    ----------
+    - `documents` (dict) A tuple with the values and the dates retrieved for each property, by property name. Properties without data have empty lists.
+    """
+    documents = {property_name: ([], []) for property_name in property_names}
+    fields = dict(zip(property_names, value_fields))
+    query, projection = get_batch_query(property_names, date_time, value_fields)
+
+    print('Retrieving ' + ', '.join(property_names) + ' data from date: ' + str(date_time))
+
+    with metrics.timer('batch_query', collection.name):
+        for document in collection.find(query, projection):
+            data_values, datetime_values = documents[document['name']]
+            data_values.append(document[fields[document['name']]])
+            datetime_values.append(document['date'])
+
+    schedule_query_plan(collection, query, projection, telescope_name)
+
+    return documents
+
+
+def get_batch_query(property_names, date_time, value_fields):
+    """
+    Get the query and the projection retrieving the documents of several properties of a collection for a given night (See `get_night_documents`).
 
+    Parameters
+    ----------
+    - `property_names` (list) The names of the properties to search in the collection
+    - `date_time` (dt.date) The day in which the night starts.
+    - `value_fields` (list) The name of the field to retrieve for each property
+
+    Returns
+    ----------
+    - `query` (dict) The query.
+    - `projection` (dict) The projection.
+    """
+    night_start, night_end = get_night_range(date_time)
+    query = {'name': {'$in': list(property_names)}, 'date': {'$gte': night_start, '$lte': night_end}}
+    projection = {"name": 1, "date": 1, "_id": 0, **{value_field: 1 for value_field in set(value_fields)}}
+
+    return query, projection
+
+
+def iter_night_documents(collection, property_name, date_time, value_field, batch_size):
+    """
+    Iterate over the values and dates of the documents of a property for a given night in batches, sorted by date,
+    so the documents of the night are never held in memory at once.
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `property_name` (str) The name of the property to search in the collection
+    - `date_time` (dt.date) The day in which the night starts.
+    - `value_field` (str) The name of the field to retrieve from the collection
+    - `batch_size` (int) The number of documents of each batch.
+
+    Returns
+    ----------
+    - `batches` (generator) Tuples with the values and the dates of the documents of each batch.
+    """
+    query, projection = get_batch_query([property_name], date_time, [value_field])
+    data_values = []
+    datetime_values = []
+
+    print(f'Streaming {property_name} data from date: {date_time}')
+
+    for document in collection.find(query, projection, batch_size=batch_size).sort('date', 1):
+        data_values.append(document[value_field])
+        datetime_values.append(document['date'])
+
+        if len(data_values) == batch_size:
+            yield data_values, datetime_values
+            data_values = []
+            datetime_values = []
+
+    if data_values:
+        yield data_values, datetime_values
+
+
+def get_documents_since(collection, property_name, since, until, value_field):
+    """
+    Get the values and dates of the documents of a property newer than a given datetime. Used to retrieve only
+    the new data of the current night instead of querying the whole night again.
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `property_name` (str) The name of the property to search in the collection
+    - `since` (dt.datetime) Only documents with a date greater than this datetime are retrieved (exclusive).
+    - `until` (dt.datetime) Only documents with a date lower or equal than this datetime are retrieved (inclusive).
+    - `value_field` (str) The name of the field to retrieve from the collection
+
+    Returns
+    ----------
+    - `data_values` (list) The values retrieved from the collection.
+    - `datetime_values` (list) The dates of the retrieved values.
+    """
+    data_values = []
+    datetime_values = []
+
+    query = {'name': property_name, 'date': {'$gt': since, '$lte': until}}
+
+    with metrics.timer('live_query', property_name):
         for document in collection.find(query, {"date": 1, value_field: 1, "_id": 0}):
             data_values.append(document[value_field])
             datetime_values.append(document['date'])
 
+    return data_values, datetime_values
+
+
+@metrics.timed('build_dataframe')
+def build_array_dataframe(data_values, datetime_values, id_var, var_name, value_name):
+    """
+    Build a long format pandas dataframe from array values retrieved from the database.
+
+    Parameters
+    ----------
+    - `data_values` (list) The array values retrieved from the collection, one array per document.
+    - `datetime_values` (list) The dates of the retrieved values.
+    - `id_var` (str) The name of the id variable
+    - `var_name` (str) The name of the variable (channel, module)
+    - `value_name` (str) The name of the value
+
+    Returns
+    ----------
+    - `pandas_df` A pandas dataframe indexed by date with a row for each variable (channel, module) and date. In case there are no values, the function will return and empty dataframe.
+    """
     if (len(data_values) > 0):
 
         # Pandas dataframe
@@ -123,66 +510,22 @@ def get_data_by_date(collection, property_name, date_time, value_field, id_var,
     return pandas_df
 
 
-def get_scalar_data_by_date(collection, property_name, date_time, value_field, value_name, search_previous=True, remove_zero_values=False):
+@metrics.timed('build_dataframe')
+def build_scalar_dataframe(data_values, datetime_values, value_name, remove_zero_values=False):
     """
-    Get scalar data from a Mongodb collection filtering by date. If the search_previous flag is set to True, the function will search
-    for data in the previous days (until 120 days) if no data is found for the specified date.
-    
+    Build a pandas dataframe from scalar values retrieved from the database.
+
     Parameters
     ----------
-    - `collection` (pymongo.collection.Collection) The collection object from pymongo. See more at <http://pymongo.readthedocs.io/en/3.12.0/api/pymongo/collection.html?highlight=collection#pymongo.collection.Collection>
-    - `property_name` (str) The name of the property to search in the collection
-    - `date_time` (dt.date) The date to search in the collection. It will search for data from 12:00pm on the selected day until 12:00 the following day.
-    - `value_field` (str) The name of the field to retrieve from the collection
+    - `data_values` (list) The scalar values retrieved from the collection.
+    - `datetime_values` (list) The dates of the retrieved values.
     - `value_name` (str) The name of the value
-    - `search_previous` (bool) Flag to search for data in the previous days if no data is found for the specified date. True by default.
     - `remove_zero_values` (bool) Boolean flag to remove zero values from the dataframe. False by default.
 
     Returns
     ----------
-    - `pandas_df` A pandas dataframe with the data retrieved from the collection. In case no data is found, the function will return and empty dataframe.
-
+    - `pandas_df` A pandas dataframe indexed by date. In case there are no values, the function will return and empty dataframe.
     """
-    data_values = []
-    datetime_values = []
-
-    date = date_time
-
-    if search_previous:
-
-        for i in range(0, 120):
-            # Query date range from the selected day in date_time parameter from 12:00 pm until the next day at 12:00 pm (inclusive)
-            query = {'name': property_name, 'date': {'$gte': dt.datetime(
-                date.year, date.month, date.day, 12), '$lte': dt.datetime(date.year, date.month, date.day) + dt.timedelta(days=1, hours=12)}}
-            
-
-
-            #query = {'name': property_name, 'date': {'$gte': dt.datetime(
-            #    date.year, date.month, date.day), '$lt': dt.datetime(date.year, date.month, date.day) + dt.timedelta(days=1)}}
-            print('\nRetrieving ' + property_name +
-                  ' data from date: ' + str(date))
-
-            for document in collection.find(query, {"date": 1, value_field: 1, "_id": 0}):
-                data_values.append(document[value_field])
-                datetime_values.append(document['date'])
-
-            if len(data_values) > 0:
-                break
-
-            else:
-                date = date_time - dt.timedelta(days=i+1)
-                print('No data found. Retrieving data from previous day...')
-    else:
-        query = {'name': property_name, 'date': {'$gte': dt.datetime(
-                date.year, date.month, date.day, 12), '$lte': dt.datetime(date.year, date.month, date.day) + dt.timedelta(days=1, hours=12)}}
-
-        print('Retrieving ' + property_name +
-              ' data from date: ' + str(date))
-
-        for document in collection.find(query, {"date": 1, value_field: 1, "_id": 0}):
-            data_values.append(document[value_field])
-            datetime_values.append(document['date'])
-
     if (len(data_values) > 0):
         
         # Pandas dataframe
@@ -203,4 +546,137 @@ def get_scalar_data_by_date(collection, property_name, date_time, value_field, v
     else:  # Return a empty pandas dataframe in case no data is found
         pandas_df = pd.DataFrame()
 
-    return pandas_df
\ No newline at end of file
+    return pandas_df
+
+
+INDEX_KEYS = [('name', 1), ('date', 1)]
+"""
+Keys of the compound index used by the queries of the nights, which filter by property name and by date range
+"""
+
+query_plans = {}
+"""
+Statistics of the plan of the last query sampled of each collection, by telescope name and collection name (See `explain_query`)
+"""
+
+index_status = {}
+"""
+Whether each collection checked has the index used by the queries (See `check_index`), by telescope name and collection name
+"""
+
+
+def check_index(collection, telescope_name, create=False):
+    """
+    Checks whether a collection has an index starting with the keys used by the queries (See `INDEX_KEYS`). Without
+    it, each night query scans the whole collection.
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `telescope_name` (str) The name of the telescope of the database.
+    - `create` (bool) Whether to create the index when it is missing. It is built in the background of the server.
+
+    Returns
+    ----------
+    - `available` (bool) Whether the collection has the index, or it was created.
+    """
+    indexes = collection.index_information()
+    # The directions are compared as they are, since the text, hashed or 2dsphere indexes have strings instead of numbers
+    available = any([tuple(item) for item in index['key'][:len(INDEX_KEYS)]] == INDEX_KEYS for index in indexes.values())
+
+    if not available and create:
+        print(f"Creating the index {INDEX_KEYS} of the collection {collection.name} ({telescope_name})")
+        collection.create_index(INDEX_KEYS, background=True)
+        available = True
+    elif not available:
+        print(f"WARNING: the collection {collection.name} ({telescope_name}) has no index on {INDEX_KEYS}, so the night queries scan the whole collection. "
+              f"Indexes found: {', '.join(indexes)}")
+
+    index_status[(telescope_name, collection.name)] = available
+
+    return available
+
+
+def explain_query(collection, query, projection):
+    """
+    Gets the statistics of the execution of a query with the explain command (executionStats verbosity). The query is run again by the server.
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `query` (dict) The filter of the query.
+    - `projection` (dict) The projection of the query.
+
+    Returns
+    ----------
+    - `stats` (dict) The keys and documents examined, the documents returned, the milliseconds spent by the server,
+    the stages of the winning plan, from the root to the leaves, and the names of the indexes used (empty for a collection scan).
+    """
+    explain = collection.database.command('explain', {'find': collection.name, 'filter': query, 'projection': projection}, verbosity='executionStats')
+    execution_stats = explain['executionStats']
+
+    stages = []
+    index_names = []
+    plans = [explain['queryPlanner']['winningPlan']]
+
+    # The stages with several children (e.g. OR, SORT_MERGE) have inputStages instead of inputStage
+    while plans:
+        plan = plans.pop(0)
+        stages.append(plan['stage'])
+
+        if 'indexName' in plan and plan['indexName'] not in index_names:
+            index_names.append(plan['indexName'])
+
+        plans.extend(([plan['inputStage']] if 'inputStage' in plan else []) + plan.get('inputStages', []))
+
+    return {'keys_examined': execution_stats['totalKeysExamined'], 'docs_examined': execution_stats['totalDocsExamined'],
+            'returned': execution_stats['nReturned'], 'execution_ms': execution_stats['executionTimeMillis'], 'stages': stages, 'indexes': index_names}
+
+
+def schedule_query_plan(collection, query, projection, telescope_name):
+    """
+    Checks the plan of a sample of the queries (`QUERY_EXPLAIN_RATE`) in another thread (See `sample_query_plan`).
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `query` (dict) The query.
+    - `projection` (dict) The projection of the query.
+    - `telescope_name` (str) The name of the telescope of the database.
+    """
+    if random.random() < QUERY_EXPLAIN_RATE:
+        t = threading.Thread(target=sample_query_plan, args=(collection, query, projection, telescope_name))
+        t.daemon = True
+        t.start()
+
+
+def sample_query_plan(collection, query, projection, telescope_name):
+    """
+    Explains a query and keeps its statistics with the metrics (See `query_plans`), warning when it scans the
+    whole collection or examines many more documents than it returns.
+
+    Parameters
+    ----------
+    - `collection` (pymongo.collection.Collection) The collection object from pymongo.
+    - `query` (dict) The filter of the query.
+    - `projection` (dict) The projection of the query.
+    - `telescope_name` (str) The name of the telescope of the database.
+
+    Returns
+    ----------
+    - `stats` (dict) The statistics of the query (See `explain_query`), or None if it could not be explained.
+    """
+    try:
+        stats = explain_query(collection, query, projection)
+    except Exception as e:
+        print(f"Error explaining a query of the collection {collection.name} ({telescope_name}):", e)
+        return None
+
+    query_plans[(telescope_name, collection.name)] = stats
+
+    if 'COLLSCAN' in stats['stages'] or stats['docs_examined'] > 2 * max(stats['returned'], 1):
+        print(f"WARNING: inefficient query of the collection {collection.name} ({telescope_name}): {stats['docs_examined']} documents examined "
+              f"for {stats['returned']} returned in {stats['execution_ms']} ms (stages: {', '.join(stats['stages'])})")
+
+    return stats
+
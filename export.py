@@ -0,0 +1,462 @@
+"""
+Streaming export of the data of a night as Parquet or CSV, so the operators can get the raw data behind the plots
+without querying the database. The properties selected are served in the /api/export address as a single file in
+long format, with a row for each property, date and channel or module. Each property is read from the night data
+cache when it is cached, otherwise the documents of the night are read from the database cursor in batches (See
+`database.iter_night_documents`), and the rows are encoded and sent in chunks, so the night is never held in memory as
+a whole dataframe. The size of the file can be estimated before downloading it (See `estimate_size`), and the export
+is offered in the sidebar of the dashboard for the night displayed (See `dashboard_utils.create_export_view`).
+
+Query arguments:
+
+- `night` (YYYY-MM-DD) The night to export.
+- `properties` (str) Comma separated names of the properties to export (See `registry.PROPERTIES`). All by default.
+- `channels` (str) The channels or modules to export, numbered from 1 as in the dashboard (e.g. 1,5,10-20). All by default.
+- `format` (str) `parquet` (default), which needs pyarrow, or `csv`.
+- `compression` (str) `snappy` (default), `zstd`, `gzip` or `none` for Parquet, and `gzip` (default) or `none` for CSV.
+- `telescope` (str) The telescope whose data is exported (See `telescopes`). The default telescope by default.
+
+The rows have the name of the property, the date, the channel or module (empty for the scalar properties) and the value.
+
+Examples:
+
+    curl -o night.parquet 'localhost:5006/api/export?night=2023-06-01&properties=scb_pixel_temperature,scb_humidity&channels=1-7'
+    curl -o rates.csv.gz 'localhost:5006/api/export?night=2023-06-01&properties=TIB_Rates_BUSYRate,TIB_Rates_CameraRate&format=csv'
+"""
+
+import io
+import time
+import zlib
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+from tornado.iostream import StreamClosedError
+from tornado.web import HTTPError, RequestHandler
+
+import async_database
+import cache
+import data_api
+import database
+import metrics
+import registry
+import telescopes
+from config import EXPORT_BATCH_DOCS, DATA_API_CHUNK_ROWS
+
+FORMATS = {'parquet': ('application/vnd.apache.parquet', 'parquet'), 'csv': ('text/csv', 'csv')}
+"""
+Content type and file extension of each format
+"""
+
+COMPRESSIONS = {'parquet': ['snappy', 'zstd', 'gzip', 'none'], 'csv': ['gzip', 'none']}
+"""
+Compressions available for each format, the default one first
+"""
+
+ESTIMATE_SAMPLE_DOCS = 20
+"""
+Number of documents of each property encoded to estimate the size of an export
+"""
+
+
+def parse_properties(properties):
+    """
+    Get the properties requested with the query arguments.
+
+    Parameters
+    ----------
+    - `properties` (str) Comma separated names of the properties.
+
+    Returns
+    ----------
+    - `properties` (list) The descriptions of the properties (See `registry.PROPERTIES`). All of them when none is given.
+    """
+    if not properties:
+        return list(registry.PROPERTIES)
+
+    try:
+        return [registry.get_property(name.strip()) for name in properties.split(',') if name.strip()]
+    except KeyError as e:
+        raise HTTPError(404, reason=f'Unknown property: {e.args[0]}')
+
+
+def get_filename(telescope, night, data_format, compression):
+    """
+    Get the name of the file of an export.
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope.
+    - `night` (dt.date) The night exported.
+    - `data_format` (str) The format (See `FORMATS`).
+    - `compression` (str) The compression (See `COMPRESSIONS`).
+
+    Returns
+    ----------
+    - `filename` (str) The name of the file.
+    """
+    extension = FORMATS[data_format][1]
+
+    if data_format == 'csv' and compression == 'gzip':
+        extension += '.gz'
+
+    return f'{telescope.name}_{night}.{extension}'
+
+
+def get_url(night, properties, channels, data_format, compression, telescope):
+    """
+    Get the address downloading an export.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The night to export.
+    - `properties` (list) The names of the properties to export.
+    - `channels` (str) The channels or modules to export (e.g. 1,5,10-20). All of them when empty.
+    - `data_format` (str) The format (See `FORMATS`).
+    - `compression` (str) The compression (See `COMPRESSIONS`).
+    - `telescope` (telescopes.Telescope) The telescope.
+
+    Returns
+    ----------
+    - `url` (str) The address of the export, relative to the root of the server.
+    """
+    arguments = {'night': night, 'properties': ','.join(properties), 'format': data_format, 'compression': compression, 'telescope': telescope.name}
+
+    if channels:
+        arguments['channels'] = channels
+
+    return '/api/export?' + urlencode(arguments)
+
+
+def build_chunk(prop, data_values, datetime_values, channels=None):
+    """
+    Build the rows of a batch of documents of a property, as done by `database.build_array_dataframe` and
+    `database.build_scalar_dataframe` but without building a dataframe.
+
+    Parameters
+    ----------
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `data_values` (list) The values of the documents, one value or array per document.
+    - `datetime_values` (list) The dates of the documents.
+    - `channels` (numpy.ndarray) The channels or modules to keep. All of them when None.
+
+    Returns
+    ----------
+    - `chunk` (dict) The array of dates, channels or modules (None for scalar properties) and values of the rows.
+    """
+    dates = np.asarray(datetime_values, dtype='datetime64[ns]')
+    values = np.asarray(data_values, dtype='float64')
+
+    if prop['shape'] == 'scalar':
+        if prop.get('remove_zero_values', False):
+            dates, values = dates[values != 0], values[values != 0]
+
+        return {'date': dates, 'channel': None, 'value': values}
+
+    columns = np.arange(1, values.shape[1] + 1, dtype='uint16')
+
+    if channels is not None:
+        columns = channels[channels <= values.shape[1]]
+        values = values[:, columns.astype('int64') - 1]
+
+    return {'date': np.repeat(dates, len(columns)), 'channel': np.tile(columns, len(dates)), 'value': values.ravel()}
+
+
+def iter_property_chunks(db, prop, night, telescope, channels=None, sample=False):
+    """
+    Yields the rows of a property for a night in chunks, from the night data cache when it is cached, otherwise from
+    the database cursor in batches of `EXPORT_BATCH_DOCS` documents.
+
+    Parameters
+    ----------
+    - `db` (telescopes.TelescopeDatabase) The database of the telescope.
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `night` (dt.date) The day in which the night starts.
+    - `telescope` (telescopes.Telescope) The telescope.
+    - `channels` (numpy.ndarray) The channels or modules to keep. All of them when None.
+    - `sample` (bool) Whether to yield only the rows of the first `ESTIMATE_SAMPLE_DOCS` documents (See `estimate_size`).
+
+    Returns
+    ----------
+    - `chunks` (generator) The chunks (See `build_chunk`).
+    """
+    # The dashboard modules are imported in the background when the server starts (See `app.import_plotting_modules`)
+    import dashboard_utils
+
+    key = cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night)
+    pandas_df = dashboard_utils.get_cached_night_data(key, dashboard_utils.get_spec(prop))
+
+    if pandas_df is not None:
+        if sample and not pandas_df.empty:
+            pandas_df = pandas_df[pandas_df.index <= pandas_df.index.unique()[:ESTIMATE_SAMPLE_DOCS].max()]
+
+        for chunk in data_api.iter_chunks(pandas_df, prop, channels):
+            yield {'date': chunk['date'], 'channel': chunk.get(prop.get('var_name')), 'value': chunk[prop['value_name']]}
+
+        return
+
+    if telescope.availability.is_empty(prop['name'], night):
+        return
+
+    batch_size = ESTIMATE_SAMPLE_DOCS if sample else EXPORT_BATCH_DOCS
+
+    for data_values, datetime_values in database.iter_night_documents(db[prop['collection']], prop['name'], night, prop['value_field'], batch_size):
+        yield build_chunk(prop, data_values, datetime_values, channels)
+
+        if sample:
+            return
+
+
+def count_rows(db, prop, night, telescope, channels=None):
+    """
+    Count the rows and the chunks of the export of a property for a night, and get the rows of its first documents.
+
+    Parameters
+    ----------
+    - `db` (telescopes.TelescopeDatabase) The database of the telescope.
+    - `prop` (dict) The description of the property (See `registry.PROPERTIES`).
+    - `night` (dt.date) The day in which the night starts.
+    - `telescope` (telescopes.Telescope) The telescope.
+    - `channels` (numpy.ndarray) The channels or modules to keep. All of them when None.
+
+    Returns
+    ----------
+    - `rows` (int) The number of rows of the property, estimated from the sample when the night is not cached.
+    - `chunks` (int) The number of chunks the rows are sent in.
+    - `sample` (dict) The rows of the first documents (See `iter_property_chunks`), or None if the property has no data.
+    """
+    sample = list(iter_property_chunks(db, prop, night, telescope, channels, sample=True))
+
+    if sum(len(chunk['date']) for chunk in sample) == 0:
+        return 0, 0, None
+
+    sample = {name: np.concatenate([chunk[name] for chunk in sample]) if sample[0][name] is not None else None for name in sample[0]}
+
+    import dashboard_utils
+
+    # The rows of the cached nights are counted, the ones of the other nights are scaled from the sample
+    key = cache.NightDataCache.make_key(telescope.name, prop['collection'], prop['name'], prop['value_field'], night)
+    pandas_df = dashboard_utils.get_cached_night_data(key, dashboard_utils.get_spec(prop))
+
+    if pandas_df is not None:
+        rows = len(pandas_df)
+
+        if channels is not None and prop['shape'] != 'scalar':
+            rows = int(np.isin(pandas_df[prop['var_name']].values, channels).sum())
+
+        return rows, -(-rows // DATA_API_CHUNK_ROWS), sample
+
+    query, _ = database.get_batch_query([prop['name']], night, [prop['value_field']])
+    docs = db[prop['collection']].count_documents(query)
+
+    return int(round(docs * len(sample['date']) / len(np.unique(sample['date'])))), -(-docs // EXPORT_BATCH_DOCS), sample
+
+
+def get_encoded_size(data_format, compression, property_name, chunk):
+    """
+    Get the size of a file with a single chunk.
+
+    Parameters
+    ----------
+    - `data_format` (str) The format (See `FORMATS`).
+    - `compression` (str) The compression (See `COMPRESSIONS`).
+    - `property_name` (str) The name of the property of the rows.
+    - `chunk` (dict) The rows (See `build_chunk`).
+
+    Returns
+    ----------
+    - `nbytes` (int) The size of the file in bytes.
+    """
+    encoder = ENCODERS[data_format](compression)
+
+    return len(encoder.encode(property_name, chunk)) + len(encoder.close())
+
+
+def estimate_size(db, props, night, telescope, channels, data_format, compression):
+    """
+    Estimate the size of the export of a night by encoding the rows of the first documents of each property. The size
+    of a row is scaled by the number of rows of the property, and the size of the metadata of a chunk (e.g. a row group
+    of a Parquet file), measured encoding a single row, by the number of chunks.
+
+    Parameters
+    ----------
+    - `db` (telescopes.TelescopeDatabase) The database of the telescope.
+    - `props` (list) The descriptions of the properties to export (See `registry.PROPERTIES`).
+    - `night` (dt.date) The day in which the night starts.
+    - `telescope` (telescopes.Telescope) The telescope.
+    - `channels` (numpy.ndarray) The channels or modules to export. All of them when None.
+    - `data_format` (str) The format (See `FORMATS`).
+    - `compression` (str) The compression (See `COMPRESSIONS`).
+
+    Returns
+    ----------
+    - `nbytes` (int) The estimated size of the file in bytes.
+    - `rows` (int) The estimated number of rows.
+    """
+    empty_size = len(ENCODERS[data_format](compression).close())
+    nbytes = empty_size
+    total_rows = 0
+
+    for prop in props:
+        rows, chunks, sample = count_rows(db, prop, night, telescope, channels)
+
+        if rows == 0:
+            continue
+
+        sample_rows = len(sample['date'])
+        sample_size = get_encoded_size(data_format, compression, prop['name'], sample) - empty_size
+        row_size = get_encoded_size(data_format, compression, prop['name'], {name: values[:1] if values is not None else None
+                                                                             for name, values in sample.items()}) - empty_size
+
+        size_per_row = (sample_size - row_size) / (sample_rows - 1) if sample_rows > 1 else row_size
+        size_per_chunk = max(row_size - size_per_row, 0)
+
+        nbytes += int(rows * size_per_row + chunks * size_per_chunk)
+        total_rows += rows
+
+    return nbytes, total_rows
+
+
+class CsvEncoder:
+    """
+    Encoder of the chunks as the lines of a CSV file, optionally gzip compressed.
+    """
+
+    def __init__(self, compression):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compression == 'gzip' else None
+        self._header = True
+
+    def _compress(self, data):
+        return self._compressor.compress(data) if self._compressor is not None else data
+
+    def encode(self, property_name, chunk):
+        channels = chunk['channel'] if chunk['channel'] is not None else pd.array([pd.NA] * len(chunk['date']), dtype='UInt16')
+        pandas_df = pd.DataFrame({'property': property_name, 'date': chunk['date'], 'channel': channels, 'value': chunk['value']})
+        data = pandas_df.to_csv(index=False, header=self._header).encode()
+        self._header = False
+
+        return self._compress(data)
+
+    def close(self):
+        data = b'property,date,channel,value\n' if self._header else b''
+
+        return self._compress(data) + (self._compressor.flush() if self._compressor is not None else b'')
+
+
+class ParquetEncoder:
+    """
+    Encoder of the chunks as the row groups of a Parquet file.
+    """
+
+    def __init__(self, compression):
+        # pyarrow is only needed to export the Parquet format
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._sink = io.BytesIO()
+        self._schema = pa.schema([('property', pa.dictionary(pa.int32(), pa.string())), ('date', pa.timestamp('ns')), ('channel', pa.uint16()),
+                                  ('value', pa.float64())])
+        self._writer = pq.ParquetWriter(self._sink, self._schema, compression=compression.upper())
+
+    def _pop(self):
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+
+        return data
+
+    def encode(self, property_name, chunk):
+        pa = self._pa
+        rows = len(chunk['date'])
+        names = pa.DictionaryArray.from_arrays(pa.array(np.zeros(rows, dtype='int32')), pa.array([property_name]))
+        channels = pa.array(chunk['channel'], type=pa.uint16()) if chunk['channel'] is not None else pa.nulls(rows, type=pa.uint16())
+
+        self._writer.write_table(pa.Table.from_arrays([names, pa.array(chunk['date']), channels, pa.array(chunk['value'])], schema=self._schema))
+
+        return self._pop()
+
+    def close(self):
+        self._writer.close()
+
+        return self._pop()
+
+
+ENCODERS = {'parquet': ParquetEncoder, 'csv': CsvEncoder}
+"""
+Encoder of each format
+"""
+
+
+class ExportHandler(RequestHandler):
+    """
+    Tornado handler serving the export of a night. It is added to the server with the `extra_patterns` option of `pn.serve`.
+    """
+
+    async def get(self):
+        tic = time.perf_counter()
+
+        nights = data_api.parse_nights(self.get_argument('night', None))
+        props = parse_properties(self.get_argument('properties', None))
+        channels = data_api.parse_channels(self.get_argument('channels', None))
+        data_format = self.get_argument('format', 'parquet')
+        telescope_name = self.get_argument('telescope', telescopes.default.name).upper()
+
+        if telescope_name not in telescopes.telescopes:
+            raise HTTPError(404, reason=f'Unknown telescope: {telescope_name}')
+
+        telescope = telescopes.get(telescope_name)
+
+        if data_format not in FORMATS:
+            raise HTTPError(400, reason=f"Unknown format: {data_format}. Available formats: {', '.join(FORMATS)}")
+
+        compression = self.get_argument('compression', COMPRESSIONS[data_format][0])
+
+        if compression not in COMPRESSIONS[data_format]:
+            raise HTTPError(400, reason=f"Unknown compression: {compression}. Available compressions: {', '.join(COMPRESSIONS[data_format])}")
+
+        try:
+            encoder = ENCODERS[data_format](compression)
+        except ImportError:
+            raise HTTPError(501, reason='pyarrow is needed to export the Parquet format, use format=csv')
+
+        content_type = 'application/gzip' if data_format == 'csv' and compression == 'gzip' else FORMATS[data_format][0]
+        self.set_header('Content-Type', content_type)
+        self.set_header('Content-Disposition', f'attachment; filename="{get_filename(telescope, nights[0], data_format, compression)}"')
+        self.set_header('Cache-Control', 'no-cache')
+
+        # The blocking calls run in the pool of threads shared by the sessions, which bounds the threads used by the requests
+        db = await async_database.run_blocking(telescope.connect)
+
+        if db is None:
+            raise HTTPError(503, reason='Connection to the database failed')
+
+        sent = 0
+
+        def encode_next(prop, chunks):
+            chunk = next(chunks, None)
+
+            return encoder.encode(prop['name'], chunk) if chunk is not None else None
+
+        try:
+            for prop in props:
+                chunks = iter_property_chunks(db, prop, nights[0], telescope, channels)
+
+                # The cursor is read and the chunks encoded out of the event loop, one chunk at a time
+                while (data := await async_database.run_blocking(encode_next, prop, chunks)) is not None:
+                    self.write(data)
+                    sent += len(data)
+                    await self.flush()
+
+            data = encoder.close()
+            self.write(data)
+            sent += len(data)
+        except StreamClosedError:
+            print(f"Export of night {nights[0]} of {telescope.name} cancelled by the client")
+        finally:
+            db.client.close()
+            metrics.EXPORT_BYTES.labels(data_format).inc(sent)
+
+        metrics.STAGE_SECONDS.labels('export', data_format).observe(time.perf_counter() - tic)
+        print(f"Export: {len(props)} properties of {telescope.name} in night {nights[0]} sent as {data_format} ({compression}, "
+              f"{sent / 2**20:0.1f} MB) in {time.perf_counter() - tic:0.2f} seconds")
@@ -0,0 +1,225 @@
+"""
+Live night feed module. A single background poller per process retrieves only the documents newer than the last
+seen timestamp of each property of the current night, appends them to the shared night data cache and pushes
+them to every subscribed session. Each telescope has its own feed (See `telescopes`).
+"""
+
+import threading
+import time
+import datetime as dt
+
+import pandas as pd
+
+import cache
+import database
+
+
+class LiveNightFeed:
+    """
+    Background poller that keeps the cached data of the current night up to date and fans out the new rows to the sessions.
+
+    The properties to poll are tracked when a session loads the current night (see `track`). Subscribers are callables
+    receiving a dict with the cache key as key and a dict with the new `rows` and, for array properties, the
+    `envelope` (max, min and avg values for each new date) as value. Both are computed once per poll, so the cost of
+    adding new data does not depend on the number of connected sessions.
+    """
+
+    def __init__(self, interval_sec=60, connect=None):
+        """
+        Parameters
+        ----------
+        - `interval_sec` (int) Seconds between each poll.
+        - `connect` (callable) The function called without arguments to connect to the database of the telescope (See `telescopes.Telescope.connect`).
+        """
+        self.interval_sec = interval_sec
+        self.connect = connect
+        self._tracked = {}
+        self._watermarks = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._db = None
+
+    def track(self, key, spec):
+        """
+        Track a property of the current night, so new documents are polled for it.
+
+        Parameters
+        ----------
+        - `key` (tuple) The night data cache key (see `cache.NightDataCache.make_key`)
+        - `spec` (dict) The parameters needed to build the new rows. It should contain the following keys:
+            - `collection` (str): The name of the collection.
+            - `scalar` (bool): Whether the property stores scalar values or arrays.
+            - `value_field`, `value_name` (str): See `database.get_data_by_date`.
+            - `id_var`, `var_name` (str): Only for array properties. See `database.get_data_by_date`.
+            - `remove_zero_values` (bool): Only for scalar properties. See `database.get_scalar_data_by_date`.
+        """
+        with self._lock:
+            self._tracked[key] = spec
+
+    def subscribe(self, session_id, callback):
+        """
+        Subscribe a session to the new rows of the current night. The poller thread is started with the first subscription.
+
+        Parameters
+        ----------
+        - `session_id` (str) The id of the Bokeh session.
+        - `callback` (callable) The function called with the new rows. It is called from the poller thread.
+        """
+        with self._lock:
+            self._subscribers[session_id] = callback
+
+            if self._thread is None or not self._thread.is_alive():
+                print("Starting live night feed in another thread")
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def unsubscribe(self, session_id):
+        """
+        Remove the subscription of a session.
+
+        Parameters
+        ----------
+        - `session_id` (str) The id of the Bokeh session.
+        """
+        with self._lock:
+            self._subscribers.pop(session_id, None)
+
+    def stats(self):
+        """
+        Get the number of tracked properties and of subscribed sessions.
+
+        Returns
+        ----------
+        - `stats` (dict) The `tracked` and `subscribers` counts.
+        """
+        with self._lock:
+            return {'tracked': len(self._tracked), 'subscribers': len(self._subscribers)}
+
+    def poll(self):
+        """
+        Retrieve the new documents of every tracked property of the current night, append them to the cache and
+        push them to the subscribers.
+
+        Returns
+        ----------
+        - `updates` (dict) The new rows for each cache key.
+        """
+        current_night = database.get_current_night()
+        night_start, night_end = database.get_night_range(current_night)
+
+        with self._lock:
+            # Stop tracking the properties of the nights that already finished or that are no longer cached
+            for key in [key for key in self._tracked if key[4] != current_night or key not in cache.night_data]:
+                del self._tracked[key]
+                self._watermarks.pop(key, None)
+
+            tracked = list(self._tracked.items())
+
+        if not tracked:
+            return {}
+
+        if self._db is None:
+            self._db = self.connect()
+
+            if self._db is None:
+                return {}
+
+        updates = {}
+
+        for key, spec in tracked:
+            since = self.get_watermark(key)
+
+            if since is None:
+                since = night_start - dt.timedelta(microseconds=1)
+
+            data_values, datetime_values = database.get_documents_since(self._db[spec['collection']], key[2], since, night_end, spec['value_field'])
+
+            if len(data_values) == 0:
+                continue
+
+            # The documents are not retrieved again even if none of their rows is kept (e.g. the zero values removed)
+            with self._lock:
+                self._watermarks[key] = pd.Timestamp(max(datetime_values))
+
+            if spec['scalar']:
+                rows = database.build_scalar_dataframe(data_values, datetime_values, spec['value_name'], spec['remove_zero_values'])
+                envelope = None
+            else:
+                rows = database.build_array_dataframe(data_values, datetime_values, spec['id_var'], spec['var_name'], spec['value_name'])
+                envelope = build_envelope(rows, spec['value_name'])
+
+            if rows.empty or not cache.night_data.append(key, rows):
+                continue
+
+            updates[key] = {'rows': rows, 'envelope': envelope}
+
+        if updates:
+            print(f"Live feed: {sum(len(update['rows']) for update in updates.values())} new rows for {len(updates)} properties")
+
+            with self._lock:
+                subscribers = list(self._subscribers.values())
+
+            for callback in subscribers:
+                try:
+                    callback(updates)
+                except Exception as e:
+                    print("Live feed: error pushing new rows to a session:", e)
+
+        return updates
+
+    def get_watermark(self, key):
+        """
+        Get the date of the newest document retrieved for a key, by the poller or by the initial load of the night.
+
+        Parameters
+        ----------
+        - `key` (tuple) The night data cache key.
+
+        Returns
+        ----------
+        - `watermark` (pandas.Timestamp) The date after which the new documents are retrieved, or None if none was retrieved.
+        """
+        with self._lock:
+            watermark = self._watermarks.get(key)
+
+        cached = cache.night_data.last_timestamp(key)
+
+        if watermark is None or (cached is not None and cached > watermark):
+            return cached
+
+        return watermark
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_sec)
+
+            try:
+                self.poll()
+            except Exception as e:
+                print("Live feed: error polling the database:", e)
+
+                # Reconnect in the next poll
+                if self._db is not None:
+                    self._db.client.close()
+                    self._db = None
+
+
+def build_envelope(rows, value_name):
+    """
+    Build the max, min and avg values for each date of the new rows of an array property.
+
+    Parameters
+    ----------
+    - `rows` (pandas.DataFrame) The new rows in long format, indexed by date.
+    - `value_name` (str) The name of the value column.
+
+    Returns
+    ----------
+    - `envelope` (pandas.DataFrame) A dataframe with the date, max, min and avg columns.
+    """
+    envelope = rows.groupby(level=0)[value_name].agg(['max', 'min', 'mean']).rename(columns={'mean': 'avg'})
+    envelope.index.name = 'date'
+
+    return envelope.reset_index()
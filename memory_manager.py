@@ -0,0 +1,447 @@
+"""
+Memory management module. Keeps track of the resources created by each session (dataframes, HoloViews objects and
+Bokeh documents), releases them when the session is destroyed and evicts the cached night data when the memory
+used by the process goes over a high-water mark. A report with the memory used is added to the admin panel.
+"""
+
+import ctypes
+import gc
+import threading
+import time
+import weakref
+from collections import deque
+
+import pandas as pd
+import panel as pn
+import psutil
+
+import async_database
+import cache
+import database
+import metrics
+import payloads
+import prewarm
+import shared_cache
+import telescopes
+from config import MEMORY_HIGH_WATER_MB, MEMORY_CHECK_INTERVAL, MEMORY_PROFILING, MEMORY_PROFILING_DIR
+
+MEMORY_LOW_WATER_RATIO = 0.8
+"""
+Ratio of the high-water mark to reach when evicting cached data
+"""
+
+
+class SessionResources:
+    """
+    Resources created for a user session. Only weak references are kept for the tracked objects, so this
+    registry does not keep them alive and can report which objects are retained after the session is released.
+    """
+
+    def __init__(self, session_id, template):
+        self.session_id = session_id
+        self.template = template
+        self.created = time.time()
+        self.released = None
+        self._refs = {'dataframes': [], 'holoviews': [], 'documents': []}
+
+    def track(self, kind, objects):
+        """
+        Track objects created for the session.
+
+        Parameters
+        ----------
+        - `kind` (str) The kind of the objects: dataframes, holoviews or documents.
+        - `objects` (list) The objects to track.
+        """
+        refs = self._refs[kind]
+
+        # Remove references to objects already collected
+        refs[:] = [ref for ref in refs if ref() is not None]
+        refs.extend(weakref.ref(obj) for obj in objects if obj is not None)
+
+    def alive(self, kind):
+        """
+        Get the tracked objects of a kind that are still alive.
+
+        Parameters
+        ----------
+        - `kind` (str) The kind of the objects: dataframes, holoviews or documents.
+
+        Returns
+        ----------
+        - `objects` (list) The tracked objects still alive.
+        """
+        return [obj for obj in (ref() for ref in self._refs[kind]) if obj is not None]
+
+    def summary(self):
+        """
+        Get a summary of the resources of the session.
+
+        Returns
+        ----------
+        - `summary` (dict) The session id, its age, and the number of dataframes (and the size of the ones not shared
+        with the night data cache), HoloViews objects and documents alive.
+        """
+        dataframes = self.alive('dataframes')
+        own_dataframes = [df for df in dataframes if not cache.night_data.is_cached(df)]
+
+        return {'session': self.session_id,
+                'age (s)': round((self.released or time.time()) - self.created),
+                'released': self.released is not None,
+                'dataframes': len(own_dataframes),
+                'dataframes (MB)': round(sum(cache.get_dataframe_size(df) for df in own_dataframes) / 2**20, 1),
+                'shared dataframes': len(dataframes) - len(own_dataframes),
+                'holoviews objects': len(self.alive('holoviews')),
+                'documents': len(self.alive('documents'))}
+
+
+_sessions = {}
+_released_sessions = deque(maxlen=20)
+_lock = threading.Lock()
+_monitor_thread = None
+
+
+def register_session(doc, template):
+    """
+    Register a new user session to track its resources.
+
+    Parameters
+    ----------
+    - `doc` (bokeh.document.Document) The document of the user session.
+    - `template` (pn.template.MaterialTemplate) The dashboard template of the session.
+    """
+    if doc is None or doc.session_context is None:
+        return
+
+    resources = SessionResources(doc.session_context.id, template)
+    resources.track('documents', [doc])
+
+    with _lock:
+        _sessions[resources.session_id] = resources
+
+    metrics.SESSIONS_CREATED.inc()
+
+
+def track(doc, kind, objects):
+    """
+    Track objects created for a user session.
+
+    Parameters
+    ----------
+    - `doc` (bokeh.document.Document) The document of the user session.
+    - `kind` (str) The kind of the objects: dataframes, holoviews or documents.
+    - `objects` (list) The objects to track.
+    """
+    if doc is None or doc.session_context is None:
+        return
+
+    with _lock:
+        resources = _sessions.get(doc.session_context.id)
+
+        if resources is not None:
+            resources.track(kind, objects)
+
+
+def release_session(session_context):
+    """
+    Release the resources of a destroyed session: the live feed subscription, the template contents and the cached
+    results of its HoloViews dynamic maps. Then runs the garbage collector and returns the free memory to the OS.
+
+    Parameters
+    ----------
+    - `session_context` (bokeh.server.contexts.BokehSessionContext) The context of the destroyed session.
+    """
+    # HoloViews is imported in the background when the server starts (See `app.import_plotting_modules`)
+    import holoviews as hv
+
+    for telescope in telescopes.get_all():
+        telescope.live_feed.unsubscribe(session_context.id)
+
+    with _lock:
+        resources = _sessions.pop(session_context.id, None)
+
+    if resources is not None:
+        for obj in resources.alive('holoviews'):
+            for dynamic_map in obj.traverse(lambda x: x, [hv.DynamicMap]):
+                dynamic_map.data.clear()
+
+        try:
+            resources.template.main.objects = []
+            resources.template.sidebar.objects = []
+        except Exception as e:
+            print("Error clearing the template of the destroyed session:", e)
+
+        resources.template = None
+
+    gc.collect()
+    trim_memory()
+
+    # The objects still alive after releasing the session are reported in the admin panel
+    if resources is not None:
+        resources.released = time.time()
+        _released_sessions.append(resources)
+
+    metrics.SESSIONS_RELEASED.inc()
+
+    print(f"Session {session_context.id} released. Memory used: {get_rss() / 2**20:0.0f} MB")
+
+
+def trim_memory():
+    """
+    Returns the free memory of the heap to the OS (only available with glibc).
+    """
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def get_rss():
+    """
+    Get the resident set size of the application process.
+
+    Returns
+    ----------
+    - `rss` (int) The memory in bytes.
+    """
+    return psutil.Process().memory_info().rss
+
+
+def check_memory(high_water_mb=MEMORY_HIGH_WATER_MB):
+    """
+    Evict the least recently used cached night data when the memory used by the process goes over the high-water mark,
+    until reaching the low-water mark, starting with the telescopes over their share (See `evict_night_data`). The current night is never evicted, as it is updated by the live feed. If that is
+    not enough, the encoded arrays of the plots are removed too (See `payloads`).
+
+    Parameters
+    ----------
+    - `high_water_mb` (int) The high-water mark in MB.
+
+    Returns
+    ----------
+    - `freed` (int) The memory in bytes used by the evicted cached data.
+    """
+    rss = get_rss()
+    high_water = high_water_mb * 2**20
+
+    if rss <= high_water:
+        return 0
+
+    freed = evict_night_data(rss - high_water * MEMORY_LOW_WATER_RATIO)
+
+    # The encoded arrays of the plots are encoded again by the next session that needs them
+    if rss - freed > high_water * MEMORY_LOW_WATER_RATIO:
+        freed += payloads.store.clear()
+
+    gc.collect()
+    trim_memory()
+
+    print(f"Memory high-water mark reached ({rss / 2**20:0.0f} MB > {high_water_mb} MB). Evicted {freed / 2**20:0.1f} MB of cached data, "
+          f"memory used now: {get_rss() / 2**20:0.0f} MB")
+
+    return freed
+
+
+def evict_night_data(nbytes):
+    """
+    Evict cached night data, first the least recently used data of the telescopes using more than their share of the
+    memory kept in the cache, proportional to their `cache_max_mb` (the telescopes without limit get the largest share),
+    and then the least recently used data of all of them. The current night is never evicted.
+
+    Parameters
+    ----------
+    - `nbytes` (int) The memory in bytes to free.
+
+    Returns
+    ----------
+    - `freed` (int) The memory in bytes used by the evicted cached data.
+    """
+    protected_nights = (database.get_current_night(), )
+    kept = max(cache.night_data.nbytes() - nbytes, 0)
+
+    limits = {telescope.name: telescope.cache_max_mb for telescope in telescopes.get_all()}
+    largest_limit = max((limit for limit in limits.values() if limit), default=1)
+    weights = {name: limit or largest_limit for name, limit in limits.items()}
+
+    freed = 0
+
+    for name, weight in weights.items():
+        excess = cache.night_data.nbytes(name) - kept * weight / sum(weights.values())
+
+        if excess > 0 and freed < nbytes:
+            freed += cache.night_data.evict(min(excess, nbytes - freed), protected_nights=protected_nights, telescope_name=name)
+
+    if freed < nbytes:
+        freed += cache.night_data.evict(nbytes - freed, protected_nights=protected_nights)
+
+    return freed
+
+
+def memory_monitor_task(interval_sec=MEMORY_CHECK_INTERVAL):
+    """
+    Checks periodically the memory used by the process (See `check_memory`).
+
+    Parameters
+    ----------
+    - `interval_sec` (int) Seconds between each check.
+    """
+    while True:
+        time.sleep(interval_sec)
+
+        try:
+            check_memory()
+        except Exception as e:
+            print("Error checking memory:", e)
+
+
+def start_memory_monitor():
+    """
+    Starts the memory monitor in another thread, if it is not running yet.
+    """
+    global _monitor_thread
+
+    with _lock:
+        if _monitor_thread is None or not _monitor_thread.is_alive():
+            print("Starting memory monitor in another thread")
+            _monitor_thread = threading.Thread(target=memory_monitor_task)
+            _monitor_thread.daemon = True
+            _monitor_thread.start()
+
+
+def get_sessions_report():
+    """
+    Get the resources of the live sessions and of the last released sessions.
+
+    Returns
+    ----------
+    - `report` (pandas.DataFrame) A dataframe with a row for each session (See `SessionResources.summary`)
+    """
+    with _lock:
+        sessions = list(_sessions.values()) + list(_released_sessions)
+
+    return pd.DataFrame([resources.summary() for resources in sessions],
+                        columns=['session', 'age (s)', 'released', 'dataframes', 'dataframes (MB)', 'shared dataframes', 'holoviews objects', 'documents'])
+
+
+def memory_report():
+    """
+    Creates the memory report for the admin panel with the RSS of the process, the cached data and the resources of each session.
+    It is added to the admin panel with the `admin_plugins` Panel config option.
+
+    Returns
+    ----------
+    - `report` (pn.Column) The panel with the memory report, updated every 5 seconds.
+    """
+    overview = pn.pane.Markdown()
+    sessions_table = pn.widgets.Tabulator(get_sessions_report(), disabled=True, show_index=False, sizing_mode='stretch_width')
+
+    def update_report():
+        if shared_cache.store.enabled:
+            shared_cache_status = f"{shared_cache.store.nbytes() / 2**20:0.1f} MB ({shared_cache.store.hits} hits, {shared_cache.store.misses} misses)"
+        else:
+            shared_cache_status = 'disabled'
+
+        if payloads.store.enabled:
+            payloads_status = f"{payloads.store.nbytes() / 2**20:0.1f} MB in {len(payloads.store)} arrays ({payloads.store.hits} hits, {payloads.store.misses} misses)"
+        else:
+            payloads_status = 'disabled'
+
+        profiling_status = f"enabled (reports in {MEMORY_PROFILING_DIR})" if MEMORY_PROFILING else 'disabled'
+
+        telescopes_status = ''.join(f"  - **{telescope.name}:** {cache.night_data.nbytes(telescope.name) / 2**20:0.1f} MB of cached night data "
+                                    f"(budget: {telescope.cache_max_mb or 'no limit'} MB), prewarm {get_prewarm_status(telescope)}\n"
+                                    for telescope in telescopes.get_all())
+
+        overview.object = f"""### Memory
+- **Process RSS:** {get_rss() / 2**20:0.1f} MB (high-water mark: {MEMORY_HIGH_WATER_MB} MB)
+- **Cached night data:** {cache.night_data.nbytes() / 2**20:0.1f} MB in {len(cache.night_data)} entries ({cache.night_data.hits} hits, {cache.night_data.misses} misses, {cache.night_data.evictions} evictions)
+- **Shared cache (worker processes):** {shared_cache_status}
+- **Encoded plot data:** {payloads_status}
+- **Live sessions:** {len(_sessions)}
+- **Telescopes:**
+{telescopes_status}- **Memory profiling:** {profiling_status}
+"""
+        sessions_table.value = get_sessions_report()
+
+    update_report()
+    pn.state.add_periodic_callback(update_report, period=5000)
+
+    return pn.Column(overview, '### Sessions', sessions_table, sizing_mode='stretch_both')
+
+
+def get_prewarm_status(telescope):
+    """
+    Get the status of the startup prewarm of a telescope shown in the memory report (See `prewarm.get_status`).
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope.
+
+    Returns
+    ----------
+    - `status` (str) The state, the night loaded, the aggregates computed and the seconds spent.
+    """
+    status = prewarm.get_status(telescope.name)
+
+    return f"{status['state']} (night: {status['night']}, aggregates: {status['done']}/{status['total']}, duration: {status['duration']} s)"
+
+
+def register_metrics():
+    """
+    Adds the state of the process (sessions, memory, caches, live feed, database circuit breaker and queries in flight, indexes and query plans, and startup prewarm) to the metrics exposed in the /metrics endpoint (See `metrics`).
+    """
+    add = metrics.callbacks.add
+
+    add('clusco_live_sessions', 'Number of live user sessions', lambda: len(_sessions))
+    add('clusco_process_rss_bytes', 'Resident set size of the application process', get_rss)
+    add('clusco_memory_high_water_bytes', 'Memory used by the process that triggers the eviction of the cached data', lambda: MEMORY_HIGH_WATER_MB * 2**20)
+
+    add('clusco_night_data_cache_bytes', 'Memory used by the night data cache', cache.night_data.nbytes)
+    add('clusco_night_data_cache_entries', 'Number of entries in the night data cache', lambda: len(cache.night_data))
+    add('clusco_cache_hits', 'Number of hits of each cache', lambda: {('night_data', ): cache.night_data.hits,
+                                                                     ('aggregates', ): cache.aggregates.hits,
+                                                                     ('shared', ): shared_cache.store.hits,
+                                                                     ('payloads', ): payloads.store.hits}, kind='counter', labels=('cache', ))
+    add('clusco_cache_misses', 'Number of misses of each cache', lambda: {('night_data', ): cache.night_data.misses,
+                                                                         ('aggregates', ): cache.aggregates.misses,
+                                                                         ('shared', ): shared_cache.store.misses,
+                                                                         ('payloads', ): payloads.store.misses}, kind='counter', labels=('cache', ))
+    add('clusco_night_data_cache_evictions', 'Number of entries evicted from the night data cache', lambda: cache.night_data.evictions, kind='counter')
+    add('clusco_shared_cache_bytes', 'Size of the cache shared by the worker processes', shared_cache.store.nbytes)
+    add('clusco_payload_cache_bytes', 'Size of the encoded arrays of the plots reused by all the sessions', payloads.store.nbytes)
+
+    add('clusco_telescope_cache_bytes', 'Memory used by the cached night data of each telescope',
+        lambda: {(telescope.name, ): cache.night_data.nbytes(telescope.name) for telescope in telescopes.get_all()}, labels=('telescope', ))
+
+    add('clusco_live_feed_tracked_properties', 'Number of properties of the current night polled by the live feeds',
+        lambda: sum(telescope.live_feed.stats()['tracked'] for telescope in telescopes.get_all()))
+    add('clusco_live_feed_subscribers', 'Number of sessions subscribed to the live feeds',
+        lambda: sum(telescope.live_feed.stats()['subscribers'] for telescope in telescopes.get_all()))
+
+    add('clusco_db_circuit_state', 'State of the circuit breaker of the database connections of each telescope',
+        lambda: {(telescope.name, state): int(telescope.breaker.state == state) for telescope in telescopes.get_all() for state in ('closed', 'open', 'half_open')},
+        labels=('telescope', 'state'))
+    add('clusco_db_failures', 'Number of failed connections and queries to the databases',
+        lambda: sum(telescope.breaker.total_failures for telescope in telescopes.get_all()), kind='counter')
+    add('clusco_db_queries_in_flight', 'Number of night queries of the sessions started and not finished yet', lambda: async_database.queries_in_flight)
+
+    add('clusco_db_index_ok', 'Whether each collection of each telescope has the index on name and date used by the night queries',
+        lambda: {key: int(available) for key, available in database.index_status.items()}, labels=('telescope', 'collection'))
+
+    for stat, documentation in (('keys_examined', 'Index keys examined'), ('docs_examined', 'Documents examined'), ('returned', 'Documents returned'),
+                                ('execution_ms', 'Milliseconds spent by the server')):
+        add(f'clusco_query_{stat}', f'{documentation} by the last night query sampled of each collection of each telescope',
+            lambda stat=stat: {key: plan[stat] for key, plan in database.query_plans.items()}, labels=('telescope', 'collection'))
+
+    add('clusco_query_collection_scan', 'Whether the last night query sampled of each collection of each telescope scanned the whole collection',
+        lambda: {key: int('COLLSCAN' in plan['stages']) for key, plan in database.query_plans.items()}, labels=('telescope', 'collection'))
+
+    add('clusco_prewarm_state', 'Number of telescopes in each state of the startup prewarm',
+        lambda: {(state, ): sum(prewarm.get_status(telescope.name)['state'] == state for telescope in telescopes.get_all()) for state in ('idle', 'running', 'done', 'failed')},
+        labels=('state', ))
+    add('clusco_prewarm_aggregates', 'Number of aggregates computed by the startup prewarm', lambda: sum(prewarm.get_status(telescope.name)['done'] for telescope in telescopes.get_all()))
+    add('clusco_prewarm_seconds', 'Seconds spent by the startup prewarm of the slowest telescope',
+        lambda: max(prewarm.get_status(telescope.name)['duration'] or 0 for telescope in telescopes.get_all()))
+
+
+register_metrics()
@@ -0,0 +1,137 @@
+"""
+Performance metrics module. The time spent in each stage of the creation of a dashboard (database connection,
+queries, dataframe building, aggregations, plots and Panel models) is recorded in histograms, and the state of the
+process (sessions, caches, memory) is read when the metrics are scraped. All of them are exposed in the Prometheus
+text format in the /metrics endpoint, served next to the admin panel.
+"""
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from tornado.web import RequestHandler
+
+registry = CollectorRegistry()
+"""
+Registry with the metrics of the application. The default registry of prometheus_client is not used, so only the metrics of the dashboard are exposed
+"""
+
+STAGE_SECONDS = Histogram('clusco_stage_seconds', 'Time spent in each stage of the creation of a dashboard', ['stage', 'name'], registry=registry,
+                          buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+"""
+Histogram with the seconds spent in each stage (connect, query, build_dataframe, min_max_avg, plot, panel, panel_models, dashboard)
+"""
+
+SESSIONS_CREATED = Counter('clusco_sessions_created', 'Number of user sessions created', registry=registry)
+"""
+Counter of the user sessions created
+"""
+
+SESSIONS_RELEASED = Counter('clusco_sessions_released', 'Number of user sessions released', registry=registry)
+"""
+Counter of the user sessions destroyed and released
+"""
+
+DATA_API_BYTES = Counter('clusco_data_api_bytes', 'Bytes sent by the binary data API', ['format'], registry=registry)
+"""
+Counter of the bytes sent by the binary data API in each format (See `data_api`)
+"""
+
+EXPORT_BYTES = Counter('clusco_export_bytes', 'Bytes sent by the exports of the nights', ['format'], registry=registry)
+"""
+Counter of the bytes sent by the exports of the nights in each format (See `export`)
+"""
+
+
+class CallbackCollector:
+    """
+    Collector with metrics whose values are read from the application when the metrics are scraped (number of
+    live sessions, cache statistics, memory used...), so keeping them does not add any cost to the dashboard.
+    """
+
+    def __init__(self):
+        self._callbacks = []
+
+    def add(self, name, documentation, callback, kind='gauge', labels=()):
+        """
+        Add a metric read with a callback.
+
+        Parameters
+        ----------
+        - `name` (str) The name of the metric.
+        - `documentation` (str) The description of the metric.
+        - `callback` (callable) The function called without arguments to get the value of the metric. When the metric has labels,
+        it should return a dict with the tuple of label values as key and the value of the metric as value.
+        - `kind` (str) The type of the metric: gauge or counter.
+        - `labels` (tuple) The names of the labels of the metric.
+        """
+        self._callbacks.append((name, documentation, callback, kind, labels))
+
+    def collect(self):
+        for name, documentation, callback, kind, labels in self._callbacks:
+            family_class = CounterMetricFamily if kind == 'counter' else GaugeMetricFamily
+            family = family_class(name, documentation, labels=labels)
+
+            try:
+                values = callback()
+            except Exception as e:
+                print(f"Error collecting the metric {name}:", e)
+                continue
+
+            if labels:
+                for label_values, value in values.items():
+                    family.add_metric(label_values, value)
+            else:
+                family.add_metric([], values)
+
+            yield family
+
+
+callbacks = CallbackCollector()
+"""
+Collector with the metrics read from the application when scraped
+"""
+
+registry.register(callbacks)
+
+
+def timer(stage, name=''):
+    """
+    Get a timer recording the seconds spent in a stage. It can be used as a context manager or as a decorator.
+
+    Parameters
+    ----------
+    - `stage` (str) The name of the stage.
+    - `name` (str) The name of the item processed in the stage (property, plot...). Empty by default.
+
+    Returns
+    ----------
+    - `timer` (prometheus_client.context_managers.Timer) The timer.
+    """
+    return STAGE_SECONDS.labels(stage, name).time()
+
+
+def timed(stage):
+    """
+    Decorator recording the seconds spent in a function as a stage, named as the function.
+
+    Parameters
+    ----------
+    - `stage` (str) The name of the stage.
+
+    Returns
+    ----------
+    - `decorator` (callable) The decorator.
+    """
+    def decorator(function):
+        return timer(stage, function.__name__)(function)
+
+    return decorator
+
+
+class MetricsHandler(RequestHandler):
+    """
+    Tornado handler serving the metrics in the Prometheus text format. It is added to the server with the `extra_patterns` option of `pn.serve`.
+    """
+
+    def get(self):
+        self.set_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.write(generate_latest(registry))
@@ -6,8 +6,10 @@ import panel as pn
 # Application modules
 import plot_helper
 import dashboard_utils
+import metrics
 
-def create_plot_panel(df, title, id_var, var_name, value_name, xlabel, ylabel, cmap, climit, template, show_loading_msg=True):
+@metrics.timed('panel')
+def create_plot_panel(df, title, id_var, var_name, value_name, xlabel, ylabel, cmap, climit, template, show_loading_msg=True, live_streams=None):
     """
     Creates a plot panel for a given dataframe and appends a plot using `plot_helper.multiplot_grouped_data`
 
@@ -20,10 +22,11 @@ def create_plot_panel(df, title, id_var, var_name, value_name, xlabel, ylabel, c
     - `value_name` (str) The name of the column to use as the value name
     - `xlabel` (str) The label for the x-axis
     - `ylabel` (str) The label for the y-axis
-    - `cmap` (str) The name of the colormap to use
+    - `cmap` (list) The hex colors of the palette to use (See `registry.linear_palette`)
     - `climit` (tuple) The limits of the colorbar
     - `template` (panel.Template) The dashboard template
     - `show_loading_msg` (bool) Whether to show the loading message or not (Only when creating the plot for the first time)
+    - `live_streams` (dict) The streams with the new data of the current night to send to the plot (See `plot_helper.multiplot_grouped_data`). None by default.
 
     Returns
     -------
@@ -42,7 +45,7 @@ def create_plot_panel(df, title, id_var, var_name, value_name, xlabel, ylabel, c
     
     else:
         plot = plot_helper.multiplot_grouped_data(df, id_var, value_name,
-                        title, xlabel, ylabel, var_name, cmap, climit)
+                        title, xlabel, ylabel, var_name, cmap, climit, live_streams)
 
         c_widget = pn.widgets.DiscreteSlider
         c_widget.align = 'center'
@@ -56,7 +59,8 @@ def create_plot_panel(df, title, id_var, var_name, value_name, xlabel, ylabel, c
 
 
 
-def create_l1_rate_plot_panel(data_dict, title, id_var, var_name, value_name, xlabel, ylabel, cmap, climit, template, show_loading_msg=True):
+@metrics.timed('panel')
+def create_l1_rate_plot_panel(data_dict, title, id_var, var_name, value_name, xlabel, ylabel, cmap, climit, template, show_loading_msg=True, live_streams=None):
     """
     Creates a plot panel for the L1 rate and appends the plot and the widget using `plot_helper.plot_l1_rate_data`
 
@@ -69,10 +73,11 @@ def create_l1_rate_plot_panel(data_dict, title, id_var, var_name, value_name, xl
     - `value_name` (str) The name of the column to use as the value name (y axis of the plot)
     - `xlabel` (str) The label for the x-axis
     - `ylabel` (str) The label for the y-axis
-    - `cmap` (LinearSegmentedColormap): The colormap object based on lookup tables using linear segments.
+    - `cmap` (list): The hex colors of the palette (See `registry.linear_palette`).
     - `climit` (tuple) The limits of the colorbar
     - `template` (panel.Template) The dashboard template
     - `show_loading_msg` (bool) Whether to show the loading message or not (Only when creating the plot for the first time)
+    - `live_streams` (dict) The streams with the new data of the current night to send to the plot (See `plot_helper.plot_l1_rate_data`). None by default.
 
     Returns
     -------
@@ -93,7 +98,7 @@ def create_l1_rate_plot_panel(data_dict, title, id_var, var_name, value_name, xl
     
     else:
         plot = plot_helper.plot_l1_rate_data(data_dict, id_var, value_name,
-                        title, xlabel, ylabel, var_name, cmap, climit)
+                        title, xlabel, ylabel, var_name, cmap, climit, live_streams)
 
         c_widget = pn.widgets.DiscreteSlider
         c_widget.align = 'center'
@@ -105,7 +110,8 @@ def create_l1_rate_plot_panel(data_dict, title, id_var, var_name, value_name, xl
     return plot_panel
 
 
-def create_l0_ipr_plot_panel(data_dict, title, id_var, var_name, value_name, xlabel, ylabel, cmap, climit, template, show_loading_msg=True):
+@metrics.timed('panel')
+def create_l0_ipr_plot_panel(data_dict, title, id_var, var_name, value_name, xlabel, ylabel, cmap, climit, template, show_loading_msg=True, live_streams=None):
     """
     Creates a plot panel for the L0 pixel IPR and appends the plot and the widget using `plot_helper.plot_l0_ipr_data`
 
@@ -118,10 +124,11 @@ def create_l0_ipr_plot_panel(data_dict, title, id_var, var_name, value_name, xla
     - `value_name` (str) The name of the column to use as the value name (y axis of the plot)
     - `xlabel` (str) The label for the x-axis
     - `ylabel` (str) The label for the y-axis
-    - `cmap` (LinearSegmentedColormap): The colormap object based on lookup tables using linear segments.
+    - `cmap` (list): The hex colors of the palette (See `registry.linear_palette`).
     - `climit` (tuple) The limits of the colorbar
     - `template` (panel.Template) The dashboard template
     - `show_loading_msg` (bool) Whether to show the loading message or not (Only when creating the plot for the first time)
+    - `live_streams` (dict) The streams with the new data of the current night to send to the plot (See `plot_helper.plot_l0_ipr_data`). None by default.
 
     Returns
     -------
@@ -142,7 +149,7 @@ def create_l0_ipr_plot_panel(data_dict, title, id_var, var_name, value_name, xla
     
     else:
         plot = plot_helper.plot_l0_ipr_data(data_dict, id_var, value_name,
-                        title, xlabel, ylabel, var_name, cmap, climit)
+                        title, xlabel, ylabel, var_name, cmap, climit, live_streams)
 
         c_widget = pn.widgets.DiscreteSlider
         c_widget.align = 'center'
@@ -155,7 +162,8 @@ def create_l0_ipr_plot_panel(data_dict, title, id_var, var_name, value_name, xla
 
 
 
-def create_tib_rates_plot_panel(data_dict, title, xlabel, ylabel, template, show_loading_msg=True):
+@metrics.timed('panel')
+def create_tib_rates_plot_panel(data_dict, title, xlabel, ylabel, template, show_loading_msg=True, live_streams=None):
     """
     Creates a plot panel for the TIB rates and appends the plot using `plot_helper.plot_tib_rate_data`
 
@@ -167,6 +175,7 @@ def create_tib_rates_plot_panel(data_dict, title, xlabel, ylabel, template, show
     - `ylabel` (str) The label for the y-axis
     - `template` (panel.Template) The dashboard template
     - `show_loading_msg` (bool) Whether to show the loading message or not (Only when creating the plot for the first time)
+    - `live_streams` (dict) The streams with the new data of the current night to send to the plot (See `plot_helper.plot_tib_rate_data`). None by default.
 
     Returns
     -------
@@ -185,13 +194,14 @@ def create_tib_rates_plot_panel(data_dict, title, xlabel, ylabel, template, show
         plot_panel = pn.panel(plot, sizing_mode='stretch_width', linked_axes=False)
         
     else:
-        plot = plot_helper.plot_tib_rate_data(data_dict, title, xlabel, ylabel)
+        plot = plot_helper.plot_tib_rate_data(data_dict, title, xlabel, ylabel, live_streams)
 
         plot_panel = pn.Column(plot, sizing_mode='stretch_width')
     return plot_panel
 
 
-def create_dragon_busy_plot_panel(data, title, xlabel, ylabel, template, show_loading_msg=True):
+@metrics.timed('panel')
+def create_dragon_busy_plot_panel(data, title, xlabel, ylabel, template, show_loading_msg=True, live_streams=None):
     """
     Creates a plot panel for the Dragon busy and appends the plot using `plot_helper.plot_dragon_busy_data`
 
@@ -203,6 +213,7 @@ def create_dragon_busy_plot_panel(data, title, xlabel, ylabel, template, show_lo
     - `ylabel` (str) The label for the y-axis
     - `template` (panel.Template) The dashboard template
     - `show_loading_msg` (bool) Whether to show the loading message or not (Only when creating the plot for the first time)
+    - `live_streams` (dict) The streams with the new data of the current night to send to the plot (See `plot_helper.plot_dragon_busy_data`). None by default.
     """
     if show_loading_msg:
         dashboard_utils.update_loading_message(template, f'''<h1 style="text-align:center">Making plots...</h1> <h2 style="text-align:center">({title.split(' (')[0]})</h2> ''')
@@ -215,7 +226,7 @@ def create_dragon_busy_plot_panel(data, title, xlabel, ylabel, template, show_lo
         plot_panel = pn.panel(plot, sizing_mode='stretch_width', linked_axes=False)
         
     else:
-        plot = plot_helper.plot_dragon_busy_data(data, title, xlabel, ylabel)
+        plot = plot_helper.plot_dragon_busy_data(data, title, xlabel, ylabel, live_streams)
 
         plot_panel = pn.panel(plot, sizing_mode='stretch_width', linked_axes=False)
 
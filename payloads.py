@@ -0,0 +1,283 @@
+"""
+Serialize-once payloads of the heavy data sources of the plots. Every session showing the same night plots the same
+cached aggregates (rasters, envelopes...), but Bokeh encodes the arrays of the data sources of each session again
+when the document is sent to the browser and after every change of date. Once the store is enabled, the arrays of
+the aggregates computed from the night data cache are registered with the key of their property and night (See
+`cache.AggregateCache`), and the first encoding of each one is kept and reused by the data sources of the other
+sessions, so only the small state of each session (the selected channel, the live data of the current night...) is
+encoded again.
+
+The arrays of the data sources are usually views of the arrays of the aggregates (e.g. the image of a raster), so
+they are identified by the array that owns their memory and their position in it instead of by their content. The
+aggregates are never modified once computed, so the encoding of an array does not change while its owner is alive.
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+import pandas as pd
+
+
+class PayloadStore:
+    """
+    Thread-safe store with the encoded arrays of the cached aggregates, limited to a maximum size. It is disabled until
+    `enable` is called, and every operation does nothing when it is disabled.
+
+    The encoded arrays are removed in least recently used order when the store goes over its maximum size, and all the
+    encodings of an aggregate are removed when it is garbage collected.
+    """
+
+    def __init__(self):
+        self.max_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._owners = {}
+        self._serials_alive = set()
+        self._payloads = OrderedDict()
+        self._nbytes = 0
+        self._serials = count()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def enable(self, max_mb):
+        """
+        Enable the store and make Bokeh use it when encoding the arrays of the data sources.
+
+        Parameters
+        ----------
+        - `max_mb` (int) The maximum size of the encoded arrays in MB. 0 to keep the store disabled.
+        """
+        self.max_bytes = max_mb * 2**20
+
+        if self.enabled:
+            install()
+
+    def share(self, aggregate, key):
+        """
+        Register the arrays of an aggregate, so their encodings are reused by the data sources of every session.
+
+        Parameters
+        ----------
+        - `aggregate` The aggregate: an array, a dataframe, a HoloViews element or a tuple of them.
+        - `key` (tuple) The key of the aggregate, with its kind, the key of its night data and its parameters.
+        """
+        if not self.enabled:
+            return
+
+        for array in iter_arrays(aggregate):
+            owner = get_owner(array)
+
+            if owner.dtype.kind == 'O':
+                continue
+
+            with self._lock:
+                if id(owner) in self._owners:
+                    continue
+
+                serial = next(self._serials)
+                self._owners[id(owner)] = (weakref.ref(owner), serial, key)
+                self._serials_alive.add(serial)
+
+            # Remove the encodings of the array when the aggregate is garbage collected
+            weakref.finalize(owner, self._remove_owner, id(owner), serial)
+
+    def encode(self, array, buffers, transform):
+        """
+        Get the encoding of an array of a data source, encoding it if it is not stored.
+
+        Parameters
+        ----------
+        - `array` (numpy.ndarray) The array of the data source.
+        - `buffers` (list) The binary buffers of the message, where the encoded array is added. None to encode it as base64.
+        - `transform` (callable) The function of Bokeh encoding the array (See `bokeh.util.serialization.transform_array`).
+
+        Returns
+        ----------
+        - `encoded` (dict) The encoded array, or None if it is not the array of a registered aggregate.
+        """
+        owner = get_owner(array)
+
+        with self._lock:
+            entry = self._owners.get(id(owner))
+
+        if entry is None or entry[0]() is not owner:
+            return None
+
+        position = (array.__array_interface__['data'][0] - owner.__array_interface__['data'][0], array.shape, array.strides, array.dtype.str)
+        payload_key = (entry[1], position, buffers is not None)
+
+        with self._lock:
+            payload = self._payloads.get(payload_key)
+
+            if payload is not None:
+                self._payloads.move_to_end(payload_key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if payload is None:
+            if buffers is None:
+                encoded = transform(array)
+                payload = (encoded, None, len(encoded.get('__ndarray__', '')) if isinstance(encoded, dict) else 0)
+            else:
+                array_buffers = []
+                encoded = transform(array, buffers=array_buffers)
+                payload = (encoded, array_buffers[0][1], len(array_buffers[0][1])) if array_buffers else (encoded, None, 0)
+
+            if isinstance(encoded, dict) and payload[2] <= self.max_bytes:
+                self._store(payload_key, payload)
+
+        encoded, data, _ = payload
+
+        if not isinstance(encoded, dict):
+            return encoded
+
+        if data is None:
+            return dict(encoded)
+
+        # Every message refers to its binary buffers with its own ids
+        from bokeh.util.serialization import make_id
+
+        buffer_id = make_id()
+        buffers.append((dict(id=buffer_id), data))
+
+        return dict(encoded, __buffer__=buffer_id)
+
+    def _store(self, payload_key, payload):
+        with self._lock:
+            if payload_key in self._payloads or payload_key[0] not in self._serials_alive:
+                return
+
+            self._payloads[payload_key] = payload
+            self._nbytes += payload[2]
+
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._payloads.popitem(last=False)
+                self._nbytes -= evicted[2]
+
+    def _remove_owner(self, owner_id, serial):
+        with self._lock:
+            entry = self._owners.get(owner_id)
+
+            if entry is not None and entry[1] == serial:
+                del self._owners[owner_id]
+
+            self._serials_alive.discard(serial)
+
+            for payload_key in [payload_key for payload_key in self._payloads if payload_key[0] == serial]:
+                self._nbytes -= self._payloads.pop(payload_key)[2]
+
+    def clear(self):
+        """
+        Remove all the encoded arrays. The aggregates stay registered, so they are encoded again when needed.
+
+        Returns
+        ----------
+        - `freed` (int) The size in bytes of the removed encodings.
+        """
+        with self._lock:
+            freed = self._nbytes
+            self._payloads.clear()
+            self._nbytes = 0
+
+        return freed
+
+    def nbytes(self):
+        """
+        Get the size of the encoded arrays.
+
+        Returns
+        ----------
+        - `nbytes` (int) The size in bytes.
+        """
+        with self._lock:
+            return self._nbytes
+
+    def __len__(self):
+        with self._lock:
+            return len(self._payloads)
+
+
+def get_owner(array):
+    """
+    Get the array that owns the memory of an array, which is the array itself when it is not a view.
+
+    Parameters
+    ----------
+    - `array` (numpy.ndarray) The array.
+
+    Returns
+    ----------
+    - `owner` (numpy.ndarray) The array owning the memory.
+    """
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+
+    return array
+
+
+def iter_arrays(aggregate):
+    """
+    Iterate over the arrays of an aggregate.
+
+    Parameters
+    ----------
+    - `aggregate` The aggregate: an array, a dataframe, a HoloViews element (with pandas or xarray data) or a tuple of them.
+
+    Returns
+    ----------
+    - `arrays` (generator) The arrays of the aggregate.
+    """
+    if isinstance(aggregate, np.ndarray):
+        yield aggregate
+    elif isinstance(aggregate, pd.DataFrame):
+        yield aggregate.index.to_numpy()
+
+        for column in aggregate.columns:
+            yield aggregate[column].to_numpy()
+    elif isinstance(aggregate, (tuple, list)):
+        for item in aggregate:
+            yield from iter_arrays(item)
+    elif hasattr(aggregate, 'kdims') and hasattr(aggregate, 'data'):
+        yield from iter_arrays(aggregate.data)
+    elif hasattr(aggregate, 'variables'):
+        # xarray dataset, e.g. the data of a rasterized plot
+        for variable in aggregate.variables.values():
+            yield from iter_arrays(variable.values)
+
+
+def install():
+    """
+    Make Bokeh encode the arrays of the data sources with the store. The arrays not registered by any aggregate are
+    encoded by Bokeh as usual.
+    """
+    from bokeh.util import serialization
+
+    if getattr(serialization.transform_array, 'payload_store', None) is not None:
+        return
+
+    bokeh_transform_array = serialization.transform_array
+
+    def transform_array(array, force_list=False, buffers=None):
+        if not force_list and isinstance(array, np.ndarray):
+            encoded = store.encode(array, buffers, bokeh_transform_array)
+
+            if encoded is not None:
+                return encoded
+
+        return bokeh_transform_array(array, force_list=force_list, buffers=buffers)
+
+    transform_array.payload_store = store
+    serialization.transform_array = transform_array
+
+
+store = PayloadStore()
+"""
+Process-wide store with the encoded arrays of the cached aggregates
+"""
@@ -1,9 +1,22 @@
 """
 HoloViz plots management module. We are using hvPlot (<https://hvplot.holoviz.org>) and Holoviews (<https://holoviews.org>) to create the plots.
 """
+import warnings
+
+import numpy as np
 import pandas as pd
 import holoviews as hv # noqa
 
+# Application modules
+import cache
+import metrics
+import profiling
+
+TIB_RATE_COLORS = {'tib_busy_rate': '#1f77b4', 'tib_calibration_rate': '#ff7f0e', 'tib_camera_rate': '#2ca02c',
+                   'tib_local_rate': '#d62728', 'tib_pedestal_rate': '#9467bd'}
+"""
+Color of the line of each TIB rate, shared by the lines of the night and the lines streamed for the current night
+"""
 
 def hvplot_df_line(df:pd.DataFrame, x:str, y:str, title:str, dic_opts:dict, color:str='green'):
     """
@@ -95,7 +108,7 @@ def hvplot_df_max_min_avg_line(df, x, title, dic_opts, category):
 
 
 
-def hvplot_df_scatter(df, x, y, title, color, size, marker, dic_opts, cmap="reds", groupby=None, datashade=False, rasterize=False, dynamic=True):
+def hvplot_df_scatter(df, x, y, title, color, size, marker, dic_opts, cmap="reds", groupby=None, datashade=False, rasterize=False, dynamic=True, pipe=None):
     """
     Plots a scatter graph - using hvPlot - from a pandas dataframe.
 
@@ -109,11 +122,12 @@ def hvplot_df_scatter(df, x, y, title, color, size, marker, dic_opts, cmap="reds
     - `size` (int): The size of the points.
     - `marker` (str): The marker of the points.
     - `dic_opts` (dict): A dictionary with the options to pass to the plot created with hvPlot. See more at <https://hvplot.holoviz.org/user_guide/Customization.html>
-    - `cmap` (LinearSegmentedColormap): The colormap object based on lookup tables using linear segments.
+    - `cmap` (list or str): The hex colors of the palette (See `registry.linear_palette`) or the name of a colormap.
     - `groupby` (str): The name of the dataframe column to use to group the points.
     - `datashade` (bool): Whether to use datashade or not.
     - `rasterize` (bool): Whether to use rasterize or not.
     - `dynamic` (bool): Whether to use dynamic or not.
+    - `pipe` (holoviews.streams.Pipe): Pipe replacing the rasterized points with the rasters sent to it (See `create_live_raster_pipe`). None by default.
 
     Returns
     ----------
@@ -123,6 +137,18 @@ def hvplot_df_scatter(df, x, y, title, color, size, marker, dic_opts, cmap="reds
         plot = df.hvplot.scatter(x=x, y=y, title=title, color=color, label='selected ' + groupby,
                                  size=size, marker=marker, cmap=cmap, groupby=groupby, datashade=datashade, rasterize=rasterize, dynamic=dynamic, responsive=True, min_height=400, muted_alpha=0)
 
+    elif groupby is None and datashade == False and dynamic == False and color == y:
+        # The rasterized points are shared by all the plots of the same data, only the options are set for this plot
+        raster = rasterize_scatter(df, x, y)
+
+        if pipe is None:
+            plot = raster.clone().opts(title=title, cmap=cmap)
+        else:
+            def live_raster(data):
+                return (raster if data is None else data).clone().opts(title=title, cmap=cmap).opts(**dic_opts)
+
+            plot = hv.DynamicMap(live_raster, streams=[pipe])
+
     else:
         plot = df.hvplot.scatter(x=x, y=y, title=title, color=color,
                                  marker=marker, cmap=cmap, groupby=groupby, datashade=datashade, rasterize=rasterize, dynamic=dynamic, responsive=True, min_height=400)
@@ -151,6 +177,470 @@ def create_empty_plot():
 
 
 
+def create_live_buffer(length=2000):
+    """
+    Creates a HoloViews buffer stream to push the max, min and avg values of the new data of the current night to a plot.
+
+    Parameters
+    ----------
+    - `length` (int): The maximum number of rows kept in the buffer. By default, more than a night of minute data.
+
+    Returns
+    ----------
+    - `buffer` (holoviews.streams.Buffer): The buffer stream. See more at <https://holoviews.org/user_guide/Streaming_Data.html>
+    """
+    example = pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'), 'max': pd.Series(dtype='float64'),
+                            'min': pd.Series(dtype='float64'), 'avg': pd.Series(dtype='float64')})
+
+    return hv.streams.Buffer(example, length=length, index=False)
+
+
+def create_live_rows_buffer(columns, length=2000):
+    """
+    Creates a HoloViews buffer stream to push the new rows of a property of the current night to a plot.
+
+    Parameters
+    ----------
+    - `columns` (list): Tuples with the name and the dtype of each column of the rows, the date first.
+    - `length` (int): The maximum number of rows kept in the buffer. By default, more than a night of minute data of a scalar property.
+
+    Returns
+    ----------
+    - `buffer` (holoviews.streams.Buffer): The buffer stream. See more at <https://holoviews.org/user_guide/Streaming_Data.html>
+    """
+    example = pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in columns})
+
+    return hv.streams.Buffer(example, length=length, index=False)
+
+
+def create_live_raster_pipe():
+    """
+    Creates a HoloViews pipe stream to replace the rasterized points of all the channels or modules of a plot with the
+    raster of the data of the current night, every time new data arrives (See `hvplot_df_scatter`).
+
+    Returns
+    ----------
+    - `pipe` (holoviews.streams.Pipe): The pipe stream, without data until the first raster is sent.
+    """
+    return hv.streams.Pipe(data=None)
+
+
+def plot_live_spikes(buffer, spike_length, color):
+    """
+    Plots a spike at the date of each row streamed to a buffer (e.g. the rate controls), without legend.
+
+    Parameters
+    ----------
+    - `buffer` (holoviews.streams.Buffer): The buffer stream created with `create_live_rows_buffer`.
+    - `spike_length` (float): The length of the spikes.
+    - `color` (str): The color of the spikes.
+
+    Returns
+    ----------
+    - `dynamic_map` (holoviews.core.spaces.DynamicMap): A DynamicMap instance from Holoviews updated every time new data is sent to the buffer.
+    """
+    def live_spikes(data):
+        return hv.Spikes(data['date']).opts(alpha=1, spike_length=spike_length, line_width=2, line_color=color, muted_alpha=0, show_legend=False)
+
+    return hv.DynamicMap(live_spikes, streams=[buffer])
+
+
+def plot_live_line(buffer, color):
+    """
+    Plots a line of the rows of a scalar property streamed to a buffer, without legend.
+
+    Parameters
+    ----------
+    - `buffer` (holoviews.streams.Buffer): The buffer stream created with `create_live_rows_buffer`, with the date and the value columns.
+    - `color` (str): The color of the line.
+
+    Returns
+    ----------
+    - `dynamic_map` (holoviews.core.spaces.DynamicMap): A DynamicMap instance from Holoviews updated every time new data is sent to the buffer.
+    """
+    y = buffer.data.columns[-1]
+
+    def live_line(data):
+        return hv.Curve(data, 'date', y).opts(color=color, muted_alpha=0, show_legend=False)
+
+    return hv.DynamicMap(live_line, streams=[buffer])
+
+
+def plot_live_min_max_avg(buffer, x):
+    """
+    Plots the max, min and avg lines of the data streamed to a buffer. Only the new rows sent to the buffer are
+    transferred to the browser.
+
+    Parameters
+    ----------
+    - `buffer` (holoviews.streams.Buffer): The buffer stream created with `create_live_buffer`.
+    - `x` (str): The name of the column to use as x axis.
+
+    Returns
+    ----------
+    - `dynamic_map` (holoviews.core.spaces.DynamicMap): A DynamicMap instance from Holoviews updated every time new data is sent to the buffer.
+    """
+    def live_lines(data):
+        max_line = hv.Curve(data, x, 'max', label='max').opts(color='red', alpha=1, muted_alpha=0)
+        mean_line = hv.Curve(data, x, 'avg', label='avg').opts(color='black', alpha=1, muted_alpha=0)
+        min_line = hv.Curve(data, x, 'min', label='min').opts(color='blue', alpha=1, muted_alpha=0)
+
+        return max_line * mean_line * min_line
+
+    return hv.DynamicMap(live_lines, streams=[buffer])
+
+
+class RangeAggregate:
+    """
+    Aggregates of the data of a property over a range of nights, updated one night after another. The values are
+    binned in a fixed number of time bins covering the whole range, keeping the max, min and average of all the
+    channels or modules in each bin and a raster with the number of values in each time and value bin. The memory
+    used depends on the number of bins, not on the rows of the nights.
+    """
+
+    def __init__(self, start, end, value_range, time_bins=1200, value_bins=300):
+        """
+        Parameters
+        ----------
+        - `start` (dt.datetime): The start of the range, usually the start of its first night. The values before it are not added.
+        - `end` (dt.datetime): The end of the range, usually the end of its last night. The values from it on are not added.
+        - `value_range` (tuple): The min and max values of the raster. The values out of the range are counted in its first or last value bin.
+        - `time_bins` (int): The number of time bins.
+        - `value_bins` (int): The number of value bins of the raster.
+        """
+        self.time_bins = time_bins
+        self.value_bins = value_bins
+        self.value_range = value_range
+        self.rows = 0
+
+        self._start = pd.Timestamp(start).value
+        self._span = pd.Timestamp(end).value - self._start
+        self.seconds_per_bin = self._span / time_bins / 1e9
+        self._counts = np.zeros((value_bins, time_bins), dtype='uint32')
+        self._max = np.full(time_bins, np.nan)
+        self._min = np.full(time_bins, np.nan)
+        self._sum = np.zeros(time_bins)
+        self._count = np.zeros(time_bins, dtype='int64')
+
+        time_edges = self._start + np.linspace(0, self._span, time_bins + 1)
+        value_edges = np.linspace(value_range[0], value_range[1], value_bins + 1)
+        self.dates = ((time_edges[:-1] + time_edges[1:]) / 2).astype('int64').astype('datetime64[ns]')
+        self.values = (value_edges[:-1] + value_edges[1:]) / 2
+
+    @profiling.profiled('aggregate')
+    @metrics.timed('range_aggregate')
+    def add(self, df, y):
+        """
+        Adds the data of a night to the aggregates.
+
+        Parameters
+        ----------
+        - `df` (pandas.DataFrame): The data of the night, indexed by date.
+        - `y` (str): The name of the column with the values.
+        """
+        if df.empty:
+            return
+
+        times = df.index.values.astype('datetime64[ns]').view('int64')
+        values = df[y].values.astype('float64')
+        valid = ~np.isnan(values) & self._in_range(times)
+        times, values = times[valid], values[valid]
+
+        time_index = self._get_time_index(times)
+        self._add_to_raster(time_index, values)
+
+        grouped = pd.DataFrame({'bin': time_index, 'value': values}).groupby('bin')['value'].agg(['max', 'min', 'sum', 'count'])
+        bins = grouped.index.values
+
+        self._max[bins] = np.fmax(self._max[bins], grouped['max'].values)
+        self._min[bins] = np.fmin(self._min[bins], grouped['min'].values)
+        self._sum[bins] += grouped['sum'].values
+        self._count[bins] += grouped['count'].values
+        self.rows += len(values)
+
+    @profiling.profiled('aggregate')
+    @metrics.timed('range_aggregate')
+    def add_buckets(self, dates, stats):
+        """
+        Adds the buckets of a level of the time pyramid of a night to the aggregates (See `rollups.load_buckets`). The
+        raster counts the mean of each channel or module in each bucket, and the max, min and average lines use the
+        max, min and mean of the buckets.
+
+        Parameters
+        ----------
+        - `dates` (numpy.ndarray): The middle datetime of each bucket.
+        - `stats` (numpy.ndarray): The min, max and mean of each channel or module in each bucket (See `rollups.BUCKET_STATS`).
+        """
+        times = dates.astype('datetime64[ns]').view('int64')
+        in_range = self._in_range(times)
+        times, stats = times[in_range], stats[:, in_range].astype('float64')
+
+        if stats.size == 0:
+            return
+
+        time_index = self._get_time_index(times)
+        means = stats[2]
+        valid = ~np.isnan(means)
+        self._add_to_raster(np.broadcast_to(time_index[:, np.newaxis], means.shape)[valid], means[valid])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+
+            np.fmax.at(self._max, time_index, np.nanmax(stats[1], axis=1))
+            np.fmin.at(self._min, time_index, np.nanmin(stats[0], axis=1))
+
+        np.add.at(self._sum, time_index, np.where(valid, means, 0).sum(axis=1))
+        np.add.at(self._count, time_index, valid.sum(axis=1))
+        self.rows += int(valid.sum())
+
+    def _in_range(self, times):
+        return (times >= self._start) & (times < self._start + self._span)
+
+    def _get_time_index(self, times):
+        return ((times - self._start) / self._span * self.time_bins).astype('int64').clip(0, self.time_bins - 1)
+
+    def _add_to_raster(self, time_index, values):
+        value_position = (values - self.value_range[0]) / (self.value_range[1] - self.value_range[0]) * self.value_bins
+        value_index = value_position.clip(0, self.value_bins - 1).astype('int64')
+
+        self._counts += np.bincount(value_index * self.time_bins + time_index,
+                                    minlength=self.value_bins * self.time_bins).reshape(self.value_bins, self.time_bins).astype('uint32')
+
+    def snapshot(self):
+        """
+        Get a copy of the current aggregates, to be sent to the plots (See `plot_range_data`).
+
+        Returns
+        ----------
+        - `data` (dict): The `image` tuple with the dates, values and counts of the raster (NaN when there are no values),
+        and the `envelope` dataframe with the max, min and avg values of each time bin (NaN when there are no values).
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg = self._sum / self._count
+
+        counts = self._counts.astype('float64')
+        counts[counts == 0] = np.nan
+
+        return {'image': (self.dates, self.values, counts),
+                'envelope': pd.DataFrame({'date': self.dates, 'max': self._max.copy(), 'min': self._min.copy(), 'avg': avg})}
+
+
+def create_range_pipe(aggregate):
+    """
+    Creates a HoloViews pipe stream to send the aggregates of a range of nights to a plot as they are updated.
+
+    Parameters
+    ----------
+    - `aggregate` (RangeAggregate): The aggregates of the range, whose current state is the initial data of the pipe.
+
+    Returns
+    ----------
+    - `pipe` (holoviews.streams.Pipe): The pipe stream. See more at <https://holoviews.org/user_guide/Streaming_Data.html>
+    """
+    return hv.streams.Pipe(data=aggregate.snapshot())
+
+
+def plot_range_data(pipe, y, title, xlabel, ylabel, cmap_custom, on_zoom=None):
+    """
+    Composite plot of a property over a range of nights, redrawn every time new aggregates are sent to the pipe:
+      - max, min and average lines of each time bin
+      - The raster with the number of values of all the channels or modules in each time and value bin
+
+    Parameters
+    ----------
+    - `pipe` (holoviews.streams.Pipe): The pipe stream created with `create_range_pipe`.
+    - `y` (str): The name of the values.
+    - `title` (str): The title of the plot.
+    - `xlabel` (str): The label of the x axis.
+    - `ylabel` (str): The label of the y axis.
+    - `cmap_custom` (list): The hex colors of the palette (See `registry.linear_palette`).
+    - `on_zoom` (callable): Function called with the new x range (tuple of datetimes) every time the user zooms or pans the plot. Defaults to None.
+
+    Returns
+    ----------
+    - `dynamic_map` (holoviews.core.spaces.DynamicMap): A DynamicMap instance from Holoviews updated every time new data is sent to the pipe.
+    """
+    def raster_plot(data):
+        # The color limits are given, since the log color mapper cannot find them before any night is added
+        counts = data['image'][2]
+        max_count = np.nanmax(counts) if np.isfinite(counts).any() else 1
+
+        return hv.Image(data['image'], kdims=['date', y], vdims=['count']).opts(cmap=cmap_custom, cnorm='log', clim=(1, max(max_count, 2)), colorbar=True,
+                                                                                alpha=0.6, tools=['hover'])
+
+    def envelope_plots(data):
+        envelope = data['envelope']
+
+        max_line = hv.Curve(envelope, 'date', ('max', y), label='max').opts(color='red', alpha=1, muted_alpha=0)
+        mean_line = hv.Curve(envelope, 'date', ('avg', y), label='avg').opts(color='black', alpha=1, muted_alpha=0)
+        min_line = hv.Curve(envelope, 'date', ('min', y), label='min').opts(color='blue', alpha=1, muted_alpha=0)
+
+        return max_line * mean_line * min_line
+
+    def zoom(x_range):
+        # Bokeh sends the datetimes of the axis as milliseconds since the epoch
+        if x_range is not None:
+            on_zoom(tuple((pd.Timestamp(x, unit='ms') if isinstance(x, (int, float)) else pd.Timestamp(x)).to_pydatetime() for x in x_range))
+
+    # The raster has its own DynamicMap, since HoloViews only links the streams to the DynamicMaps returning a single element.
+    # The x range is only watched, so zooming does not redraw the plot until new aggregates are sent to the pipe
+    raster_map = hv.DynamicMap(raster_plot, streams=[pipe])
+
+    if on_zoom is not None:
+        hv.streams.RangeX(source=raster_map).add_subscriber(zoom)
+
+    dynamic_map = raster_map * hv.DynamicMap(envelope_plots, streams=[pipe])
+
+    return dynamic_map.opts(title=title, xlabel=xlabel, ylabel=ylabel, legend_position='top', responsive=True, min_height=500, hooks=[disable_logo],
+                            show_grid=True, legend_opts={"click_policy": "hide"})
+
+
+@metrics.timed('plot')
+def plot_trend_data(df, title, xlabel, ylabel):
+    """
+    Plot the nightly statistics of a channel or module over a range of nights (See `rollups.load_trend`). It shows:
+        - The band between the 5th and 95th percentiles of each night
+        - The max and min lines
+        - The mean and median lines
+
+    Parameters
+    ----------
+    - `df` (pandas.DataFrame): The statistics of each night, indexed by night.
+    - `title` (str): Title of the plot
+    - `xlabel` (str): Label for the x axis
+    - `ylabel` (str): Label for the y axis
+
+    Returns
+    -------
+    - `composite_plot` (holoviews.core.overlay.Overlay): The composited plots.
+    """
+    df = df.reset_index()
+
+    band_plot = hv.Area(df, 'night', ['p05', 'p95'], label='5-95 percentiles').opts(color='purple', alpha=0.25, line_alpha=0, muted_alpha=0)
+    max_line = hv.Curve(df, 'night', 'max', label='max').opts(color='red', line_dash='dashed', muted_alpha=0)
+    min_line = hv.Curve(df, 'night', 'min', label='min').opts(color='blue', line_dash='dashed', muted_alpha=0)
+    median_line = hv.Curve(df, 'night', 'p50', label='median').opts(color='purple', muted_alpha=0)
+    mean_line = hv.Curve(df, 'night', 'mean', label='mean').opts(color='black', muted_alpha=0)
+    mean_points = hv.Scatter(df, 'night', ['mean', 'min', 'max', 'p05', 'p50', 'p95', 'count']).opts(color='black', size=4, tools=['hover'])
+
+    composite_plot = band_plot * max_line * min_line * median_line * mean_line * mean_points
+
+    return composite_plot.opts(title=title, xlabel=xlabel, ylabel=ylabel, legend_position='top', responsive=True, min_height=500, hooks=[disable_logo],
+                               show_grid=True, legend_opts={"click_policy": "hide"})
+
+
+@metrics.timed('plot')
+def plot_correlation_data(image, title, xlabel, ylabel, cmap_custom, highlight=None, highlight_label=''):
+    """
+    Plot the rasterized scatter of two properties of a night (See `correlation.bin_pairs`), with the pairs of values of
+    a channel or module on top of it.
+
+    Parameters
+    ----------
+    - `image` (tuple): The centers of the bins of each axis and the number of pairs of values in each bin.
+    - `title` (str): Title of the plot
+    - `xlabel` (str): Label for the x axis
+    - `ylabel` (str): Label for the y axis
+    - `cmap_custom` (list): The hex colors of the palette (See `registry.linear_palette`).
+    - `highlight` (tuple): The values of both properties of the channel or module shown on top. None by default.
+    - `highlight_label` (str): The label of the channel or module shown on top.
+
+    Returns
+    -------
+    - `composite_plot` (holoviews.core.overlay.Overlay): The composited plots.
+    """
+    counts = image[2]
+    max_count = np.nanmax(counts) if np.isfinite(counts).any() else 1
+
+    composite_plot = hv.Image(image, kdims=['x', 'y'], vdims=['count']).opts(cmap=cmap_custom, cnorm='log', clim=(1, max(max_count, 2)),
+                                                                            colorbar=True, alpha=0.8, tools=['hover'])
+
+    # The scatter is empty when no channel or module is selected, so the plot is always an overlay
+    highlight_plot = hv.Scatter(highlight if highlight is not None else [], 'x', 'y', label=highlight_label if highlight is not None else '')
+    composite_plot = composite_plot * highlight_plot.opts(color='purple', size=4, alpha=0.6, muted_alpha=0)
+
+    return composite_plot.opts(title=title, xlabel=xlabel, ylabel=ylabel, legend_position='top', responsive=True, min_height=500, hooks=[disable_logo],
+                               show_grid=True, legend_opts={"click_policy": "hide"})
+
+
+@metrics.timed('plot')
+def plot_module_data(image, title, xlabel, ylabel, cmap_custom, clim, on_tap=None):
+    """
+    Plot the values of a pixel property reduced to the modules of the camera as an image, with a row per module (See
+    `camera.get_module_image`).
+
+    Parameters
+    ----------
+    - `image` (tuple): The dates of the columns, the modules of the rows and the values.
+    - `title` (str): Title of the plot
+    - `xlabel` (str): Label for the x axis
+    - `ylabel` (str): Label of the values, shown in the colorbar
+    - `cmap_custom` (list): The hex colors of the palette (See `registry.linear_palette`).
+    - `clim` (tuple): The limits of the colormap.
+    - `on_tap` (callable): Function called with the module (int) every time the user clicks the plot. Defaults to None.
+
+    Returns
+    -------
+    - `image_plot` (holoviews.element.Image): The image.
+    """
+    image_plot = hv.Image(image, kdims=['date', 'module'], vdims=[('value', ylabel)]).opts(
+        title=title, xlabel=xlabel, ylabel='Module ID', cmap=cmap_custom, clim=clim, colorbar=True, clipping_colors={'NaN': 'transparent'},
+        tools=['hover', 'tap'], responsive=True, min_height=500, hooks=[disable_logo])
+
+    def tap(x, y):
+        if y is not None:
+            on_tap(int(round(y)))
+
+    if on_tap is not None:
+        hv.streams.Tap(source=image_plot).add_subscriber(tap)
+
+    return image_plot
+
+
+@metrics.timed('plot')
+def plot_module_pixels(dates, channels, values, module_values, title, xlabel, ylabel, statistic, module_property=None):
+    """
+    Plot the values of the pixels of a module and their statistic, optionally above a property of the same module.
+
+    Parameters
+    ----------
+    - `dates` (numpy.ndarray): The dates of the values.
+    - `channels` (numpy.ndarray): The channels of the pixels of the module.
+    - `values` (numpy.ndarray): The values of the pixels, with a row per date and a column per channel.
+    - `module_values` (numpy.ndarray): The statistic of the pixels of the module for each date.
+    - `title` (str): Title of the plot
+    - `xlabel` (str): Label for the x axis
+    - `ylabel` (str): Label for the y axis
+    - `statistic` (str): The statistic of the pixels (mean, max...)
+    - `module_property` (tuple): The dates, values, title and y label of the property of the module plotted below. None by default.
+
+    Returns
+    -------
+    - `composite_plot` (holoviews.core.overlay.Overlay or holoviews.core.layout.Layout): The plot of the pixels, and the
+    plot of the property of the module below it when given, sharing the x axis.
+    """
+    pixel_lines = [hv.Curve((dates, values[:, i]), 'date', ('value', ylabel), label=f'channel {channel}').opts(alpha=0.8, muted_alpha=0)
+                   for i, channel in enumerate(channels)]
+    module_line = hv.Curve((dates, module_values), 'date', ('value', ylabel), label=f'module {statistic}').opts(color='black', line_dash='dashed',
+                                                                                                             line_width=2, muted_alpha=0)
+
+    composite_plot = hv.Overlay(pixel_lines + [module_line]).opts(
+        title=title, xlabel=xlabel, ylabel=ylabel, legend_position='right', responsive=True, min_height=350, hooks=[disable_logo],
+        show_grid=True, legend_opts={"click_policy": "mute"})
+
+    if module_property is None:
+        return composite_plot
+
+    property_dates, property_values, property_title, property_ylabel = module_property
+    property_plot = hv.Curve((property_dates, property_values), 'date', ('module_value', property_ylabel)).opts(
+        title=property_title, xlabel=xlabel, ylabel=property_ylabel, color='purple', responsive=True, min_height=250, hooks=[disable_logo],
+        show_grid=True)
+
+    return (composite_plot + property_plot).cols(1)
+
+
+@profiling.profiled('aggregate')
+@metrics.timed('min_max_avg')
 def build_min_max_avg(df, x, y, category):
     """
     Builds a dataframe with the max, min and avg values for each date.
@@ -246,6 +736,79 @@ def build_min_max_avg(df, x, y, category):
     return df_agg
 
 
+def get_min_max_avg(df, x, y, category):
+    """
+    Gets the dataframe with the max, min and avg values for each date (See `build_min_max_avg`) from the shared aggregates cache,
+    building it in case it is not cached.
+
+    Parameters
+    ----------
+    - `df` (pandas.DataFrame): The dataframe to process.
+    - `x` (str): The name of the column to use as x axis.
+    - `y` (str): The name of the column to use as y axis.
+    - `category` (str): The name of the variable to plot (channel, module...)
+
+    Returns
+    ----------
+    - `df_agg` (pandas.DataFrame): The dataframe with the max, min and avg values for each date.
+    """
+    return cache.aggregates.get_or_compute('envelope', df, (x, y, category), lambda: build_min_max_avg(df, x, y, category))
+
+
+@profiling.profiled('aggregate')
+def rasterize_scatter(df, x, y):
+    """
+    Rasterizes the scattered points for all groups/var names available in the dataframe (channels, modules...), colored by the y value.
+    The rasterized plot is stored in the shared aggregates cache, so it should be cloned before setting any option on it.
+
+    Parameters
+    ----------
+    - `df` (pandas.DataFrame): The dataframe to plot.
+    - `x` (str): The name of the dataframe column to use as x axis.
+    - `y` (str): The name of the dataframe column to use as y axis and color.
+
+    Returns
+    ----------
+    - `plot` (holoviews.element.raster.Image): The rasterized plot created with hvPlot.
+    """
+    return cache.aggregates.get_or_compute('raster', df, (x, y), lambda: df.hvplot.scatter(x=x, y=y, color=y, rasterize=True, dynamic=False,
+                                                                                           responsive=True, min_height=400),
+                                           dump=dump_image, load=load_image)
+
+
+def dump_image(image):
+    """
+    Converts a HoloViews image to a tuple that can be stored in the cache shared by the worker processes.
+    The options of the image are not kept when it is pickled, so they are stored separately.
+
+    Parameters
+    ----------
+    - `image` (holoviews.element.raster.Image): The image to convert.
+
+    Returns
+    ----------
+    - `state` (tuple): The data, key dimensions, value dimensions and options of the image.
+    """
+    return (image.data, image.kdims, image.vdims, dict(image.opts.get().kwargs))
+
+
+def load_image(state):
+    """
+    Creates a HoloViews image from a tuple created with `dump_image`.
+
+    Parameters
+    ----------
+    - `state` (tuple): The data, key dimensions, value dimensions and options of the image.
+
+    Returns
+    ----------
+    - `image` (holoviews.element.raster.Image): The image.
+    """
+    data, kdims, vdims, options = state
+
+    return hv.Image(data, kdims=kdims, vdims=vdims).opts(**options)
+
+
 def disable_logo(plot, element):
     """
     Hook to disable the Bokeh logo in the plot.
@@ -257,7 +820,9 @@ def disable_logo(plot, element):
     """
     plot.state.toolbar.logo = None
 
-def multiplot_grouped_data(data, x, y, title, xlabel, ylabel, groupby, cmap_custom, clim):
+@profiling.profiled('plot')
+@metrics.timed('plot')
+def multiplot_grouped_data(data, x, y, title, xlabel, ylabel, groupby, cmap_custom, clim, live_streams=None):
     """
     Composite Plot with:
       - max, min and average lines
@@ -274,16 +839,19 @@ def multiplot_grouped_data(data, x, y, title, xlabel, ylabel, groupby, cmap_cust
     - `xlabel` (str): The label of the x axis.
     - `ylabel` (str): The label of the y axis.
     - `groupby` (str): The name of the variable to plot (channel, module...)
-    - `cmap_custom` (LinearSegmentedColormap): The colormap object based on lookup tables using linear segments.
+    - `cmap_custom` (list): The hex colors of the palette (See `registry.linear_palette`).
     - `clim` (tuple): The min and max values for the colormap.
+    - `live_streams` (dict): The streams of the new data of the current night: the `envelope` buffer (See `create_live_buffer`) and the `raster` pipe (See `create_live_raster_pipe`). None by default.
 
     Returns
     ----------
     - `composite_plot` (holoviews.core.overlay.Overlay): The composited plots created with hvPlot.
     """
 
+    live_streams = live_streams or {}
+
     # Build a pandas dataframe from the original dataframe and select the min and max values for each date
-    df_with_min_max_avg = build_min_max_avg(data, x, y, groupby)
+    df_with_min_max_avg = get_min_max_avg(data, x, y, groupby)
     
     # Just for debugging purposes: Check if we have duplicated indexes (dates) in the dataframe
     # print(df_with_min_max_avg[df_with_min_max_avg.index.duplicated(keep=False)])
@@ -301,16 +869,23 @@ def multiplot_grouped_data(data, x, y, title, xlabel, ylabel, groupby, cmap_cust
 
     # Plot scatter from data for all channels (rasterized)
     all_channels_scatter_plot = hvplot_df_scatter(data, x=x, y=y, title=title, color=y, cmap=cmap_custom,  size=20, marker='o', dic_opts={
-                                                  'padding': 0.1, 'tools': [''], 'xlabel': xlabel, 'alpha': 0.15, 'ylabel': ylabel, 'clim': clim}, rasterize=True, dynamic=False)
+                                                  'padding': 0.1, 'tools': [''], 'xlabel': xlabel, 'alpha': 0.15, 'ylabel': ylabel, 'clim': clim}, rasterize=True, dynamic=False,
+                                                  pipe=live_streams.get('raster'))
 
     # Create a composite plot with all the plots merged
     composite_plot = lines_plot * single_channel_scatter_plot  * max_line_plot * all_channels_scatter_plot
 
+    # Lines with the new data streamed for the current night
+    if 'envelope' in live_streams:
+        composite_plot = composite_plot * plot_live_min_max_avg(live_streams['envelope'], x)
+
     return composite_plot.opts(legend_position='top', responsive=True, min_height=500, hooks=[disable_logo], show_grid=True, legend_opts={"click_policy": "hide"},)
 
 
 
-def plot_l1_rate_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_custom, clim):
+@profiling.profiled('plot')
+@metrics.timed('plot')
+def plot_l1_rate_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_custom, clim, live_streams=None):
     """
     Composite plot for L1 rate data. It shows:
         - max, min and average lines
@@ -338,8 +913,10 @@ def plot_l1_rate_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_cust
     - `xlabel` (str): The label of the x axis.
     - `ylabel` (str): The label of the y axis.
     - `groupby` (str): The name of the variable to plot (channel, module...)
-    - `cmap_custom` (LinearSegmentedColormap): The colormap object based on lookup tables using linear segments.
+    - `cmap_custom` (list): The hex colors of the palette (See `registry.linear_palette`).
     - `clim` (tuple): The min and max values for the colormap.
+    - `live_streams` (dict): The streams of the new data of the current night: the `envelope` buffer (See `create_live_buffer`), the `raster` pipe
+    (See `create_live_raster_pipe`) and the buffers with the new rows of `l1_rate_control` and `l0_rate_control` (See `create_live_rows_buffer`). None by default.
 
     Returns
     ----------
@@ -351,9 +928,10 @@ def plot_l1_rate_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_cust
     l1_rate_max_data = data_dict['l1_rate_max']
     l1_rate_target_data = data_dict['l1_rate_target']
     l0_rate_control_data = data_dict['l0_rate_control']
+    live_streams = live_streams or {}
 
     # Build a pandas dataframe from the original dataframe and select the min and max values for each date
-    df_with_min_max_avg = build_min_max_avg(l1_rate_data, x, y, groupby)
+    df_with_min_max_avg = get_min_max_avg(l1_rate_data, x, y, groupby)
     
     # Just for debugging purposes: Check if we have duplicated indexes (dates) in the dataframe
     # print(df_with_min_max_avg[df_with_min_max_avg.index.duplicated(keep=False)])
@@ -372,7 +950,8 @@ def plot_l1_rate_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_cust
     
     # Plot scatter from data for all channels (rasterized)
     all_channels_scatter_plot = hvplot_df_scatter(l1_rate_data, x=x, y=y, title=title, color=y, cmap=cmap_custom,  size=20, marker='o', dic_opts={
-                                                  'padding': 0.1, 'tools': [''], 'xlabel': xlabel, 'alpha': 0.15, 'ylabel': ylabel, 'clim': clim, 'responsive': True, 'min_height':400}, rasterize=True, dynamic=False)
+                                                  'padding': 0.1, 'tools': [''], 'xlabel': xlabel, 'alpha': 0.15, 'ylabel': ylabel, 'clim': clim, 'responsive': True, 'min_height':400}, rasterize=True, dynamic=False,
+                                                  pipe=live_streams.get('raster'))
 
 
     # Create a composite plot with all the plots merged
@@ -430,10 +1009,20 @@ def plot_l1_rate_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_cust
     
     #composite_plot = lines_plot * single_channel_scatter_plot  * max_line_plot * all_channels_scatter_plot *  l1_rate_control_plot * l0_rate_control_plot * l1_rate_max_plot * l1_rate_target_plot
 
+    # Rate controls and lines with the new data streamed for the current night
+    for name, color in (('l0_rate_control', 'orange'), ('l1_rate_control', 'green')):
+        if name in live_streams:
+            composite_plot = composite_plot * plot_live_spikes(live_streams[name], df_with_min_max_avg['max'].max(), color)
+
+    if 'envelope' in live_streams:
+        composite_plot = composite_plot * plot_live_min_max_avg(live_streams['envelope'], x)
+
     return composite_plot.opts(legend_position='top', responsive=True, min_height=500, hooks=[disable_logo], show_grid=True, legend_opts={"click_policy": "hide"},)
 
 
-def plot_l0_ipr_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_custom, clim):
+@profiling.profiled('plot')
+@metrics.timed('plot')
+def plot_l0_ipr_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_custom, clim, live_streams=None):
     """
     Plot L0 IPR data and L0 Rate Max data in a plot.
 
@@ -455,8 +1044,9 @@ def plot_l0_ipr_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_custo
     - `xlabel` (str): Label for the x axis
     - `ylabel` (str): Label for the y axis
     - `groupby` (str): Name of the column to be used to group the data (e.g. channel)
-    - `cmap_custom` (LinearSegmentedColormap): Custom colormap to be used for the scatter plot
+    - `cmap_custom` (list): The hex colors of the palette to be used for the scatter plot (See `registry.linear_palette`)
     - `clim` (tuple): Color limits for the scatter plot
+    - `live_streams` (dict): The streams of the new data of the current night: the `envelope` buffer (See `create_live_buffer`) and the `raster` pipe (See `create_live_raster_pipe`). None by default.
 
     Returns
     -------
@@ -465,9 +1055,10 @@ def plot_l0_ipr_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_custo
 
     l0_pixel_ipr_data = data_dict['l0_pixel_ipr']
     l0_rate_max_data = data_dict['l0_rate_max']
+    live_streams = live_streams or {}
 
     # Build a pandas dataframe from the original dataframe and select the min and max values for each date
-    df_with_min_max_avg = build_min_max_avg(l0_pixel_ipr_data, x, y, groupby)
+    df_with_min_max_avg = get_min_max_avg(l0_pixel_ipr_data, x, y, groupby)
     
     # Just for debugging purposes: Check if we have duplicated indexes (dates) in the dataframe
     # print(df_with_min_max_avg[df_with_min_max_avg.index.duplicated(keep=False)])
@@ -486,7 +1077,8 @@ def plot_l0_ipr_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_custo
     
     # Plot scatter from data for all channels (rasterized)
     all_channels_scatter_plot = hvplot_df_scatter(l0_pixel_ipr_data, x=x, y=y, title=title, color=y, cmap=cmap_custom,  size=20, marker='o', dic_opts={
-                                                  'padding': 0.1, 'tools': [''], 'xlabel': xlabel, 'alpha': 0.15, 'ylabel': ylabel, 'clim': clim,}, rasterize=True, dynamic=False)
+                                                  'padding': 0.1, 'tools': [''], 'xlabel': xlabel, 'alpha': 0.15, 'ylabel': ylabel, 'clim': clim,}, rasterize=True, dynamic=False,
+                                                  pipe=live_streams.get('raster'))
 
     l0_pixel_ipr_data = l0_pixel_ipr_data.reset_index()
     min_date = l0_pixel_ipr_data['date'].min()
@@ -506,11 +1098,17 @@ def plot_l0_ipr_data(data_dict, x, y, title, xlabel, ylabel, groupby, cmap_custo
     
     else:
         composite_plot = lines_plot * single_channel_scatter_plot  * max_line_plot * all_channels_scatter_plot
+
+    # Lines with the new data streamed for the current night
+    if 'envelope' in live_streams:
+        composite_plot = composite_plot * plot_live_min_max_avg(live_streams['envelope'], x)
     
     return composite_plot.opts(legend_position='top', responsive=True, min_height=500, hooks=[disable_logo], show_grid=True, legend_opts={"click_policy": "hide"})
 
 
-def plot_tib_rate_data(data_dict, title, xlabel, ylabel):
+@profiling.profiled('plot')
+@metrics.timed('plot')
+def plot_tib_rate_data(data_dict, title, xlabel, ylabel, live_streams=None):
     """
     Plot the TIB Rates data
     
@@ -525,6 +1123,7 @@ def plot_tib_rate_data(data_dict, title, xlabel, ylabel):
     - `title` (str): Title of the plot
     - `xlabel` (str): Label for the x axis
     - `ylabel` (str): Label for the y axis
+    - `live_streams` (dict): The buffers with the new rows of each rate of the current night, with the same keys as `data_dict` (See `create_live_rows_buffer`). None by default.
 
     Returns
     -------
@@ -536,17 +1135,24 @@ def plot_tib_rate_data(data_dict, title, xlabel, ylabel):
     tib_local_rate_data = data_dict['tib_local_rate']
     tib_pedestal_rate_data = data_dict['tib_pedestal_rate']
     
-    tib_busy_rate_plot = tib_busy_rate_data.hvplot.line(x='date', y=tib_busy_rate_data, title=title, grid=True, responsive=True, min_height=400, legend='top', label='busy', muted_alpha=0, yformatter='%.0f')
-    tib_calibration_rate_plot = tib_calibration_rate_data.hvplot.line(x='date', y=tib_calibration_rate_data, title=title, grid=True, responsive=True, min_height=400, label='calibration', legend='top', muted_alpha=0, yformatter='%.0f')
-    tib_camera_rate_plot = tib_camera_rate_data.hvplot.line(x='date', y=tib_camera_rate_data, title=title, grid=True, responsive=True, min_height=400, legend='top', label='camera', muted_alpha=0, yformatter='%.0f')
-    tib_local_rate_plot = tib_local_rate_data.hvplot.line(x='date', y=tib_local_rate_data, title=title, grid=True, responsive=True, min_height=400, legend='top', label='local', muted_alpha=0, yformatter='%.0f')
-    tib_pedestal_rate_plot = tib_pedestal_rate_data.hvplot.line(x='date', y=tib_pedestal_rate_data, title=title, grid=True, responsive=True, min_height=400, label='pedestal', legend='top', muted_alpha=0, yformatter='%.0f')
+    tib_busy_rate_plot = tib_busy_rate_data.hvplot.line(x='date', y=tib_busy_rate_data, title=title, grid=True, responsive=True, min_height=400, legend='top', label='busy', color=TIB_RATE_COLORS['tib_busy_rate'], muted_alpha=0, yformatter='%.0f')
+    tib_calibration_rate_plot = tib_calibration_rate_data.hvplot.line(x='date', y=tib_calibration_rate_data, title=title, grid=True, responsive=True, min_height=400, label='calibration', color=TIB_RATE_COLORS['tib_calibration_rate'], legend='top', muted_alpha=0, yformatter='%.0f')
+    tib_camera_rate_plot = tib_camera_rate_data.hvplot.line(x='date', y=tib_camera_rate_data, title=title, grid=True, responsive=True, min_height=400, legend='top', label='camera', color=TIB_RATE_COLORS['tib_camera_rate'], muted_alpha=0, yformatter='%.0f')
+    tib_local_rate_plot = tib_local_rate_data.hvplot.line(x='date', y=tib_local_rate_data, title=title, grid=True, responsive=True, min_height=400, legend='top', label='local', color=TIB_RATE_COLORS['tib_local_rate'], muted_alpha=0, yformatter='%.0f')
+    tib_pedestal_rate_plot = tib_pedestal_rate_data.hvplot.line(x='date', y=tib_pedestal_rate_data, title=title, grid=True, responsive=True, min_height=400, label='pedestal', color=TIB_RATE_COLORS['tib_pedestal_rate'], legend='top', muted_alpha=0, yformatter='%.0f')
 
     composite_plot = tib_busy_rate_plot * tib_calibration_rate_plot * tib_camera_rate_plot * tib_local_rate_plot * tib_pedestal_rate_plot
+
+    # Lines with the new data streamed for the current night
+    for name, buffer in (live_streams or {}).items():
+        composite_plot = composite_plot * plot_live_line(buffer, TIB_RATE_COLORS[name])
+
     return composite_plot.opts(legend_position='top', xlabel=xlabel, ylabel=ylabel, hooks=[disable_logo], show_grid=True, responsive=True, min_height=500, legend_opts={"click_policy": "hide"})
 
 
-def plot_dragon_busy_data(data, title, xlabel, ylabel):
+@profiling.profiled('plot')
+@metrics.timed('plot')
+def plot_dragon_busy_data(data, title, xlabel, ylabel, live_streams=None):
     """
     Plot the Dragon Busy data. It will create a scatter plot with the busy status of the modules.
 
@@ -556,7 +1162,18 @@ def plot_dragon_busy_data(data, title, xlabel, ylabel):
     - `title` (str): Title of the plot
     - `xlabel` (str): Label for the x axis
     - `ylabel` (str): Label for the y axis
+    - `live_streams` (dict): The `rows` buffer with the new rows of the current night (See `create_live_rows_buffer`). None by default.
     """
     busy_plot = data.hvplot.scatter(x='date', y='module', c='busy_status', cmap='viridis', title=title, grid=True, responsive=True, min_height=400, max_height=750)
-    return busy_plot.opts(xlabel=xlabel, ylabel=ylabel, hooks=[disable_logo], show_grid=True, responsive=True, min_height=500, max_height=750, clim=(0, 3), color_levels=[0, 0.5, 1.5, 2.5, 3], clabel='Busy Status', colorbar_opts={'title_standoff': -150, 'padding': 30})
+
+    busy_plot = busy_plot.opts(xlabel=xlabel, ylabel=ylabel, hooks=[disable_logo], show_grid=True, responsive=True, min_height=500, max_height=750, clim=(0, 3), color_levels=[0, 0.5, 1.5, 2.5, 3], clabel='Busy Status', colorbar_opts={'title_standoff': -150, 'padding': 30})
+
+    # Points with the new data streamed for the current night
+    if live_streams and 'rows' in live_streams:
+        def live_points(data):
+            return hv.Scatter(data, 'date', ['module', 'busy_status']).opts(color='busy_status', cmap='viridis', clim=(0, 3), color_levels=[0, 0.5, 1.5, 2.5, 3])
+
+        busy_plot = busy_plot * hv.DynamicMap(live_points, streams=[live_streams['rows']])
+
+    return busy_plot
     
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+Startup prewarm module. When the server starts, the latest night with data is loaded in a background thread into
+the shared night data cache, and the aggregates of its plots (envelopes and rasters) are computed, so the first
+operator opening the dashboard does not pay for the database queries and the aggregations. The latest night of each
+telescope is loaded in its own thread (See `telescopes`).
+"""
+
+import threading
+import time
+import datetime as dt
+
+import database
+import profiling
+import registry
+import telescopes
+
+AGGREGATED_PROPERTIES = registry.get_aggregated_properties()
+"""
+Array properties plotted with their max, min and avg envelope and a rasterized scatter
+"""
+
+statuses = {}
+"""
+Status of the prewarm of each telescope by name (See `get_status`)
+"""
+
+
+def get_status(telescope_name):
+    """
+    Get the status of the prewarm of a telescope.
+
+    Parameters
+    ----------
+    - `telescope_name` (str) The name of the telescope.
+
+    Returns
+    ----------
+    - `status` (dict) The state of the prewarm (idle, running, done or failed), the night loaded, the aggregates computed and the seconds spent.
+    """
+    return statuses.setdefault(telescope_name, {'state': 'idle', 'night': None, 'done': 0, 'total': 0, 'duration': None})
+
+
+def prewarm(telescope=None):
+    """
+    Loads the latest night with data of a telescope into the night data cache and computes the aggregates of its plots.
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope. The default one by default.
+    """
+    # The plotting modules are imported in the background when the server starts (See `app.import_plotting_modules`)
+    import dashboard_utils
+    import plot_helper
+
+    if telescope is None:
+        telescope = telescopes.default
+
+    tic = time.perf_counter()
+    profiling.bind_session(f'prewarm_{telescope.name}')
+    status = get_status(telescope.name)
+    status.update(state='running', night=None, done=0, total=len(AGGREGATED_PROPERTIES), duration=None)
+
+    db = telescope.connect()
+
+    if db is None:
+        status['state'] = 'failed'
+        return
+
+    try:
+        anchor = registry.get_property(registry.ANCHOR_PROPERTY)
+        night = database.get_latest_night(db[anchor['collection']], anchor['name'], dt.date.today())
+
+        if night is None:
+            print(f"Prewarm: no data of {telescope.name} found in the previous 120 days")
+            status['state'] = 'done'
+            return
+
+        print(f"Prewarm: loading night {night} of {telescope.name}")
+        status['night'] = night
+
+        night_data = dashboard_utils.load_night_data(db, night, telescope=telescope)
+
+        for property_name in AGGREGATED_PROPERTIES:
+            df = night_data[property_name]
+
+            if not df.empty:
+                var_name, value_name = df.columns
+                plot_helper.get_min_max_avg(df, 'date', value_name, var_name)
+                plot_helper.rasterize_scatter(df, 'date', value_name)
+
+            status['done'] += 1
+
+        status['state'] = 'done'
+
+    except Exception as e:
+        print(f"Prewarm: error loading the latest night of {telescope.name}:", e)
+        status['state'] = 'failed'
+
+    finally:
+        db.client.close()
+        status['duration'] = round(time.perf_counter() - tic, 2)
+
+    print(f"Prewarm of {telescope.name} finished in {status['duration']:0.4f} seconds")
+    profiling.dump_session_report(f'prewarm_{telescope.name}')
+
+
+def start_prewarm(telescope=None):
+    """
+    Starts the prewarm of a telescope in another thread, so the server starts accepting connections while the data is loaded.
+    Sessions requesting the same night wait for the aggregates being computed instead of computing them again.
+
+    Parameters
+    ----------
+    - `telescope` (telescopes.Telescope) The telescope. The default one by default.
+    """
+    if telescope is None:
+        telescope = telescopes.default
+
+    print(f"Starting prewarm of the latest night of {telescope.name} in another thread")
+    get_status(telescope.name)['state'] = 'running'
+    prewarm_thread = threading.Thread(target=prewarm, args=(telescope, ))
+    prewarm_thread.daemon = True
+    prewarm_thread.start()
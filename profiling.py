@@ -0,0 +1,286 @@
+"""
+Memory profiling module. When enabled with the `MEMORY_PROFILING` variable, tracemalloc snapshots are taken around each
+database fetch and each plot build, recording the memory allocated in the stage, its top allocation sites and the size
+retained by the resulting DataFrames and HoloViews objects. The records are kept per session and a report is written
+when the session is destroyed. When it is disabled the profiled functions are not wrapped, so it has no overhead.
+The snapshots include the allocations of the other threads running at the same time, so profile with few concurrent sessions.
+"""
+
+import datetime as dt
+import functools
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from config import MEMORY_PROFILING, MEMORY_PROFILING_DIR, MEMORY_PROFILING_TOP, MEMORY_PROFILING_FRAMES
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+"""
+Directory of the application modules, used to find the line of the application responsible of each allocation
+"""
+
+_records = {}
+_lock = threading.Lock()
+_local = threading.local()
+_active_stages = 0
+
+if MEMORY_PROFILING:
+    print(f"Memory profiling enabled. Reports are written to {MEMORY_PROFILING_DIR}")
+
+
+
+def profiled(stage):
+    """
+    Decorator taking tracemalloc snapshots around a function when the memory profiling is enabled. The function is
+    returned unchanged when it is disabled.
+
+    Parameters
+    ----------
+    - `stage` (str) The name of the stage (fetch, aggregate, plot).
+
+    Returns
+    ----------
+    - `decorator` (callable) The decorator.
+    """
+    def decorator(function):
+        if not MEMORY_PROFILING:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            depth = getattr(_local, 'depth', 0)
+            start_tracing()
+            before = tracemalloc.take_snapshot()
+            tic = time.perf_counter()
+            _local.depth = depth + 1
+
+            try:
+                result = function(*args, **kwargs)
+                seconds = time.perf_counter() - tic
+                after = tracemalloc.take_snapshot()
+            finally:
+                _local.depth = depth
+                stop_tracing()
+
+            record(stage, function.__name__, seconds, before, after, result, depth)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def start_tracing():
+    """
+    Starts tracing the memory allocations if no other profiled stage is running. The allocations are only traced while
+    the profiled stages run, since tracing the rest of the application (e.g. the imports and the JIT compilation of
+    datashader) would make it much slower.
+    """
+    global _active_stages
+
+    with _lock:
+        if _active_stages == 0:
+            tracemalloc.start(MEMORY_PROFILING_FRAMES)
+
+        _active_stages += 1
+
+
+def stop_tracing():
+    """
+    Stops tracing the memory allocations if no other profiled stage is running.
+    """
+    global _active_stages
+
+    with _lock:
+        _active_stages -= 1
+
+        if _active_stages == 0:
+            tracemalloc.stop()
+
+
+def bind_session(session_id):
+    """
+    Attributes the profiled stages run in the current thread to a session. The stages run in threads not bound to a
+    session are attributed to the server.
+
+    Parameters
+    ----------
+    - `session_id` (str) The id of the session, or a name for the stages run outside the sessions (e.g. prewarm).
+    """
+    if MEMORY_PROFILING:
+        _local.session_id = session_id
+
+
+def get_session():
+    """
+    Get the session the profiled stages run in the current thread are attributed to, so it can be bound to the threads
+    started to run part of its work.
+
+    Returns
+    ----------
+    - `session_id` (str) The id of the session, or None if the thread is not bound to a session.
+    """
+    return getattr(_local, 'session_id', None)
+
+
+def record(stage, name, seconds, before, after, result, depth=0):
+    """
+    Records the memory allocated by a stage between two snapshots and the size retained by its result.
+
+    Parameters
+    ----------
+    - `stage` (str) The name of the stage.
+    - `name` (str) The name of the profiled function.
+    - `seconds` (float) The seconds spent in the function.
+    - `before` (tracemalloc.Snapshot) The snapshot taken before the function.
+    - `after` (tracemalloc.Snapshot) The snapshot taken after the function.
+    - `result` (object) The result of the function.
+    - `depth` (int) The number of profiled stages enclosing this one (e.g. an aggregate computed while building a plot).
+    """
+    session_id = getattr(_local, 'session_id', None) or 'server'
+    filters = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+    differences = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'traceback')
+
+    entry = {'time': dt.datetime.now(), 'stage': stage, 'name': name, 'seconds': seconds, 'depth': depth,
+             'allocated': sum(difference.size_diff for difference in differences),
+             'retained': retained_size(result),
+             'sites': [(describe(difference.traceback), difference.size_diff, difference.count_diff)
+                       for difference in differences[:MEMORY_PROFILING_TOP] if difference.size_diff >= 1024]}
+
+    with _lock:
+        _records.setdefault(session_id, []).append(entry)
+
+
+def describe(traceback):
+    """
+    Get the description of an allocation site: the line where the memory was allocated and the line of the application
+    that led to it.
+
+    Parameters
+    ----------
+    - `traceback` (tracemalloc.Traceback) The traceback of the allocation.
+
+    Returns
+    ----------
+    - `site` (str) The description of the allocation site.
+    """
+    # The frames are sorted from the oldest to the most recent one
+    frames = list(traceback)
+    allocation = frames[-1]
+    app_frames = [frame for frame in frames if frame.filename.startswith(APP_DIR)]
+    site = f"{allocation.filename}:{allocation.lineno}"
+
+    if app_frames and app_frames[-1] is not allocation:
+        site += f" (from {os.path.relpath(app_frames[-1].filename, APP_DIR)}:{app_frames[-1].lineno})"
+
+    return site
+
+
+def retained_size(obj, seen=None):
+    """
+    Get the bytes retained by the data of an object: DataFrames, Series, arrays, xarray datasets and the data of the
+    elements of HoloViews objects, also inside lists, tuples and dicts. Data shared by several elements is counted once.
+
+    Parameters
+    ----------
+    - `obj` (object) The object.
+    - `seen` (set) The ids of the objects already counted.
+
+    Returns
+    ----------
+    - `size` (int) The bytes retained by the object.
+    """
+    # HoloViews is imported in the background when the server starts (See `app.import_plotting_modules`)
+    import holoviews as hv
+
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+
+    if isinstance(obj, hv.core.Dimensioned):
+        return sum(retained_size(element.data, seen) for element in obj.traverse(lambda x: x, [hv.Element]))
+
+    if isinstance(obj, dict):
+        return sum(retained_size(value, seen) for value in obj.values())
+
+    if isinstance(obj, (list, tuple)):
+        return sum(retained_size(value, seen) for value in obj)
+
+    # Other data containers, such as the xarray datasets of the rasterized plots
+    nbytes = getattr(obj, 'nbytes', None)
+
+    return nbytes if isinstance(nbytes, int) else 0
+
+
+def dump_session_report(session_id):
+    """
+    Writes the report of a session to the `MEMORY_PROFILING_DIR` directory and removes its records. Nothing is done
+    when the memory profiling is disabled or the session has no records.
+
+    Parameters
+    ----------
+    - `session_id` (str) The id of the session.
+
+    Returns
+    ----------
+    - `path` (str) The path of the report, or None if it was not written.
+    """
+    if not MEMORY_PROFILING:
+        return None
+
+    with _lock:
+        entries = _records.pop(session_id, [])
+
+    if not entries:
+        return None
+
+    lines = [f"Memory profile of session {session_id}",
+             f"Written: {dt.datetime.now().isoformat()}",
+             "",
+             "Stages (allocated memory still alive after the stage, size retained by its result).",
+             "Nested stages (e.g. aggregates computed while building a plot) are also included in the enclosing stage.",
+             "----------"]
+
+    for stage in sorted({entry['stage'] for entry in entries}):
+        stage_entries = [entry for entry in entries if entry['stage'] == stage]
+        lines.append(f"{stage}: {len(stage_entries)} calls, {sum(entry['seconds'] for entry in stage_entries):0.2f} s, "
+                     f"allocated {sum(entry['allocated'] for entry in stage_entries) / 2**20:0.1f} MB, "
+                     f"retained {sum(entry['retained'] for entry in stage_entries) / 2**20:0.1f} MB")
+
+    lines += ["", "Calls", "----------"]
+
+    for entry in sorted(entries, key=lambda entry: entry['allocated'], reverse=True):
+        nested = ' (nested)' if entry['depth'] else ''
+        lines.append(f"{entry['time']:%H:%M:%S} {entry['stage']} {entry['name']}{nested}: {entry['seconds']:0.2f} s, "
+                     f"allocated {entry['allocated'] / 2**20:0.1f} MB, retained {entry['retained'] / 2**20:0.1f} MB")
+
+        for site, size, count in entry['sites']:
+            lines.append(f"    {size / 2**20:8.2f} MB {count:8d} blocks  {site}")
+
+    os.makedirs(MEMORY_PROFILING_DIR, exist_ok=True)
+    path = os.path.join(MEMORY_PROFILING_DIR, f"{dt.datetime.now():%Y%m%d_%H%M%S}_{session_id}.txt")
+
+    with open(path, 'w') as report_file:
+        report_file.write('\n'.join(lines) + '\n')
+
+    print(f"Memory profile of session {session_id} written to {path}")
+
+    return path
@@ -0,0 +1,255 @@
+"""
+Registry of the metrics shown in the dashboard. It describes each property retrieved from the database (collection,
+property name, value field and shape) and each plot panel (the properties it depends on, colormap, color limits, tab
+and grid cell). The dashboard executes this description (See `dashboard_utils.update_dashboard`), so new CLUSCO
+properties are added here without changing the code that fetches the data and builds the plots.
+"""
+
+PALETTE_SIZE = 256
+"""
+Number of colors of the palettes of the plots
+"""
+
+
+def linear_palette(stops, n=PALETTE_SIZE):
+    """
+    Get a palette of hex colors interpolating linearly between color stops, sampled as the lookup table of a matplotlib
+    `LinearSegmentedColormap.from_list` with the same stops, so matplotlib is not needed to build the colormaps.
+
+    Parameters
+    ----------
+    - `stops` (list) Tuples with the position (from 0 to 1) and the RGB color (each channel from 0 to 1) of each stop, sorted by position.
+    - `n` (int) The number of colors of the palette.
+
+    Returns
+    ----------
+    - `palette` (list) The hex colors of the palette.
+    """
+    palette = []
+
+    for i in range(n):
+        x = i / (n - 1)
+        # The segment of the stops containing x (the last one for x = 1)
+        j = next(j for j in range(1, len(stops)) if x <= stops[j][0] or j == len(stops) - 1)
+        (x0, color0), (x1, color1) = stops[j - 1], stops[j]
+        t = (x - x0) / (x1 - x0) if x1 > x0 else 1
+        palette.append('#' + ''.join(f'{round((c0 + (c1 - c0) * t) * 255):02x}' for c0, c1 in zip(color0, color1)))
+
+    return palette
+
+
+# Custom color maps recreated from this bars: https://camera.lst1.iac.es/mon0
+cmap_temps = linear_palette([
+    (0, (0, 0, 1)),
+    (18/30, (0, 1, 0)),
+    (25/30, (1, 0.65, 0)),
+    (26/30, (1, 0, 0)),
+    (1, (1, 0, 0))])
+
+cmap_humidty = linear_palette([
+    (0, (1, 0.64, 0)),
+    (10/80, (1, 0.92, 0)),
+    (40/80, (0, 1, 0)),
+    (70/80, (1, 0.92, 0)),
+    (74/80, (1, 0.64, 0)),
+    (80/80, (1, 0, 0))])
+
+cmap_anode = linear_palette([
+    (0, (0, 0, 1)),
+    (5/100, (0, 1, 0)),
+    (60/100, (1, 0.92, 0)),
+    (80/100, (1, 0.64, 0)),
+    (100/100, (1, 0, 0))])
+
+cmap_hv = linear_palette([
+    (0, (0, 0, 1)),
+    (10/1400, (0, 0, 1)),
+    (200/1400, (0, 1, 0)),
+    (950/1400, (1, 0.92, 0)),
+    (1200/1400, (1, 0.64, 0)),
+    (1400/1400, (1, 0, 0))])
+
+cmap_backplane_temp = linear_palette([
+    (0, (0, 0, 1)),
+    (20/37, (0, 1, 0)),
+    (30/37, (1, 0.99, 0.22)),
+    (33/37, (1, 0.64, 0)),
+    (35/37, (1, 0, 0)),
+    (37/37, (1, 0, 0))])
+
+PROPERTIES = [
+    # Pixel and module arrays
+    {'name': 'scb_pixel_temperature', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'array', 'var_name': 'channel', 'value_name': 'temperature'},
+    {'name': 'scb_temperature', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'array', 'var_name': 'module', 'value_name': 'temperature'},
+    {'name': 'scb_humidity', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'array', 'var_name': 'module', 'value_name': 'humidity'},
+    {'name': 'scb_pixel_an_current', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'array', 'var_name': 'channel', 'value_name': 'anode'},
+    {'name': 'scb_pixel_hv_monitored', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'array', 'var_name': 'channel', 'value_name': 'hv'},
+    {'name': 'backplane_temperature', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'array', 'var_name': 'module', 'value_name': 'temperature'},
+    {'name': 'l1_rate', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'array', 'var_name': 'module', 'value_name': 'l1_rate'},
+    {'name': 'l0_pixel_ipr', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'array', 'var_name': 'channel', 'value_name': 'l0_pixel_ipr'},
+    {'name': 'dragon_busy', 'collection': 'CLUSCO_min', 'value_field': 'max', 'shape': 'array', 'var_name': 'module', 'value_name': 'busy_status'},
+    # Scalars
+    {'name': 'clusco_l1_rate_control', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'l1_rate_control', 'remove_zero_values': True},
+    {'name': 'clusco_l0_rate_control', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'l0_rate_control', 'remove_zero_values': True},
+    {'name': 'clusco_l1_rate_max', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'l1_rate_max'},
+    {'name': 'clusco_l1_rate_target', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'l1_rate_target'},
+    {'name': 'clusco_l0_rate_max', 'collection': 'CLUSCO_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'l0_rate_max'},
+    {'name': 'TIB_Rates_BUSYRate', 'collection': 'TIB_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'tib_busy_rate'},
+    {'name': 'TIB_Rates_CalibrationRate', 'collection': 'TIB_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'calibration_rate'},
+    {'name': 'TIB_Rates_CameraRate', 'collection': 'TIB_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'camera_rate'},
+    {'name': 'TIB_Rates_LocalRate', 'collection': 'TIB_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'local_rate'},
+    {'name': 'TIB_Rates_PedestalRate', 'collection': 'TIB_min', 'value_field': 'avg', 'shape': 'scalar', 'value_name': 'pedestal_rate'},
+]
+"""
+Properties retrieved from the database, with their collection, the field where the value is stored, their shape (array
+of pixels or modules, or scalar) and the names of the columns of their dataframes. Scalars may remove their zero values.
+"""
+
+ANCHOR_PROPERTY = 'scb_pixel_temperature'
+"""
+Property used to choose the night displayed. When the selected night has no data for it, the latest night with data is displayed
+"""
+
+TABS = [
+    {'title': 'Pixel Temp, Anode & HV - SCB Temp & Humidity', 'nrows': 2, 'ncols': 3},
+    {'title': 'Rates', 'nrows': 2, 'ncols': 2},
+    {'title': 'Dragon Busy', 'nrows': 1, 'ncols': 1},
+]
+"""
+Tabs of the dashboard, with the size of the grid where their panels are placed
+"""
+
+PANELS = [
+    # First tab
+    {'name': 'pacta_temperature', 'title': 'PACTA Temperature', 'kind': 'grouped', 'property': 'scb_pixel_temperature',
+     'xlabel': 'Time (UTC)', 'ylabel': 'Temperature (ºC)', 'cmap': cmap_temps, 'clim': (0, 30), 'threshold': 26, 'tab': 0, 'cell': (0, 0)},
+    {'name': 'scb_temperature', 'title': 'SCB Temperature', 'kind': 'grouped', 'property': 'scb_temperature',
+     'xlabel': 'Time (UTC)', 'ylabel': 'Temperature (ºC)', 'cmap': cmap_temps, 'clim': (0, 30), 'threshold': 26, 'tab': 0, 'cell': (0, 1)},
+    {'name': 'scb_humidity', 'title': 'SCB Humidity', 'kind': 'grouped', 'property': 'scb_humidity',
+     'xlabel': 'Time (UTC)', 'ylabel': 'Humidity (%)', 'cmap': cmap_humidty, 'clim': (0, 80), 'threshold': 74, 'tab': 0, 'cell': (0, 2)},
+    {'name': 'scb_anode_current', 'title': 'SCB Anode Current', 'kind': 'grouped', 'property': 'scb_pixel_an_current',
+     'xlabel': 'Time (UTC)', 'ylabel': 'Anode Current (µA)', 'cmap': cmap_anode, 'clim': (0, 100), 'threshold': 80, 'tab': 0, 'cell': (1, 0)},
+    {'name': 'high_voltage', 'title': 'High Voltage', 'kind': 'grouped', 'property': 'scb_pixel_hv_monitored',
+     'xlabel': 'Time (UTC)', 'ylabel': 'HV (V)', 'cmap': cmap_hv, 'clim': (10, 1400), 'threshold': 1200, 'tab': 0, 'cell': (1, 1)},
+    {'name': 'scb_backplane_temperature', 'title': 'SCB Backplane Temperature', 'kind': 'grouped', 'property': 'backplane_temperature',
+     'xlabel': 'Time (UTC)', 'ylabel': 'Temperature (ºC)', 'cmap': cmap_backplane_temp, 'clim': (0, 37), 'threshold': 35, 'tab': 0, 'cell': (1, 2)},
+    # Second tab
+    {'name': 'l1_rate', 'title': 'L1 Rate', 'kind': 'l1_rate', 'property': 'l1_rate',
+     'inputs': {'l1_rate': 'l1_rate', 'l1_rate_control': 'clusco_l1_rate_control', 'l1_rate_max': 'clusco_l1_rate_max',
+                'l1_rate_target': 'clusco_l1_rate_target', 'l0_rate_control': 'clusco_l0_rate_control'},
+     'live_inputs': ('l1_rate_control', 'l0_rate_control'),
+     'xlabel': 'Time (UTC)', 'ylabel': 'L1 Rate (Hz)', 'cmap': cmap_temps, 'clim': (0, 1000), 'tab': 1, 'cell': (0, 0)},
+    {'name': 'l0_pixel_ipr', 'title': 'L0 Pixel IPR', 'kind': 'l0_ipr', 'property': 'l0_pixel_ipr',
+     'inputs': {'l0_pixel_ipr': 'l0_pixel_ipr', 'l0_rate_max': 'clusco_l0_rate_max'},
+     'xlabel': 'Time (UTC)', 'ylabel': 'L0 Pixel IPR (Hz)', 'cmap': cmap_temps, 'clim': (0, 1000), 'tab': 1, 'cell': (0, 1)},
+    {'name': 'tib_rates', 'title': 'TIB Rates', 'kind': 'tib_rates', 'property': 'TIB_Rates_BUSYRate',
+     'inputs': {'tib_busy_rate': 'TIB_Rates_BUSYRate', 'tib_calibration_rate': 'TIB_Rates_CalibrationRate', 'tib_camera_rate': 'TIB_Rates_CameraRate',
+                'tib_local_rate': 'TIB_Rates_LocalRate', 'tib_pedestal_rate': 'TIB_Rates_PedestalRate'},
+     'live_inputs': ('tib_busy_rate', 'tib_calibration_rate', 'tib_camera_rate', 'tib_local_rate', 'tib_pedestal_rate'),
+     'xlabel': 'Time (UTC)', 'ylabel': 'TIB Rates (Hz)', 'tab': 1, 'cell': (1, slice(None))},
+    # Third tab
+    {'name': 'dragon_busy', 'title': 'Dragon Busy', 'kind': 'dragon_busy', 'property': 'dragon_busy',
+     'xlabel': 'Time (UTC)', 'ylabel': 'Module ID', 'tab': 2, 'cell': (0, slice(None))},
+]
+"""
+Plot panels of the dashboard. Each panel is built by the builder of its kind (See `dashboard_utils.build_panel`) with the
+data of its main property or, when it has `inputs`, with a dict of the data of several properties. The panels are placed
+in the grid cell (row and column, which may be slices) of their tab. The pixel and module panels with a `threshold`
+(the breakpoint of their colormap where the color turns to orange or red) are scanned for the channels or modules above it (See `thresholds`).
+The new rows of the `live_inputs` of a panel are streamed to its plot while the current night is displayed (See `LIVE_KINDS`)
+"""
+
+AGGREGATED_KINDS = ('grouped', 'l1_rate', 'l0_ipr')
+"""
+Kinds of panels that plot the max, min and avg envelope and a rasterized scatter of their main property
+"""
+
+LIVE_KINDS = ('grouped', 'l1_rate', 'l0_ipr', 'tib_rates', 'dragon_busy')
+"""
+Kinds of panels that receive the new data of the current night (See `live_feed`). The aggregated kinds receive the
+envelope and the raster of their main property, and the other kinds the new rows of their main property, or of their
+`live_inputs` when they have inputs
+"""
+
+
+def get_property(name):
+    """
+    Get the description of a property.
+
+    Parameters
+    ----------
+    - `name` (str) The name of the property.
+
+    Returns
+    ----------
+    - `prop` (dict) The description of the property (See `PROPERTIES`).
+    """
+    return _properties_by_name[name]
+
+
+def get_dependencies(panel):
+    """
+    Get the properties needed to build a panel.
+
+    Parameters
+    ----------
+    - `panel` (dict) The description of the panel (See `PANELS`).
+
+    Returns
+    ----------
+    - `property_names` (list) The names of the properties.
+    """
+    return list(panel['inputs'].values()) if 'inputs' in panel else [panel['property']]
+
+
+def get_aggregated_properties():
+    """
+    Get the properties plotted with the max, min and avg envelope and a rasterized scatter.
+
+    Returns
+    ----------
+    - `property_names` (list) The names of the properties.
+    """
+    return [panel['property'] for panel in PANELS if panel['kind'] in AGGREGATED_KINDS]
+
+
+def get_threshold_panels():
+    """
+    Get the panels whose channels or modules are scanned against a threshold (See `thresholds`).
+
+    Returns
+    ----------
+    - `panels` (list) The descriptions of the panels with a threshold (See `PANELS`).
+    """
+    return [panel for panel in PANELS if 'threshold' in panel]
+
+
+def get_batches(properties, batch_size):
+    """
+    Split properties into the batches retrieved with a single query: properties of the same collection and shape, at
+    most `batch_size` of them in each batch. Scalars are small, so all the scalars of a collection are a single batch.
+
+    Parameters
+    ----------
+    - `properties` (list) The descriptions of the properties (See `PROPERTIES`).
+    - `batch_size` (int) The maximum number of array properties in a batch.
+
+    Returns
+    ----------
+    - `batches` (list) Lists with the descriptions of the properties of each batch.
+    """
+    groups = {}
+
+    for prop in properties:
+        groups.setdefault((prop['collection'], prop['shape']), []).append(prop)
+
+    batches = []
+
+    for (_, shape), group in groups.items():
+        size = len(group) if shape == 'scalar' else max(batch_size, 1)
+        batches.extend(group[i:i + size] for i in range(0, len(group), size))
+
+    return batches
+
+
+_properties_by_name = {prop['name']: prop for prop in PROPERTIES}
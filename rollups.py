@@ -0,0 +1,442 @@
+"""
+Nightly rollups of the pixel and module properties. For each array property of the `CLUSCO_min` collection, the
+statistics of each channel or module over a night (mean, min, max, 5th, 50th and 95th percentiles and number of
+samples) are computed once and stored in the `ROLLUPS_DIR` directory, as a small .npy file per property and night.
+The trends of a channel over many months are read from these files (See `load_trend`) instead of the minute data.
+
+The rollups are the coarsest level of a time pyramid (See `LEVELS`): from the same query, the min, max and mean of
+each channel or module are stored as well in buckets of 10 minutes and 1 hour, so the plots of wide ranges of nights
+read the coarsest level that still fills their pixels (See `choose_level` and `load_buckets`) instead of the minute data.
+
+The nights that have finished are rolled up with this script, e.g. daily from a cron job. The nights already rolled
+up are skipped, unless forced. Only the nights of the default telescope are rolled up (See `telescopes`).
+
+Usage (from the root of the repository):
+
+    python rollups.py --start 2023-01-01 --end 2023-06-30
+    python rollups.py --days 2
+"""
+
+import argparse
+import datetime as dt
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import database
+import registry
+import telescopes
+from config import ROLLUPS_DIR, FETCH_WORKERS, FETCH_BATCH_SIZE
+
+STATS = ('mean', 'min', 'max', 'p05', 'p50', 'p95', 'count')
+"""
+Statistics stored for each channel or module, in the order of the columns of the rollup files
+"""
+
+LEVELS = (('1min', 60), ('10min', 600), ('1h', 3600), ('1night', 86400))
+"""
+Levels of the time pyramid, from the finest to the coarsest, with the seconds of their buckets. The 1min level is
+the data of the collection and the 1night level the rollups. The other levels are stored with the rollups (See `compute_level`)
+"""
+
+STORED_LEVELS = ('10min', '1h')
+"""
+Levels of the time pyramid stored in their own files
+"""
+
+BUCKET_STATS = ('min', 'max', 'mean')
+"""
+Statistics stored for each bucket of the levels of the time pyramid, in the order of the first axis of the level files
+"""
+
+COLLECTION = 'CLUSCO_min'
+"""
+Collection whose array properties are rolled up
+"""
+
+
+def get_rollup_properties():
+    """
+    Get the properties rolled up: the array properties of the `CLUSCO_min` collection.
+
+    Returns
+    ----------
+    - `properties` (list) The descriptions of the properties (See `registry.PROPERTIES`).
+    """
+    return [prop for prop in registry.PROPERTIES if prop['collection'] == COLLECTION and prop['shape'] == 'array']
+
+
+def get_rollup_path(property_name, night):
+    """
+    Get the path of the rollup of a property for a night.
+
+    Parameters
+    ----------
+    - `property_name` (str) The name of the property.
+    - `night` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `path` (str) The path of the .npy file.
+    """
+    return os.path.join(ROLLUPS_DIR, property_name, f'{night}.npy')
+
+
+def get_level_path(property_name, level, night):
+    """
+    Get the path of a stored level of the time pyramid of a property for a night.
+
+    Parameters
+    ----------
+    - `property_name` (str) The name of the property.
+    - `level` (str) The name of the level (See `STORED_LEVELS`).
+    - `night` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `path` (str) The path of the .npy file.
+    """
+    return os.path.join(ROLLUPS_DIR, property_name, level, f'{night}.npy')
+
+
+def has_rollup(property_name, night):
+    """
+    Whether a property is already rolled up for a night, including the stored levels of the time pyramid.
+
+    Parameters
+    ----------
+    - `property_name` (str) The name of the property.
+    - `night` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `available` (bool) Whether the rollup exists.
+    """
+    return os.path.exists(get_rollup_path(property_name, night)) and all(os.path.exists(get_level_path(property_name, level, night))
+                                                                         for level in STORED_LEVELS)
+
+
+def get_values_array(data_values):
+    """
+    Get the values of a night as a 2D array, padded with NaN in case some documents have fewer channels.
+
+    Parameters
+    ----------
+    - `data_values` (list) The arrays of values retrieved from the collection, one array per document.
+
+    Returns
+    ----------
+    - `values` (numpy.ndarray) Array of float64 with a row per document and a column per channel or module.
+    """
+    arrays = [np.array(values, dtype='float64') for values in data_values]
+    values = np.full((len(arrays), max(len(array) for array in arrays)), np.nan)
+
+    for i, array in enumerate(arrays):
+        values[i, :len(array)] = array
+
+    return values
+
+
+def compute_rollup(data_values):
+    """
+    Computes the statistics of each channel or module over a night.
+
+    Parameters
+    ----------
+    - `data_values` (list) The arrays of values retrieved from the collection, one array per document.
+
+    Returns
+    ----------
+    - `rollup` (numpy.ndarray) Array of float32 with a row per channel or module and a column per statistic (See `STATS`).
+    It has no rows when there are no values.
+    """
+    if len(data_values) == 0:
+        return np.empty((0, len(STATS)), dtype='float32')
+
+    values = get_values_array(data_values)
+
+    # Channels without any value get NaN statistics
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        percentiles = np.nanpercentile(values, [5, 50, 95], axis=0)
+        rollup = np.column_stack([np.nanmean(values, axis=0), np.nanmin(values, axis=0), np.nanmax(values, axis=0),
+                                  percentiles[0], percentiles[1], percentiles[2], np.count_nonzero(~np.isnan(values), axis=0)])
+
+    return rollup.astype('float32')
+
+
+def compute_level(data_values, datetime_values, night, seconds):
+    """
+    Computes a level of the time pyramid for a night: the min, max and mean of each channel or module in buckets of
+    a number of seconds from the start of the night. The documents are sorted by bucket and each statistic is
+    reduced for all the buckets at once.
+
+    Parameters
+    ----------
+    - `data_values` (list) The arrays of values retrieved from the collection, one array per document.
+    - `datetime_values` (list) The dates of the retrieved values.
+    - `night` (dt.date) The day in which the night starts.
+    - `seconds` (int) The seconds of each bucket (See `LEVELS`).
+
+    Returns
+    ----------
+    - `level` (numpy.ndarray) Array of float32 with a statistic per row (See `BUCKET_STATS`), a bucket per column and
+    a channel or module per plane. The buckets without values are NaN. It has no channels when there are no values.
+    """
+    n_buckets = 86400 // seconds
+
+    if len(data_values) == 0:
+        return np.empty((len(BUCKET_STATS), n_buckets, 0), dtype='float32')
+
+    values = get_values_array(data_values)
+    night_start = np.datetime64(database.get_night_range(night)[0], 'ns')
+    offsets = (np.array(datetime_values, dtype='datetime64[ns]') - night_start) // np.timedelta64(seconds, 's')
+    buckets = offsets.astype('int64').clip(0, n_buckets - 1)
+
+    order = np.argsort(buckets, kind='stable')
+    buckets, values = buckets[order], values[order]
+    filled, starts = np.unique(buckets, return_index=True)
+
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+    counts = np.add.reduceat(valid, starts, axis=0)
+
+    level = np.full((len(BUCKET_STATS), n_buckets, values.shape[1]), np.nan, dtype='float32')
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        level[0, filled] = np.fmin.reduceat(values, starts, axis=0)
+        level[1, filled] = np.fmax.reduceat(values, starts, axis=0)
+        level[2, filled] = sums / counts
+
+    return level
+
+
+def write_array(path, array):
+    """
+    Writes an array through a temporary file, so a partially written rollup or level is never read.
+
+    Parameters
+    ----------
+    - `path` (str) The path of the .npy file.
+    - `array` (numpy.ndarray) The array to write.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temporary_path = path + '.tmp'
+
+    with open(temporary_path, 'wb') as array_file:
+        np.save(array_file, array)
+
+    os.replace(temporary_path, path)
+
+
+def write_rollup(property_name, night, rollup):
+    """
+    Writes the rollup of a property for a night (See `write_array`).
+
+    Parameters
+    ----------
+    - `property_name` (str) The name of the property.
+    - `night` (dt.date) The day in which the night starts.
+    - `rollup` (numpy.ndarray) The statistics of each channel or module (See `compute_rollup`).
+    """
+    write_array(get_rollup_path(property_name, night), rollup)
+
+
+def rollup_night(db, night, properties=None, force=False):
+    """
+    Rolls up the properties of a night and stores the levels of their time pyramid, retrieving them in batches with a single query per batch (See `database.get_night_documents`).
+    Nights without data are rolled up as well, with no rows, so they are not queried again.
+
+    Parameters
+    ----------
+    - `db` (pymongo.database.Database) The database object from pymongo.
+    - `night` (dt.date) The day in which the night starts.
+    - `properties` (list) The descriptions of the properties. All the properties rolled up by default (See `get_rollup_properties`).
+    - `force` (bool) Whether to roll up again the properties already rolled up.
+
+    Returns
+    ----------
+    - `rolled_up` (list) The names of the properties rolled up.
+    """
+    if properties is None:
+        properties = get_rollup_properties()
+
+    properties = [prop for prop in properties if force or not has_rollup(prop['name'], night)]
+    rolled_up = []
+
+    for batch in registry.get_batches(properties, FETCH_BATCH_SIZE):
+        documents = database.get_night_documents(db[batch[0]['collection']], [prop['name'] for prop in batch], night,
+                                                 [prop['value_field'] for prop in batch], telescopes.default.name)
+
+        for prop in batch:
+            data_values, datetime_values = documents.pop(prop['name'])
+
+            for level, seconds in LEVELS:
+                if level in STORED_LEVELS:
+                    write_array(get_level_path(prop['name'], level, night), compute_level(data_values, datetime_values, night, seconds))
+
+            write_rollup(prop['name'], night, compute_rollup(data_values))
+            rolled_up.append(prop['name'])
+
+    return rolled_up
+
+
+def rollup_nights(nights, workers=FETCH_WORKERS, force=False):
+    """
+    Rolls up several nights, running the nights in a pool of threads. The current night is always skipped, since its
+    data keeps changing.
+
+    Parameters
+    ----------
+    - `nights` (list) The days in which each night starts.
+    - `workers` (int) The number of nights rolled up at the same time.
+    - `force` (bool) Whether to roll up again the properties already rolled up.
+
+    Returns
+    ----------
+    - `rolled_up` (dict) The names of the properties rolled up for each night.
+    """
+    nights = [night for night in nights if night < database.get_current_night()]
+    telescope = telescopes.default
+    db = telescope.connect()
+
+    if db is None:
+        raise ConnectionError(f"Connection to database of {telescope.name} ({telescope.db_host}:{telescope.db_port}) failed")
+
+    rolled_up = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {executor.submit(rollup_night, db, night, None, force): night for night in nights}
+
+            for future in as_completed(futures):
+                try:
+                    rolled_up[futures[future]] = future.result()
+                except Exception as e:
+                    print(f"Error rolling up night {futures[future]}:", e)
+    finally:
+        db.client.close()
+
+    return rolled_up
+
+
+def load_trend(property_name, channel, start, end):
+    """
+    Get the statistics of a channel or module over a range of nights from the rollups. Only the row of the channel is
+    read from each file, so months of nights are loaded in a fraction of a second.
+
+    Parameters
+    ----------
+    - `property_name` (str) The name of the property.
+    - `channel` (int) The channel or module, numbered from 1 as in the dashboard.
+    - `start` (dt.date) The first night.
+    - `end` (dt.date) The last night.
+
+    Returns
+    ----------
+    - `trend` (pandas.DataFrame) Dataframe indexed by night with a column per statistic (See `STATS`). The nights
+    without rollup or without values of the channel are not included.
+    """
+    nights = []
+    rows = []
+
+    for i in range((end - start).days + 1):
+        night = start + dt.timedelta(days=i)
+        path = get_rollup_path(property_name, night)
+
+        if not os.path.exists(path):
+            continue
+
+        rollup = np.load(path, mmap_mode='r')
+
+        if channel - 1 < rollup.shape[0] and rollup[channel - 1, STATS.index('count')] > 0:
+            nights.append(night)
+            rows.append(np.array(rollup[channel - 1]))
+
+    trend = pd.DataFrame(np.array(rows, dtype='float32').reshape(len(rows), len(STATS)), columns=STATS,
+                         index=pd.DatetimeIndex(nights, name='night'))
+
+    return trend
+
+
+def choose_level(seconds_per_pixel):
+    """
+    Chooses the coarsest level of the time pyramid that still has at least one bucket per pixel of a plot.
+
+    Parameters
+    ----------
+    - `seconds_per_pixel` (float) The seconds covered by each pixel (or time bin) of the plot.
+
+    Returns
+    ----------
+    - `level` (str) The name of the level (See `LEVELS`). The 1min level when the pixels are finer than every bucket.
+    """
+    chosen = LEVELS[0][0]
+
+    for level, seconds in LEVELS:
+        if seconds <= seconds_per_pixel:
+            chosen = level
+
+    return chosen
+
+
+def load_buckets(property_name, level, night):
+    """
+    Get the buckets of a level of the time pyramid of a property for a night. The 1night level is read from the rollup.
+
+    Parameters
+    ----------
+    - `property_name` (str) The name of the property.
+    - `level` (str) The name of the level (See `LEVELS`), except the 1min level, which is the data of the collection.
+    - `night` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `buckets` (tuple) The middle datetime of each bucket (numpy.ndarray of datetime64[ns]) and the statistics of the
+    buckets (See `compute_level`), or None if the level is not stored for the night.
+    """
+    seconds = dict(LEVELS)[level]
+    night_start = np.datetime64(database.get_night_range(night)[0], 'ns')
+    dates = night_start + (np.arange(86400 // seconds) * seconds + seconds // 2).astype('timedelta64[s]')
+
+    if level == '1night':
+        path = get_rollup_path(property_name, night)
+
+        if not os.path.exists(path):
+            return None
+
+        rollup = np.load(path)
+        stats = rollup[:, [STATS.index(stat) for stat in BUCKET_STATS]].T[:, np.newaxis, :]
+
+        return dates, stats
+
+    path = get_level_path(property_name, level, night)
+
+    if not os.path.exists(path):
+        return None
+
+    return dates, np.load(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rolls up the pixel and module properties of the nights that have finished')
+    parser.add_argument('--start', type=dt.date.fromisoformat, default=None, help='First night to roll up (YYYY-MM-DD)')
+    parser.add_argument('--end', type=dt.date.fromisoformat, default=None, help='Last night to roll up (YYYY-MM-DD). The last night that has finished by default')
+    parser.add_argument('--days', type=int, default=1, help='Number of nights before the current one to roll up, when no start is given (1 by default)')
+    parser.add_argument('--workers', type=int, default=FETCH_WORKERS, help=f'Number of nights rolled up at the same time ({FETCH_WORKERS} by default)')
+    parser.add_argument('--force', action='store_true', help='Roll up again the nights already rolled up')
+    args = parser.parse_args()
+
+    end = args.end or database.get_current_night() - dt.timedelta(days=1)
+    start = args.start or end - dt.timedelta(days=args.days - 1)
+
+    tic = time.perf_counter()
+    rolled_up = rollup_nights([start + dt.timedelta(days=i) for i in range((end - start).days + 1)], args.workers, args.force)
+
+    print(f"{sum(len(names) for names in rolled_up.values())} rollups of {len(rolled_up)} nights written to {ROLLUPS_DIR} in {time.perf_counter() - tic:0.2f} seconds")
@@ -0,0 +1,260 @@
+"""
+Cross-process cache module. When the application is served with several worker processes (See `--num-procs` in
+`app.py`), the night data and the aggregates computed from it are stored once in a directory shared by all the workers
+(in memory with /dev/shm by default). Numeric dataframes are stored as a .npy file per column and loaded as read-only
+memory maps, so every worker reads the same pages of memory instead of holding its own copy of the data.
+"""
+
+import json
+import os
+import pickle
+import shutil
+import stat
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class SharedStore:
+    """
+    Store of dataframes and other objects in a directory shared by the worker processes. It is disabled until `enable`
+    is called, and every operation does nothing when it is disabled.
+
+    Each entry is a directory written in a temporary location and renamed when it is complete, so the other processes
+    never read a partially written entry. Entries are removed in least recently used order when the store goes over
+    its maximum size.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.max_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def enable(self, directory, max_mb, clear=False):
+        """
+        Enable the store.
+
+        Parameters
+        ----------
+        - `directory` (str) The directory where the entries are stored. It is created if it does not exist.
+        - `max_mb` (int) The maximum size of the stored entries in MB.
+        - `clear` (bool) Whether to remove the entries stored by a previous run. Only the parent process should clear the store.
+
+        Returns
+        ----------
+        - `enabled` (bool) Whether the store was enabled. It stays disabled when the directory belongs to another user.
+        """
+        if clear:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # Some entries are unpickled when loaded, so another user able to write in the directory could run code in the
+        # application. The directory may have been created by another user before, e.g. in /dev/shm
+        status = os.lstat(directory)
+
+        if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid():
+            print(f"WARNING: the shared cache directory {directory} is not a directory owned by the user of the application, the shared cache is disabled")
+            return False
+
+        os.chmod(directory, 0o700)
+
+        self.directory = directory
+        self.max_bytes = max_mb * 2**20
+
+        return True
+
+    def _path(self, key):
+        return os.path.join(self.directory, '__'.join(str(part) for part in key).replace(os.sep, '_'))
+
+    def load(self, key, max_age=None):
+        """
+        Load an entry of the store.
+
+        Parameters
+        ----------
+        - `key` (tuple) The key of the entry.
+        - `max_age` (float) Maximum age of the entry in seconds. Older entries are not loaded. None to load entries of any age.
+
+        Returns
+        ----------
+        - `value` The stored dataframe (backed by read-only memory maps) or object, or None if the key is not stored.
+        """
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+
+        try:
+            if max_age is not None and time.time() - os.path.getmtime(path) > max_age:
+                self.misses += 1
+                return None
+
+            with open(os.path.join(path, 'meta.json')) as meta_file:
+                meta = json.load(meta_file)
+
+            if meta['format'] == 'pickle':
+                with open(os.path.join(path, 'value.pkl'), 'rb') as value_file:
+                    value = pickle.load(value_file)
+            else:
+                value = read_dataframe(path, meta)
+
+            # Update the access time used to remove the least recently used entries
+            os.utime(os.path.join(path, 'meta.json'))
+
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return value
+
+    def store(self, key, value):
+        """
+        Store an entry, replacing any previous value. Dataframes with numeric columns are stored as .npy files,
+        any other value is pickled.
+
+        Parameters
+        ----------
+        - `key` (tuple) The key of the entry.
+        - `value` The dataframe or object to store.
+        """
+        if not self.enabled:
+            return
+
+        path = self._path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{time.time_ns()}"
+
+        try:
+            os.makedirs(tmp_path)
+
+            if isinstance(value, pd.DataFrame) and is_numeric_dataframe(value):
+                meta = write_dataframe(tmp_path, value)
+            else:
+                meta = {'format': 'pickle'}
+
+                with open(os.path.join(tmp_path, 'value.pkl'), 'wb') as value_file:
+                    pickle.dump(value, value_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as meta_file:
+                json.dump(meta, meta_file)
+
+            # Replace the previous entry. The processes with the old files mapped keep reading them until they are released.
+            if os.path.exists(path):
+                old_path = f"{path}.old-{os.getpid()}-{time.time_ns()}"
+                os.rename(path, old_path)
+                shutil.rmtree(old_path, ignore_errors=True)
+
+            os.rename(tmp_path, path)
+
+        except OSError as e:
+            print("Error storing data in the shared cache:", e)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+
+        self.prune()
+
+    def prune(self):
+        """
+        Remove the least recently used entries until the store is under its maximum size.
+        """
+        entries = []
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.path.getmtime(os.path.join(path, 'meta.json')), size, path))
+            except OSError:  # Entry being written or removed by another process
+                continue
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def nbytes(self):
+        """
+        Get the size of the stored entries.
+
+        Returns
+        ----------
+        - `nbytes` (int) The size in bytes.
+        """
+        if not self.enabled:
+            return 0
+
+        return sum(entry.stat().st_size for name in os.listdir(self.directory) for entry in os.scandir(os.path.join(self.directory, name)))
+
+
+def is_numeric_dataframe(df):
+    """
+    Check if all the columns and the index of a dataframe can be stored as .npy files.
+
+    Parameters
+    ----------
+    - `df` (pandas.DataFrame) The dataframe to check.
+
+    Returns
+    ----------
+    - `numeric` (bool) Whether all the columns and the index have a numeric or datetime dtype.
+    """
+    return all(dtype.kind in 'biufM' for dtype in list(df.dtypes) + [df.index.dtype])
+
+
+def write_dataframe(path, df):
+    """
+    Write the index and each column of a dataframe as .npy files.
+
+    Parameters
+    ----------
+    - `path` (str) The directory where the files are written.
+    - `df` (pandas.DataFrame) The dataframe to write.
+
+    Returns
+    ----------
+    - `meta` (dict) The metadata needed to read the dataframe again.
+    """
+    np.save(os.path.join(path, 'index.npy'), df.index.values)
+
+    for i, column in enumerate(df.columns):
+        np.save(os.path.join(path, f'column_{i}.npy'), df[column].values)
+
+    return {'format': 'npy', 'columns': list(df.columns), 'index_name': df.index.name}
+
+
+def read_dataframe(path, meta):
+    """
+    Read a dataframe written with `write_dataframe`, using read-only memory maps.
+
+    Parameters
+    ----------
+    - `path` (str) The directory with the files.
+    - `meta` (dict) The metadata returned by `write_dataframe`.
+
+    Returns
+    ----------
+    - `df` (pandas.DataFrame) The dataframe backed by the memory mapped files.
+    """
+    index = pd.Index(np.load(os.path.join(path, 'index.npy'), mmap_mode='r'), name=meta['index_name'], copy=False)
+    data = {column: np.load(os.path.join(path, f'column_{i}.npy'), mmap_mode='r') for i, column in enumerate(meta['columns'])}
+
+    return pd.DataFrame(data, index=index, columns=meta['columns'], copy=False)
+
+
+store = SharedStore()
+"""
+Process-wide access to the cache shared by the worker processes
+"""
@@ -0,0 +1,322 @@
+"""
+Static snapshots of the archived nights. Most lookups of old nights only need to see their plots, so the plots of the
+dashboard (See `registry.PANELS`) are built with the `plot_helper` builders for a range of nights and rendered to a
+standalone HTML page per night, with the rasters embedded, and optionally to a PNG per tab. The snapshots are written
+to the `SNAPSHOTS_DIR` directory, served by the dashboard in the /snapshots address, and the dashboard shows the
+snapshot of an archived night instantly, building the interactive plots only when they are requested. The snapshots
+are written for the default telescope (See `telescopes`).
+
+Usage (from the root of the repository):
+
+    python snapshots.py --start 2023-06-01 --end 2023-06-30 --workers 4
+    python snapshots.py --start 2023-06-01 --end 2023-06-01 --png --force
+"""
+
+import argparse
+import datetime as dt
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import database
+import registry
+import telescopes
+from config import SNAPSHOTS_DIR
+
+
+def get_snapshot_path(night, filename='index.html'):
+    """
+    Get the path of a file of the snapshot of a night.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The day in which the night starts.
+    - `filename` (str) The name of the file. The HTML page by default.
+
+    Returns
+    ----------
+    - `path` (str) The path of the file.
+    """
+    return os.path.join(SNAPSHOTS_DIR, str(night), filename)
+
+
+def get_snapshot_url(night):
+    """
+    Get the address where the dashboard serves the snapshot of a night.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `url` (str) The address of the HTML page of the snapshot.
+    """
+    return f'/snapshots/{night}/index.html'
+
+
+def has_snapshot(night):
+    """
+    Whether there is a snapshot of an archived night. The current night is never archived, since its data keeps changing.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `available` (bool) Whether the snapshot of the night is available.
+    """
+    return night < database.get_current_night() and os.path.exists(get_snapshot_path(night))
+
+
+def init_worker():
+    """
+    Imports the plotting modules and loads the Bokeh backend of HoloViews in each process of the pool.
+    """
+    import holoviews as hv
+    import hvplot.pandas # noqa
+
+    hv.extension('bokeh', logo=False)
+
+
+def build_plot(panel, night_data, night):
+    """
+    Builds the plot of a panel described in the registry with the `plot_helper` builders used by the dashboard.
+
+    Parameters
+    ----------
+    - `panel` (dict) The description of the panel (See `registry.PANELS`).
+    - `night_data` (dict) The dataframe of each property by property name.
+    - `night` (dt.date) The day in which the night starts, shown in the title of the plot.
+
+    Returns
+    ----------
+    - `plot` (holoviews.core.Dimensioned) The plot.
+    """
+    import plot_helper
+
+    prop = registry.get_property(panel['property'])
+    title = panel['title'] + ' (' + str(night) + ')'
+
+    if night_data[panel['property']].empty:
+        return plot_helper.create_empty_plot()
+
+    if 'inputs' in panel:
+        data = {key: night_data[property_name] for key, property_name in panel['inputs'].items()}
+    else:
+        data = night_data[panel['property']]
+
+    if panel['kind'] == 'grouped':
+        return plot_helper.multiplot_grouped_data(data, 'date', prop['value_name'], title, panel['xlabel'], panel['ylabel'], prop['var_name'],
+                                                  panel['cmap'], panel['clim'])
+
+    if panel['kind'] == 'l1_rate':
+        return plot_helper.plot_l1_rate_data(data, 'date', prop['value_name'], title, panel['xlabel'], panel['ylabel'], prop['var_name'],
+                                             panel['cmap'], panel['clim'])
+
+    if panel['kind'] == 'l0_ipr':
+        return plot_helper.plot_l0_ipr_data(data, 'date', prop['value_name'], title, panel['xlabel'], panel['ylabel'], prop['var_name'],
+                                            panel['cmap'], panel['clim'])
+
+    if panel['kind'] == 'tib_rates':
+        return plot_helper.plot_tib_rate_data(data, title, panel['xlabel'], panel['ylabel'])
+
+    if panel['kind'] == 'dragon_busy':
+        return plot_helper.plot_dragon_busy_data(data, title, panel['xlabel'], panel['ylabel'])
+
+    raise ValueError(f"Unknown kind of panel: {panel['kind']}")
+
+
+def build_tab_layouts(night_data, night):
+    """
+    Renders the plots of each tab of the dashboard to Bokeh models, placed in the rows of the grid of the tab. The
+    channel and module plots show the first channel or module, and the rasters of all of them are computed for the
+    whole night and embedded in the models.
+
+    Parameters
+    ----------
+    - `night_data` (dict) The dataframe of each property by property name.
+    - `night` (dt.date) The day in which the night starts.
+
+    Returns
+    ----------
+    - `layouts` (list) The Bokeh layout of each tab (See `registry.TABS`).
+    """
+    import holoviews as hv
+    from bokeh.layouts import layout
+
+    layouts = []
+
+    for tab_index, tab in enumerate(registry.TABS):
+        rows = [[] for _ in range(tab['nrows'])]
+        panels = sorted((panel for panel in registry.PANELS if panel['tab'] == tab_index), key=lambda panel: get_column(panel['cell']))
+
+        for panel in panels:
+            rows[panel['cell'][0]].append(hv.render(build_plot(panel, night_data, night), backend='bokeh'))
+
+        layouts.append(layout([row for row in rows if row], sizing_mode='stretch_width'))
+
+    return layouts
+
+
+def get_column(cell):
+    """
+    Get the first column of a grid cell.
+
+    Parameters
+    ----------
+    - `cell` (tuple) The row and the column (int or slice) of the cell.
+
+    Returns
+    ----------
+    - `column` (int) The first column of the cell.
+    """
+    column = cell[1]
+
+    return column.start or 0 if isinstance(column, slice) else column
+
+
+def write_file(path, write):
+    """
+    Writes a file through a temporary file, so the dashboard never serves a partially written snapshot.
+
+    Parameters
+    ----------
+    - `path` (str) The path of the file.
+    - `write` (callable) The function writing the file, called with the path of the temporary file.
+    """
+    temporary_path = path + '.tmp'
+    write(temporary_path)
+    os.replace(temporary_path, path)
+
+
+def render_night(night, png=False, inline=False):
+    """
+    Renders the snapshot of a night: an HTML page with the tabs of the dashboard and, optionally, a PNG of each tab.
+    Nothing is written when the night has no data.
+
+    Parameters
+    ----------
+    - `night` (dt.date) The day in which the night starts.
+    - `png` (bool) Whether to export a PNG of each tab. It needs selenium and a web driver (See <https://docs.bokeh.org/en/2.4.3/docs/user_guide/export.html>).
+    - `inline` (bool) Whether to embed the Bokeh JavaScript in the page, so it can be opened without the dashboard. By
+    default the page loads it from the dashboard server.
+
+    Returns
+    ----------
+    - `paths` (list) The paths of the files written.
+    """
+    from bokeh.embed import file_html
+    from bokeh.models import Div, Panel, Tabs
+    from bokeh.layouts import column
+    from bokeh.resources import INLINE, Resources
+
+    import dashboard_utils
+
+    tic = time.perf_counter()
+    telescope = telescopes.default
+    db = telescope.connect()
+
+    if db is None:
+        raise ConnectionError(f"Connection to database of {telescope.name} ({telescope.db_host}:{telescope.db_port}) failed")
+
+    try:
+        night_data = dashboard_utils.load_night_data(db, night)
+    finally:
+        db.client.close()
+
+    if night_data[registry.ANCHOR_PROPERTY].empty:
+        print(f"No data found for night {night}, skipping it")
+        return []
+
+    layouts = build_tab_layouts(night_data, night)
+    os.makedirs(os.path.dirname(get_snapshot_path(night)), exist_ok=True)
+    paths = []
+
+    if png:
+        from bokeh.io import export_png
+
+        for tab_index, tab_layout in enumerate(layouts):
+            path = get_snapshot_path(night, f'tab{tab_index + 1}.png')
+
+            try:
+                write_file(path, lambda temporary_path, tab_layout=tab_layout: export_png(tab_layout, filename=temporary_path, width=1800))
+                paths.append(path)
+            except (ImportError, RuntimeError) as e:
+                print(f"PNG export of night {night} failed (selenium and a web driver are needed):", e)
+                break
+
+    header = Div(text=f"""<h2>Clusco Reports: night {night}</h2>
+        <p>Static snapshot generated on {dt.datetime.now():%Y-%m-%d %H:%M}. The channel and module plots show the first
+        channel or module. Open the <a href="/" target="_top">interactive dashboard</a> and select the night to choose other channels or modules.</p>""",
+                 sizing_mode='stretch_width')
+
+    tabs = Tabs(tabs=[Panel(child=tab_layout, title=tab['title']) for tab, tab_layout in zip(registry.TABS, layouts)], sizing_mode='stretch_width')
+    resources = INLINE if inline else Resources(mode='server', root_url='/')
+    html = file_html(column(header, tabs, sizing_mode='stretch_width'), resources, title=f'Clusco Reports ({night})')
+
+    def write_html(temporary_path):
+        with open(temporary_path, 'w') as html_file:
+            html_file.write(html)
+
+    write_file(get_snapshot_path(night), write_html)
+    paths.append(get_snapshot_path(night))
+
+    print(f"Snapshot of night {night} rendered in {time.perf_counter() - tic:0.2f} seconds")
+
+    return paths
+
+
+def render_nights(nights, workers=4, png=False, inline=False, force=False):
+    """
+    Renders the snapshots of several nights in a pool of processes. The nights already rendered are skipped, unless forced,
+    and the current night is always skipped.
+
+    Parameters
+    ----------
+    - `nights` (list) The days in which each night starts.
+    - `workers` (int) The number of processes.
+    - `png` (bool) Whether to export a PNG of each tab (See `render_night`).
+    - `inline` (bool) Whether to embed the Bokeh JavaScript in the pages (See `render_night`).
+    - `force` (bool) Whether to render again the nights already rendered.
+
+    Returns
+    ----------
+    - `rendered` (dict) The paths of the files written for each night rendered.
+    """
+    nights = [night for night in nights if night < database.get_current_night() and (force or not has_snapshot(night))]
+    rendered = {}
+
+    if not nights:
+        print("No nights to render")
+        return rendered
+
+    print(f"Rendering {len(nights)} nights with {workers} processes")
+
+    with ProcessPoolExecutor(max_workers=max(workers, 1), initializer=init_worker) as executor:
+        futures = {executor.submit(render_night, night, png, inline): night for night in nights}
+
+        for future in as_completed(futures):
+            try:
+                rendered[futures[future]] = future.result()
+            except Exception as e:
+                print(f"Error rendering night {futures[future]}:", e)
+
+    return rendered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Renders static snapshots of the archived nights')
+    parser.add_argument('--start', type=dt.date.fromisoformat, required=True, help='First night to render (YYYY-MM-DD)')
+    parser.add_argument('--end', type=dt.date.fromisoformat, default=None, help='Last night to render (YYYY-MM-DD). The first night by default')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes rendering the nights (the number of CPUs by default)')
+    parser.add_argument('--png', action='store_true', help='Export a PNG of each tab as well. It needs selenium and a web driver')
+    parser.add_argument('--inline', action='store_true', help='Embed the Bokeh JavaScript in the pages, so they can be opened without the dashboard')
+    parser.add_argument('--force', action='store_true', help='Render again the nights already rendered')
+    args = parser.parse_args()
+
+    end = args.end or args.start
+    nights = [args.start + dt.timedelta(days=i) for i in range((end - args.start).days + 1)]
+
+    render_nights(nights, args.workers, args.png, args.inline, args.force)
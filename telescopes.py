@@ -0,0 +1,198 @@
+"""
+Telescopes served by the application. A single process serves the dashboards of several telescopes (See `TELESCOPES`),
+so the plotting libraries and the code of the dashboard are imported once, while each telescope has its own database
+and collection names, night availability index, live night feed, circuit breaker and budget of cached night data.
+The telescope of a session is selected with the `telescope` URL parameter (e.g. /app?telescope=LST2), and the first
+telescope is displayed by default.
+
+The settings of each telescope are read from the variables prefixed with its name, which default to the settings of
+the application:
+
+- `<NAME>_DB_HOST`, `<NAME>_DB_PORT`, `<NAME>_DB_NAME` The database of the telescope.
+- `<NAME>_COLLECTIONS` The names of its collections, when they are not the ones of the registry (e.g. CLUSCO_min=LST2_CLUSCO_min,TIB_min=LST2_TIB_min).
+- `<NAME>_CACHE_MAX_MB` The maximum memory used by its cached night data (See `TELESCOPE_CACHE_MAX_MB`).
+- `<NAME>_AVAILABILITY_FILE` The file where its availability index is stored. The default telescope uses `AVAILABILITY_FILE`.
+"""
+
+import os
+
+import availability
+import cache
+import database
+import live_feed
+from config import (TELESCOPES, TELESCOPE_CACHE_MAX_MB, DB_HOST, DB_PORT, DB_NAME, DB_BREAKER_FAILURES, DB_BREAKER_RESET, LIVE_FEED_INTERVAL,
+                    AVAILABILITY_FILE)
+
+
+class TelescopeDatabase:
+    """
+    Database of a telescope whose collections are accessed with the names of the registry (See `registry.PROPERTIES`),
+    so the queries do not depend on the collection names of each telescope. The rest of the attributes are the ones of
+    the pymongo database.
+    """
+
+    def __init__(self, db, collections):
+        """
+        Parameters
+        ----------
+        - `db` (pymongo.database.Database) The database object from pymongo.
+        - `collections` (dict) The name of the collection of the telescope for each collection of the registry that has another name.
+        """
+        self._db = db
+        self._collections = collections
+
+    def __getitem__(self, collection_name):
+        return self._db[self._collections.get(collection_name, collection_name)]
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+class Telescope:
+    """
+    Connection settings and state of a telescope: its availability index, live night feed and circuit breaker. Its
+    night data is stored in the process-wide night data cache under its name, within its own budget (See `cache.NightDataCache`).
+    """
+
+    def __init__(self, name, db_host, db_port, db_name, collections=None, cache_max_mb=TELESCOPE_CACHE_MAX_MB, availability_file=None,
+                 breaker=None):
+        """
+        Parameters
+        ----------
+        - `name` (str) The name of the telescope, used in the URL parameter and in the cache keys.
+        - `db_host`, `db_port`, `db_name` (str) The database of the telescope (See `database.connect`).
+        - `collections` (dict) The name of the collection of the telescope for each collection of the registry that has another name.
+        - `cache_max_mb` (int) The maximum memory in MB used by its cached night data. None for no limit.
+        - `availability_file` (str) The file where its availability index is stored. None to keep it only in memory.
+        - `breaker` (database.CircuitBreaker) The circuit breaker of its database. A new one by default.
+        """
+        self.name = name
+        self.db_host = db_host
+        self.db_port = db_port
+        self.db_name = db_name
+        self.collections = collections or {}
+        self.cache_max_mb = cache_max_mb
+        self.breaker = breaker if breaker is not None else database.CircuitBreaker(DB_BREAKER_FAILURES, DB_BREAKER_RESET)
+        self.availability = availability.AvailabilityIndex(availability_file, connect=self.connect)
+        self.live_feed = live_feed.LiveNightFeed(interval_sec=LIVE_FEED_INTERVAL, connect=self.connect)
+
+        cache.night_data.set_budget(name, cache_max_mb * 2**20 if cache_max_mb else None)
+
+    def connect(self):
+        """
+        Connect to the database of the telescope (See `database.connect`).
+
+        Returns
+        ----------
+        - `db` (TelescopeDatabase) The database of the telescope, or None if the connection failed or was not attempted.
+        """
+        db = database.connect(self.db_host, self.db_port, self.db_name, self.breaker)
+
+        return TelescopeDatabase(db, self.collections) if db is not None else None
+
+    def connect_with_retry(self):
+        """
+        Connect to the database of the telescope retrying the failed connections with backoff (See `database.connect_with_retry`).
+
+        Returns
+        ----------
+        - `db` (TelescopeDatabase) The database of the telescope, or None if every attempt failed.
+        """
+        db = database.connect_with_retry(self.db_host, self.db_port, self.db_name, circuit_breaker=self.breaker)
+
+        return TelescopeDatabase(db, self.collections) if db is not None else None
+
+    def get_collection_name(self, collection_name):
+        """
+        Get the name in the database of the telescope of a collection of the registry.
+
+        Parameters
+        ----------
+        - `collection_name` (str) The name of the collection in the registry (CLUSCO_min, TIB_min...)
+
+        Returns
+        ----------
+        - `collection_name` (str) The name of the collection of the telescope.
+        """
+        return self.collections.get(collection_name, collection_name)
+
+
+def parse_collections(value):
+    """
+    Parse the names of the collections of a telescope.
+
+    Parameters
+    ----------
+    - `value` (str) Comma-separated pairs of registry and telescope collection names (e.g. CLUSCO_min=LST2_CLUSCO_min).
+
+    Returns
+    ----------
+    - `collections` (dict) The name of the collection of the telescope for each collection of the registry.
+    """
+    return dict(pair.split('=', 1) for pair in (pair.strip() for pair in value.split(',')) if pair)
+
+
+def load_telescope(name, is_default):
+    """
+    Create a telescope with the settings of the variables prefixed with its name.
+
+    Parameters
+    ----------
+    - `name` (str) The name of the telescope.
+    - `is_default` (bool) Whether it is the default telescope, which uses the availability file and the circuit breaker of the application.
+
+    Returns
+    ----------
+    - `telescope` (Telescope) The telescope.
+    """
+    def setting(variable, default):
+        return os.environ.get(f'{name}_{variable}', default)
+
+    root, extension = os.path.splitext(AVAILABILITY_FILE)
+    availability_file = setting('AVAILABILITY_FILE', AVAILABILITY_FILE if is_default else f'{root}.{name}{extension}')
+
+    return Telescope(name, setting('DB_HOST', DB_HOST), setting('DB_PORT', DB_PORT), setting('DB_NAME', DB_NAME),
+                     collections=parse_collections(setting('COLLECTIONS', '')), cache_max_mb=int(setting('CACHE_MAX_MB', TELESCOPE_CACHE_MAX_MB)),
+                     availability_file=availability_file, breaker=database.breaker if is_default else None)
+
+
+def get(name=None):
+    """
+    Get a telescope by name.
+
+    Parameters
+    ----------
+    - `name` (str) The name of the telescope, case insensitive. None for the default telescope.
+
+    Returns
+    ----------
+    - `telescope` (Telescope) The telescope, or the default telescope if there is none with that name.
+    """
+    if name is None:
+        return default
+
+    return telescopes.get(name.upper(), default)
+
+
+def get_all():
+    """
+    Get the telescopes served by the application.
+
+    Returns
+    ----------
+    - `telescopes` (list) The telescopes, the default one first.
+    """
+    return list(telescopes.values())
+
+
+_names = [name.strip().upper() for name in TELESCOPES.split(',') if name.strip()] or ['LST1']
+
+telescopes = {name: load_telescope(name, i == 0) for i, name in enumerate(dict.fromkeys(_names))}
+"""
+Telescopes served by the application by name
+"""
+
+default = telescopes[_names[0]]
+"""
+Telescope displayed when the session does not select one
+"""
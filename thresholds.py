@@ -0,0 +1,106 @@
+"""
+Threshold scan of the pixel and module properties of a night. The values of all the channels or modules are arranged
+as a 2D array (a row per date and a column per channel or module) and compared with the threshold of the property at
+once, instead of going through the channels one by one with the slider of the plot. The 2D array of each dataframe
+is cached with the other aggregates (See `cache.AggregateCache`), so scanning again with other thresholds only takes
+the comparison. The default thresholds are the breakpoints of the colormaps of the plots where the color turns to
+orange or red (See `registry.PANELS`).
+"""
+
+import numpy as np
+import pandas as pd
+
+import cache
+import metrics
+
+
+def get_night_array(pandas_df, var_name, value_name):
+    """
+    Get the values of a night as a 2D array from its long format dataframe (See `database.build_array_dataframe`),
+    which is sorted by date.
+
+    Parameters
+    ----------
+    - `pandas_df` (pandas.DataFrame) The dataframe of the night, indexed by date.
+    - `var_name` (str) The name of the column with the channel or module.
+    - `value_name` (str) The name of the column with the values.
+
+    Returns
+    ----------
+    - `dates` (numpy.ndarray) The dates of the rows, as datetime64[ns].
+    - `channels` (numpy.ndarray) The channel or module of each column.
+    - `values` (numpy.ndarray) Array of float32 with a row per date and a column per channel or module. NaN when there is no value.
+    """
+    dates = pandas_df.index.values
+    channels = pandas_df[var_name].to_numpy()
+
+    # The dataframe is sorted by date, so a new row starts at each change of date
+    new_date = np.empty(len(dates), dtype=bool)
+    new_date[:1] = True
+    new_date[1:] = dates[1:] != dates[:-1]
+    date_index = np.cumsum(new_date, dtype='int32') - 1
+
+    first_channel = int(channels.min())
+    values = np.full((int(date_index[-1]) + 1, int(channels.max()) - first_channel + 1), np.nan, dtype='float32')
+    values[date_index, channels - first_channel] = pandas_df[value_name].to_numpy(dtype='float32')
+
+    return dates[new_date], np.arange(first_channel, first_channel + values.shape[1]), values
+
+
+def load_night_array(pandas_df, var_name, value_name):
+    """
+    Get the 2D array of a night (See `get_night_array`) from the aggregates cache, computing it if it is not cached.
+
+    Parameters
+    ----------
+    - `pandas_df` (pandas.DataFrame) The dataframe of the night, indexed by date.
+    - `var_name` (str) The name of the column with the channel or module.
+    - `value_name` (str) The name of the column with the values.
+
+    Returns
+    ----------
+    - `night_array` (tuple) The dates, channels and values of the night (See `get_night_array`).
+    """
+    return cache.aggregates.get_or_compute('night_array', pandas_df, (var_name, value_name), lambda: get_night_array(pandas_df, var_name, value_name))
+
+
+@metrics.timed('threshold_scan')
+def scan_night(pandas_df, var_name, value_name, threshold):
+    """
+    Compares all the values of a night with a threshold in a single pass and ranks the channels or modules by the time
+    they spent above it and by their peak value.
+
+    Parameters
+    ----------
+    - `pandas_df` (pandas.DataFrame) The dataframe of the night, indexed by date (See `database.build_array_dataframe`).
+    - `var_name` (str) The name of the column with the channel or module.
+    - `value_name` (str) The name of the column with the values.
+    - `threshold` (float) The threshold.
+
+    Returns
+    ----------
+    - `ranking` (pandas.DataFrame) A row for each channel or module with data: the minutes above the threshold, the peak
+    value and the date of the first value above the threshold (NaT if none), sorted from the worst one.
+    """
+    columns = [var_name, 'minutes_above', 'peak', 'first_above']
+
+    if pandas_df.empty:
+        return pd.DataFrame(columns=columns)
+
+    dates, channels, values = load_night_array(pandas_df, var_name, value_name)
+
+    # Minutes represented by each row, from the usual interval between the dates
+    minutes_per_row = np.median(np.diff(dates)).astype('timedelta64[s]').astype('float64') / 60 if len(dates) > 1 else 1.0
+
+    above = values > threshold
+    rows_above = np.count_nonzero(above, axis=0)
+    first_above = np.where(rows_above > 0, dates[np.argmax(above, axis=0)], np.datetime64('NaT'))
+
+    # fmax ignores the missing values, leaving NaN only for the channels without data
+    peak = np.fmax.reduce(values, axis=0).astype('float64')
+    has_data = ~np.isnan(peak)
+
+    ranking = pd.DataFrame({var_name: channels, 'minutes_above': rows_above * minutes_per_row, 'peak': peak, 'first_above': first_above},
+                           columns=columns)[has_data]
+
+    return ranking.sort_values(['minutes_above', 'peak'], ascending=False, ignore_index=True)